@@ -4,12 +4,13 @@ import re
 from decimal import Decimal
 from typing import Literal, Union
 
+from dateutil.relativedelta import relativedelta
 from django.conf import settings
-from django.db.models import Max, Min, Sum
+from django.db.models import Sum
 from drf_spectacular.utils import extend_schema_serializer
 from metering_billing.invoice import (
     generate_balance_adjustment_invoice,
-    generate_invoice,
+    schedule_invoicing,
 )
 from metering_billing.models import (
     AddOnSpecification,
@@ -22,6 +23,7 @@ from metering_billing.models import (
     Feature,
     Invoice,
     InvoiceLineItem,
+    InvoicingJob,
     Metric,
     NumericFilter,
     Organization,
@@ -43,6 +45,7 @@ from metering_billing.serializers.serializer_utils import (
     ConvertEmptyStringToNullMixin,
     FeatureUUIDField,
     InvoiceUUIDField,
+    InvoicingJobUUIDField,
     MetricUUIDField,
     PlanUUIDField,
     PlanVersionUUIDField,
@@ -51,7 +54,13 @@ from metering_billing.serializers.serializer_utils import (
     TimeZoneSerializerField,
     UsageAlertUUIDField,
 )
-from metering_billing.utils import convert_to_date, now_utc
+from metering_billing.utils import (
+    calculate_end_date,
+    convert_to_date,
+    convert_to_datetime,
+    date_as_max_dt,
+    now_utc,
+)
 from metering_billing.utils.enums import (
     CATEGORICAL_FILTER_OPERATORS,
     CUSTOMER_BALANCE_ADJUSTMENT_STATUS,
@@ -63,6 +72,7 @@ from metering_billing.utils.enums import (
     TAX_PROVIDER,
     USAGE_BEHAVIOR,
     USAGE_BILLING_BEHAVIOR,
+    USAGE_BILLING_FREQUENCY,
 )
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
@@ -455,26 +465,10 @@ class InvoiceSerializer(
         return obj.get_payment_status_display()
 
     def get_start_date(self, obj) -> datetime.date:
-        try:
-            min_date = obj.min_date
-        except AttributeError:
-            min_date = obj.line_items.all().aggregate(min_date=Min("start_date"))[
-                "min_date"
-            ]
-        return (
-            convert_to_date(min_date) if min_date else convert_to_date(obj.issue_date)
-        )
+        return convert_to_date(obj.start_date or obj.issue_date)
 
     def get_end_date(self, obj) -> datetime.date:
-        try:
-            max_date = obj.max_date
-        except AttributeError:
-            max_date = obj.line_items.all().aggregate(max_date=Max("end_date"))[
-                "max_date"
-            ]
-        return (
-            convert_to_date(max_date) if max_date else convert_to_date(obj.issue_date)
-        )
+        return convert_to_date(obj.end_date or obj.issue_date)
 
 
 class LightweightInvoiceSerializer(InvoiceSerializer):
@@ -491,6 +485,55 @@ class LightweightInvoiceSerializer(InvoiceSerializer):
         extra_kwargs = {**InvoiceSerializer.Meta.extra_kwargs}
 
 
+class InvoiceListSerializer(InvoiceSerializer):
+    """
+    Invoice as it appears in a paginated list. Line items are only included when
+    they're asked for with expand, line_item_count is always there.
+    """
+
+    EXPANDABLE_FIELDS = ("line_items",)
+
+    class Meta(InvoiceSerializer.Meta):
+        fields = InvoiceSerializer.Meta.fields + ("line_item_count",)
+        extra_kwargs = {
+            **InvoiceSerializer.Meta.extra_kwargs,
+            "line_item_count": {"required": True, "read_only": True},
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = self.context.get("expand", ())
+        for field_name in self.EXPANDABLE_FIELDS:
+            if field_name not in expand:
+                self.fields.pop(field_name)
+
+
+class InvoicingJobSerializer(TimezoneFieldMixin, serializers.ModelSerializer):
+    class Meta:
+        model = InvoicingJob
+        fields = (
+            "invoicing_job_id",
+            "status",
+            "predicted_cost_due",
+            "invoices",
+            "errors",
+            "created",
+            "completed_at",
+        )
+        extra_kwargs = {
+            "invoicing_job_id": {"required": True, "read_only": True},
+            "status": {"required": True, "read_only": True},
+            "predicted_cost_due": {"required": True, "read_only": True},
+            "invoices": {"required": True, "read_only": True},
+            "errors": {"required": True, "read_only": True},
+            "created": {"required": True, "read_only": True},
+            "completed_at": {"required": True, "read_only": True},
+        }
+
+    invoicing_job_id = InvoicingJobUUIDField()
+    invoices = LightweightInvoiceSerializer(many=True)
+
+
 class CustomerStripeIntegrationSerializer(serializers.Serializer):
     stripe_id = serializers.CharField()
     has_payment_method = serializers.BooleanField()
@@ -611,7 +654,7 @@ class CustomerSerializer(
         elif obj.payment_provider == PAYMENT_PROCESSORS.BRAINTREE:
             braintree_dict = d.get(PAYMENT_PROCESSORS.BRAINTREE)
             if braintree_dict:
-                return braintree_dict["paypal_id"]
+                return braintree_dict["braintree_id"]
         return None
 
     def get_address(self, obj) -> AddressSerializer(allow_null=True, required=True):
@@ -708,6 +751,56 @@ class CustomerSerializer(
             return Decimal(0)
 
 
+class CustomerListSerializer(CustomerSerializer):
+    """
+    Customer as it appears in a paginated list. The nested data that takes extra
+    queries to load is only included when it's asked for with expand.
+    """
+
+    EXPANDABLE_FIELDS = ("subscriptions", "invoices", "total_amount_due")
+
+    class Meta(CustomerSerializer.Meta):
+        fields = (
+            "customer_id",
+            "email",
+            "customer_name",
+            "created",
+            "integrations",
+            "default_currency",
+            "payment_provider",
+            "payment_provider_id",
+            "has_payment_method",
+            "billing_address",
+            "shipping_address",
+            "tax_rate",
+            "timezone",
+            "tax_providers",
+            "subscriptions",
+            "invoices",
+            "total_amount_due",
+        )
+        extra_kwargs = {
+            **CustomerSerializer.Meta.extra_kwargs,
+            "created": {"required": True, "read_only": True},
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = self.context.get("expand", ())
+        for field_name in self.EXPANDABLE_FIELDS:
+            if field_name not in expand:
+                self.fields.pop(field_name)
+
+
+class CustomerListFilterSerializer(serializers.Serializer):
+    expand = serializers.MultipleChoiceField(
+        choices=CustomerListSerializer.EXPANDABLE_FIELDS,
+        required=False,
+        default=set(),
+        help_text="Nested data to include for every customer in the page. Can be given more than once.",
+    )
+
+
 @extend_schema_serializer(deprecate_fields=["address"])
 class CustomerCreateSerializer(
     ConvertEmptyStringToNullMixin, TimezoneFieldMixin, serializers.ModelSerializer
@@ -1389,6 +1482,56 @@ class SubscriptionRecordCreateSerializer(
             )
         return data
 
+    def set_next_billing_date(self, data, now=None):
+        """
+        Check that the subscription doesn't end in the past and, for plans billed
+        monthly or quarterly, set the first next_billing_date on the validated data.
+        """
+        if now is None:
+            now = now_utc()
+        duration = data["billing_plan"].plan.plan_duration
+        billing_freq = data["billing_plan"].usage_billing_frequency
+        start_date = convert_to_datetime(data["start_date"], date_behavior="min")
+        day_anchor = data["billing_plan"].day_anchor or start_date.date().day
+        month_anchor = data["billing_plan"].month_anchor or start_date.date().month
+        timezone = data["customer"].timezone
+        end_date = calculate_end_date(
+            duration,
+            start_date,
+            timezone,
+            day_anchor=day_anchor,
+            month_anchor=month_anchor,
+        )
+        end_date = data.get("end_date", end_date)
+        if end_date < now:
+            raise ValidationError(
+                "End date cannot be in the past. For historical backfilling of subscriptions, please contact support."
+            )
+        if billing_freq in [
+            USAGE_BILLING_FREQUENCY.MONTHLY,
+            USAGE_BILLING_FREQUENCY.QUARTERLY,
+        ]:
+            found = False
+            i = 0
+            num_months = 1 if billing_freq == USAGE_BILLING_FREQUENCY.MONTHLY else 3
+            while not found:
+                tentative_nbd = date_as_max_dt(
+                    start_date + relativedelta(months=i, day=day_anchor, days=-1)
+                )
+                if tentative_nbd <= start_date:
+                    i += 1
+                    continue
+                elif tentative_nbd > end_date:
+                    tentative_nbd = end_date
+                    break
+                months_btwn = relativedelta(end_date, tentative_nbd).months
+                if months_btwn % num_months == 0:
+                    found = True
+                else:
+                    i += 1
+            data["next_billing_date"] = tentative_nbd
+        return data
+
     def create(self, validated_data):
         from metering_billing.invoice import generate_invoice
 
@@ -1675,6 +1818,12 @@ class InvoiceListFilterSerializer(serializers.Serializer):
         default=[INVOICE_STATUS_ENUM.PAID],
         help_text="A filter for invoices with a specific payment status",
     )
+    expand = serializers.MultipleChoiceField(
+        choices=InvoiceListSerializer.EXPANDABLE_FIELDS,
+        required=False,
+        default=set(),
+        help_text="Nested data to include for every invoice in a page. Can be given more than once.",
+    )
 
     def validate(self, data):
         data = super().validate(data)
@@ -2183,7 +2332,7 @@ class AddOnSubscriptionRecordCreateSerializer(
         for sf in attach_to_sr.filters.all():
             sr.filters.add(sf)
         if invoice_now:
-            generate_invoice(sr)
+            sr.invoicing_job = schedule_invoicing([sr])
         return sr
         return sr
         return sr
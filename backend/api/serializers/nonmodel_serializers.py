@@ -1,9 +1,13 @@
 from api.serializers.model_serializers import (
+    CustomerCreateSerializer,
+    CustomerSerializer,
     FeatureSerializer,
     LightweightCustomerSerializer,
     LightweightMetricSerializer,
     LightweightPlanVersionSerializer,
     SubscriptionCategoricalFilterSerializer,
+    SubscriptionRecordCreateSerializer,
+    SubscriptionRecordSerializer,
 )
 from metering_billing.models import (
     Customer,
@@ -294,5 +298,60 @@ class CustomerDeleteResponseSerializer(serializers.Serializer):
     num_addons_deleted = serializers.IntegerField()
 
 
+class CustomerBatchCreateRequestSerializer(serializers.Serializer):
+    customers = CustomerCreateSerializer(
+        many=True,
+        help_text="The customers to create. Each one is validated on its own, so the valid ones are created even if others fail.",
+    )
+
+
+class CustomerBatchCreateResponseSerializer(serializers.Serializer):
+    customers = CustomerSerializer(many=True)
+    errors = serializers.DictField(
+        child=serializers.DictField(),
+        help_text="The validation errors of the customers that weren't created, keyed by their position in the request.",
+    )
+
+
+class SubscriptionRecordBatchCreateRequestSerializer(serializers.Serializer):
+    subscriptions = SubscriptionRecordCreateSerializer(
+        many=True,
+        help_text="The subscriptions to create. Each one is validated on its own, so the valid ones are created even if others fail.",
+    )
+
+
+class SubscriptionRecordBatchCreateResponseSerializer(serializers.Serializer):
+    subscriptions = SubscriptionRecordSerializer(many=True)
+    errors = serializers.DictField(
+        child=serializers.DictField(),
+        help_text="The validation errors of the subscriptions that weren't created, keyed by their position in the request.",
+    )
+
+
+class IdempotencyIdsField(serializers.ListField):
+    child = serializers.CharField()
+
+    def to_internal_value(self, data):
+        # a single id can be sent on its own
+        if isinstance(data, str):
+            data = [data]
+        return list(dict.fromkeys(super().to_internal_value(data)))
+
+
+class ConfirmIdemsReceivedRequestSerializer(serializers.Serializer):
+    idempotency_ids = IdempotencyIdsField(
+        help_text="The idempotency ids of the events to look for."
+    )
+    number_days_lookback = serializers.IntegerField(
+        default=30,
+        min_value=1,
+        help_text="How many days back to look for the events.",
+    )
+    customer_id = serializers.CharField(
+        required=False,
+        help_text="Only look for events of this customer.",
+    )
+
+
 class GetInvoicePdfURLResponseSerializer(serializers.Serializer):
     url = serializers.URLField()
@@ -8,7 +8,6 @@ import re
 import uuid
 from decimal import Decimal
 from functools import reduce
-from itertools import chain
 from typing import Optional
 
 import posthog
@@ -23,11 +22,15 @@ from api.serializers.model_serializers import (
     CustomerBalanceAdjustmentSerializer,
     CustomerBalanceAdjustmentUpdateSerializer,
     CustomerCreateSerializer,
+    CustomerListFilterSerializer,
+    CustomerListSerializer,
     CustomerSerializer,
     EventSerializer,
     InvoiceListFilterSerializer,
+    InvoiceListSerializer,
     InvoiceSerializer,
     InvoiceUpdateSerializer,
+    InvoicingJobSerializer,
     ListPlansFilterSerializer,
     ListSubscriptionRecordFilter,
     PlanSerializer,
@@ -39,6 +42,9 @@ from api.serializers.model_serializers import (
     SubscriptionRecordUpdateSerializer,
 )
 from api.serializers.nonmodel_serializers import (
+    ConfirmIdemsReceivedRequestSerializer,
+    CustomerBatchCreateRequestSerializer,
+    CustomerBatchCreateResponseSerializer,
     CustomerDeleteResponseSerializer,
     FeatureAccessRequestSerialzier,
     FeatureAccessResponseSerializer,
@@ -50,16 +56,19 @@ from api.serializers.nonmodel_serializers import (
     GetInvoicePdfURLResponseSerializer,
     MetricAccessRequestSerializer,
     MetricAccessResponseSerializer,
+    SubscriptionRecordBatchCreateRequestSerializer,
+    SubscriptionRecordBatchCreateResponseSerializer,
 )
 from dateutil import parser
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection
 from django.db.models import (
     Count,
     DecimalField,
+    Exists,
     F,
-    Max,
-    Min,
     OuterRef,
     Prefetch,
     Q,
@@ -73,6 +82,7 @@ from django.http import HttpRequest, HttpResponseBadRequest, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from drf_spectacular.utils import OpenApiParameter, extend_schema, inline_serializer
 from metering_billing.auth.auth_utils import fast_api_key_validation_and_cache
+from metering_billing.batch import create_customers, create_subscription_records
 from metering_billing.exceptions import (
     DuplicateCustomer,
     MethodNotAllowed,
@@ -82,16 +92,16 @@ from metering_billing.exceptions import (
     SwitchPlanSamePlanException,
 )
 from metering_billing.exceptions.exceptions import NotFoundException
-from metering_billing.invoice import generate_invoice
+from metering_billing.invoice import schedule_invoicing
 from metering_billing.invoice_pdf import get_invoice_presigned_url
 from metering_billing.kafka.producer import Producer
 from metering_billing.models import (
-    CategoricalFilter,
     Customer,
     CustomerBalanceAdjustment,
     Event,
     Invoice,
     InvoiceLineItem,
+    InvoicingJob,
     Metric,
     Plan,
     PlanComponent,
@@ -101,20 +111,17 @@ from metering_billing.models import (
     Tag,
 )
 from metering_billing.permissions import HasUserAPIKey, ValidOrganization
+from metering_billing.renderers import loads
 from metering_billing.serializers.serializer_utils import (
     AddonUUIDField,
     BalanceAdjustmentUUIDField,
     InvoiceUUIDField,
+    InvoicingJobUUIDField,
     MetricUUIDField,
     OrganizationUUIDField,
     PlanUUIDField,
 )
-from metering_billing.utils import (
-    calculate_end_date,
-    convert_to_datetime,
-    date_as_max_dt,
-    now_utc,
-)
+from metering_billing.utils import now_utc
 from metering_billing.utils.enums import (
     CATEGORICAL_FILTER_OPERATORS,
     CUSTOMER_BALANCE_ADJUSTMENT_STATUS,
@@ -127,9 +134,11 @@ from metering_billing.utils.enums import (
     SUBSCRIPTION_STATUS,
     USAGE_BEHAVIOR,
     USAGE_BILLING_BEHAVIOR,
-    USAGE_BILLING_FREQUENCY,
 )
-from metering_billing.webhooks import customer_created_webhook
+from metering_billing.webhooks import (
+    customer_created_webhook,
+    customers_created_webhook,
+)
 from rest_framework import mixins, serializers, status, viewsets
 from rest_framework.decorators import (
     action,
@@ -137,7 +146,8 @@ from rest_framework.decorators import (
     authentication_classes,
     permission_classes,
 )
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -145,6 +155,7 @@ from rest_framework.views import APIView
 POSTHOG_PERSON = settings.POSTHOG_PERSON
 SVIX_CONNECTOR = settings.SVIX_CONNECTOR
 IDEMPOTENCY_ID_NAMESPACE = settings.IDEMPOTENCY_ID_NAMESPACE
+CUSTOMER_ID_NAMESPACE = settings.CUSTOMER_ID_NAMESPACE
 
 logger = logging.getLogger("django.server")
 
@@ -177,81 +188,291 @@ class EmptySerializer(serializers.Serializer):
     pass
 
 
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique ordering such as (created, id). A cursor holds the
+    ordering values of the row to continue from, the last row of the page for next
+    and the first one for previous, so every page is a range scan from there and
+    deep pages cost the same as the first one.
+
+    It's opt-in to keep existing clients working: lists are only paginated when a
+    cursor or a page size is given.
+    """
+
+    ordering = ("-created", "-id")
+    page_size = 100
+    max_page_size = 1000
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    def is_requested(self, request):
+        return (
+            self.cursor_query_param in request.query_params
+            or self.page_size_query_param in request.query_params
+        )
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, obj, reverse=False):
+        position = [str(getattr(obj, field.lstrip("-"))) for field in self.ordering]
+        payload = {"p": position, "r": reverse}
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    def decode_cursor(self, request):
+        """
+        Returns the position the cursor points at, and whether the page is read
+        backwards from it.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            position, reverse = payload["p"], bool(payload["r"])
+        except (ValueError, KeyError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def filter_after(self, queryset, position, ordering):
+        # rows strictly after the position in the ordering
+        after_position = Q()
+        equal_to_position = {}
+        for field, value in zip(ordering, position):
+            field_name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            after_position |= Q(
+                **equal_to_position, **{f"{field_name}__{lookup}": value}
+            )
+            equal_to_position[field_name] = value
+        return queryset.filter(after_position)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(
+                field[1:] if field.startswith("-") else f"-{field}"
+                for field in ordering
+            )
+        if position is not None:
+            queryset = self.filter_after(queryset, position, ordering)
+        try:
+            page = list(queryset.order_by(*ordering)[: page_size + 1])
+        except (DjangoValidationError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+        self.next_cursor = None
+        self.previous_cursor = None
+        if page and has_next:
+            self.next_cursor = self.encode_cursor(page[-1])
+        if page and has_previous:
+            self.previous_cursor = self.encode_cursor(page[0], reverse=True)
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.next_cursor,
+                "previous": self.previous_cursor,
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "previous": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The next or previous cursor of another page.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": f"Number of results per page, at most {self.max_page_size}.",
+                "schema": {"type": "integer"},
+            },
+        ]
+
+
+def invoicing_job_headers(invoicing_job):
+    # the response body stays the subscription records, the invoices are generated
+    # in the background and can be followed with the job id
+    if invoicing_job is None:
+        return None
+    return {
+        "X-Invoicing-Job-Id": InvoicingJobUUIDField().to_representation(
+            invoicing_job.invoicing_job_id
+        ),
+        "X-Predicted-Invoice-Amount": f"{invoicing_job.predicted_cost_due:.2f}",
+    }
+
+
+def get_batch_items(data, key):
+    items = data.get(key) if hasattr(data, "get") else None
+    if not isinstance(items, list):
+        raise ValidationError({key: ["Expected a list of items."]})
+    if len(items) > settings.BATCH_CREATE_MAX_SIZE:
+        raise ValidationError(
+            {
+                key: [
+                    f"Ensure this field has no more than {settings.BATCH_CREATE_MAX_SIZE} elements."
+                ]
+            }
+        )
+    return items
+
+
+class InvoiceKeysetPagination(KeysetPagination):
+    ordering = ("-issue_date", "-id")
+
+
+class SubscriptionKeysetPagination(KeysetPagination):
+    ordering = ("-start_date", "-id")
+
+
 class CustomerViewSet(PermissionPolicyMixin, viewsets.ModelViewSet):
     lookup_field = "customer_id"
     http_method_names = ["get", "post", "head"]
     queryset = Customer.objects.all()
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         now = now_utc()
         organization = self.request.organization
+        expand = self.get_expand()
         qs = Customer.objects.filter(organization=organization)
-        qs = qs.select_related("default_currency")
-        qs = qs.prefetch_related(
-            "organization",
-            Prefetch(
-                "subscription_records",
-                queryset=SubscriptionRecord.base_objects.active(now)
-                .filter(
-                    organization=organization,
-                )
-                .select_related("customer", "billing_plan", "billing_plan__plan")
-                .prefetch_related(
-                    "filters",
-                    "addon_subscription_records",
-                    "organization",
+        qs = qs.select_related(
+            "default_currency", "stripe_integration", "braintree_integration"
+        )
+        qs = qs.prefetch_related("organization")
+        if "subscriptions" in expand:
+            qs = qs.prefetch_related(
+                Prefetch(
+                    "subscription_records",
+                    queryset=SubscriptionRecord.base_objects.active(now)
+                    .filter(
+                        organization=organization,
+                    )
+                    .select_related("customer", "billing_plan", "billing_plan__plan")
+                    .prefetch_related(
+                        "filters",
+                        "addon_subscription_records",
+                        "organization",
+                    ),
+                    to_attr="active_subscription_records",
                 ),
-                to_attr="active_subscription_records",
-            ),
-            Prefetch(
-                "invoices",
-                queryset=Invoice.objects.filter(
-                    organization=organization,
-                    payment_status__in=[
-                        Invoice.PaymentStatus.PAID,
-                        Invoice.PaymentStatus.UNPAID,
-                    ],
-                )
-                .order_by("-issue_date")
-                .select_related("currency")
-                .prefetch_related(
-                    "organization",
-                    Prefetch(
-                        "line_items",
-                        queryset=InvoiceLineItem.objects.all()
-                        .select_related(
-                            "pricing_unit",
-                            "associated_subscription_record",
-                            "associated_plan_version",
-                            "associated_recurring_charge",
-                            "associated_plan_component",
-                        )
-                        .prefetch_related("organization"),
+            )
+        if "invoices" in expand:
+            qs = qs.prefetch_related(
+                Prefetch(
+                    "invoices",
+                    queryset=Invoice.objects.filter(
+                        organization=organization,
+                        payment_status__in=[
+                            Invoice.PaymentStatus.PAID,
+                            Invoice.PaymentStatus.UNPAID,
+                        ],
+                    )
+                    .order_by("-issue_date")
+                    .select_related("currency")
+                    .prefetch_related(
+                        "organization",
+                        Prefetch(
+                            "line_items",
+                            queryset=InvoiceLineItem.objects.all()
+                            .select_related(
+                                "pricing_unit",
+                                "associated_subscription_record",
+                                "associated_plan_version",
+                                "associated_recurring_charge",
+                                "associated_plan_component",
+                            )
+                            .prefetch_related("organization"),
+                        ),
                     ),
-                )
-                .annotate(
-                    min_date=Min("line_items__start_date"),
-                    max_date=Max("line_items__end_date"),
+                    to_attr="active_invoices",
                 ),
-                to_attr="active_invoices",
-            ),
-        )
-        qs = qs.annotate(
-            total_amount_due=Sum(
-                "invoices__cost_due",
-                filter=Q(invoices__payment_status=Invoice.PaymentStatus.UNPAID),
-                output_field=DecimalField(),
             )
-        )
+        if "total_amount_due" in expand:
+            # a subquery rather than a join and group by, so a page of customers
+            # only sums the invoices of that page
+            qs = qs.annotate(
+                total_amount_due=Subquery(
+                    Invoice.objects.filter(
+                        customer=OuterRef("pk"),
+                        payment_status=Invoice.PaymentStatus.UNPAID,
+                    )
+                    .values("customer")
+                    .annotate(total=Sum("cost_due"))
+                    .values("total"),
+                    output_field=DecimalField(),
+                )
+            )
         return qs
 
+    def is_paginated_list(self):
+        return self.action == "list" and self.paginator.is_requested(self.request)
+
+    def get_expand(self):
+        """
+        The nested data to load for each customer. Paginated lists load only what is
+        asked for with expand, everything else gets all of it as before.
+        """
+        if not self.is_paginated_list():
+            return set(CustomerListSerializer.EXPANDABLE_FIELDS)
+        serializer = CustomerListFilterSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data["expand"]
+
     def get_serializer_class(self):
         if self.action == "create":
             return CustomerCreateSerializer
         elif self.action == "archive":
             return EmptySerializer
+        elif self.is_paginated_list():
+            return CustomerListSerializer
         return CustomerSerializer
 
+    @extend_schema(
+        parameters=[CustomerListFilterSerializer],
+    )
+    def list(self, request, *args, **kwargs):
+        """
+        Lists the organization's customers. Pass page_size or cursor to get them a
+        page at a time, newest first, in the lighter list format.
+        """
+        return super().list(request, *args, **kwargs)
+
     @extend_schema(responses=CustomerSerializer)
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -305,97 +526,34 @@ class CustomerViewSet(PermissionPolicyMixin, viewsets.ModelViewSet):
         CustomerDeleteResponseSerializer().validate(return_data)
         return Response(return_data, status=status.HTTP_200_OK)
 
-    # @extend_schema(
-    #     request=inline_serializer(
-    #         name="CustomerBatchCreateRequest",
-    #         fields={
-    #             "customers": CustomerCreateSerializer(many=True),
-    #             "behavior_on_existing": serializers.ChoiceField(
-    #                 choices=["merge", "ignore", "overwrite"],
-    #                 help_text="Determines what to do if a customer with the same email or customer_id already exists. Ignore skips, merge merges the existing customer with the new customer, and overwrite overwrites the existing customer with the new customer.",
-    #             ),
-    #         },
-    #     ),
-    #     responses={
-    #         201: inline_serializer(
-    #             name="CustomerBatchCreateSuccess",
-    #             fields={
-    #                 "success": serializers.ChoiceField(choices=["all", "some"]),
-    #                 "failed_customers": serializers.DictField(
-    #                     required=False,
-    #                     help_text="Returns the customers that failed to be created, if any, in the same format as the request.",
-    #                 ),
-    #             },
-    #         ),
-    #         400: inline_serializer(
-    #             name="CustomerBatchCreateFailure",
-    #             fields={
-    #                 "success": serializers.ChoiceField(choices=["none"]),
-    #                 "failed_customers": serializers.DictField(
-    #                     help_text="Returns the customers that failed to be created in the same format as the request."
-    #                 ),
-    #             },
-    #         ),
-    #     },
-    # )
-    # @action(detail=False, methods=["post"])
-    # def batch(self, request, format=None):
-    #     organization = request.organization
-    #     serializer = CustomerCreateSerializer(
-    #         data=request.data["customers"],
-    #         many=True,
-    #         context={"organization": organization},
-    #     )
-    #     serializer.is_valid(raise_exception=True)
-    #     failed_customers = {}
-    #     behavior = request.data.get("behavior_on_existing", "merge")
-    #     for customer in serializer.validated_data:
-    #         try:
-    #             match = Customer.objects.filter(
-    #                 Q(email=customer["email"]) | Q(customer_id=customer["customer_id"]),
-    #                 organization=organization,
-    #             )
-    #             if match.exists():
-    #                 match = match.first()
-    #                 if behavior == "ignore":
-    #                     pass
-    #                 else:
-    #                     if "customer_id" in customer:
-    #                         non_unique_id = Customer.objects.filter(
-    #                             ~Q(pk=match.pk), customer_id=customer["customer_id"]
-    #                         ).exists()
-    #                         if non_unique_id:
-    #                             failed_customers[
-    #                                 customer["customer_id"]
-    #                             ] = "customer_id already exists"
-    #                             continue
-    #                     CustomerUpdateSerializer().update(
-    #                         match, customer, behavior=behavior
-    #                     )
-    #             else:
-    #                 customer["organization"] = organization
-    #                 CustomerCreateSerializer().create(customer)
-    #         except Exception as e:
-    #             identifier = customer.get("customer_id", customer.get("email"))
-    #             failed_customers[identifier] = str(e)
-
-    #     if len(failed_customers) == 0 or len(failed_customers) < len(
-    #         serializer.validated_data
-    #     ):
-    #         return Response(
-    #             {
-    #                 "success": "all" if len(failed_customers) == 0 else "some",
-    #                 "failed_customers": failed_customers,
-    #             },
-    #             status=status.HTTP_201_CREATED,
-    #         )
-    #     return Response(
-    #         {
-    #             "success": "none",
-    #             "failed_customers": failed_customers,
-    #         },
-    #         status=status.HTTP_400_BAD_REQUEST,
-    #     )
+    @extend_schema(
+        request=CustomerBatchCreateRequestSerializer,
+        responses={
+            201: CustomerBatchCreateResponseSerializer,
+            400: CustomerBatchCreateResponseSerializer,
+        },
+    )
+    @action(detail=False, methods=["post"])
+    def batch(self, request, *args, **kwargs):
+        """
+        Creates many customers at once. The customers that fail validation are left
+        out and reported in errors, keyed by their position in the request.
+        """
+        organization = request.organization
+        customers_data = get_batch_items(request.data, "customers")
+        customers, errors = create_customers(organization, customers_data)
+        positions = {x.pk: i for i, x in enumerate(customers)}
+        customers = sorted(
+            self.get_queryset().filter(pk__in=positions), key=lambda x: positions[x.pk]
+        )
+        customers_data = CustomerSerializer(customers, many=True).data
+        customers_created_webhook(organization, customers, customers_data)
+        return Response(
+            {"customers": customers_data, "errors": errors},
+            status=status.HTTP_400_BAD_REQUEST
+            if len(customers) == 0 and len(errors) > 0
+            else status.HTTP_201_CREATED,
+        )
 
     def perform_create(self, serializer):
         try:
@@ -411,6 +569,8 @@ class CustomerViewSet(PermissionPolicyMixin, viewsets.ModelViewSet):
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context.update({"organization": self.request.organization})
+        if self.is_paginated_list():
+            context["expand"] = self.get_expand()
         return context
 
     def dispatch(self, request, *args, **kwargs):
@@ -629,6 +789,7 @@ class SubscriptionViewSet(
         "post",
     ]
     queryset = SubscriptionRecord.objects.all()
+    pagination_class = SubscriptionKeysetPagination
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -650,39 +811,67 @@ class SubscriptionViewSet(
         else:
             return SubscriptionRecordSerializer
 
-    def _prefetch_qs(self, qs):
-        qs = qs.select_related("billing_plan")
+    def _list_prefetch_qs(self, qs):
+        # what SubscriptionRecordSerializer reads, loaded for the rows of a page
+        qs = qs.select_related("customer", "billing_plan__plan")
         qs = qs.prefetch_related(
-            Prefetch(
-                "billing_plan__plan_components",
-                queryset=PlanComponent.objects.all(),
-            ),
-            Prefetch(
-                "billing_plan__plan_components__billable_metric",
-                queryset=Metric.objects.all(),
-            ),
-            Prefetch(
-                "billing_plan__plan_components__tiers",
-                queryset=PriceTier.objects.all(),
-            ),
+            "filters",
             Prefetch(
                 "addon_subscription_records",
                 queryset=SubscriptionRecord.addon_objects.select_related(
-                    "billing_plan"
+                    "billing_plan__plan__addon_spec",
+                    "billing_plan__plan__display_version",
                 ).prefetch_related(
-                    Prefetch(
-                        "billing_plan__plan_components",
-                        queryset=PlanComponent.objects.all(),
-                    ),
-                    Prefetch(
-                        "billing_plan__plan_components__tiers",
-                        queryset=PriceTier.objects.all(),
-                    ),
+                    "billing_plan__plan__display_version__plan_components"
                 ),
             ),
         )
         return qs
 
+    def _filter_args(self, validated_data, now):
+        customer = validated_data.get("customer")
+        allowed_status = validated_data.get("status", [SUBSCRIPTION_STATUS.ACTIVE])
+        range_start = validated_data.get("range_start")
+        range_end = validated_data.get("range_end")
+        plan = validated_data.get("plan")
+        args = []
+        if customer:
+            args.append(Q(customer=customer))
+        if allowed_status:
+            status_combo = []
+            if SUBSCRIPTION_STATUS.ACTIVE in allowed_status:
+                status_combo.append(Q(start_date__lte=now, end_date__gte=now))
+            if SUBSCRIPTION_STATUS.ENDED in allowed_status:
+                status_combo.append(Q(end_date__lt=now))
+            if SUBSCRIPTION_STATUS.NOT_STARTED in allowed_status:
+                status_combo.append(Q(start_date__gt=now))
+            args.append(reduce(operator.or_, status_combo))
+        if range_start:
+            args.append(Q(end_date__gte=range_start))
+        if range_end:
+            args.append(Q(start_date__lte=range_end))
+        if plan:
+            args.append(Q(billing_plan__plan=plan))
+        return args
+
+    def _has_filters_args(self, subscription_filters, prefix=""):
+        # one EXISTS per filter, matched on its value rather than on a stored
+        # CategoricalFilter so that reads don't create any
+        organization = self.request.organization
+        SubscriptionFilter = SubscriptionRecord.filters.through
+        return [
+            Exists(
+                SubscriptionFilter.objects.filter(
+                    subscriptionrecord_id=OuterRef(f"{prefix}pk"),
+                    categoricalfilter__organization=organization,
+                    categoricalfilter__property_name=sf["property_name"],
+                    categoricalfilter__operator=CATEGORICAL_FILTER_OPERATORS.ISIN,
+                    categoricalfilter__comparison_value=[sf["value"]],
+                )
+            )
+            for sf in subscription_filters
+        ]
+
     def get_queryset(self):
         if self.action in ["cancel_addon", "update_addon"]:
             qs = SubscriptionRecord.addon_objects.all()
@@ -713,76 +902,32 @@ class SubscriptionViewSet(
                 serializer = SubscriptionRecordFilterSerializerDelete(
                     data=data, context=context
                 )
-            elif self.action == "list":
+            else:
                 serializer = ListSubscriptionRecordFilter(
                     data=self.request.query_params, context=context
                 )
-            else:
-                raise Exception("Invalid action")
             serializer.is_valid(raise_exception=True)
-            # unpack whats in the serialized data
-
-            customer = serializer.validated_data.get("customer")
-            subscription_filters = serializer.validated_data.get("subscription_filters")
-            allowed_status = serializer.validated_data.get(
-                "status", [SUBSCRIPTION_STATUS.ACTIVE]
-            )
-            range_start = serializer.validated_data.get("range_start")
-            range_end = serializer.validated_data.get("range_end")
-            plan = serializer.validated_data.get("plan")
-            # add onto args
-            args = []
-            if customer:
-                args.append(Q(customer=customer))
-            if allowed_status:
-                status_combo = []
-                if SUBSCRIPTION_STATUS.ACTIVE in allowed_status:
-                    status_combo.append(Q(start_date__lte=now, end_date__gte=now))
-                if SUBSCRIPTION_STATUS.ENDED in allowed_status:
-                    status_combo.append(Q(end_date__lt=now))
-                if SUBSCRIPTION_STATUS.NOT_STARTED in allowed_status:
-                    status_combo.append(Q(start_date__gt=now))
-                args.append(reduce(operator.or_, status_combo))
-            if range_start:
-                args.append(Q(end_date__gte=range_start))
-            if range_end:
-                args.append(Q(start_date__lte=range_end))
-            if plan:
-                args.append(Q(billing_plan__plan=plan))
-
+            args = self._filter_args(serializer.validated_data, now)
             qs = qs.filter(*args)
-            qs = self._prefetch_qs(qs)
+            # the matching subscriptions and their add-ons, in the same query
             qs = SubscriptionRecord.objects.filter(
-                pk__in=[
-                    sr.pk
-                    for sr in chain(
-                        qs, *[r.addon_subscription_records.all() for r in qs]
-                    )
-                ]
+                Q(pk__in=qs.values("pk")) | Q(parent__in=qs.values("pk"))
             )
-
-            if serializer.validated_data.get("subscription_filters"):
-                filters = []
-                for filter in serializer.validated_data["subscription_filters"]:
-                    m2m, _ = CategoricalFilter.objects.get_or_create(
-                        organization=organization,
-                        property_name=filter["property_name"],
-                        comparison_value=[filter["value"]],
-                        operator=CATEGORICAL_FILTER_OPERATORS.ISIN,
-                    )
-                    filters.append(m2m)
-                query = reduce(
-                    lambda acc, filter: acc & Q(filters=filter), filters, Q()
+            qs = qs.filter(
+                *self._has_filters_args(
+                    serializer.validated_data.get("subscription_filters", [])
                 )
-                qs = qs.filter(query)
+            )
+            if self.action == "list":
+                qs = self._list_prefetch_qs(qs)
         elif self.action in ["cancel_addon", "update_addon"]:
             subscription_filters = self.request.query_params.getlist(
-                "subscription_filters[]"
+                "attached_subscription_filters[]"
             )
             subscription_filters = [json.loads(x) for x in subscription_filters]
             dict_params = self.request.query_params.dict()
             data = {
-                "subscription_filters": subscription_filters,
+                "attached_subscription_filters": subscription_filters,
                 "attached_customer_id": dict_params.get("attached_customer_id"),
                 "attached_plan_id": dict_params.get("attached_plan_id"),
                 "addon_id": dict_params.get("addon_id"),
@@ -791,60 +936,21 @@ class SubscriptionViewSet(
                 data=data, context=context
             )
             serializer.is_valid(raise_exception=True)
-
-            customer = serializer.validated_data.get("customer")
-            subscription_filters = serializer.validated_data.get("subscription_filters")
-            allowed_status = serializer.validated_data.get(
-                "status", [SUBSCRIPTION_STATUS.ACTIVE]
+            args = self._filter_args(serializer.validated_data, now)
+            args += [
+                Q(customer=serializer.validated_data["attached_customer_id"]),
+                Q(
+                    parent__billing_plan__plan=serializer.validated_data[
+                        "attached_plan_id"
+                    ]
+                ),
+                Q(billing_plan__plan=serializer.validated_data["addon_id"]),
+            ]
+            args += self._has_filters_args(
+                serializer.validated_data.get("attached_subscription_filters", []),
+                prefix="parent__",
             )
-            range_start = serializer.validated_data.get("range_start")
-            range_end = serializer.validated_data.get("range_end")
-            plan = serializer.validated_data.get("plan")
-            # add onto args
-            args = []
-            if customer:
-                args.append(Q(customer=customer))
-            if allowed_status:
-                status_combo = []
-                if SUBSCRIPTION_STATUS.ACTIVE in allowed_status:
-                    status_combo.append(Q(start_date__lte=now, end_date__gte=now))
-                if SUBSCRIPTION_STATUS.ENDED in allowed_status:
-                    status_combo.append(Q(end_date__lt=now))
-                if SUBSCRIPTION_STATUS.NOT_STARTED in allowed_status:
-                    status_combo.append(Q(start_date__gt=now))
-                args.append(reduce(operator.or_, status_combo))
-            if range_start:
-                args.append(Q(end_date__gte=range_start))
-            if range_end:
-                args.append(Q(start_date__lte=range_end))
-            if plan:
-                args.append(Q(billing_plan__plan=plan))
-
             qs = qs.filter(*args)
-            qs = self._prefetch_qs(qs)
-            qs = SubscriptionRecord.objects.filter(
-                pk__in=[
-                    sr.pk
-                    for sr in chain(
-                        qs, *[r.addon_subscription_records.all() for r in qs]
-                    )
-                ]
-            )
-
-            if serializer.validated_data.get("subscription_filters"):
-                filters = []
-                for filter in serializer.validated_data["subscription_filters"]:
-                    m2m, _ = CategoricalFilter.objects.get_or_create(
-                        organization=organization,
-                        property_name=filter["property_name"],
-                        comparison_value=[filter["value"]],
-                        operator=CATEGORICAL_FILTER_OPERATORS.ISIN,
-                    )
-                    filters.append(m2m)
-                query = reduce(
-                    lambda acc, filter: acc & Q(filters=filter), filters, Q()
-                )
-                qs = qs.filter(query)
         return qs
 
     @extend_schema(
@@ -877,58 +983,7 @@ class SubscriptionViewSet(
                 raise ValidationError(
                     "Invalid subscription filter. Please check your subscription filters setting."
                 )
-        # check to see if subscription exists
-        duration = serializer.validated_data["billing_plan"].plan.plan_duration
-        billing_freq = serializer.validated_data["billing_plan"].usage_billing_frequency
-        start_date = convert_to_datetime(
-            serializer.validated_data["start_date"], date_behavior="min"
-        )
-        day_anchor = (
-            serializer.validated_data["billing_plan"].day_anchor
-            or start_date.date().day
-        )
-        month_anchor = (
-            serializer.validated_data["billing_plan"].month_anchor
-            or start_date.date().month
-        )
-        timezone = serializer.validated_data["customer"].timezone
-        end_date = calculate_end_date(
-            duration,
-            start_date,
-            timezone,
-            day_anchor=day_anchor,
-            month_anchor=month_anchor,
-        )
-        end_date = serializer.validated_data.get("end_date", end_date)
-        if end_date < now:
-            raise ValidationError(
-                "End date cannot be in the past. For historical backfilling of subscriptions, please contact support."
-            )
-        if billing_freq in [
-            USAGE_BILLING_FREQUENCY.MONTHLY,
-            USAGE_BILLING_FREQUENCY.QUARTERLY,
-        ]:
-            found = False
-            i = 0
-            num_months = 1 if billing_freq == USAGE_BILLING_FREQUENCY.MONTHLY else 3
-            while not found:
-                tentative_nbd = date_as_max_dt(
-                    start_date + relativedelta(months=i, day=day_anchor, days=-1)
-                )
-                if tentative_nbd <= start_date:
-                    i += 1
-                    continue
-                elif tentative_nbd > end_date:
-                    tentative_nbd = end_date
-                    break
-                months_btwn = relativedelta(end_date, tentative_nbd).months
-                if months_btwn % num_months == 0:
-                    found = True
-                else:
-                    i += 1
-            serializer.validated_data[
-                "next_billing_date"
-            ] = tentative_nbd  # end_date - i * relativedelta(months=num_months)
+        serializer.set_next_billing_date(serializer.validated_data, now)
         subscription_record = serializer.save(
             organization=organization,
         )
@@ -940,6 +995,44 @@ class SubscriptionViewSet(
             status=status.HTTP_201_CREATED,
         )
 
+    @extend_schema(
+        request=SubscriptionRecordBatchCreateRequestSerializer,
+        responses={
+            201: SubscriptionRecordBatchCreateResponseSerializer,
+            400: SubscriptionRecordBatchCreateResponseSerializer,
+        },
+    )
+    @action(detail=False, methods=["post"], url_path="add/batch")
+    def add_batch(self, request, *args, **kwargs):
+        """
+        Creates many subscriptions at once, like /subscriptions/add does for one. The
+        subscriptions that fail validation or overlap an existing one are left out and
+        reported in errors, keyed by their position in the request.
+        """
+        organization = self.request.organization
+        subscriptions_data = get_batch_items(request.data, "subscriptions")
+        subscription_records, errors = create_subscription_records(
+            organization, subscriptions_data
+        )
+        positions = {x.pk: i for i, x in enumerate(subscription_records)}
+        subscription_records = self._list_prefetch_qs(
+            SubscriptionRecord.objects.filter(pk__in=positions)
+        )
+        subscription_records = sorted(
+            subscription_records, key=lambda x: positions[x.pk]
+        )
+        return Response(
+            {
+                "subscriptions": SubscriptionRecordSerializer(
+                    subscription_records, many=True
+                ).data,
+                "errors": errors,
+            },
+            status=status.HTTP_400_BAD_REQUEST
+            if len(subscription_records) == 0 and len(errors) > 0
+            else status.HTTP_201_CREATED,
+        )
+
     @extend_schema(
         parameters=[
             SubscriptionRecordFilterSerializerDelete,
@@ -963,22 +1056,27 @@ class SubscriptionViewSet(
             invoice_usage_charges=usage_behavior == USAGE_BILLING_BEHAVIOR.BILL_FULL,
             auto_renew=False,
             end_date=now,
-            fully_billed=invoicing_behavior == INVOICING_BEHAVIOR.INVOICE_NOW,
+            # an invoicing job marks them fully billed once it has invoiced them
+            fully_billed=False,
         )
         qs = SubscriptionRecord.objects.filter(pk__in=qs_pks, organization=organization)
         customer_ids = qs.values_list("customer", flat=True).distinct()
         customer_set = Customer.objects.filter(
             id__in=customer_ids, organization=organization
         )
+        invoicing_job = None
         if invoicing_behavior == INVOICING_BEHAVIOR.INVOICE_NOW:
-            for customer in customer_set:
-                generate_invoice(qs.filter(customer=customer))
+            invoicing_job = schedule_invoicing(qs.filter(customer__in=customer_set))
 
         return_qs = SubscriptionRecord.base_objects.filter(
             pk__in=original_qs, organization=organization
         )
         ret = SubscriptionRecordSerializer(return_qs, many=True).data
-        return Response(ret, status=status.HTTP_200_OK)
+        return Response(
+            ret,
+            status=status.HTTP_200_OK,
+            headers=invoicing_job_headers(invoicing_job),
+        )
 
     @extend_schema(
         parameters=[SubscriptionRecordFilterSerializer],
@@ -1009,6 +1107,7 @@ class SubscriptionViewSet(
         usage_behavior = serializer.validated_data.get("usage_behavior")
         turn_off_auto_renew = serializer.validated_data.get("turn_off_auto_renew")
         end_date = serializer.validated_data.get("end_date")
+        invoicing_job = None
         if replace_billing_plan:
             qs = qs.filter(
                 billing_plan__plan__addon_spec__isnull=True
@@ -1053,15 +1152,13 @@ class SubscriptionViewSet(
                 subscription_record.invoice_usage_charges = keep_separate
                 subscription_record.auto_renew = False
                 subscription_record.end_date = now
-                subscription_record.fully_billed = (
-                    billing_behavior == INVOICING_BEHAVIOR.INVOICE_NOW
-                )
+                subscription_record.fully_billed = False
                 subscription_record.save()
             new_qs = SubscriptionRecord.objects.filter(
                 pk__in=original_qs, organization=organization
             )
             if billing_behavior == INVOICING_BEHAVIOR.INVOICE_NOW:
-                generate_invoice(new_qs)
+                invoicing_job = schedule_invoicing(new_qs)
         else:
             update_dict = {}
             if turn_off_auto_renew:
@@ -1076,7 +1173,11 @@ class SubscriptionViewSet(
             pk__in=original_qs, organization=organization
         )
         ret = SubscriptionRecordSerializer(return_qs, many=True).data
-        return Response(ret, status=status.HTTP_200_OK)
+        return Response(
+            ret,
+            status=status.HTTP_200_OK,
+            headers=invoicing_job_headers(invoicing_job),
+        )
 
     @extend_schema(responses=AddOnSubscriptionRecordSerializer)
     @action(detail=False, methods=["post"], url_path="addons/add")
@@ -1087,6 +1188,7 @@ class SubscriptionViewSet(
         return Response(
             AddOnSubscriptionRecordSerializer(sr).data,
             status=status.HTTP_201_CREATED,
+            headers=invoicing_job_headers(getattr(sr, "invoicing_job", None)),
         )
 
     @extend_schema(
@@ -1116,6 +1218,7 @@ class SubscriptionViewSet(
             update_dict["quantity"] = quantity
         if len(update_dict) > 0:
             qs.update(**update_dict)
+        invoicing_job = None
         if (
             billing_behavior == INVOICING_BEHAVIOR.INVOICE_NOW
             and "quantity" in update_dict
@@ -1124,7 +1227,7 @@ class SubscriptionViewSet(
                 pk__in=original_qs, organization=organization
             )
             if billing_behavior == INVOICING_BEHAVIOR.INVOICE_NOW:
-                generate_invoice(new_qs)
+                invoicing_job = schedule_invoicing(new_qs)
 
         return_qs = SubscriptionRecord.addon_objects.filter(
             pk__in=original_qs, organization=organization
@@ -1132,6 +1235,7 @@ class SubscriptionViewSet(
         return Response(
             AddOnSubscriptionRecordSerializer(return_qs, many=True).data,
             status=status.HTTP_200_OK,
+            headers=invoicing_job_headers(invoicing_job),
         )
 
     @extend_schema(
@@ -1155,7 +1259,8 @@ class SubscriptionViewSet(
             invoice_usage_charges=usage_behavior == USAGE_BILLING_BEHAVIOR.BILL_FULL,
             auto_renew=False,
             end_date=now,
-            fully_billed=invoicing_behavior == INVOICING_BEHAVIOR.INVOICE_NOW,
+            # an invoicing job marks them fully billed once it has invoiced them
+            fully_billed=False,
         )
         qs = SubscriptionRecord.addon_objects.filter(
             pk__in=qs_pks, organization=organization
@@ -1164,9 +1269,9 @@ class SubscriptionViewSet(
         customer_set = Customer.objects.filter(
             id__in=customer_ids, organization=organization
         )
+        invoicing_job = None
         if invoicing_behavior == INVOICING_BEHAVIOR.INVOICE_NOW:
-            for customer in customer_set:
-                generate_invoice(qs.filter(customer=customer))
+            invoicing_job = schedule_invoicing(qs.filter(customer__in=customer_set))
 
         return_qs = SubscriptionRecord.addon_objects.filter(
             pk__in=original_qs, organization=organization
@@ -1174,6 +1279,7 @@ class SubscriptionViewSet(
         return Response(
             AddOnSubscriptionRecordSerializer(return_qs, many=True).data,
             status=status.HTTP_200_OK,
+            headers=invoicing_job_headers(invoicing_job),
         )
 
     def dispatch(self, request, *args, **kwargs):
@@ -1212,6 +1318,7 @@ class InvoiceViewSet(PermissionPolicyMixin, viewsets.ModelViewSet):
     http_method_names = ["get", "patch", "head"]
     lookup_field = "invoice_id"
     queryset = Invoice.objects.all()
+    pagination_class = InvoiceKeysetPagination
     permission_classes_per_method = {
         "partial_update": [IsAuthenticated & ValidOrganization],
     }
@@ -1249,11 +1356,48 @@ class InvoiceViewSet(PermissionPolicyMixin, viewsets.ModelViewSet):
             if serializer.validated_data.get("customer"):
                 args.append(Q(customer=serializer.validated_data["customer"]))
 
-        return Invoice.objects.filter(*args)
+        qs = Invoice.objects.filter(*args)
+        qs = qs.select_related(
+            "currency",
+            "customer",
+            "customer__billing_address",
+            "customer__stripe_integration",
+            "customer__braintree_integration",
+        )
+        qs = qs.prefetch_related("organization", "organization__address")
+        if "line_items" in self.get_expand():
+            qs = qs.prefetch_related(
+                Prefetch(
+                    "line_items",
+                    queryset=InvoiceLineItem.objects.select_related(
+                        "associated_subscription_record__billing_plan__plan"
+                    ).prefetch_related("associated_subscription_record__filters"),
+                )
+            )
+        return qs
+
+    def is_paginated_list(self):
+        return self.action == "list" and self.paginator.is_requested(self.request)
+
+    def get_expand(self):
+        """
+        The nested data to load for each invoice. Paginated lists load only what is
+        asked for with expand, everything else gets all of it as before.
+        """
+        if not self.is_paginated_list():
+            return set(InvoiceListSerializer.EXPANDABLE_FIELDS)
+        serializer = InvoiceListFilterSerializer(
+            data=self.request.query_params,
+            context={"organization": self.request.organization},
+        )
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data["expand"]
 
     def get_serializer_class(self):
         if self.action == "partial_update":
             return InvoiceUpdateSerializer
+        elif self.is_paginated_list():
+            return InvoiceListSerializer
         return InvoiceSerializer
 
     @extend_schema(responses=InvoiceSerializer)
@@ -1276,6 +1420,8 @@ class InvoiceViewSet(PermissionPolicyMixin, viewsets.ModelViewSet):
         context = super().get_serializer_context()
         organization = self.request.organization
         context.update({"organization": organization})
+        if self.is_paginated_list():
+            context["expand"] = self.get_expand()
         return context
 
     def dispatch(self, request, *args, **kwargs):
@@ -1303,6 +1449,10 @@ class InvoiceViewSet(PermissionPolicyMixin, viewsets.ModelViewSet):
         parameters=[InvoiceListFilterSerializer],
     )
     def list(self, request):
+        """
+        Lists the organization's invoices. Pass page_size or cursor to get them a
+        page at a time, most recently issued first, in the lighter list format.
+        """
         return super().list(request)
 
     @extend_schema(
@@ -1367,9 +1517,6 @@ class CustomerBalanceAdjustmentViewSet(
         qs = qs.filter(amount__gt=0)
         qs = qs.select_related("customer", "pricing_unit", "amount_paid_currency")
         qs = qs.prefetch_related("drawdowns")
-        qs = qs.annotate(
-            total_drawdowns=Sum("drawdowns__amount"),
-        )
         if self.action == "list":
             args = []
             serializer = CustomerBalanceAdjustmentFilterSerializer(
@@ -1722,22 +1869,73 @@ class GetInvoicePdfURL(APIView):
         return Response({"url": url}, status=status.HTTP_200_OK)
 
 
+class InvoicingJobView(APIView):
+    permission_classes = [IsAuthenticated | HasUserAPIKey]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="invoicing_job_id",
+                type=str,
+                required=True,
+                description="The id returned in the X-Invoicing-Job-Id header.",
+            )
+        ],
+        responses=InvoicingJobSerializer,
+    )
+    def get(self, request, format=None):
+        organization = request.organization
+        invoicing_job_id = InvoicingJobUUIDField().to_internal_value(
+            request.query_params.get("invoicing_job_id")
+        )
+        invoicing_job = (
+            InvoicingJob.objects.filter(
+                organization=organization, invoicing_job_id=invoicing_job_id
+            )
+            .prefetch_related("invoices", "invoices__currency")
+            .first()
+        )
+        if invoicing_job is None:
+            raise NotFoundException("Invoicing job not found")
+        return Response(
+            InvoicingJobSerializer(invoicing_job).data, status=status.HTTP_200_OK
+        )
+
+
+# The ids are sent as one array and hashed in the database, each one is a lookup on
+# the (organization, uuidv5_idempotency_id) events index restricted to the chunks
+# inside the lookback window
+IDEMS_NOT_RECEIVED_QUERY = """
+SELECT
+    ids.idempotency_id
+FROM
+    unnest(%(idempotency_ids)s::text[]) AS ids(idempotency_id)
+WHERE
+    NOT EXISTS (
+        SELECT
+            1
+        FROM
+            metering_billing_usageevent
+        WHERE
+            metering_billing_usageevent.organization_id = %(organization_id)s
+            AND metering_billing_usageevent.uuidv5_idempotency_id = uuid_generate_v5(
+                %(idempotency_id_namespace)s::uuid,
+                ids.idempotency_id
+            )
+            AND metering_billing_usageevent.time_created >= %(start_time)s
+            AND (
+                %(uuidv5_customer_id)s::uuid IS NULL
+                OR metering_billing_usageevent.uuidv5_customer_id = %(uuidv5_customer_id)s::uuid
+            )
+    )
+"""
+
+
 class ConfirmIdemsReceivedView(APIView):
     permission_classes = [IsAuthenticated | HasUserAPIKey]
 
     @extend_schema(
-        request=inline_serializer(
-            name="ConfirmIdemsReceivedRequest",
-            fields={
-                "idempotency_ids": serializers.ListField(
-                    child=serializers.CharField(), required=True
-                ),
-                "number_days_lookback": serializers.IntegerField(
-                    default=30, required=False
-                ),
-                "customer_id": serializers.CharField(required=False),
-            },
-        ),
+        request=ConfirmIdemsReceivedRequestSerializer,
         responses={
             200: inline_serializer(
                 name="ConfirmIdemsReceived",
@@ -1759,34 +1957,33 @@ class ConfirmIdemsReceivedView(APIView):
     )
     def post(self, request, format=None):
         organization = request.organization
-        if request.data.get("idempotency_ids") is None:
+        serializer = ConfirmIdemsReceivedRequestSerializer(data=request.data)
+        if not serializer.is_valid():
             return Response(
                 {
                     "status": "failure",
-                    "error": "idempotency_ids is required",
+                    "error": "; ".join(
+                        f"{field}: {' '.join(str(x) for x in errors)}"
+                        for field, errors in serializer.errors.items()
+                    ),
                 },
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        if isinstance(request.data.get("idempotency_ids"), str):
-            idempotency_ids = {request.data.get("idempotency_ids")}
-        else:
-            idempotency_ids = list(set(request.data.get("idempotency_ids")))
-        number_days_lookback = request.data.get("number_days_lookback", 30)
-        now_minus_lookback = now_utc() - relativedelta(days=number_days_lookback)
-        num_batches_idems = len(idempotency_ids) // 1000 + 1
-        ids_not_found = []
-        for i in range(num_batches_idems):
-            idem_batch = set(idempotency_ids[i * 1000 : (i + 1) * 1000])
-            idem_batch = {uuid.uuid5(IDEMPOTENCY_ID_NAMESPACE, x) for x in idem_batch}
-            events = Event.objects.filter(
-                organization=organization,
-                time_created__gte=now_minus_lookback,
-                uuidv5_idempotency_id__in=idem_batch,
-            )
-            if request.data.get("customer_id"):
-                events = events.filter(customer_id=request.data.get("customer_id"))
-            events_set = set(events.values_list("idempotency_id", flat=True))
-            ids_not_found += list(idem_batch - events_set)
+        idempotency_ids = serializer.validated_data["idempotency_ids"]
+        number_days_lookback = serializer.validated_data["number_days_lookback"]
+        customer_id = serializer.validated_data.get("customer_id")
+        params = {
+            "idempotency_ids": idempotency_ids,
+            "idempotency_id_namespace": str(IDEMPOTENCY_ID_NAMESPACE),
+            "organization_id": organization.pk,
+            "start_time": now_utc() - relativedelta(days=number_days_lookback),
+            "uuidv5_customer_id": str(uuid.uuid5(CUSTOMER_ID_NAMESPACE, customer_id))
+            if customer_id
+            else None,
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(IDEMS_NOT_RECEIVED_QUERY, params)
+            ids_not_found = [row[0] for row in cursor.fetchall()]
         return Response(
             {
                 "status": "success",
@@ -1806,7 +2003,7 @@ def load_event(request: HttpRequest) -> Optional[dict]:
     """
     if request.content_type == "application/json":
         try:
-            event_data = json.loads(request.body)
+            event_data = loads(request.body)
             return event_data
         except json.JSONDecodeError as e:
             logger.error(e)
@@ -0,0 +1,72 @@
+import uuid
+
+from locust import HttpUser, between, task
+
+ADMIN_API_KEY = "admin_api_key"
+BATCH_SIZE = 100
+LIST_PAGE_SIZE = 1000
+
+
+class AuthenticatedUserTrackBatches(HttpUser):
+    """
+    Large /track bodies, where most of the request time goes into parsing JSON.
+    """
+
+    wait_time = between(0.05, 0.5)
+
+    def on_start(self):
+        self.client.headers = {"X-API-KEY": ADMIN_API_KEY}
+
+    @task
+    def track_batch(self):
+        self.client.post(
+            "/api/track/",
+            json={
+                "batch": [
+                    {
+                        "event_name": "test",
+                        "customer_id": "baz",
+                        "time_created": "2020-01-01T00:00:00Z",
+                        "properties": {
+                            "foo": "bar",
+                            "region": "us-east-1",
+                            "tokens": i,
+                            "latency_ms": i * 0.25,
+                        },
+                        "idempotency_id": str(uuid.uuid4()),
+                    }
+                    for i in range(BATCH_SIZE)
+                ]
+            },
+        )
+
+
+class AuthenticatedUserListEndpoints(HttpUser):
+    """
+    Big list responses, where most of the response time goes into rendering JSON.
+    """
+
+    wait_time = between(0.5, 1)
+
+    def on_start(self):
+        self.client.headers = {"X-API-KEY": ADMIN_API_KEY}
+
+    @task(3)
+    def list_customers(self):
+        self.client.get(
+            "/api/customers/",
+            params={"page_size": LIST_PAGE_SIZE, "expand": "subscriptions"},
+            name="/api/customers/",
+        )
+
+    @task(3)
+    def list_invoices(self):
+        self.client.get(
+            "/api/invoices/",
+            params={
+                "page_size": LIST_PAGE_SIZE,
+                "payment_status": ["paid", "unpaid"],
+                "expand": "line_items",
+            },
+            name="/api/invoices/",
+        )
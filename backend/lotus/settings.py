@@ -46,6 +46,46 @@ except Exception:
 VITE_API_URL = config("VITE_API_URL", default="http://localhost:8000")
 EVENT_CACHE_FLUSH_SECONDS = config("EVENT_CACHE_FLUSH_SECONDS", default=180, cast=int)
 EVENT_CACHE_FLUSH_COUNT = config("EVENT_CACHE_FLUSH_COUNT", default=1000, cast=int)
+BILLING_RUN_CHUNK_SIZE = config("BILLING_RUN_CHUNK_SIZE", default=50, cast=int)
+# how long the event consumer collects usage changes before alerts are re-evaluated
+ALERT_EVALUATION_DEBOUNCE_SECONDS = config(
+    "ALERT_EVALUATION_DEBOUNCE_SECONDS", default=5, cast=int
+)
+ALERT_EVALUATION_BATCH_SIZE = config(
+    "ALERT_EVALUATION_BATCH_SIZE", default=500, cast=int
+)
+BALANCE_ADJUSTMENT_EXPIRY_BATCH_SIZE = config(
+    "BALANCE_ADJUSTMENT_EXPIRY_BATCH_SIZE", default=1000, cast=int
+)
+# how many payment objects are looked up at once when a processor has no bulk API
+PAYMENT_STATUS_POLL_CONCURRENCY = config(
+    "PAYMENT_STATUS_POLL_CONCURRENCY", default=8, cast=int
+)
+# open invoices issued within this many days are found by listing the paid ones, older
+# ones are retrieved one by one
+PAYMENT_STATUS_LIST_WINDOW_DAYS = config(
+    "PAYMENT_STATUS_LIST_WINDOW_DAYS", default=7, cast=int
+)
+# payment processor clients are kept between calls so their connections are reused
+API_CLIENT_REGISTRY_SIZE = config("API_CLIENT_REGISTRY_SIZE", default=256, cast=int)
+API_CLIENT_MAX_AGE = config("API_CLIENT_MAX_AGE", default=60 * 60, cast=int)
+# events are browsed in a time window ending now by default, one chunk of the
+# events hypertable wide
+EVENT_BROWSING_WINDOW_DAYS = config("EVENT_BROWSING_WINDOW_DAYS", default=7, cast=int)
+# most customers or subscriptions a single batch create request can contain
+BATCH_CREATE_MAX_SIZE = config("BATCH_CREATE_MAX_SIZE", default=5000, cast=int)
+# webhooks are written to an outbox and sent to Svix by the dispatch_webhooks task
+WEBHOOK_DISPATCH_BATCH_SIZE = config(
+    "WEBHOOK_DISPATCH_BATCH_SIZE", default=200, cast=int
+)
+WEBHOOK_DISPATCH_CONCURRENCY = config(
+    "WEBHOOK_DISPATCH_CONCURRENCY", default=16, cast=int
+)
+WEBHOOK_DISPATCH_CONCURRENCY_PER_ORGANIZATION = config(
+    "WEBHOOK_DISPATCH_CONCURRENCY_PER_ORGANIZATION", default=4, cast=int
+)
+WEBHOOK_MAX_ATTEMPTS = config("WEBHOOK_MAX_ATTEMPTS", default=8, cast=int)
+BILLING_RUN_MAX_RETRIES = config("BILLING_RUN_MAX_RETRIES", default=3, cast=int)
 DOCKERIZED = config("DOCKERIZED", default=False, cast=bool)
 DEBUG = config("DEBUG", default=False, cast=bool)
 PROFILER_ENABLED = config("PROFILER_ENABLED", default=False, cast=bool)
@@ -105,6 +145,9 @@ if BRAINTREE_TEST_SECRET_KEY == "change_me":
 BRAINTREE_WEBHOOK_SECRET = config("BRAINTREE_WEBHOOK_SECRET", default="")
 # taxjar
 TAXJAR_API_KEY = config("TAXJAR_API_KEY", default=None)
+# seconds a resolved tax rate is kept in the shared cache and in each process
+TAX_RATE_CACHE_TTL = config("TAX_RATE_CACHE_TTL", default=30 * 24 * 60 * 60, cast=int)
+TAX_RATE_LOCAL_CACHE_TTL = config("TAX_RATE_LOCAL_CACHE_TTL", default=60 * 60, cast=int)
 # Webhooks for Svix
 SVIX_API_KEY = config("SVIX_API_KEY", default="")
 SVIX_JWT_SECRET = config("SVIX_JWT_SECRET", default="")
@@ -526,6 +569,15 @@ REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
     "EXCEPTION_HANDLER": "drf_standardized_errors.handler.exception_handler",
     "COERCE_DECIMAL_TO_STRING": False,
+    "DEFAULT_RENDERER_CLASSES": [
+        "metering_billing.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "metering_billing.renderers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
 DRF_STANDARDIZED_ERRORS = {
@@ -121,6 +121,11 @@ urlpatterns = [
     path("api/ping/", api_views.Ping.as_view(), name="ping"),
     path("api/track/", api_views.track_event, name="track_event"),
     path("api/invoice_url/", api_views.GetInvoicePdfURL.as_view(), name="invoice_url"),
+    path(
+        "api/invoicing_job/",
+        api_views.InvoicingJobView.as_view(),
+        name="invoicing_job",
+    ),
     path(
         "api/metric_access/",
         api_views.MetricAccessView.as_view(),
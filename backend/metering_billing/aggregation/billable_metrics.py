@@ -53,6 +53,63 @@ class UsageRevenueSummary(TypedDict):
     usage_qty: Decimal
 
 
+def _uuidv5_customer_id(customer: Customer) -> uuid.UUID:
+    if customer.uuidv5_customer_id is None:
+        return customer_id_uuidv5(customer.customer_id)
+    return customer.uuidv5_customer_id
+
+
+def _rows_per_customer(rows: list[namedtuple]) -> dict[uuid.UUID, list[namedtuple]]:
+    rows_per_customer = {}
+    for row in rows:
+        rows_per_customer.setdefault(row.uuidv5_customer_id, []).append(row)
+    return rows_per_customer
+
+
+def _subscription_record_rows(
+    rows_per_customer: dict[uuid.UUID, list[namedtuple]],
+    subscription_record: SubscriptionRecord,
+    start: Optional[datetime.datetime] = None,
+    time_field: str = "bucket",
+) -> list[namedtuple]:
+    """
+    The rows of a query over several customers that belong to the subscription record:
+    the ones of its customer that match its subscription filters and, if given, are
+    from start on.
+    """
+    filters = subscription_record.filters.all()
+    return [
+        row
+        for row in rows_per_customer.get(
+            _uuidv5_customer_id(subscription_record.customer), []
+        )
+        if (start is None or getattr(row, time_field) >= start)
+        and all(
+            getattr(row, filter.property_name, None) in filter.comparison_value
+            for filter in filters
+        )
+    ]
+
+
+def _combine_usage(
+    query_type: METRIC_AGGREGATION, rows: list[namedtuple], usage=Decimal(0)
+) -> Decimal:
+    """
+    Adds the usage_qty of the rows to the given usage, the same way the cagg totals
+    aggregate their buckets.
+    """
+    if query_type == METRIC_AGGREGATION.MAX:
+        return max(
+            [usage] + [row.usage_qty for row in rows if row.usage_qty is not None]
+        )
+    if query_type == METRIC_AGGREGATION.AVERAGE:
+        num_events = sum(row.num_events for row in rows)
+        if num_events == 0:
+            return usage
+        return sum(row.usage_qty * row.num_events for row in rows) / num_events
+    return usage + sum(row.usage_qty or 0 for row in rows)
+
+
 class MetricHandler(abc.ABC):
     @staticmethod
     @abc.abstractmethod
@@ -116,6 +173,19 @@ class MetricHandler(abc.ABC):
         """
         pass
 
+    @staticmethod
+    def get_subscription_records_current_usage(
+        metric: Metric,
+        previous_usages: list[tuple[SubscriptionRecord, Decimal, datetime.datetime]],
+        group_by: list[str],
+        now: datetime.datetime,
+    ) -> list[tuple[Decimal, datetime.datetime]]:
+        """This is the batched version of get_subscription_record_current_usage that the usage alerts use. Every subscription record comes with the current usage it had as of some time, and the method returns its current usage now along with the time that usage is accurate as of. group_by are the organization's subscription filter keys. Handlers override it to read only what changed since the previous usage, in a single query for all the subscription records. By default every subscription record is read in full."""
+        return [
+            (metric.get_subscription_record_current_usage(subscription_record), now)
+            for subscription_record, _, _ in previous_usages
+        ]
+
     @staticmethod
     @abc.abstractmethod
     def get_subscription_record_daily_billable_usage(
@@ -423,6 +493,67 @@ class CounterHandler(MetricHandler):
             metric, subscription_record
         )
 
+    @staticmethod
+    def get_subscription_records_current_usage(
+        metric: Metric,
+        previous_usages: list[tuple[SubscriptionRecord, Decimal, datetime.datetime]],
+        group_by: list[str],
+        now: datetime.datetime,
+    ) -> list[tuple[Decimal, datetime.datetime]]:
+        from metering_billing.aggregation.counter_query_templates import (
+            COUNTER_CAGG_BUCKETS_SINCE,
+        )
+
+        if metric.usage_aggregation_type in [
+            METRIC_AGGREGATION.UNIQUE,
+            METRIC_AGGREGATION.AVERAGE,
+        ]:
+            # neither can be carried forward from the previous usage
+            return MetricHandler.get_subscription_records_current_usage(
+                metric, previous_usages, group_by, now
+            )
+        # only whole seconds are read, the current one is left to the next read
+        as_of = now.replace(microsecond=0)
+        starts = [
+            max(previous_as_of, subscription_record.usage_start_date).replace(
+                microsecond=0
+            )
+            for subscription_record, _, previous_as_of in previous_usages
+        ]
+        injection_dict = {
+            "cagg_name": (
+                ("org_" + metric.organization.organization_id.hex)[:22]
+                + "___"
+                + ("metric_" + metric.metric_id.hex)[:22]
+                + "___"
+                + "second"
+            ),
+            "group_by": group_by,
+            "uuidv5_customer_ids": {
+                _uuidv5_customer_id(subscription_record.customer)
+                for subscription_record, _, _ in previous_usages
+            },
+            "start_date": min(starts),
+            "end_date": as_of,
+        }
+        query = Template(COUNTER_CAGG_BUCKETS_SINCE).render(**injection_dict)
+        with connection.cursor() as cursor:
+            cursor.execute(query)
+            rows_per_customer = _rows_per_customer(namedtuplefetchall(cursor))
+        usages = []
+        for (subscription_record, usage, _), start in zip(previous_usages, starts):
+            rows = [
+                row
+                for row in _subscription_record_rows(
+                    rows_per_customer, subscription_record, start
+                )
+                if row.bucket <= subscription_record.end_date
+            ]
+            usages.append(
+                (_combine_usage(metric.usage_aggregation_type, rows, usage), as_of)
+            )
+        return usages
+
     @staticmethod
     def get_daily_total_usage(
         metric: Metric,
@@ -1241,6 +1372,76 @@ class GaugeHandler(MetricHandler):
             return Decimal(0)
         return result[0].usage_qty
 
+    @staticmethod
+    def get_subscription_records_current_usage(
+        metric: Metric,
+        previous_usages: list[tuple[SubscriptionRecord, Decimal, datetime.datetime]],
+        group_by: list[str],
+        now: datetime.datetime,
+    ) -> list[tuple[Decimal, datetime.datetime]]:
+        from .gauge_query_templates import (
+            GAUGE_DELTA_CHANGES_SINCE,
+            GAUGE_TOTAL_GET_LATEST_USAGE,
+        )
+
+        # the state carries over from before the subscription started, so a subscription
+        # record that was never read starts from the whole history
+        starts = [
+            None
+            if previous_as_of <= subscription_record.usage_start_date
+            else previous_as_of
+            for subscription_record, _, previous_as_of in previous_usages
+        ]
+        injection_dict = {
+            "cumsum_cagg": (
+                ("org_" + metric.organization.organization_id.hex)[:22]
+                + "___"
+                + ("metric_" + metric.metric_id.hex)[:22]
+                + "___"
+                + "cumsum"
+            ),
+            "group_by": group_by,
+            "uuidv5_customer_ids": {
+                _uuidv5_customer_id(subscription_record.customer)
+                for subscription_record, _, _ in previous_usages
+            },
+            "start_date": None if None in starts else min(starts),
+            "end_date": now,
+            "uuidv5_event_name": uuid.uuid5(EVENT_NAME_NAMESPACE, metric.event_name),
+            "organization_id": metric.organization.id,
+            "numeric_filters": [
+                (x.property_name, x.operator, x.comparison_value)
+                for x in metric.numeric_filters.all()
+            ],
+            "categorical_filters": [
+                (x.property_name, x.operator, x.comparison_value)
+                for x in metric.categorical_filters.all()
+            ],
+            "property_name": metric.property_name,
+        }
+        if metric.event_type == "delta":
+            query = Template(GAUGE_DELTA_CHANGES_SINCE).render(**injection_dict)
+        elif metric.event_type == "total":
+            query = Template(GAUGE_TOTAL_GET_LATEST_USAGE).render(**injection_dict)
+        with connection.cursor() as cursor:
+            cursor.execute(query)
+            rows_per_customer = _rows_per_customer(namedtuplefetchall(cursor))
+        usages = []
+        for (subscription_record, usage, _), start in zip(previous_usages, starts):
+            rows = _subscription_record_rows(
+                rows_per_customer, subscription_record, start, "time_bucket"
+            )
+            if start is None:
+                usage = Decimal(0)
+            if metric.event_type == "delta":
+                # add up the state changes since the previous read
+                usage = _combine_usage(METRIC_AGGREGATION.SUM, rows, usage)
+            elif len(rows) > 0:
+                # the latest state reported since the previous read, if any
+                usage = max(rows, key=lambda row: row.time_bucket).usage_qty
+            usages.append((usage, now))
+        return usages
+
     @staticmethod
     def get_subscription_record_daily_billable_usage(
         metric: Metric, subscription_record: SubscriptionRecord
@@ -1631,6 +1832,55 @@ class RateHandler(MetricHandler):
             return Decimal(0)
         return results[0].usage_qty
 
+    @staticmethod
+    def get_subscription_records_current_usage(
+        metric: Metric,
+        previous_usages: list[tuple[SubscriptionRecord, Decimal, datetime.datetime]],
+        group_by: list[str],
+        now: datetime.datetime,
+    ) -> list[tuple[Decimal, datetime.datetime]]:
+        from metering_billing.aggregation.rate_query_templates import (
+            RATE_CAGG_GET_CURRENT_USAGE,
+        )
+
+        if metric.usage_aggregation_type == METRIC_AGGREGATION.UNIQUE:
+            # the per second distinct counts can't be added up
+            return MetricHandler.get_subscription_records_current_usage(
+                metric, previous_usages, group_by, now
+            )
+        injection_dict = {
+            "cagg_name": (
+                ("org_" + metric.organization.organization_id.hex)[:22]
+                + "___"
+                + ("metric_" + metric.metric_id.hex)[:22]
+                + "___"
+                + "rate_cagg"
+            ),
+            "query_type": metric.usage_aggregation_type,
+            "group_by": group_by,
+            "uuidv5_customer_ids": {
+                _uuidv5_customer_id(subscription_record.customer)
+                for subscription_record, _, _ in previous_usages
+            },
+            "lookback_qty": 1,
+            "lookback_units": metric.granularity,
+            "reference_time": now,
+        }
+        query = Template(RATE_CAGG_GET_CURRENT_USAGE).render(**injection_dict)
+        with connection.cursor() as cursor:
+            cursor.execute(query)
+            rows_per_customer = _rows_per_customer(namedtuplefetchall(cursor))
+        return [
+            (
+                _combine_usage(
+                    metric.usage_aggregation_type,
+                    _subscription_record_rows(rows_per_customer, subscription_record),
+                ),
+                now,
+            )
+            for subscription_record, _, _ in previous_usages
+        ]
+
     @staticmethod
     def get_subscription_record_daily_billable_usage(
         metric: Metric, subscription_record: SubscriptionRecord
@@ -111,6 +111,32 @@ GROUP BY
 """
 
 
+# every second bucket of the given customers in a time range, so the usage alerts can add
+# what happened since their last run to the value they already have
+COUNTER_CAGG_BUCKETS_SINCE = """
+SELECT
+    uuidv5_customer_id
+    {%- for group_by_field in group_by %}
+    , {{ group_by_field }}
+    {%- endfor %}
+    , bucket
+    , num_events
+    , usage_qty
+FROM
+    {{ cagg_name }}
+WHERE
+    uuidv5_customer_id IN (
+        {%- for uuidv5_customer_id in uuidv5_customer_ids %}
+        '{{ uuidv5_customer_id }}'
+        {%- if not loop.last %},{% endif %}
+        {%- endfor %}
+    )
+    AND bucket >= '{{ start_date }}'::timestamptz
+    AND bucket < '{{ end_date }}'::timestamptz
+    AND bucket <= NOW()
+"""
+
+
 COUNTER_UNIQUE_TOTAL = """
 SELECT
     "metering_billing_usageevent"."uuidv5_customer_id" AS uuidv5_customer_id
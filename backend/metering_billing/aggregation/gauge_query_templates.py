@@ -628,6 +628,68 @@ FULL OUTER JOIN
 USING (uuidv5_customer_id {%- for group_by_field in group_by %}, {{ group_by_field }}{% endfor %});
 """
 
+# the state changes of the given customers since the usage alerts last read them,
+# straight from the events since the cumsum cagg only has daily buckets
+GAUGE_DELTA_CHANGES_SINCE = """
+SELECT
+    "metering_billing_usageevent"."uuidv5_customer_id" AS uuidv5_customer_id
+    {%- for group_by_field in group_by %}
+    ,"metering_billing_usageevent"."properties" ->> '{{ group_by_field }}' AS {{ group_by_field }}
+    {%- endfor %}
+    , "metering_billing_usageevent"."time_created" AS time_bucket
+    , SUM(
+        ("metering_billing_usageevent"."properties" ->> '{{ property_name }}')::text::decimal
+    ) AS usage_qty
+FROM
+    "metering_billing_usageevent"
+WHERE
+    "metering_billing_usageevent"."uuidv5_event_name" = '{{ uuidv5_event_name }}'
+    AND "metering_billing_usageevent"."organization_id" = {{ organization_id }}
+    AND "metering_billing_usageevent"."uuidv5_customer_id" IN (
+        {%- for uuidv5_customer_id in uuidv5_customer_ids %}
+        '{{ uuidv5_customer_id }}'
+        {%- if not loop.last %},{% endif %}
+        {%- endfor %}
+    )
+    {%- if start_date is not none %}
+    AND "metering_billing_usageevent"."time_created" >= '{{ start_date }}'::timestamptz
+    {%- endif %}
+    AND "metering_billing_usageevent"."time_created" < '{{ end_date }}'::timestamptz
+    {%- for property_name, operator, comparison in numeric_filters %}
+    AND ("metering_billing_usageevent"."properties" ->> '{{ property_name }}')::text::decimal
+        {% if operator == "gt" %}
+        >
+        {% elif operator == "gte" %}
+        >=
+        {% elif operator == "lt" %}
+        <
+        {% elif operator == "lte" %}
+        <=
+        {% elif operator == "eq" %}
+        =
+        {% endif %}
+        {{ comparison }}
+    {%- endfor %}
+    {%- for property_name, operator, comparison in categorical_filters %}
+    AND (COALESCE("metering_billing_usageevent"."properties" ->> '{{ property_name }}', ''))
+        {% if operator == "isnotin" %}
+        NOT
+        {% endif %}
+        IN (
+            {%- for pval in comparison %}
+            '{{ pval }}'
+            {%- if not loop.last %},{% endif %}
+            {%- endfor %}
+        )
+    {%- endfor %}
+GROUP BY
+    uuidv5_customer_id
+    {%- for group_by_field in group_by %}
+    , {{ group_by_field }}
+    {%- endfor %}
+    , "metering_billing_usageevent"."time_created"
+"""
+
 GAUGE_DELTA_TOTAL_PER_DAY = """
 WITH prev_value AS (
     SELECT
@@ -876,6 +938,35 @@ GROUP BY
     {%- endfor %}
 """
 
+# the latest state of the given customers, if it was reported after start_date
+GAUGE_TOTAL_GET_LATEST_USAGE = """
+SELECT
+    uuidv5_customer_id
+    {%- for group_by_field in group_by %}
+    , {{ group_by_field }}
+    {%- endfor %}
+    , last(cumulative_usage_qty, time_bucket) AS usage_qty
+    , MAX(time_bucket) AS time_bucket
+FROM
+    {{ cumsum_cagg }}
+WHERE
+    uuidv5_customer_id IN (
+        {%- for uuidv5_customer_id in uuidv5_customer_ids %}
+        '{{ uuidv5_customer_id }}'
+        {%- if not loop.last %},{% endif %}
+        {%- endfor %}
+    )
+    {%- if start_date is not none %}
+    AND time_bucket >= '{{ start_date }}'::timestamptz
+    {%- endif %}
+    AND time_bucket <= NOW()
+GROUP BY
+    uuidv5_customer_id
+    {%- for group_by_field in group_by %}
+    , {{ group_by_field }}
+    {%- endfor %}
+"""
+
 GAUGE_TOTAL_GET_TOTAL_USAGE_WITH_PRORATION = """
 WITH prev_state AS (
     SELECT
@@ -152,6 +152,39 @@ GROUP BY
     , bucket
 """
 
+# the latest window of the given customers, read from the rate cagg instead of the events
+RATE_CAGG_GET_CURRENT_USAGE = """
+SELECT
+    uuidv5_customer_id
+    {%- for group_by_field in group_by %}
+    , {{ group_by_field }}
+    {%- endfor %}
+    , SUM(num_events) AS num_events
+    , {%- if query_type == "count" or query_type == "sum" -%}
+    SUM(second_usage)
+    {%- elif query_type == "average" -%}
+    SUM(second_usage * num_events) / SUM(num_events)
+    {%- elif query_type == "max" -%}
+    MAX(second_usage)
+    {%- endif %} AS usage_qty
+FROM
+    {{ cagg_name }}
+WHERE
+    uuidv5_customer_id IN (
+        {%- for uuidv5_customer_id in uuidv5_customer_ids %}
+        '{{ uuidv5_customer_id }}'
+        {%- if not loop.last %},{% endif %}
+        {%- endfor %}
+    )
+    AND bucket <= '{{ reference_time }}'::timestamptz
+    AND bucket >= '{{ reference_time }}'::timestamptz + INTERVAL '-1 {{ lookback_units }}' * {{ lookback_qty }}
+GROUP BY
+    uuidv5_customer_id
+    {%- for group_by_field in group_by %}
+    , {{ group_by_field }}
+    {%- endfor %}
+"""
+
 RATE_CAGG_TOTAL = """
 WITH rate_per_bucket AS (
     SELECT 
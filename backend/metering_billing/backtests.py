@@ -0,0 +1,340 @@
+import copy
+import logging
+from decimal import Decimal, InvalidOperation
+
+import pytz
+from django.db import transaction
+from metering_billing.pricing import TierScheduleCache
+from metering_billing.serializers.backtest_serializers import (
+    AllSubstitutionResultsSerializer,
+)
+from metering_billing.serializers.serializer_utils import PlanVersionUUIDField
+from metering_billing.utils import (
+    date_as_max_dt,
+    date_as_min_dt,
+    dates_bwn_two_dts,
+)
+from metering_billing.utils.enums import BACKTEST_STATUS, METRIC_TYPE
+
+logger = logging.getLogger("django.server")
+
+
+class BacktestUsage:
+    """
+    Historical usage of a backtest, fetched once per subscription record and metric
+    and shared by every plan evaluated against that record.
+    """
+
+    def __init__(self):
+        self._usage = {}
+
+    def total_usage(self, subscription_record, plan_version, metric):
+        key = (subscription_record.pk, metric.pk)
+        if metric.metric_type == METRIC_TYPE.GAUGE:
+            # gauges with total granularity are prorated over the plan duration
+            key += (plan_version.plan.plan_duration,)
+        if key not in self._usage:
+            if plan_version.pk != subscription_record.billing_plan_id:
+                # query with an unsaved copy, the live record is never modified
+                subscription_record = copy.copy(subscription_record)
+                subscription_record.billing_plan = plan_version
+            self._usage[key] = metric.get_subscription_record_total_billable_usage(
+                subscription_record
+            )
+        return self._usage[key]
+
+
+def evaluate_plan(subscription_record, plan_version, usage, tier_schedules):
+    """
+    In-memory equivalent of SubscriptionRecord.get_usage_and_revenue for an arbitrary
+    plan version, with the component revenue keyed by metric name.
+    """
+    revenue_by_metric = {}
+    usage_amount_due = Decimal(0)
+    for plan_component in plan_version.plan_components.all():
+        metric = plan_component.billable_metric
+        usage_qty = usage.total_usage(subscription_record, plan_version, metric)
+        revenue = tier_schedules.get(plan_component).total_revenue(usage_qty)
+        metric_name = metric.billable_metric_name
+        revenue_by_metric[metric_name] = (
+            revenue_by_metric.get(metric_name, Decimal(0)) + revenue
+        )
+        usage_amount_due += revenue
+    flat_amount_due = sum(x.amount for x in plan_version.recurring_charges.all())
+    return {
+        "revenue_by_metric": revenue_by_metric,
+        "flat_amount_due": flat_amount_due,
+        "total_amount_due": flat_amount_due + usage_amount_due,
+    }
+
+
+def get_backtest_plan_version(plan_version_pk):
+    from metering_billing.models import PlanVersion
+
+    return (
+        PlanVersion.objects.select_related("plan")
+        .prefetch_related(
+            "plan_components__billable_metric",
+            "plan_components__tiers",
+            "recurring_charges",
+        )
+        .get(pk=plan_version_pk)
+    )
+
+
+def compute_substitution_results(substitution, usage=None, tier_schedules=None):
+    """
+    Evaluate the original and the new plan of a substitution over the subscription
+    records of the backtest period. Nothing is written to the database.
+    """
+    from metering_billing.models import SubscriptionRecord
+
+    if usage is None:
+        usage = BacktestUsage()
+    if tier_schedules is None:
+        tier_schedules = TierScheduleCache()
+    backtest = substitution.backtest
+    start_date = date_as_min_dt(backtest.start_date, timezone=pytz.UTC)
+    end_date = date_as_max_dt(backtest.end_date, timezone=pytz.UTC)
+    original_plan = get_backtest_plan_version(substitution.original_plan_id)
+    new_plan = get_backtest_plan_version(substitution.new_plan_id)
+    outer_results = {
+        "substitution_name": f"{str(original_plan)} --> {str(new_plan)}",
+        "original_plan": {
+            "plan_name": str(original_plan),
+            "plan_id": PlanVersionUUIDField().to_representation(
+                original_plan.version_id
+            ),
+            "plan_revenue": Decimal(0),
+        },
+        "new_plan": {
+            "plan_name": str(new_plan),
+            "plan_id": PlanVersionUUIDField().to_representation(new_plan.version_id),
+            "plan_revenue": Decimal(0),
+        },
+    }
+    # since we can have at most one new plan per old plan, the old plan uniquely
+    # identifies the substitution
+    subst_subscriptions = (
+        SubscriptionRecord.objects.filter(
+            billing_plan=original_plan,
+            start_date__lte=end_date,
+            end_date__gte=start_date,
+            end_date__lte=end_date,
+            organization=backtest.organization,
+        )
+        .select_related("customer", "billing_plan__plan")
+        .prefetch_related("filters")
+    )
+    inner_results = {
+        "cumulative_revenue": {},
+        "revenue_by_metric": {},
+        "top_customers": {},
+    }
+    for sub in subst_subscriptions:
+        customer = sub.customer
+        if customer not in inner_results["top_customers"]:
+            inner_results["top_customers"][customer] = {
+                "original_plan_revenue": Decimal(0),
+                "new_plan_revenue": Decimal(0),
+            }
+        sub_end_date = sub.end_date
+        if sub_end_date not in inner_results["cumulative_revenue"]:
+            inner_results["cumulative_revenue"][sub_end_date] = {
+                "original_plan_revenue": Decimal(0),
+                "new_plan_revenue": Decimal(0),
+            }
+        for plan_version, key in [
+            (original_plan, "original_plan_revenue"),
+            (new_plan, "new_plan_revenue"),
+        ]:
+            usage_revenue = evaluate_plan(sub, plan_version, usage, tier_schedules)
+            inner_results["cumulative_revenue"][sub_end_date][key] += usage_revenue[
+                "total_amount_due"
+            ]
+            inner_results["top_customers"][customer][key] += usage_revenue[
+                "total_amount_due"
+            ]
+            metric_revenues = [
+                *usage_revenue["revenue_by_metric"].items(),
+                ("flat_fees", usage_revenue["flat_amount_due"]),
+            ]
+            for metric_name, revenue in metric_revenues:
+                if metric_name not in inner_results["revenue_by_metric"]:
+                    inner_results["revenue_by_metric"][metric_name] = {
+                        "original_plan_revenue": Decimal(0),
+                        "new_plan_revenue": Decimal(0),
+                    }
+                inner_results["revenue_by_metric"][metric_name][key] += revenue
+    format_substitution_results(inner_results)
+    outer_results["results"] = inner_results
+    try:
+        outer_results["original_plan"]["plan_revenue"] = inner_results[
+            "cumulative_revenue"
+        ][-1]["original_plan_revenue"]
+    except IndexError:
+        outer_results["original_plan"]["plan_revenue"] = Decimal(0)
+    try:
+        outer_results["new_plan"]["plan_revenue"] = inner_results["cumulative_revenue"][
+            -1
+        ]["new_plan_revenue"]
+    except IndexError:
+        outer_results["new_plan"]["plan_revenue"] = Decimal(0)
+    try:
+        outer_results["pct_revenue_change"] = (
+            outer_results["new_plan"]["plan_revenue"]
+            / outer_results["original_plan"]["plan_revenue"]
+            - 1
+        )
+    except (ZeroDivisionError, InvalidOperation):
+        outer_results["pct_revenue_change"] = None
+    return outer_results
+
+
+def format_substitution_results(inner_results):
+    # change cumulative revenue to be cumulative and in fronted format
+    cum_rev_dict_list = []
+    cum_rev = inner_results.pop("cumulative_revenue")
+    cum_rev_lst = sorted(cum_rev.items(), key=lambda x: x[0], reverse=True)
+    date_cumrev_list = []
+    for date, cum_rev_dict in cum_rev_lst:
+        date_cumrev_list.append((date.date(), cum_rev_dict))
+    cum_rev_lst = date_cumrev_list
+    try:
+        every_date = list(dates_bwn_two_dts(cum_rev_lst[-1][0], cum_rev_lst[0][0]))
+    except IndexError:
+        every_date = []
+    if cum_rev_lst:
+        date, rev_dict = cum_rev_lst.pop(-1)
+        last_dict = {**rev_dict, "date": date}
+    else:
+        rev_dict = {}
+    for date in every_date:
+        if (
+            date < cum_rev_lst[-1][0]
+        ):  # have not reached the next data point yet, dont add
+            new_dict = last_dict.copy()
+            new_dict["date"] = date
+        elif date == cum_rev_lst[-1][0]:  # have reached the next data point, add it
+            date, rev_dict = cum_rev_lst.pop()
+            new_dict = {**rev_dict, "date": date}
+            new_dict["original_plan_revenue"] += last_dict["original_plan_revenue"]
+            new_dict["new_plan_revenue"] += last_dict["new_plan_revenue"]
+            last_dict = new_dict
+        else:
+            raise Exception("should not be greater than the most recent date")
+        cum_rev_dict_list.append(new_dict)
+    inner_results["cumulative_revenue"] = cum_rev_dict_list
+    # change metric revenue to be in frontend format
+    metric_rev = inner_results.pop("revenue_by_metric")
+    metric_rev = [
+        {**rev_dict, "metric_name": metric_name}
+        for metric_name, rev_dict in metric_rev.items()
+    ]
+    inner_results["revenue_by_metric"] = metric_rev
+    # change top customers to be in frontend format
+    top_cust_dict = {}
+    top_cust = inner_results.pop("top_customers")
+    top_original = sorted(
+        top_cust.items(),
+        key=lambda x: x[1]["original_plan_revenue"],
+        reverse=True,
+    )[:5]
+    top_cust_dict["original_plan_revenue"] = [
+        {
+            "customer_id": customer.customer_id,
+            "customer_name": customer.customer_name,
+            "value": rev_dict.get("original_plan_revenue", 0),
+        }
+        for customer, rev_dict in top_original
+    ]
+    top_new = sorted(
+        top_cust.items(), key=lambda x: x[1]["new_plan_revenue"], reverse=True
+    )[:5]
+    top_cust_dict["new_plan_revenue"] = [
+        {
+            "customer_id": customer.customer_id,
+            "customer_name": customer.customer_name,
+            "value": rev_dict.get("new_plan_revenue", 0),
+        }
+        for customer, rev_dict in top_new
+    ]
+    all_pct_change = []
+    for customer, rev_dict in top_cust.items():
+        try:
+            pct_change = (
+                rev_dict.get("new_plan_revenue", 0)
+                / rev_dict.get("original_plan_revenue", 0)
+                - 1
+            )
+        except (ZeroDivisionError, InvalidOperation):
+            pct_change = None
+        all_pct_change.append((customer, pct_change))
+    all_pct_change = sorted(
+        [tup for tup in all_pct_change if tup[1] is not None],
+        key=lambda x: x[1],
+    )
+    top_cust_dict["biggest_pct_increase"] = [
+        {
+            "customer_id": customer.customer_id,
+            "customer_name": customer.customer_name,
+            "value": pct_change,
+        }
+        for customer, pct_change in all_pct_change[-5:]
+    ][::-1]
+    top_cust_dict["biggest_pct_decrease"] = [
+        {
+            "customer_id": customer.customer_id,
+            "customer_name": customer.customer_name,
+            "value": pct_change,
+        }
+        for customer, pct_change in all_pct_change[:5]
+    ]
+    inner_results["top_customers"] = top_cust_dict
+    return inner_results
+
+
+def finish_backtest_if_done(backtest_pk):
+    """
+    Combine the substitution results once every substitution has been evaluated. The
+    backtest row is locked so only one of the workers finishing concurrently does it.
+    """
+    from metering_billing.models import Backtest
+
+    with transaction.atomic():
+        backtest = Backtest.objects.select_for_update().get(pk=backtest_pk)
+        if backtest.status != BACKTEST_STATUS.RUNNING:
+            return backtest
+        substitution_results = list(
+            backtest.backtest_substitutions.order_by("pk").values_list(
+                "results", flat=True
+            )
+        )
+        if any(x is None for x in substitution_results):
+            return backtest
+        all_results = {"substitution_results": substitution_results}
+        all_results["original_plans_revenue"] = sum(
+            x["original_plan"]["plan_revenue"] for x in substitution_results
+        )
+        all_results["new_plans_revenue"] = sum(
+            x["new_plan"]["plan_revenue"] for x in substitution_results
+        )
+        try:
+            all_results["pct_revenue_change"] = (
+                all_results["new_plans_revenue"] / all_results["original_plans_revenue"]
+                - 1
+            )
+        except (ZeroDivisionError, InvalidOperation):
+            all_results["pct_revenue_change"] = None
+        serializer = AllSubstitutionResultsSerializer(data=all_results)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except Exception:
+            logger.error("errors", serializer.errors, "all results", all_results)
+            backtest.status = BACKTEST_STATUS.FAILED
+            backtest.save()
+            raise
+        backtest.backtest_results = serializer.validated_data
+        backtest.status = BACKTEST_STATUS.COMPLETED
+        backtest.save()
+    return backtest
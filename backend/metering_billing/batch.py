@@ -0,0 +1,369 @@
+from collections import defaultdict
+from functools import partial
+
+import sentry_sdk
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, Q
+from metering_billing.serializers.serializer_utils import AddonUUIDField, PlanUUIDField
+from metering_billing.utils import now_utc
+from metering_billing.utils.enums import (
+    CATEGORICAL_FILTER_OPERATORS,
+    ORGANIZATION_SETTING_NAMES,
+)
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import as_serializer_error
+from simple_history.utils import bulk_create_with_history
+
+
+def item_values(items, key):
+    """The values of key in the items of a batch that are dictionaries."""
+    return {
+        str(item[key])
+        for item in items
+        if isinstance(item, dict) and item.get(key) is not None
+    }
+
+
+def dates_overlap(new, old):
+    # the same check SubscriptionRecord.save does for a single subscription
+    return (
+        new.start_date <= old.start_date <= new.end_date
+        or new.start_date <= old.end_date <= new.end_date
+    )
+
+
+def duplicate_customer_error(e):
+    # the same messages CustomerViewSet.perform_create gives for a single customer
+    if "unique_email" in str(e.__cause__):
+        return {"email": ["Customer email already exists"]}
+    elif "unique_customer_id" in str(e.__cause__):
+        return {"customer_id": ["Customer ID already exists"]}
+    raise e
+
+
+def enqueue_connect_customers(organization_pk, customer_payment_providers):
+    from metering_billing.tasks import connect_customers_to_payment_processors
+
+    try:
+        connect_customers_to_payment_processors.delay(
+            organization_pk, customer_payment_providers
+        )
+    except Exception as e:
+        # the customers are created, they can still be linked to a processor later
+        sentry_sdk.capture_exception(e)
+
+
+def create_customers(organization, customers_data):
+    """
+    Create a batch of customers. Each item is validated on its own, against objects
+    that are looked up for the whole batch at once, and the valid ones are written
+    together. If another request created one of them in the meantime, they're written
+    one by one instead. Linking them to payment processors is left to a background
+    task. Returns the new customers and the errors of the items that weren't created,
+    keyed by their position in the batch.
+    """
+    from api.serializers.model_serializers import CustomerCreateSerializer
+    from metering_billing.models import Address, Customer, PricingUnit
+
+    currencies = {
+        x.code: x
+        for x in PricingUnit.objects.filter(
+            organization=organization,
+            code__in=item_values(customers_data, "default_currency_code"),
+        )
+    }
+    context = {"organization": organization, "slug_lookups": {PricingUnit: currencies}}
+    taken_emails = set()
+    taken_customer_ids = set()
+    for email, customer_id in Customer.objects.filter(
+        Q(email__in=item_values(customers_data, "email"))
+        | Q(customer_id__in=item_values(customers_data, "customer_id")),
+        organization=organization,
+    ).values_list("email", "customer_id"):
+        taken_emails.add(email)
+        taken_customer_ids.add(customer_id)
+
+    errors = {}
+    valid_data = []
+    for i, item in enumerate(customers_data):
+        serializer = CustomerCreateSerializer(data=item, context=context)
+        if not serializer.is_valid():
+            errors[i] = serializer.errors
+            continue
+        data = serializer.validated_data
+        if data["email"] in taken_emails:
+            errors[i] = {"email": ["Customer email already exists"]}
+            continue
+        if data.get("customer_id") in taken_customer_ids:
+            errors[i] = {"customer_id": ["Customer ID already exists"]}
+            continue
+        taken_emails.add(data["email"])
+        if data.get("customer_id") is not None:
+            taken_customer_ids.add(data["customer_id"])
+        valid_data.append((i, data))
+    if len(valid_data) == 0:
+        return [], errors
+
+    default_currency = (
+        organization.default_currency
+        or PricingUnit.objects.filter(code="USD", organization=organization).first()
+    )
+    addresses = {}
+
+    def get_address(address_data):
+        if not address_data:
+            return None
+        key = tuple(sorted(address_data.items()))
+        if key not in addresses:
+            addresses[key], _ = Address.objects.get_or_create(
+                **address_data, organization=organization
+            )
+        return addresses[key]
+
+    customers = []
+    payment_providers = []
+    with transaction.atomic():
+        for _, data in valid_data:
+            payment_provider_id = data.pop("payment_provider_id", None)
+            payment_provider = data.pop("payment_provider", None)
+            address = data.pop("address", None)
+            billing_address = data.pop("billing_address", None) or address
+            shipping_address = data.pop("shipping_address", None)
+            customer = Customer(organization=organization, **data)
+            customer.billing_address = get_address(billing_address)
+            customer.shipping_address = get_address(shipping_address)
+            if customer.default_currency is None:
+                customer.default_currency = default_currency
+            customers.append(customer)
+            payment_providers.append((payment_provider, payment_provider_id))
+        try:
+            with transaction.atomic():
+                customers = bulk_create_with_history(customers, Customer)
+        except IntegrityError:
+            # created by another request since they were checked
+            created = []
+            created_payment_providers = []
+            for (i, _), customer, payment_provider in zip(
+                valid_data, customers, payment_providers
+            ):
+                try:
+                    with transaction.atomic():
+                        customer.save()
+                except IntegrityError as e:
+                    errors[i] = duplicate_customer_error(e)
+                    continue
+                created.append(customer)
+                created_payment_providers.append(payment_provider)
+            customers = created
+            payment_providers = created_payment_providers
+        if len(customers) > 0:
+            transaction.on_commit(
+                partial(
+                    enqueue_connect_customers,
+                    organization.pk,
+                    [
+                        (customer.pk, payment_provider, payment_provider_id)
+                        for customer, (payment_provider, payment_provider_id) in zip(
+                            customers, payment_providers
+                        )
+                    ],
+                )
+            )
+    return customers, errors
+
+
+def create_subscription_records(organization, subscriptions_data):
+    """
+    Create a batch of subscriptions. Each item is validated on its own, then the
+    overlap check is done with one query for the whole batch, including overlaps
+    between the items. The valid subscriptions are written together, along with their
+    filters and usage alert results. Once they're committed, the ones charged in
+    advance are invoiced once per customer, each customer in its own transaction, and
+    a customer whose invoice fails gets an error on each of its items. Returns the new
+    subscription records and the errors of the items that weren't created or
+    invoiced, keyed by their position in the batch.
+    """
+    from api.serializers.model_serializers import SubscriptionRecordCreateSerializer
+    from metering_billing.invoice import generate_invoice
+    from metering_billing.models import (
+        CategoricalFilter,
+        Customer,
+        Plan,
+        RecurringCharge,
+        SubscriptionRecord,
+        UsageAlert,
+        UsageAlertResult,
+    )
+
+    now = now_utc()
+    customers = {
+        x.customer_id: x
+        for x in Customer.objects.filter(
+            organization=organization,
+            customer_id__in=item_values(subscriptions_data, "customer_id"),
+        )
+    }
+    plan_ids = set()
+    for plan_id in item_values(subscriptions_data, "plan_id"):
+        for field in (PlanUUIDField(), AddonUUIDField()):
+            try:
+                plan_ids.add(field.to_internal_value(plan_id))
+                break
+            except ValidationError:
+                continue
+    plans = {
+        x.plan_id: x
+        for x in Plan.objects.filter(organization=organization, plan_id__in=plan_ids)
+        .select_related("target_customer", "display_version__plan")
+        .prefetch_related("display_version__recurring_charges")
+    }
+    context = {
+        "organization": organization,
+        "slug_lookups": {Customer: customers, Plan: plans},
+    }
+    sf_setting = organization.settings.get(
+        setting_name=ORGANIZATION_SETTING_NAMES.SUBSCRIPTION_FILTER_KEYS
+    )
+    categorical_filters = {}
+
+    def get_filter(property_name, value):
+        key = (property_name, value)
+        if key not in categorical_filters:
+            filter_dict = {
+                "organization": organization,
+                "property_name": property_name,
+                "operator": CATEGORICAL_FILTER_OPERATORS.ISIN,
+                "comparison_value": [value],
+            }
+            cf = CategoricalFilter.objects.filter(**filter_dict).first()
+            if cf is None:
+                cf = CategoricalFilter.objects.create(**filter_dict)
+            categorical_filters[key] = cf
+        return categorical_filters[key]
+
+    errors = {}
+    pending = []
+    for i, item in enumerate(subscriptions_data):
+        serializer = SubscriptionRecordCreateSerializer(data=item, context=context)
+        try:
+            serializer.is_valid(raise_exception=True)
+            data = serializer.validated_data
+            subscription_filters = data.pop("subscription_filters", [])
+            for sf in subscription_filters:
+                if sf["property_name"] not in sf_setting.setting_values:
+                    raise ValidationError(
+                        "Invalid subscription filter. Please check your subscription filters setting."
+                    )
+            serializer.set_next_billing_date(data, now)
+        except ValidationError as e:
+            errors[i] = as_serializer_error(e)
+            continue
+        subscription_record = SubscriptionRecord(organization=organization, **data)
+        subscription_record.set_billing_dates()
+        if any(
+            x.charge_timing == RecurringCharge.ChargeTimingType.IN_ADVANCE
+            for x in subscription_record.billing_plan.recurring_charges.all()
+        ):
+            # the first invoice only charges the in advance fees
+            subscription_record.invoice_usage_charges = False
+        filters = [
+            get_filter(x["property_name"], x["value"]) for x in subscription_filters
+        ]
+        pending.append((i, subscription_record, filters))
+    if len(pending) == 0:
+        return [], errors
+
+    subscriptions = defaultdict(list)
+    for subscription in SubscriptionRecord.objects.filter(
+        organization=organization,
+        customer__in={x.customer for _, x, _ in pending},
+        billing_plan__in={x.billing_plan for _, x, _ in pending},
+        start_date__lte=max(x.end_date for _, x, _ in pending),
+        end_date__gte=min(x.start_date for _, x, _ in pending),
+    ).prefetch_related(
+        Prefetch(
+            "filters",
+            queryset=CategoricalFilter.objects.filter(organization=organization),
+            to_attr="filters_lst",
+        )
+    ):
+        subscriptions[(subscription.customer_id, subscription.billing_plan_id)].append(
+            (subscription, {x.pk for x in subscription.filters_lst})
+        )
+    created = []
+    for i, subscription_record, filters in pending:
+        filter_pks = {x.pk for x in filters}
+        key = (subscription_record.customer.pk, subscription_record.billing_plan.pk)
+        if any(
+            dates_overlap(subscription_record, old)
+            and CategoricalFilter.overlaps(old_filter_pks, filter_pks)
+            for old, old_filter_pks in subscriptions[key]
+        ):
+            errors[i] = {
+                "non_field_errors": [
+                    "Overlapping subscriptions with the same filters are not allowed."
+                ]
+            }
+            continue
+        subscriptions[key].append((subscription_record, filter_pks))
+        created.append((i, subscription_record, filters))
+    if len(created) == 0:
+        return [], errors
+
+    subscription_records = [x for _, x, _ in created]
+    with transaction.atomic():
+        bulk_create_with_history(subscription_records, SubscriptionRecord)
+        SubscriptionFilter = SubscriptionRecord.filters.through
+        SubscriptionFilter.objects.bulk_create(
+            [
+                SubscriptionFilter(
+                    subscriptionrecord_id=subscription_record.pk,
+                    categoricalfilter_id=cf.pk,
+                )
+                for _, subscription_record, filters in created
+                for cf in filters
+            ]
+        )
+        alerts = defaultdict(list)
+        for alert in UsageAlert.objects.filter(
+            organization=organization,
+            plan_version__in={x.billing_plan for x in subscription_records},
+        ):
+            alerts[alert.plan_version_id].append(alert)
+        UsageAlertResult.objects.bulk_create(
+            [
+                UsageAlertResult(
+                    organization=organization,
+                    alert=alert,
+                    subscription_record=subscription_record,
+                    last_run_value=0,
+                    last_run_timestamp=subscription_record.usage_start_date,
+                )
+                for subscription_record in subscription_records
+                for alert in alerts[subscription_record.billing_plan.pk]
+            ]
+        )
+
+    charged_in_advance = defaultdict(list)
+    for i, subscription_record, _ in created:
+        if not subscription_record.invoice_usage_charges:
+            charged_in_advance[subscription_record.customer.pk].append(
+                (i, subscription_record)
+            )
+    for customer_items in charged_in_advance.values():
+        try:
+            with transaction.atomic():
+                generate_invoice([x for _, x in customer_items])
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            for i, _ in customer_items:
+                errors[i] = {
+                    "non_field_errors": [
+                        "The subscription was created, but its invoice couldn't be generated."
+                    ]
+                }
+    # later invoices charge usage, whether or not the first one went through
+    SubscriptionRecord.objects.filter(
+        pk__in=[x.pk for items in charged_in_advance.values() for _, x in items]
+    ).update(invoice_usage_charges=True)
+    return subscription_records, errors
@@ -1,14 +1,16 @@
 import logging
+from collections import deque
 from collections.abc import Iterable
-from decimal import Decimal
+from decimal import ROUND_HALF_UP, Decimal
+from functools import partial
 
 import sentry_sdk
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
-from django.db.models import Sum
+from django.db import transaction
 from django.db.models.query import QuerySet
 from metering_billing.payment_processors import PAYMENT_PROCESSOR_MAP
-from metering_billing.taxes import get_lotus_tax_rates, get_taxjar_tax_rates
+from metering_billing.taxes import TaxRateService, get_lotus_tax_rates
 from metering_billing.utils import (
     calculate_end_date,
     convert_to_datetime,
@@ -23,7 +25,7 @@ from metering_billing.utils.enums import (
     ORGANIZATION_SETTING_NAMES,
     TAX_PROVIDER,
 )
-from metering_billing.webhooks import invoice_created_webhook
+from metering_billing.webhooks import invoice_created_webhook, invoice_paid_webhook
 
 logger = logging.getLogger("django.server")
 
@@ -37,26 +39,270 @@ DEBUG = settings.DEBUG
 #     lotus_python.host = LOTUS_HOST
 
 
+def as_stored_decimal(value):
+    """
+    Round a value the same way a numeric(20, 10) column does, so totals computed in
+    memory match SUM() over the persisted line items.
+    """
+    from metering_billing.models import InvoiceLineItem
+
+    if value is None:
+        return None
+    value = InvoiceLineItem._meta.get_field("subtotal").to_python(value)
+    return value.quantize(Decimal("1E-10"), rounding=ROUND_HALF_UP)
+
+
+class InvoiceBuilder:
+    """
+    Assembles an invoice and its line items in memory. Discounts, taxes, balance
+    adjustments and the final cost are computed from the pending line items, and
+    persist() writes everything with one invoice save and one bulk_create.
+    """
+
+    def __init__(self, invoice):
+        self.invoice = invoice
+        self.line_items = []
+        self.subscription_records = []
+
+    def add_line_item(self, **kwargs):
+        from metering_billing.models import InvoiceLineItem
+
+        kwargs["subtotal"] = as_stored_decimal(kwargs.get("subtotal", Decimal(0)))
+        kwargs.setdefault("pricing_unit", self.invoice.organization.default_currency)
+        line_item = InvoiceLineItem(invoice=self.invoice, **kwargs)
+        self.line_items.append(line_item)
+        return line_item
+
+    def add_subscription_record(self, subscription_record):
+        self.subscription_records.append(subscription_record)
+
+    def subtotal(self, line_items=None):
+        if line_items is None:
+            line_items = self.line_items
+        return sum(x.subtotal for x in line_items)
+
+    def summarize(self):
+        """
+        Store the billing period and line item count on the invoice, so it can be
+        listed without looking at its line items.
+        """
+        invoice = self.invoice
+        start_dates = [x.start_date for x in self.line_items if x.start_date]
+        end_dates = [x.end_date for x in self.line_items if x.end_date]
+        invoice.start_date = min(start_dates, default=None)
+        invoice.end_date = max(end_dates, default=None)
+        invoice.line_item_count = len(self.line_items)
+
+    def as_draft(self):
+        """
+        Return the unsaved invoice with its pending line items attached, in the shape
+        DraftInvoiceSerializer expects, so a preview never needs to hit the database.
+        """
+        self.summarize()
+        invoice = self.invoice
+        invoice.draft_line_items = list(self.line_items)
+        return invoice
+
+    def persist(self):
+        from metering_billing.models import Invoice, InvoiceLineItem
+
+        self.summarize()
+        invoice = self.invoice
+        paid_on_creation = invoice.payment_status == Invoice.PaymentStatus.PAID
+        invoice.save()
+        InvoiceLineItem.objects.bulk_create(self.line_items)
+        if self.subscription_records:
+            invoice.subscription_records.add(*self.subscription_records)
+        if paid_on_creation and invoice.cost_due > 0:
+            # Invoice.save only notifies on a status transition, which a single save of
+            # a new invoice never is
+            invoice_paid_webhook(invoice, invoice.organization)
+        return invoice
+
+
+class InvoiceNumberPool:
+    """
+    Invoice numbers reserved in blocks ahead of time. A billing run reserves a block
+    per organization before it starts invoicing, so the counter row is only locked for
+    that short reservation and not for the length of every invoicing transaction.
+    """
+
+    def __init__(self):
+        self._numbers = {}
+
+    def reserve(self, organization_pk, issue_date, n):
+        from metering_billing.models import InvoiceNumberCounter
+
+        key = (organization_pk, issue_date.date())
+        numbers = InvoiceNumberCounter.reserve(organization_pk, issue_date, n=n)
+        self._numbers.setdefault(key, deque()).extend(numbers)
+
+    def take(self, organization, issue_date, n=1):
+        from metering_billing.models import Invoice
+
+        numbers = self._numbers.get((organization.pk, issue_date.date()))
+        if not numbers or len(numbers) < n:
+            return Invoice.generate_invoice_numbers(organization, issue_date, n=n)
+        return [numbers.popleft() for _ in range(n)]
+
+
 def generate_invoice(
     subscription_records,
     draft=False,
     charge_next_plan=False,
     generate_next_subscription_record=False,
     issue_date=None,
+    invoice_number_pool=None,
+    tax_rates=None,
 ):
     """
     Generate an invoice for a subscription.
+
+    Draft invoices are computed without touching the database: the returned invoices
+    are unsaved and carry their line items in memory, see InvoiceBuilder.as_draft.
     """
-    from metering_billing.models import Invoice, PricingUnit
+    if not issue_date:
+        issue_date = now_utc()
+    if not isinstance(subscription_records, (QuerySet, Iterable)):
+        subscription_records = [subscription_records]
+
+    if len(subscription_records) == 0:
+        return None
+
+    builders = compute_invoices(
+        subscription_records,
+        draft=draft,
+        charge_next_plan=charge_next_plan,
+        generate_next_subscription_record=generate_next_subscription_record,
+        issue_date=issue_date,
+        invoice_number_pool=invoice_number_pool,
+        tax_rates=tax_rates,
+    )
+    if draft:
+        return [builder.as_draft() for builder in builders]
+
+    invoices = []
+    for builder in builders:
+        invoice = builder.persist()
+        invoices.append(invoice)
+
+        # the payment processor is called once the invoice is committed, not while the
+        # billing run holds its row locks, and never for an invoice that rolls back
+        transaction.on_commit(partial(create_external_payment_obj, invoice))
+        for subscription_record in subscription_records:
+            if subscription_record.end_date <= now_utc():
+                subscription_record.fully_billed = True
+                subscription_record.save()
+        # billing runs invoice inside a transaction, the pdf worker has to see the row
+        transaction.on_commit(partial(enqueue_invoice_pdf, invoice.pk))
+
+        invoice_created_webhook(invoice, invoice.organization)
+
+    return invoices
+
+
+def predict_invoicing_cost(subscription_records, issue_date=None):
+    """
+    Read-only estimate of what invoicing the subscription records now costs: their
+    flat fees, their usage as the metric aggregates have it, and plan discounts.
+    Taxes and customer balances aren't looked up, and nothing is written or sent.
+    """
+    from metering_billing.models import Invoice
+    from metering_billing.pricing import TierScheduleCache
+
+    if issue_date is None:
+        issue_date = now_utc()
+    tier_schedules = TierScheduleCache()
+    predicted_cost_due = Decimal(0)
+    for subscription_record in subscription_records:
+        builder = InvoiceBuilder(
+            Invoice(
+                issue_date=issue_date,
+                organization=subscription_record.organization,
+                customer=subscription_record.customer,
+                currency=subscription_record.billing_plan.pricing_unit,
+                payment_status=Invoice.PaymentStatus.DRAFT,
+            )
+        )
+        calculate_subscription_record_flat_fees(subscription_record, builder)
+        calculate_subscription_record_usage_fees(
+            subscription_record, builder, tier_schedules=tier_schedules
+        )
+        apply_plan_discounts(builder)
+        predicted_cost_due += builder.subtotal()
+    return predicted_cost_due
+
+
+def schedule_invoicing(subscription_records):
+    """
+    Background counterpart of generate_invoice for API requests. Records an
+    InvoicingJob for the subscription records with its cost predicted by
+    predict_invoicing_cost, and enqueues it once the surrounding transaction commits.
+    """
+    from metering_billing.models import InvoicingJob
+
+    subscription_records = list(subscription_records)
+    if len(subscription_records) == 0:
+        return None
+    invoicing_job = InvoicingJob.objects.create(
+        organization=subscription_records[0].organization,
+        predicted_cost_due=predict_invoicing_cost(subscription_records),
+    )
+    invoicing_job.subscription_records.add(*subscription_records)
+    transaction.on_commit(partial(enqueue_invoicing_job, invoicing_job.pk))
+    return invoicing_job
+
+
+def enqueue_invoicing_job(invoicing_job_pk):
+    from metering_billing.tasks import run_invoicing_job
+
+    try:
+        run_invoicing_job.delay(invoicing_job_pk)
+    except Exception as e:
+        # the job stays pending and is picked up again by the periodic billing task
+        sentry_sdk.capture_exception(e)
+
+
+def create_external_payment_obj(invoice):
+    try:
+        generate_external_payment_obj(invoice)
+    except Exception as e:
+        # the invoice is already committed, a failed push must not undo it
+        sentry_sdk.capture_exception(e)
+
+
+def enqueue_invoice_pdf(invoice_pk):
     from metering_billing.tasks import generate_invoice_pdf_async
 
+    try:
+        generate_invoice_pdf_async.delay(invoice_pk)
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+
+
+def compute_invoices(
+    subscription_records,
+    draft=False,
+    charge_next_plan=False,
+    generate_next_subscription_record=False,
+    issue_date=None,
+    invoice_number_pool=None,
+    tax_rates=None,
+):
+    """
+    Run the invoice pipeline up to the final cost and return one InvoiceBuilder per
+    currency, without persisting the invoices. When draft is True nothing is written.
+    """
+    from metering_billing.models import Invoice, PricingUnit
+    from metering_billing.pricing import TierScheduleCache
+
     if not issue_date:
         issue_date = now_utc()
     if not isinstance(subscription_records, (QuerySet, Iterable)):
         subscription_records = [subscription_records]
 
     if len(subscription_records) == 0:
-        return None
+        return []
 
     try:
         customers = subscription_records.values("customer").distinct().count()
@@ -88,7 +334,10 @@ def generate_invoice(
             x.billing_plan.pricing_unit for x in subscription_records
         }
 
-    invoices = {}
+    tier_schedules = TierScheduleCache()
+    if tax_rates is None:
+        tax_rates = TaxRateService()
+    builders = {}
     for currency in distinct_currencies:
         # create kwargs for invoice
         invoice_kwargs = {
@@ -101,16 +350,28 @@ def generate_invoice(
             "currency": currency,
             "due_date": due_date,
         }
-        # Create the invoice
-        invoice = Invoice.objects.create(**invoice_kwargs)
-        invoices[currency] = invoice
+        builders[currency] = InvoiceBuilder(Invoice(**invoice_kwargs))
+    if not draft:
+        # numbers are needed up front for the balance adjustment descriptions
+        if invoice_number_pool is not None:
+            invoice_numbers = invoice_number_pool.take(
+                organization, issue_date, n=len(builders)
+            )
+        else:
+            invoice_numbers = Invoice.generate_invoice_numbers(
+                organization, issue_date, n=len(builders)
+            )
+        for builder, invoice_number in zip(builders.values(), invoice_numbers):
+            builder.invoice.invoice_number = invoice_number
     for subscription_record in subscription_records:
-        invoice = invoices[subscription_record.billing_plan.pricing_unit]
-        invoice.subscription_records.add(subscription_record)
+        builder = builders[subscription_record.billing_plan.pricing_unit]
+        builder.add_subscription_record(subscription_record)
         # flat fee calculation for current plan
-        calculate_subscription_record_flat_fees(subscription_record, invoice)
+        calculate_subscription_record_flat_fees(subscription_record, builder)
         # usage calculation
-        calculate_subscription_record_usage_fees(subscription_record, invoice)
+        calculate_subscription_record_usage_fees(
+            subscription_record, builder, tier_schedules=tier_schedules
+        )
         # next plan flat fee calculation
         next_bp = find_next_billing_plan(subscription_record)
         sr_renews = check_subscription_record_renews(subscription_record, issue_date)
@@ -126,37 +387,21 @@ def generate_invoice(
             if charge_next_plan:
                 # this can be both for actual invoicing or just for drafts to see whats next
                 charge_next_plan_flat_fee(
-                    subscription_record, next_subscription_record, next_bp, invoice
+                    subscription_record, next_subscription_record, next_bp, builder
                 )
-    for invoice in invoices.values():
-        apply_plan_discounts(invoice)
-        apply_taxes(invoice, customer, organization, draft)
-        apply_customer_balance_adjustments(invoice, customer, organization, draft)
-        finalize_cost_due(invoice, draft)
-        invoice.cost_due = invoice.line_items.aggregate(tot=Sum("subtotal"))["tot"] or 0
-        if abs(invoice.cost_due) < 0.01 and not draft:
-            invoice.payment_status = Invoice.PaymentStatus.PAID
-        invoice.save()
-
-        if not draft:
-            generate_external_payment_obj(invoice)
-            for subscription_record in subscription_records:
-                if subscription_record.end_date <= now_utc():
-                    subscription_record.fully_billed = True
-                    subscription_record.save()
-            try:
-                generate_invoice_pdf_async.delay(invoice.pk)
-            except Exception as e:
-                sentry_sdk.capture_exception(e)
+    for builder in builders.values():
+        apply_plan_discounts(builder)
+        apply_taxes(builder, customer, organization, draft, tax_rates=tax_rates)
+        apply_customer_balance_adjustments(builder, customer, organization, draft)
+        finalize_cost_due(builder, draft)
 
-            invoice_created_webhook(invoice, organization)
+    return list(builders.values())
 
-    return list(invoices.values())
 
+def calculate_subscription_record_flat_fees(subscription_record, builder):
+    from metering_billing.models import RecurringCharge
 
-def calculate_subscription_record_flat_fees(subscription_record, invoice):
-    from metering_billing.models import InvoiceLineItem, RecurringCharge
-
+    invoice = builder.invoice
     for recurring_charge in subscription_record.billing_plan.recurring_charges.all():
         flat_fee_due = recurring_charge.calculate_amount_due(subscription_record)
         amt_already_billed = recurring_charge.amount_already_invoiced(
@@ -183,7 +428,7 @@ def calculate_subscription_record_flat_fees(subscription_record, invoice):
             end = subscription_record.end_date
             qty = subscription_record.quantity
             if flat_fee_due > 0:
-                InvoiceLineItem.objects.create(
+                builder.add_line_item(
                     name=f"{billing_plan_name} v{billing_plan_version} Flat Fee",
                     start_date=convert_to_datetime(start, date_behavior="min"),
                     end_date=convert_to_datetime(end, date_behavior="max"),
@@ -191,14 +436,13 @@ def calculate_subscription_record_flat_fees(subscription_record, invoice):
                     subtotal=flat_fee_due,
                     billing_type=recurring_charge.get_charge_timing_display(),
                     chargeable_item_type=CHARGEABLE_ITEM_TYPE.RECURRING_CHARGE,
-                    invoice=invoice,
                     associated_subscription_record=subscription_record,
                     associated_plan_version=billing_plan,
                     associated_recurring_charge=recurring_charge,
                     organization=subscription_record.organization,
                 )
             if amt_already_billed > 0:
-                InvoiceLineItem.objects.create(
+                builder.add_line_item(
                     name=f"{billing_plan_name} v{billing_plan_version} Flat Fee Already Invoiced",
                     start_date=invoice.issue_date,
                     end_date=invoice.issue_date,
@@ -206,7 +450,6 @@ def calculate_subscription_record_flat_fees(subscription_record, invoice):
                     subtotal=-amt_already_billed,
                     billing_type=recurring_charge.get_charge_timing_display(),
                     chargeable_item_type=CHARGEABLE_ITEM_TYPE.RECURRING_CHARGE,
-                    invoice=invoice,
                     associated_subscription_record=subscription_record,
                     associated_plan_version=billing_plan,
                     associated_recurring_charge=recurring_charge,
@@ -214,20 +457,22 @@ def calculate_subscription_record_flat_fees(subscription_record, invoice):
                 )
 
 
-def calculate_subscription_record_usage_fees(subscription_record, invoice):
-    from metering_billing.models import InvoiceLineItem
-
+def calculate_subscription_record_usage_fees(
+    subscription_record, builder, tier_schedules=None
+):
     billing_plan = subscription_record.billing_plan
     # only calculate this for parent plans! addons should never calculate
     if subscription_record.invoice_usage_charges:
         for plan_component in billing_plan.plan_components.all():
-            usg_rev = plan_component.calculate_total_revenue(subscription_record)
+            usg_rev = plan_component.calculate_total_revenue(
+                subscription_record, tier_schedules=tier_schedules
+            )
             qty = usg_rev["usage_qty"]
             rev = usg_rev["revenue"]
             logger.info(
                 f"plan_component: {plan_component.billable_metric.billable_metric_name} usage_qty: {qty} revenue: {rev}",
             )
-            InvoiceLineItem.objects.create(
+            builder.add_line_item(
                 name=str(plan_component.billable_metric.billable_metric_name),
                 start_date=subscription_record.usage_start_date,
                 end_date=subscription_record.end_date,
@@ -235,7 +480,6 @@ def calculate_subscription_record_usage_fees(subscription_record, invoice):
                 subtotal=usg_rev["revenue"],
                 billing_type=INVOICE_CHARGE_TIMING_TYPE.IN_ARREARS,
                 chargeable_item_type=CHARGEABLE_ITEM_TYPE.USAGE_CHARGE,
-                invoice=invoice,
                 associated_subscription_record=subscription_record,
                 associated_plan_version=billing_plan,
                 organization=subscription_record.organization,
@@ -282,9 +526,9 @@ def create_next_subscription_record(subscription_record, next_bp):
 
 
 def charge_next_plan_flat_fee(
-    subscription_record, next_subscription_record, next_bp, invoice
+    subscription_record, next_subscription_record, next_bp, builder
 ):
-    from metering_billing.models import InvoiceLineItem, RecurringCharge
+    from metering_billing.models import RecurringCharge
 
     timezone = subscription_record.customer.timezone
     for recurring_charge in next_bp.recurring_charges.all():
@@ -307,7 +551,7 @@ def charge_next_plan_flat_fee(
             subtotal = recurring_charge.amount * next_subscription_record.quantity
             qty = next_subscription_record.quantity
             qty = qty if qty > 1 else None
-            InvoiceLineItem.objects.create(
+            builder.add_line_item(
                 name=name,
                 start_date=new_start,
                 end_date=calculate_end_date(next_bp_duration, new_start, timezone),
@@ -315,47 +559,37 @@ def charge_next_plan_flat_fee(
                 subtotal=subtotal,
                 billing_type=INVOICE_CHARGE_TIMING_TYPE.IN_ADVANCE,
                 chargeable_item_type=CHARGEABLE_ITEM_TYPE.RECURRING_CHARGE,
-                invoice=invoice,
                 associated_subscription_record=next_subscription_record,
                 associated_plan_version=next_bp,
                 organization=subscription_record.organization,
             )
 
 
-def apply_plan_discounts(invoice):
-    from metering_billing.models import InvoiceLineItem, PlanVersion, SubscriptionRecord
-
-    distinct_sr_pv_combos = (
-        invoice.line_items.filter(
-            associated_subscription_record__isnull=False,
-            associated_plan_version__isnull=False,
+def apply_plan_discounts(builder):
+    invoice = builder.invoice
+    distinct_sr_pv_combos = {
+        (x.associated_subscription_record_id, x.associated_plan_version_id): (
+            x.associated_subscription_record,
+            x.associated_plan_version,
         )
-        .values("associated_subscription_record", "associated_plan_version")
-        .distinct()
-    )
-    srs = SubscriptionRecord.objects.filter(
-        pk__in=[x["associated_subscription_record"] for x in distinct_sr_pv_combos]
-    )
-    pvs = PlanVersion.objects.filter(
-        pk__in=[x["associated_plan_version"] for x in distinct_sr_pv_combos]
-    )
-    for combo in distinct_sr_pv_combos:
-        sr = srs.get(pk=combo["associated_subscription_record"])
-        pv = pvs.get(pk=combo["associated_plan_version"])
+        for x in builder.line_items
+        if x.associated_subscription_record_id is not None
+        and x.associated_plan_version_id is not None
+    }
+    for (sr_pk, pv_pk), (sr, pv) in distinct_sr_pv_combos.items():
         if pv.price_adjustment:
-            plan_amount = (
-                invoice.line_items.filter(
-                    associated_subscription_record=sr,
-                    associated_plan_version=pv,
-                ).aggregate(tot=Sum("subtotal"))["tot"]
-                or 0
+            plan_amount = builder.subtotal(
+                x
+                for x in builder.line_items
+                if x.associated_subscription_record_id == sr_pk
+                and x.associated_plan_version_id == pv_pk
             )
             price_adj_name = str(pv.price_adjustment)
             new_amount_due = pv.price_adjustment.apply(plan_amount)
             new_amount_due = max(new_amount_due, Decimal(0))
             difference = new_amount_due - plan_amount
             if difference != 0:
-                InvoiceLineItem.objects.create(
+                builder.add_line_item(
                     name=f"{pv.plan.plan_name} v{pv.version} {price_adj_name}",
                     start_date=invoice.issue_date,
                     end_date=invoice.issue_date,
@@ -363,18 +597,19 @@ def apply_plan_discounts(invoice):
                     subtotal=difference,
                     billing_type=INVOICE_CHARGE_TIMING_TYPE.IN_ARREARS,
                     chargeable_item_type=CHARGEABLE_ITEM_TYPE.PLAN_ADJUSTMENT,
-                    invoice=invoice,
                     associated_subscription_record=sr,
                     organization=sr.organization,
                 )
 
 
-def apply_taxes(invoice, customer, organization, draft):
+def apply_taxes(builder, customer, organization, draft, tax_rates=None):
     """
-    Apply taxes to an invoice
+    Apply taxes to an invoice. Rates are resolved once per plan, and through tax_rates
+    once per address and tax code across all the invoices sharing the service.
     """
-    from metering_billing.models import Invoice, InvoiceLineItem, Organization
+    from metering_billing.models import Invoice, Organization
 
+    invoice = builder.invoice
     if invoice.payment_status == Invoice.PaymentStatus.PAID:
         return
     order_of_tax_providers_to_check = (
@@ -382,24 +617,22 @@ def apply_taxes(invoice, customer, organization, draft):
     )
     if len(order_of_tax_providers_to_check) == 0:
         return
+    if tax_rates is None:
+        tax_rates = TaxRateService()
     subscription_records = {
-        x.associated_subscription_record
-        for x in invoice.line_items.all().select_related(
-            "associated_subscription_record"
-        )
+        x.associated_subscription_record for x in builder.line_items
     }
 
     tax_rate_dict = {}
     for sr in subscription_records:
-        current_subtotal = (
-            invoice.line_items.filter(associated_subscription_record=sr).aggregate(
-                tot=Sum("subtotal")
-            )["tot"]
-            or 0
+        current_subtotal = builder.subtotal(
+            x
+            for x in builder.line_items
+            if x.associated_subscription_record_id == getattr(sr, "pk", None)
         )
-        plan = sr.billing_plan.plan
+        plan = sr.billing_plan.plan if sr else None
         tax_rate = tax_rate_dict.get(plan, None)
-        if tax_rate is None or not draft:
+        if tax_rate is None:
             for tax_provider in order_of_tax_providers_to_check:
                 if tax_provider == TAX_PROVIDER.LOTUS:
                     txr, success = get_lotus_tax_rates(
@@ -414,8 +647,8 @@ def apply_taxes(invoice, customer, organization, draft):
                     and organization.organization_type
                     == Organization.OrganizationType.PRODUCTION
                 ):
-                    txr, success = get_taxjar_tax_rates(
-                        customer, organization, plan, draft, current_subtotal
+                    txr, success = tax_rates.get_taxjar_tax_rate(
+                        customer, organization, plan, draft
                     )
                     if success:
                         tax_rate = txr
@@ -429,7 +662,7 @@ def apply_taxes(invoice, customer, organization, draft):
         name = f"Tax - {round(tax_rate, 2)}%"
         tax_amount = current_subtotal * (tax_rate / Decimal(100))
         if tax_amount > 0:
-            InvoiceLineItem.objects.create(
+            builder.add_line_item(
                 name=name,
                 start_date=invoice.issue_date,
                 end_date=invoice.issue_date,
@@ -437,29 +670,25 @@ def apply_taxes(invoice, customer, organization, draft):
                 subtotal=tax_amount,
                 billing_type=INVOICE_CHARGE_TIMING_TYPE.IN_ARREARS,
                 chargeable_item_type=CHARGEABLE_ITEM_TYPE.TAX,
-                invoice=invoice,
                 organization=invoice.organization,
                 associated_subscription_record=sr,
             )
 
 
-def apply_customer_balance_adjustments(invoice, customer, organization, draft):
+def apply_customer_balance_adjustments(builder, customer, organization, draft):
     """
     Apply customer balance adjustments to an invoice
     """
-    from metering_billing.models import (
-        CustomerBalanceAdjustment,
-        Invoice,
-        InvoiceLineItem,
-    )
+    from metering_billing.models import CustomerBalanceAdjustment, Invoice
 
+    invoice = builder.invoice
     issue_date = invoice.issue_date
     issue_date_fmt = issue_date.strftime("%Y-%m-%d")
     if invoice.payment_status == Invoice.PaymentStatus.PAID or draft:
         return
-    subtotal = invoice.line_items.aggregate(tot=Sum("subtotal"))["tot"] or 0
+    subtotal = builder.subtotal()
     if subtotal < 0:
-        InvoiceLineItem.objects.create(
+        builder.add_line_item(
             name="Granted Credit",
             start_date=invoice.issue_date,
             end_date=invoice.issue_date,
@@ -467,7 +696,6 @@ def apply_customer_balance_adjustments(invoice, customer, organization, draft):
             subtotal=-subtotal,
             billing_type=INVOICE_CHARGE_TIMING_TYPE.ONE_TIME,
             chargeable_item_type=CHARGEABLE_ITEM_TYPE.CUSTOMER_ADJUSTMENT,
-            invoice=invoice,
             organization=organization,
         )
         if not draft:
@@ -496,7 +724,7 @@ def apply_customer_balance_adjustments(invoice, customer, organization, draft):
                     description=f"Balance decrease from invoice {invoice.invoice_number} generated on {issue_date_fmt}",
                 )
             if -balance_adjustment + leftover != 0:
-                InvoiceLineItem.objects.create(
+                builder.add_line_item(
                     name="Applied Credit",
                     start_date=issue_date,
                     end_date=issue_date,
@@ -504,7 +732,6 @@ def apply_customer_balance_adjustments(invoice, customer, organization, draft):
                     subtotal=-balance_adjustment + leftover,
                     billing_type=INVOICE_CHARGE_TIMING_TYPE.ONE_TIME,
                     chargeable_item_type=CHARGEABLE_ITEM_TYPE.CUSTOMER_ADJUSTMENT,
-                    invoice=invoice,
                     organization=organization,
                 )
 
@@ -513,8 +740,7 @@ def generate_balance_adjustment_invoice(balance_adjustment, draft=False):
     """
     Generate an invoice for a subscription.
     """
-    from metering_billing.models import Invoice, InvoiceLineItem
-    from metering_billing.tasks import generate_invoice_pdf_async
+    from metering_billing.models import Invoice
 
     issue_date = balance_adjustment.created
     customer = balance_adjustment.customer
@@ -531,11 +757,10 @@ def generate_balance_adjustment_invoice(balance_adjustment, draft=False):
         "currency": balance_adjustment.amount_paid_currency,
         "due_date": due_date,
     }
-    # Create the invoice
-    invoice = Invoice.objects.create(**invoice_kwargs)
+    builder = InvoiceBuilder(Invoice(**invoice_kwargs))
 
     # Create the invoice line item
-    InvoiceLineItem.objects.create(
+    builder.add_line_item(
         name=f"Credit Grant: {balance_adjustment.amount_paid_currency.symbol}{balance_adjustment.amount}",
         start_date=issue_date,
         end_date=issue_date,
@@ -543,19 +768,16 @@ def generate_balance_adjustment_invoice(balance_adjustment, draft=False):
         subtotal=balance_adjustment.amount_paid,
         billing_type=INVOICE_CHARGE_TIMING_TYPE.ONE_TIME,
         chargeable_item_type=CHARGEABLE_ITEM_TYPE.ONE_TIME_CHARGE,
-        invoice=invoice,
         organization=organization,
     )
 
-    apply_taxes(invoice, customer, organization, draft)
-    finalize_cost_due(invoice, draft)
+    apply_taxes(builder, customer, organization, draft)
+    finalize_cost_due(builder, draft)
+    invoice = builder.persist()
 
     if not draft:
-        generate_external_payment_obj(invoice)
-        try:
-            generate_invoice_pdf_async.delay(invoice.pk)
-        except Exception as e:
-            sentry_sdk.capture_exception(e)
+        transaction.on_commit(partial(create_external_payment_obj, invoice))
+        transaction.on_commit(partial(enqueue_invoice_pdf, invoice.pk))
         invoice_created_webhook(invoice, organization)
 
     return invoice
@@ -595,10 +817,10 @@ def calculate_due_date(issue_date, organization):
         return due_date
 
 
-def finalize_cost_due(invoice, draft):
+def finalize_cost_due(builder, draft):
     from metering_billing.models import Invoice
 
-    invoice.cost_due = invoice.line_items.aggregate(tot=Sum("subtotal"))["tot"] or 0
+    invoice = builder.invoice
+    invoice.cost_due = builder.subtotal()
     if abs(invoice.cost_due) < 0.01 and not draft:
         invoice.payment_status = Invoice.PaymentStatus.PAID
-    invoice.save()
@@ -1,4 +1,6 @@
+import itertools
 import logging
+import time
 from dataclasses import dataclass
 
 import posthog
@@ -14,6 +16,8 @@ POSTHOG_PERSON = settings.POSTHOG_PERSON
 KAFKA_HOST = settings.KAFKA_HOST
 KAFKA_EVENTS_TOPIC = settings.KAFKA_EVENTS_TOPIC
 CONSUMER = settings.CONSUMER
+ALERT_EVALUATION_DEBOUNCE_SECONDS = settings.ALERT_EVALUATION_DEBOUNCE_SECONDS
+ALERT_EVALUATION_BATCH_SIZE = settings.ALERT_EVALUATION_BATCH_SIZE
 
 logger = logging.getLogger("django.server")
 
@@ -34,32 +38,95 @@ class Consumer(metaclass=Singleton):
         self.__connection = CONSUMER
         self.config = ConsumerConfig()
         self.topic = self.config.topic
+        self.usage_changes = set()
+        self.last_alert_flush = time.monotonic()
 
     def consume(self):
         """Consume messages from a Redpanda topic"""
         try:
-            for msg in self.__connection:
-                if msg is None or msg.value is None or msg.key is None:
-                    continue
-
-                logger.info(f"Consumed record. key={msg.key}, value={msg.value}")
-                try:
-                    event = msg.value["events"][0]
-                    organization_pk = msg.value["organization_id"]
-                    write_batch_events_to_db({organization_pk: [event]})
-                except Exception as e:
-                    sentry_sdk.capture_exception(e)
-                    logger.info(
-                        f"Could not consume from topic: {self.topic}. Excpetionmessage: {e}"
-                    )
-                    continue
+            while True:
+                records = self.__connection.poll(timeout_ms=1000)
+                buffer = {}
+                for msg in itertools.chain.from_iterable(records.values()):
+                    if msg is None or msg.value is None or msg.key is None:
+                        continue
+
+                    logger.info(f"Consumed record. key={msg.key}, value={msg.value}")
+                    try:
+                        event = msg.value["events"][0]
+                        organization_pk = msg.value["organization_id"]
+                    except Exception as e:
+                        sentry_sdk.capture_exception(e)
+                        logger.info(
+                            f"Could not consume from topic: {self.topic}. Excpetionmessage: {e}"
+                        )
+                        continue
+                    buffer.setdefault(organization_pk, []).append(event)
+                if len(buffer) > 0:
+                    self.usage_changes |= self.write_buffer(buffer)
+                self.flush_usage_changes()
         except Exception:
             logger.info(f"Could not consume from topic: {self.topic}")
             raise
 
+    def write_buffer(self, buffer):
+        try:
+            return write_batch_events_to_db(buffer)
+        except Exception:
+            # write the events one by one so a bad event doesn't drop the whole batch
+            usage_changes = set()
+            for organization_pk, events in buffer.items():
+                for event in events:
+                    try:
+                        usage_changes |= write_batch_events_to_db(
+                            {organization_pk: [event]}
+                        )
+                    except Exception as e:
+                        sentry_sdk.capture_exception(e)
+                        logger.info(
+                            f"Could not consume from topic: {self.topic}. Excpetionmessage: {e}"
+                        )
+            return usage_changes
+
+    def flush_usage_changes(self, force=False):
+        """
+        Hand the usage changes collected since the last flush to the alert workers, at
+        most every ALERT_EVALUATION_DEBOUNCE_SECONDS so bursts of events for the same
+        customer are evaluated once.
+        """
+        from metering_billing.tasks import refresh_alerts_for_usage_changes
+
+        now = time.monotonic()
+        if len(self.usage_changes) == 0:
+            self.last_alert_flush = now
+            return
+        if (
+            not force
+            and now - self.last_alert_flush < ALERT_EVALUATION_DEBOUNCE_SECONDS
+        ):
+            return
+        usage_changes = sorted(self.usage_changes)
+        for i in range(0, len(usage_changes), ALERT_EVALUATION_BATCH_SIZE):
+            try:
+                # counter alerts only read whole seconds, so let the current one end
+                refresh_alerts_for_usage_changes.apply_async(
+                    args=(usage_changes[i : i + ALERT_EVALUATION_BATCH_SIZE],),
+                    countdown=1,
+                )
+            except Exception as e:
+                # the periodic alert sweep picks these up
+                sentry_sdk.capture_exception(e)
+        self.usage_changes = set()
+        self.last_alert_flush = now
+
 
 def write_batch_events_to_db(buffer):
+    """
+    Insert the buffered events and return the (organization pk, customer id, event
+    name) tuples they touched, so usage alerts on those can be re-evaluated.
+    """
     now = now_utc()
+    usage_changes = set()
     for org_pk, events_list in buffer.items():
         ### Match Customer pk with customer_id amd fill in customer pk
         events_to_insert = []
@@ -67,6 +134,9 @@ def write_batch_events_to_db(buffer):
             events_to_insert.append(Event(**{**event, "inserted_at": now}))
         ## now insert events
         events = Event.objects.bulk_create(events_to_insert, ignore_conflicts=True)
+        usage_changes |= {
+            (org_pk, event.cust_id, event.event_name) for event in events_to_insert
+        }
         organization_name = cache.get(f"organization_name_{org_pk}")
         if not organization_name:
             organization_name = Organization.objects.get(pk=org_pk).organization_name
@@ -82,3 +152,4 @@ def write_batch_events_to_db(buffer):
             )
         except Exception:
             pass
+    return usage_changes
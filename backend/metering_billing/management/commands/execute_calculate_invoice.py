@@ -1,10 +1,10 @@
 from django.core.management.base import BaseCommand
 
-from metering_billing.tasks import calculate_invoice
+from metering_billing.tasks import calculate_invoice_inner
 
 
 class Command(BaseCommand):
     "Django command to execute calculate invoice"
 
     def handle(self, *args, **options):
-        calculate_invoice()
+        calculate_invoice_inner(synchronous=True)
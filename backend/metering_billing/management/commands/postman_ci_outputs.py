@@ -4,7 +4,7 @@ import uuid
 from django.core.management.base import BaseCommand
 from metering_billing.aggregation.billable_metrics import METRIC_HANDLER_MAP
 from metering_billing.demos import create_pc_and_tiers, make_subscription_record
-from metering_billing.invoice import generate_invoice
+from metering_billing.invoice import compute_invoices
 from metering_billing.models import (
     AddOnSpecification,
     Customer,
@@ -164,7 +164,7 @@ class Command(BaseCommand):
         )
 
         # invoice
-        invoice = generate_invoice(sr, draft=True)[0]
+        invoice = compute_invoices(sr, draft=True)[0].persist()
         print(f"INVOICE_ID=invoice_{invoice.invoice_id.hex}")
 
         # credit
@@ -1,3 +1,4 @@
+import sentry_sdk
 from django.core.management.base import BaseCommand
 from django_celery_beat.models import IntervalSchedule, PeriodicTask
 from dotenv import load_dotenv
@@ -16,12 +17,12 @@ class Command(BaseCommand):
             every=15,
             period=IntervalSchedule.MINUTES,
         )
-        every_5_mins, _ = IntervalSchedule.objects.get_or_create(
-            every=5,
+        every_minute, _ = IntervalSchedule.objects.get_or_create(
+            every=1,
             period=IntervalSchedule.MINUTES,
         )
-        every_3_minutes, _ = IntervalSchedule.objects.get_or_create(
-            every=3,
+        every_5_mins, _ = IntervalSchedule.objects.get_or_create(
+            every=5,
             period=IntervalSchedule.MINUTES,
         )
 
@@ -38,10 +39,11 @@ class Command(BaseCommand):
             defaults={"interval": every_15_mins, "crontab": None},
         )
 
+        # alerts are evaluated as events are consumed, this is only a safety net
         PeriodicTask.objects.update_or_create(
             name="Run Alert Refreshes",
             task="metering_billing.tasks.refresh_alerts",
-            defaults={"interval": every_3_minutes, "crontab": None},
+            defaults={"interval": every_hour, "crontab": None},
         )
 
         PeriodicTask.objects.update_or_create(
@@ -61,3 +63,36 @@ class Command(BaseCommand):
             task="metering_billing.tasks.check_past_due_invoices",
             defaults={"interval": every_15_mins, "crontab": None},
         )
+
+        PeriodicTask.objects.update_or_create(
+            name="Sync Payment Processor Customers",
+            task="metering_billing.tasks.sync_payment_processor_customers",
+            defaults={"interval": every_hour, "crontab": None},
+        )
+
+        # webhooks are dispatched as they are written, this retries the failed ones
+        PeriodicTask.objects.update_or_create(
+            name="Dispatch Webhooks",
+            task="metering_billing.tasks.dispatch_webhooks",
+            defaults={"interval": every_minute, "crontab": None},
+        )
+
+        # customers connected before their payment methods and addresses were kept
+        # have never been synced, fill them in now rather than on the next hourly run
+        from metering_billing.models import (
+            BraintreeCustomerIntegration,
+            StripeCustomerIntegration,
+        )
+        from metering_billing.tasks import sync_payment_processor_customers
+
+        if (
+            StripeCustomerIntegration.objects.filter(synced_at__isnull=True).exists()
+            or BraintreeCustomerIntegration.objects.filter(
+                synced_at__isnull=True
+            ).exists()
+        ):
+            try:
+                sync_payment_processor_customers.delay()
+            except Exception as e:
+                # the hourly sync fills them in as well
+                sentry_sdk.capture_exception(e)
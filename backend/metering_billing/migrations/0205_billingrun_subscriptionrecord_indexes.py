@@ -0,0 +1,80 @@
+# Generated by Django 4.0.5 on 2023-02-24 18:12
+
+from django.db import migrations, models
+import metering_billing.utils.utils
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0204_alter_idempotencecheck_time_created"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BillingRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "billing_run_id",
+                    models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="running",
+                        max_length=40,
+                    ),
+                ),
+                ("due_before", models.DateTimeField()),
+                (
+                    "started_at",
+                    models.DateTimeField(default=metering_billing.utils.utils.now_utc),
+                ),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+                ("total_customers", models.PositiveIntegerField(default=0)),
+                ("total_chunks", models.PositiveIntegerField(default=0)),
+                ("completed_chunks", models.PositiveIntegerField(default=0)),
+                ("invoiced_customers", models.PositiveIntegerField(default=0)),
+                (
+                    "skipped_customers",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Customers that were already being billed by an overlapping run.",
+                    ),
+                ),
+                ("failed_customers", models.PositiveIntegerField(default=0)),
+                ("retries", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="subscriptionrecord",
+            index=models.Index(
+                condition=models.Q(("fully_billed", False)),
+                fields=["next_billing_date"],
+                name="sr_unbilled_next_billing_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscriptionrecord",
+            index=models.Index(
+                condition=models.Q(("fully_billed", False)),
+                fields=["end_date"],
+                name="sr_unbilled_end_date_idx",
+            ),
+        ),
+    ]
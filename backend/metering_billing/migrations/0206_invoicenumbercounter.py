@@ -0,0 +1,45 @@
+# Generated by Django 4.0.5 on 2023-02-25 10:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0205_billingrun_subscriptionrecord_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InvoiceNumberCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("last_number", models.PositiveIntegerField(default=0)),
+                (
+                    "organization",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="metering_billing.organization",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="invoicenumbercounter",
+            constraint=models.UniqueConstraint(
+                fields=("organization", "date"),
+                name="unique_invoice_number_counter_per_org_date",
+            ),
+        ),
+    ]
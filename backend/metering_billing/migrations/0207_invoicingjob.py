@@ -0,0 +1,78 @@
+# Generated by Django 4.0.5 on 2023-02-25 16:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+import metering_billing.utils.utils
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0206_invoicenumbercounter"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InvoicingJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "invoicing_job_id",
+                    models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=40,
+                    ),
+                ),
+                (
+                    "predicted_cost_due",
+                    models.DecimalField(
+                        blank=True, decimal_places=10, max_digits=20, null=True
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(default=metering_billing.utils.utils.now_utc),
+                ),
+                ("completed_at", models.DateTimeField(blank=True, null=True)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                (
+                    "invoices",
+                    models.ManyToManyField(
+                        blank=True, related_name="+", to="metering_billing.invoice"
+                    ),
+                ),
+                (
+                    "organization",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="invoicing_jobs",
+                        to="metering_billing.organization",
+                    ),
+                ),
+                (
+                    "subscription_records",
+                    models.ManyToManyField(
+                        related_name="+", to="metering_billing.subscriptionrecord"
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.5 on 2023-02-26 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0207_invoicingjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="backtestsubstitution",
+            name="results",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="historicalbacktestsubstitution",
+            name="results",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 4.0.5 on 2023-02-27 10:12
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_credit_ledger(apps, schema_editor):
+    CustomerBalanceAdjustment = apps.get_model(
+        "metering_billing", "CustomerBalanceAdjustment"
+    )
+    CustomerCreditBalance = apps.get_model("metering_billing", "CustomerCreditBalance")
+
+    grants = (
+        CustomerBalanceAdjustment.objects.filter(amount__gt=0)
+        .select_related("customer")
+        .annotate(
+            drawn_down=Coalesce(
+                Sum("drawdowns__amount"),
+                Decimal(0),
+                output_field=models.DecimalField(),
+            )
+        )
+    )
+    credit_balances = {}
+    updated_grants = []
+    for grant in grants.iterator():
+        grant.remaining_balance = max(grant.amount + grant.drawn_down, Decimal(0))
+        updated_grants.append(grant)
+        if grant.status != "active" or grant.remaining_balance == 0:
+            continue
+        key = (grant.customer_id, grant.pricing_unit_id)
+        if key not in credit_balances:
+            credit_balances[key] = CustomerCreditBalance(
+                organization_id=grant.organization_id or grant.customer.organization_id,
+                customer_id=grant.customer_id,
+                pricing_unit_id=grant.pricing_unit_id,
+            )
+        credit_balance = credit_balances[key]
+        credit_balance.balance += grant.remaining_balance
+        if grant.expires_at is not None and (
+            credit_balance.next_expiry is None
+            or grant.expires_at < credit_balance.next_expiry
+        ):
+            credit_balance.next_expiry = grant.expires_at
+    CustomerBalanceAdjustment.objects.bulk_update(
+        updated_grants, ["remaining_balance"], batch_size=1000
+    )
+    CustomerCreditBalance.objects.bulk_create(credit_balances.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0208_backtestsubstitution_results"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customerbalanceadjustment",
+            name="remaining_balance",
+            field=models.DecimalField(
+                blank=True, decimal_places=10, max_digits=20, null=True
+            ),
+        ),
+        migrations.CreateModel(
+            name="CustomerCreditBalance",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "balance",
+                    models.DecimalField(
+                        decimal_places=10, default=Decimal("0"), max_digits=20
+                    ),
+                ),
+                ("next_expiry", models.DateTimeField(blank=True, null=True)),
+                (
+                    "customer",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="credit_balances",
+                        to="metering_billing.customer",
+                    ),
+                ),
+                (
+                    "organization",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="metering_billing.organization",
+                    ),
+                ),
+                (
+                    "pricing_unit",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="metering_billing.pricingunit",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("customer", "pricing_unit")},
+            },
+        ),
+        migrations.RunPython(backfill_credit_ledger, migrations.RunPython.noop),
+    ]
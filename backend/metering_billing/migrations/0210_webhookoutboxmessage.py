@@ -0,0 +1,105 @@
+# Generated by Django 4.0.5 on 2023-02-27 16:40
+
+import django.core.serializers.json
+import django.db.models.deletion
+import metering_billing.utils.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0209_customercreditbalance"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookOutboxMessage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "event_type",
+                    models.CharField(
+                        choices=[
+                            ("invoice.created", "invoice.created"),
+                            ("invoice.paid", "invoice.paid"),
+                            ("invoice.past_due", "invoice.past_due"),
+                            ("usage_alert.triggered", "usage_alert.triggered"),
+                            ("customer.created", "customer.created"),
+                        ],
+                        max_length=40,
+                    ),
+                ),
+                ("event_id", models.CharField(max_length=255)),
+                (
+                    "properties",
+                    models.JSONField(
+                        encoder=django.core.serializers.json.DjangoJSONEncoder
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("sent", "Sent"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=40,
+                    ),
+                ),
+                (
+                    "created",
+                    models.DateTimeField(default=metering_billing.utils.utils.now_utc),
+                ),
+                (
+                    "next_attempt_at",
+                    models.DateTimeField(default=metering_billing.utils.utils.now_utc),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True, null=True)),
+                ("sent_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "customer",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="metering_billing.customer",
+                    ),
+                ),
+                (
+                    "organization",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="metering_billing.organization",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="webhookoutboxmessage",
+            index=models.Index(
+                fields=["status", "next_attempt_at"],
+                name="metering_bi_status_eed798_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="webhookoutboxmessage",
+            index=models.Index(
+                fields=["customer", "status", "created"],
+                name="metering_bi_custome_432309_idx",
+            ),
+        ),
+    ]
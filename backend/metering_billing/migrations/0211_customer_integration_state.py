@@ -0,0 +1,53 @@
+# Generated by Django 4.0.5 on 2023-02-28 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0210_webhookoutboxmessage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stripecustomerintegration",
+            name="has_payment_method",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="stripecustomerintegration",
+            name="billing_address",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="stripecustomerintegration",
+            name="shipping_address",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="stripecustomerintegration",
+            name="synced_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="braintreecustomerintegration",
+            name="has_payment_method",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="braintreecustomerintegration",
+            name="billing_address",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="braintreecustomerintegration",
+            name="shipping_address",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="braintreecustomerintegration",
+            name="synced_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.0.5 on 2023-02-28 15:31
+
+import metering_billing.utils.utils
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_created(apps, schema_editor):
+    # the first history row of a customer is when it was created
+    Customer = apps.get_model("metering_billing", "Customer")
+    HistoricalCustomer = apps.get_model("metering_billing", "HistoricalCustomer")
+
+    first_history_date = (
+        HistoricalCustomer.objects.filter(id=OuterRef("pk"))
+        .order_by("history_date")
+        .values("history_date")[:1]
+    )
+    Customer.objects.filter(id__in=HistoricalCustomer.objects.values("id")).update(
+        created=Subquery(first_history_date)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0211_customer_integration_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customer",
+            name="created",
+            field=models.DateTimeField(
+                default=metering_billing.utils.utils.now_utc,
+                help_text="The date the customer was created",
+            ),
+        ),
+        migrations.AddField(
+            model_name="historicalcustomer",
+            name="created",
+            field=models.DateTimeField(
+                default=metering_billing.utils.utils.now_utc,
+                help_text="The date the customer was created",
+            ),
+        ),
+        migrations.RunPython(backfill_created, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["organization", "created", "id"],
+                name="metering_bi_organiz_a13497_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.0.5 on 2023-03-01 10:12
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+
+
+def backfill_line_item_summary(apps, schema_editor):
+    Invoice = apps.get_model("metering_billing", "Invoice")
+    InvoiceLineItem = apps.get_model("metering_billing", "InvoiceLineItem")
+
+    line_items = (
+        InvoiceLineItem.objects.filter(invoice=OuterRef("pk"))
+        .order_by()
+        .values("invoice")
+    )
+    Invoice.objects.filter(id__in=InvoiceLineItem.objects.values("invoice")).update(
+        start_date=Subquery(
+            line_items.annotate(start_date=Min("start_date")).values("start_date")
+        ),
+        end_date=Subquery(
+            line_items.annotate(end_date=Max("end_date")).values("end_date")
+        ),
+        line_item_count=Subquery(
+            line_items.annotate(count=Count("id")).values("count")
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0212_customer_created"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="historicalinvoice",
+            name="end_date",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="historicalinvoice",
+            name="line_item_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="historicalinvoice",
+            name="start_date",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="end_date",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="line_item_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="invoice",
+            name="start_date",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_line_item_summary, migrations.RunPython.noop),
+    ]
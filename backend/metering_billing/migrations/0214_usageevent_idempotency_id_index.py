@@ -0,0 +1,20 @@
+# Generated by Django 4.0.5 on 2023-03-01 14:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0213_invoice_line_item_summary"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            CREATE INDEX IF NOT EXISTS metering_billing_usageevent_idempotency_id_idx
+            ON metering_billing_usageevent (organization_id, uuidv5_idempotency_id, time_created DESC);
+            """,
+            reverse_sql="DROP INDEX IF EXISTS metering_billing_usageevent_idempotency_id_idx;",
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.0.5 on 2023-03-02 09:31
+
+import rest_framework.utils.encoders
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0214_usageevent_idempotency_id_index"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="backtest",
+            name="backtest_results",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                encoder=rest_framework.utils.encoders.JSONEncoder,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="backtestsubstitution",
+            name="results",
+            field=models.JSONField(
+                blank=True,
+                encoder=rest_framework.utils.encoders.JSONEncoder,
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="historicalbacktest",
+            name="backtest_results",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                encoder=rest_framework.utils.encoders.JSONEncoder,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="historicalbacktestsubstitution",
+            name="results",
+            field=models.JSONField(
+                blank=True,
+                encoder=rest_framework.utils.encoders.JSONEncoder,
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="webhookoutboxmessage",
+            name="properties",
+            field=models.JSONField(encoder=rest_framework.utils.encoders.JSONEncoder),
+        ),
+    ]
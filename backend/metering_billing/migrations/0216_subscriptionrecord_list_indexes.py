@@ -0,0 +1,27 @@
+# Generated by Django 4.0.5 on 2023-03-03 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0215_json_payload_encoder"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="subscriptionrecord",
+            index=models.Index(
+                fields=["organization", "customer", "start_date", "end_date"],
+                name="metering_bi_organiz_0891a9_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscriptionrecord",
+            index=models.Index(
+                fields=["organization", "start_date", "id"],
+                name="metering_bi_organiz_45768d_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.5 on 2023-03-03 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0216_subscriptionrecord_list_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="invoicingjob",
+            name="errors",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text="Why the customers that couldn't be invoiced failed, keyed by customer_id. The billing run invoices their subscriptions instead.",
+            ),
+        ),
+    ]
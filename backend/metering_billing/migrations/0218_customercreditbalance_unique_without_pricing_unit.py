@@ -0,0 +1,51 @@
+# Generated by Django 4.0.5 on 2023-03-03 16:20
+
+from django.db import migrations, models
+
+
+def merge_credit_balances_without_pricing_unit(apps, schema_editor):
+    CustomerCreditBalance = apps.get_model("metering_billing", "CustomerCreditBalance")
+
+    kept = {}
+    duplicates = []
+    for credit_balance in CustomerCreditBalance.objects.filter(
+        pricing_unit__isnull=True
+    ).order_by("customer_id", "pk"):
+        if credit_balance.customer_id not in kept:
+            kept[credit_balance.customer_id] = credit_balance
+            continue
+        first = kept[credit_balance.customer_id]
+        first.balance += credit_balance.balance
+        if credit_balance.next_expiry is not None and (
+            first.next_expiry is None or credit_balance.next_expiry < first.next_expiry
+        ):
+            first.next_expiry = credit_balance.next_expiry
+        first.merged = True
+        duplicates.append(credit_balance.pk)
+    CustomerCreditBalance.objects.bulk_update(
+        [x for x in kept.values() if getattr(x, "merged", False)],
+        ["balance", "next_expiry"],
+        batch_size=1000,
+    )
+    CustomerCreditBalance.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("metering_billing", "0217_invoicingjob_errors"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_credit_balances_without_pricing_unit, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name="customercreditbalance",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("pricing_unit__isnull", True)),
+                fields=("customer",),
+                name="unique_credit_balance_without_pricing_unit",
+            ),
+        ),
+    ]
@@ -2,7 +2,6 @@ import datetime
 import itertools
 import json
 import logging
-import math
 import uuid
 from decimal import Decimal
 from typing import Literal, Optional, TypedDict, Union
@@ -20,8 +19,21 @@ from django.core.validators import (
     MinLengthValidator,
     MinValueValidator,
 )
-from django.db import connection, models
-from django.db.models import Count, F, FloatField, Prefetch, Q, QuerySet, Sum
+from django.db import connection, models, transaction
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    FloatField,
+    Min,
+    Prefetch,
+    Q,
+    QuerySet,
+    Sum,
+    Value,
+    When,
+    prefetch_related_objects,
+)
 from django.db.models.constraints import CheckConstraint, UniqueConstraint
 from django.db.models.functions import Cast, Coalesce
 from django.utils.translation import gettext_lazy as _
@@ -46,6 +58,7 @@ from metering_billing.utils import (
 from metering_billing.utils.enums import (
     ACCOUNTS_RECEIVABLE_TRANSACTION_TYPES,
     BACKTEST_STATUS,
+    BILLING_RUN_STATUS,
     CATEGORICAL_FILTER_OPERATORS,
     CHARGEABLE_ITEM_TYPE,
     CUSTOMER_BALANCE_ADJUSTMENT_STATUS,
@@ -53,6 +66,7 @@ from metering_billing.utils.enums import (
     FLAT_FEE_BEHAVIOR,
     INVOICE_CHARGE_TIMING_TYPE,
     INVOICING_BEHAVIOR,
+    INVOICING_JOB_STATUS,
     MAKE_PLAN_VERSION_ACTIVE_TYPE,
     METRIC_AGGREGATION,
     METRIC_GRANULARITY,
@@ -74,9 +88,11 @@ from metering_billing.utils.enums import (
     TAX_PROVIDER,
     USAGE_BILLING_FREQUENCY,
     USAGE_CALC_GRANULARITY,
+    WEBHOOK_MESSAGE_STATUS,
     WEBHOOK_TRIGGER_EVENTS,
 )
 from metering_billing.webhooks import invoice_paid_webhook, usage_alert_webhook
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework_api_key.models import AbstractAPIKey
 from simple_history.models import HistoricalRecords
 from svix.api import ApplicationIn, EndpointIn, EndpointSecretRotateIn, EndpointUpdate
@@ -535,6 +551,43 @@ class WebhookTrigger(models.Model):
         ]
 
 
+class WebhookOutboxMessage(models.Model):
+    """
+    A webhook waiting to be sent to Svix. Messages are written in the same transaction
+    as the change that triggers them and sent by the dispatch_webhooks task, which
+    keeps the messages of a customer in order and retries failures with backoff.
+    """
+
+    organization = models.ForeignKey(
+        Organization, on_delete=models.CASCADE, related_name="+"
+    )
+    customer = models.ForeignKey(
+        "Customer", on_delete=models.CASCADE, related_name="+", null=True, blank=True
+    )
+    event_type = models.CharField(choices=WEBHOOK_TRIGGER_EVENTS.choices, max_length=40)
+    event_id = models.CharField(max_length=255)
+    properties = models.JSONField(encoder=JSONEncoder)
+    status = models.CharField(
+        choices=WEBHOOK_MESSAGE_STATUS.choices,
+        default=WEBHOOK_MESSAGE_STATUS.PENDING,
+        max_length=40,
+    )
+    created = models.DateTimeField(default=now_utc)
+    next_attempt_at = models.DateTimeField(default=now_utc)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+            models.Index(fields=["customer", "status", "created"]),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} - {self.status}"
+
+
 class User(AbstractUser):
     organization = models.ForeignKey(
         Organization,
@@ -611,6 +664,9 @@ class Customer(models.Model):
     deleted = models.DateTimeField(
         null=True, help_text="The date the customer was deleted"
     )
+    created = models.DateTimeField(
+        default=now_utc, help_text="The date the customer was created"
+    )
 
     # BILLING RELATED FIELDS
     default_currency = models.ForeignKey(
@@ -685,6 +741,9 @@ class Customer(models.Model):
                 fields=["organization", "customer_id"], name="unique_customer_id"
             ),
         ]
+        indexes = [
+            models.Index(fields=["organization", "created", "id"]),
+        ]
 
     def __str__(self) -> str:
         return str(self.customer_name) + " " + str(self.customer_id)
@@ -748,18 +807,10 @@ class Customer(models.Model):
                 charge_next_plan=True,
             )
             total += sum([inv.cost_due for inv in invs])
-            for inv in invs:
-                inv.delete()
         return total
 
     def get_currency_balance(self, currency):
-        now = now_utc()
-        balance = self.customer_balance_adjustments.filter(
-            Q(expires_at__gte=now) | Q(expires_at__isnull=True),
-            effective_at__lte=now,
-            amount_currency=currency,
-        ).aggregate(balance=Sum("amount"))["balance"] or Decimal(0)
-        return balance
+        return CustomerBalanceAdjustment.get_pricing_unit_balance(self, currency)
 
     def get_outstanding_revenue(self):
         unpaid_invoice_amount_due = (
@@ -795,9 +846,103 @@ class Customer(models.Model):
             return self.shipping_address
 
 
+class CustomerCreditBalance(models.Model):
+    """
+    Running total of the credit a customer can still draw down in a pricing unit. It is
+    moved in the same transaction as every grant, drawdown and expiry written to the
+    CustomerBalanceAdjustment ledger, so reading a balance doesn't sum the ledger.
+    """
+
+    organization = models.ForeignKey(
+        Organization, on_delete=models.CASCADE, related_name="+"
+    )
+    customer = models.ForeignKey(
+        Customer, on_delete=models.CASCADE, related_name="credit_balances"
+    )
+    pricing_unit = models.ForeignKey(
+        "PricingUnit",
+        on_delete=models.CASCADE,
+        related_name="+",
+        null=True,
+        blank=True,
+    )
+    balance = models.DecimalField(decimal_places=10, max_digits=20, default=Decimal(0))
+    # earliest expiry of an open grant. Grants only ever move it earlier, so until the
+    # expiry job recomputes it it can be early, never late
+    next_expiry = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ("customer", "pricing_unit")
+        constraints = [
+            # unique_together doesn't cover the rows without a pricing unit, NULLs are
+            # never equal in postgres
+            UniqueConstraint(
+                fields=["customer"],
+                condition=Q(pricing_unit__isnull=True),
+                name="unique_credit_balance_without_pricing_unit",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.customer} {self.balance}"
+
+    @staticmethod
+    def lock(organization_id, customer_id, pricing_unit_id):
+        """
+        Locks the balance row, creating it if needed. Call it inside a transaction and
+        before locking any of the grants, so concurrent writers queue on this row.
+        """
+        (
+            credit_balance,
+            _,
+        ) = CustomerCreditBalance.objects.select_for_update().get_or_create(
+            customer_id=customer_id,
+            pricing_unit_id=pricing_unit_id,
+            defaults={"organization_id": organization_id},
+        )
+        return credit_balance
+
+    def record(self, amount, expires_at=None):
+        self.balance += amount
+        if expires_at is not None and (
+            self.next_expiry is None or expires_at < self.next_expiry
+        ):
+            self.next_expiry = expires_at
+        self.save(update_fields=["balance", "next_expiry"])
+
+    def open_grants(self):
+        return CustomerBalanceAdjustment.objects.filter(
+            customer_id=self.customer_id,
+            pricing_unit_id=self.pricing_unit_id,
+            status=CUSTOMER_BALANCE_ADJUSTMENT_STATUS.ACTIVE,
+            remaining_balance__gt=0,
+        )
+
+    def refresh_next_expiry(self):
+        self.next_expiry = self.open_grants().aggregate(next_expiry=Min("expires_at"))[
+            "next_expiry"
+        ]
+        self.save(update_fields=["next_expiry"])
+
+    def get_balance(self, now=None):
+        now = now or now_utc()
+        if self.next_expiry is None or self.next_expiry >= now:
+            return self.balance
+        # some grants have expired but the expiry job hasn't zeroed them out yet
+        expired = (
+            self.open_grants()
+            .filter(expires_at__lt=now)
+            .aggregate(expired=Sum("remaining_balance"))["expired"]
+        )
+        return self.balance - (expired or 0)
+
+
 class CustomerBalanceAdjustment(models.Model):
     """
-    This model is used to store the customer balance adjustments.
+    This model is used to store the customer balance adjustments. It's an append-only
+    ledger: grants are positive, and drawdowns and expiries are negative children of the
+    grant they consume. Each grant keeps its remaining balance, and the open total per
+    customer and pricing unit is kept in CustomerCreditBalance.
     """
 
     adjustment_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
@@ -841,6 +986,10 @@ class CustomerBalanceAdjustment(models.Model):
         choices=CUSTOMER_BALANCE_ADJUSTMENT_STATUS.choices,
         default=CUSTOMER_BALANCE_ADJUSTMENT_STATUS.ACTIVE,
     )
+    # only set on grants, and only ever moved by the ledger
+    remaining_balance = models.DecimalField(
+        decimal_places=10, max_digits=20, null=True, blank=True
+    )
 
     def __str__(self):
         return f"{self.customer.customer_name} {self.amount} {self.created}"
@@ -859,6 +1008,7 @@ class CustomerBalanceAdjustment(models.Model):
         ]
 
     def save(self, *args, **kwargs):
+        adding = self.pk is None
         if self.pk:
             prev_amount, new_amount = self.amount, kwargs.get("amount", self.amount)
             prev_price_unit, new_price_unit = self.pricing_unit, kwargs.get(
@@ -915,9 +1065,36 @@ class CustomerBalanceAdjustment(models.Model):
             self.organization = self.customer.organization
         if self.amount_paid is None or self.amount_paid == 0:
             self.amount_paid_currency = None
-        super(CustomerBalanceAdjustment, self).save(*args, **kwargs)
+        if not adding:
+            if "update_fields" not in kwargs:
+                kwargs["update_fields"] = [
+                    field.name
+                    for field in self._meta.concrete_fields
+                    if not field.primary_key and field.name != "remaining_balance"
+                ]
+            super(CustomerBalanceAdjustment, self).save(*args, **kwargs)
+            return
+        if self.amount > 0:
+            self.remaining_balance = self.amount
+        with transaction.atomic():
+            credit_balance = CustomerCreditBalance.lock(
+                self.organization_id, self.customer_id, self.pricing_unit_id
+            )
+            super(CustomerBalanceAdjustment, self).save(*args, **kwargs)
+            if self.parent_adjustment_id is not None:
+                CustomerBalanceAdjustment.objects.filter(
+                    pk=self.parent_adjustment_id
+                ).update(remaining_balance=F("remaining_balance") + self.amount)
+                credit_balance.record(self.amount)
+            elif (
+                self.amount > 0
+                and self.status == CUSTOMER_BALANCE_ADJUSTMENT_STATUS.ACTIVE
+            ):
+                credit_balance.record(self.amount, self.expires_at)
 
     def get_remaining_balance(self):
+        if self.remaining_balance is not None:
+            return self.remaining_balance
         try:
             dd_aggregate = self.total_drawdowns
         except AttributeError:
@@ -946,84 +1123,79 @@ class CustomerBalanceAdjustment(models.Model):
                 parent_adjustment=self,
                 description=description,
             )
+            self.remaining_balance = 0
         self.status = CUSTOMER_BALANCE_ADJUSTMENT_STATUS.INACTIVE
         self.save()
 
     @staticmethod
     def draw_down_amount(customer, amount, pricing_unit, description=""):
         now = now_utc()
-        adjs = (
-            CustomerBalanceAdjustment.objects.filter(
-                Q(expires_at__gte=now) | Q(expires_at__isnull=True),
-                organization=customer.organization,
-                customer=customer,
-                pricing_unit=pricing_unit,
-                amount__gt=0,
-                status=CUSTOMER_BALANCE_ADJUSTMENT_STATUS.ACTIVE,
+        with transaction.atomic():
+            credit_balance = CustomerCreditBalance.lock(
+                customer.organization_id,
+                customer.pk,
+                pricing_unit.pk if pricing_unit else None,
             )
-            .annotate(
-                cost_basis=Cast(
-                    Coalesce(F("amount_paid") / F("amount"), 0), FloatField()
+            grants = (
+                credit_balance.open_grants()
+                .select_for_update()
+                .filter(Q(expires_at__gte=now) | Q(expires_at__isnull=True))
+                .annotate(
+                    cost_basis=Cast(
+                        Coalesce(F("amount_paid") / F("amount"), 0), FloatField()
+                    )
                 )
-            )
-            .order_by(
-                F("expires_at").asc(nulls_last=True),
-                F("cost_basis").desc(nulls_last=True),
-            )
-            .annotate(
-                drawn_down_amount=Coalesce(
-                    Sum("drawdowns__amount"), 0, output_field=models.DecimalField()
+                .order_by(
+                    F("expires_at").asc(nulls_last=True),
+                    F("cost_basis").desc(nulls_last=True),
                 )
             )
-            .annotate(remaining_balance=F("amount") + F("drawn_down_amount"))
-        )
-        am = amount
-        for adj in adjs:
-            remaining_balance = adj.remaining_balance
-            if remaining_balance <= 0:
-                adj.status = CUSTOMER_BALANCE_ADJUSTMENT_STATUS.INACTIVE
-                adj.save()
-                continue
-            drawdown_amount = min(am, remaining_balance)
-            CustomerBalanceAdjustment.objects.create(
-                organization=customer.organization,
-                customer=customer,
-                amount=-drawdown_amount,
-                pricing_unit=adj.pricing_unit,
-                parent_adjustment=adj,
-                description=description,
+            am = amount
+            drawdowns = []
+            closed_expiring_grant = False
+            for grant in grants:
+                drawdown_amount = min(am, grant.remaining_balance)
+                # (customer, created) is unique
+                created = now + datetime.timedelta(microseconds=len(drawdowns))
+                drawdowns.append(
+                    CustomerBalanceAdjustment(
+                        organization_id=customer.organization_id,
+                        customer=customer,
+                        amount=-drawdown_amount,
+                        pricing_unit_id=grant.pricing_unit_id,
+                        parent_adjustment=grant,
+                        description=description,
+                        created=created,
+                        effective_at=created,
+                    )
+                )
+                grant.remaining_balance -= drawdown_amount
+                if grant.remaining_balance == 0:
+                    grant.status = CUSTOMER_BALANCE_ADJUSTMENT_STATUS.INACTIVE
+                    closed_expiring_grant |= grant.expires_at is not None
+                am -= drawdown_amount
+                if am == 0:
+                    break
+            if len(drawdowns) == 0:
+                return am
+            CustomerBalanceAdjustment.objects.bulk_create(drawdowns)
+            CustomerBalanceAdjustment.objects.bulk_update(
+                [drawdown.parent_adjustment for drawdown in drawdowns],
+                ["remaining_balance", "status"],
             )
-            if drawdown_amount == remaining_balance:
-                adj.status = CUSTOMER_BALANCE_ADJUSTMENT_STATUS.INACTIVE
-                adj.save()
-            am -= drawdown_amount
-            if am == 0:
-                break
+            credit_balance.record(am - amount)
+            if closed_expiring_grant:
+                credit_balance.refresh_next_expiry()
         return am
 
     @staticmethod
     def get_pricing_unit_balance(customer, pricing_unit):
-        now = now_utc()
-        adjs = (
-            CustomerBalanceAdjustment.objects.filter(
-                Q(expires_at__gte=now) | Q(expires_at__isnull=True),
-                organization=customer.organization,
-                customer=customer,
-                pricing_unit=pricing_unit,
-                amount__gt=0,
-                status=CUSTOMER_BALANCE_ADJUSTMENT_STATUS.ACTIVE,
-            )
-            .prefetch_related("drawdowns")
-            .annotate(
-                drawn_down_amount=Coalesce(
-                    Sum("drawdowns__amount"), 0, output_field=models.DecimalField()
-                )
-            )
-            .annotate(remaining_balance=F("amount") - F("drawn_down_amount"))
-            .aggregate(total_balance=Sum("remaining_balance"))["total_balance"]
-        )
-        total_balance = adjs or 0
-        return total_balance
+        credit_balance = CustomerCreditBalance.objects.filter(
+            customer=customer, pricing_unit=pricing_unit
+        ).first()
+        if credit_balance is None:
+            return 0
+        return credit_balance.get_balance()
 
 
 class IdempotenceCheck(models.Model):
@@ -1364,6 +1536,19 @@ class Metric(models.Model):
 
         return usage
 
+    def get_subscription_records_current_usage(self, previous_usages, group_by, now):
+        from metering_billing.aggregation.billable_metrics import METRIC_HANDLER_MAP
+
+        if self.status == METRIC_STATUS.ACTIVE and not self.mat_views_provisioned:
+            self.provision_materialized_views()
+
+        handler = METRIC_HANDLER_MAP[self.metric_type]
+        usages = handler.get_subscription_records_current_usage(
+            self, previous_usages, group_by, now
+        )
+
+        return usages
+
     def get_daily_total_usage(
         self,
         start_date: datetime.date,
@@ -1460,43 +1645,10 @@ class PriceTier(models.Model):
     )
 
     def calculate_revenue(self, usage: float, prev_tier_end=False):
-        # if division_factor is None:
-        #     division_factor = len(usage_dict)
-        revenue = 0
-        discontinuous_range = (
-            prev_tier_end != self.range_start and prev_tier_end is not None
-        )
-        # for usage in usage_dict.values():
+        from metering_billing.pricing import CompiledTier
+
         usage = convert_to_decimal(usage)
-        usage_in_range = (
-            self.range_start <= usage
-            if discontinuous_range
-            else self.range_start < usage or self.range_start == 0
-        )
-        if usage_in_range:
-            if self.type == PriceTier.PriceTierType.FLAT:
-                revenue += self.cost_per_batch
-            elif self.type == PriceTier.PriceTierType.PER_UNIT:
-                if self.range_end is not None:
-                    billable_units = min(
-                        usage - self.range_start, self.range_end - self.range_start
-                    )
-                else:
-                    billable_units = usage - self.range_start
-                if discontinuous_range:
-                    billable_units += 1
-                billable_batches = billable_units / self.metric_units_per_batch
-                if self.batch_rounding_type == PriceTier.BatchRoundingType.ROUND_UP:
-                    billable_batches = math.ceil(billable_batches)
-                elif self.batch_rounding_type == PriceTier.BatchRoundingType.ROUND_DOWN:
-                    billable_batches = math.floor(billable_batches)
-                elif (
-                    self.batch_rounding_type
-                    == PriceTier.BatchRoundingType.ROUND_NEAREST
-                ):
-                    billable_batches = round(billable_batches)
-                revenue += self.cost_per_batch * billable_batches
-        return revenue
+        return CompiledTier(self, prev_tier_end=prev_tier_end).revenue(usage)
 
 
 class PlanComponent(models.Model):
@@ -1536,28 +1688,30 @@ class PlanComponent(models.Model):
             self.pricing_unit = self.plan_version.pricing_unit
         super().save(*args, **kwargs)
 
-    def calculate_total_revenue(self, subscription_record) -> UsageRevenueSummary:
+    def get_tier_schedule(self, tier_schedules=None):
+        from metering_billing.pricing import TierSchedule
+
+        if tier_schedules is not None:
+            return tier_schedules.get(self)
+        try:
+            return self._tier_schedule
+        except AttributeError:
+            self._tier_schedule = TierSchedule.from_plan_component(self)
+            return self._tier_schedule
+
+    def calculate_total_revenue(
+        self, subscription_record, tier_schedules=None
+    ) -> UsageRevenueSummary:
         billable_metric = self.billable_metric
         usage_qty = billable_metric.get_subscription_record_total_billable_usage(
             subscription_record
         )
-        revenue = 0
-        tiers = self.tiers.all()
-        for i, tier in enumerate(tiers):
-            if i > 0:
-                # this is for determining whether this is a continuous or discontinuous range
-                prev_tier_end = tiers[i - 1].range_end
-                tier_revenue = tier.calculate_revenue(
-                    usage_qty, prev_tier_end=prev_tier_end
-                )
-            else:
-                tier_revenue = tier.calculate_revenue(usage_qty)
-            revenue += tier_revenue
-        revenue = convert_to_decimal(revenue)
+        schedule = self.get_tier_schedule(tier_schedules)
+        revenue = schedule.total_revenue(usage_qty)
         return {"revenue": revenue, "usage_qty": usage_qty}
 
     def calculate_revenue_per_day(
-        self, subscription_record
+        self, subscription_record, tier_schedules=None
     ) -> dict[datetime.datetime, UsageRevenueSummary]:
         billable_metric = self.billable_metric
         usage_per_day = billable_metric.get_subscription_record_daily_billable_usage(
@@ -1570,23 +1724,19 @@ class PlanComponent(models.Model):
             period = convert_to_date(period)
             results[period] = {"revenue": Decimal(0), "usage_qty": Decimal(0)}
 
-        running_total_revenue = Decimal(0)
+        dates, usages, running_totals = [], [], []
         running_total_usage = Decimal(0)
         for date, usage_qty in usage_per_day.items():
-            date = convert_to_date(date)
             usage_qty = convert_to_decimal(usage_qty)
             running_total_usage += usage_qty
-            revenue = Decimal(0)
-            tiers = self.tiers.all()
-            for i, tier in enumerate(tiers):
-                if i > 0:
-                    prev_tier_end = tiers[i - 1].range_end
-                    tier_revenue = tier.calculate_revenue(
-                        running_total_usage, prev_tier_end=prev_tier_end
-                    )
-                else:
-                    tier_revenue = tier.calculate_revenue(running_total_usage)
-                revenue += convert_to_decimal(tier_revenue)
+            dates.append(convert_to_date(date))
+            usages.append(usage_qty)
+            running_totals.append(running_total_usage)
+
+        schedule = self.get_tier_schedule(tier_schedules)
+        cumulative_revenues = schedule.revenue_many(running_totals, quantize_tiers=True)
+        running_total_revenue = Decimal(0)
+        for date, usage_qty, revenue in zip(dates, usages, cumulative_revenues):
             date_revenue = revenue - running_total_revenue
             running_total_revenue += date_revenue
             if date in results:
@@ -1658,6 +1808,11 @@ class Invoice(models.Model):
         "SubscriptionRecord", related_name="invoices"
     )
     invoice_past_due_webhook_sent = models.BooleanField(default=False)
+    # summary of the line items, stored when the invoice is finalized so listing
+    # invoices never has to aggregate over them
+    start_date = models.DateTimeField(null=True, blank=True)
+    end_date = models.DateTimeField(null=True, blank=True)
+    line_item_count = models.PositiveIntegerField(default=0)
     history = HistoricalRecords()
 
     class Meta:
@@ -1678,30 +1833,101 @@ class Invoice(models.Model):
             self.currency = self.organization.default_currency
 
         ### Generate invoice number
-        if not self.pk and self.payment_status != Invoice.PaymentStatus.DRAFT:
-            issue_date = self.issue_date.date()
-            issue_date_string = issue_date.strftime("%y%m%d")
-            next_invoice_number = "000001"
-            last_invoice = (
-                Invoice.objects.filter(
-                    invoice_number__startswith=issue_date_string,
-                    organization=self.organization,
-                )
-                .order_by("-invoice_number")
-                .first()
+        if (
+            not self.pk
+            and self.payment_status != Invoice.PaymentStatus.DRAFT
+            and not self.invoice_number
+        ):
+            (self.invoice_number,) = Invoice.generate_invoice_numbers(
+                self.organization, self.issue_date
             )
-            if last_invoice:
-                last_invoice_number = int(last_invoice.invoice_number[7:])
-                next_invoice_number = "{0:06d}".format(last_invoice_number + 1)
-
-            self.invoice_number = issue_date_string + "-" + next_invoice_number
             # if not self.due_date:
             #     self.due_date = self.issue_date + datetime.timedelta(days=1)
         paid_before = self.payment_status == Invoice.PaymentStatus.PAID
-        super().save(*args, **kwargs)
-        paid_after = self.payment_status == Invoice.PaymentStatus.PAID
-        if not paid_before and paid_after and self.cost_due > 0:
-            invoice_paid_webhook(self, self.organization)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            paid_after = self.payment_status == Invoice.PaymentStatus.PAID
+            if not paid_before and paid_after and self.cost_due > 0:
+                invoice_paid_webhook(self, self.organization)
+
+    @staticmethod
+    def generate_invoice_numbers(organization, issue_date, n=1):
+        """
+        Returns the next n invoice numbers for the organization on the issue date, so
+        callers that build several invoices before saving them don't hand out the same
+        number twice.
+        """
+        return InvoiceNumberCounter.reserve(organization.pk, issue_date, n=n)
+
+
+class InvoiceNumberCounter(models.Model):
+    """
+    Last invoice number handed out for an organization on a given day. Numbers are
+    reserved by incrementing the row in place, so concurrent invoicing never reads the
+    same last number, and a block of numbers costs a single UPDATE.
+    """
+
+    organization = models.ForeignKey(
+        Organization, on_delete=models.CASCADE, related_name="+"
+    )
+    date = models.DateField()
+    last_number = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=["organization", "date"],
+                name="unique_invoice_number_counter_per_org_date",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.last_number}"
+
+    @staticmethod
+    def format_invoice_number(date, number):
+        return date.strftime("%y%m%d") + "-" + "{0:06d}".format(number)
+
+    @classmethod
+    def reserve(cls, organization_pk, issue_date, n=1):
+        """
+        Reserve a block of n consecutive invoice numbers and return them formatted.
+        """
+        date = issue_date.date()
+        table = cls._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET last_number = last_number + %s "
+                "WHERE organization_id = %s AND date = %s RETURNING last_number",
+                [n, organization_pk, date],
+            )
+            row = cursor.fetchone()
+            if row is None:
+                # first reservation of the day, continue after any invoice numbered
+                # before the counter existed
+                prefix = date.strftime("%y%m%d")
+                last_invoice = (
+                    Invoice.objects.filter(
+                        invoice_number__startswith=prefix,
+                        organization_id=organization_pk,
+                    )
+                    .order_by("-invoice_number")
+                    .first()
+                )
+                start = int(last_invoice.invoice_number[7:]) if last_invoice else 0
+                cursor.execute(
+                    f"INSERT INTO {table} (organization_id, date, last_number) "
+                    "VALUES (%s, %s, %s) ON CONFLICT (organization_id, date) "
+                    f"DO UPDATE SET last_number = {table}.last_number + %s "
+                    "RETURNING last_number",
+                    [organization_pk, date, start + n, n],
+                )
+                row = cursor.fetchone()
+        last_number = row[0]
+        return [
+            cls.format_invoice_number(date, number)
+            for number in range(last_number - n + 1, last_number + 1)
+        ]
 
 
 class InvoiceLineItem(models.Model):
@@ -2310,6 +2536,14 @@ class SubscriptionRecordManager(models.Manager):
             time = now_utc()
         return self.filter(end_date__lte=time)
 
+    def due_for_billing(self, time=None):
+        if time is None:
+            time = now_utc()
+        return self.filter(
+            (Q(end_date__lt=time) | Q(next_billing_date__lt=time))
+            & Q(fully_billed=False),
+        )
+
     def not_started(self, time=None):
         if time is None:
             time = now_utc()
@@ -2409,13 +2643,32 @@ class SubscriptionRecord(models.Model):
                 check=Q(start_date__lte=F("end_date")), name="end_date_gte_start_date"
             ),
         ]
+        indexes = [
+            # partial indexes backing SubscriptionRecord.objects.due_for_billing
+            models.Index(
+                fields=["next_billing_date"],
+                condition=Q(fully_billed=False),
+                name="sr_unbilled_next_billing_idx",
+            ),
+            models.Index(
+                fields=["end_date"],
+                condition=Q(fully_billed=False),
+                name="sr_unbilled_end_date_idx",
+            ),
+            # subscription list filters and its keyset pagination
+            models.Index(fields=["organization", "customer", "start_date", "end_date"]),
+            models.Index(fields=["organization", "start_date", "id"]),
+        ]
 
     def __str__(self):
         addon = "[ADDON] " if self.billing_plan.plan.addon_spec else ""
         return f"{addon}{self.customer.customer_name}  {self.billing_plan.plan.plan_name} : {self.start_date.date()} to {self.end_date.date()}"
 
-    def save(self, *args, **kwargs):
-        new_filters = kwargs.pop("subscription_filters", [])
+    def set_billing_dates(self):
+        """
+        Fill in the dates that weren't given, from the plan and the customer's timezone.
+        Called by save, and directly by code that bulk creates subscription records.
+        """
         now = now_utc()
         timezone = self.customer.timezone
         if not self.end_date:
@@ -2462,6 +2715,10 @@ class SubscriptionRecord(models.Model):
                     )
         if not self.usage_start_date:
             self.usage_start_date = self.start_date
+
+    def save(self, *args, **kwargs):
+        new_filters = kwargs.pop("subscription_filters", [])
+        self.set_billing_dates()
         new = not self.pk
         if new:
             overlapping_subscriptions = SubscriptionRecord.objects.filter(
@@ -2496,14 +2753,13 @@ class SubscriptionRecord(models.Model):
             alerts = UsageAlert.objects.filter(
                 organization=self.organization, plan_version=self.billing_plan
             )
-            now = now_utc()
             for alert in alerts:
                 UsageAlertResult.objects.create(
                     organization=self.organization,
                     alert=alert,
                     subscription_record=self,
                     last_run_value=0,
-                    last_run_timestamp=now,
+                    last_run_timestamp=self.usage_start_date,
                 )
 
     def get_filters_dictionary(self):
@@ -2520,7 +2776,7 @@ class SubscriptionRecord(models.Model):
         ).aggregate(tot=Sum("subtotal"))["tot"]
         return billed_invoices or 0
 
-    def get_usage_and_revenue(self):
+    def get_usage_and_revenue(self, tier_schedules=None):
         sub_dict = {"components": []}
         # set up the billing plan for this subscription
         plan = self.billing_plan
@@ -2532,7 +2788,9 @@ class SubscriptionRecord(models.Model):
         plan_components_qs = plan.plan_components.all()
         # For each component of the plan, calculate usage/revenue
         for plan_component in plan_components_qs:
-            plan_component_summary = plan_component.calculate_total_revenue(self)
+            plan_component_summary = plan_component.calculate_total_revenue(
+                self, tier_schedules=tier_schedules
+            )
             sub_dict["components"].append((plan_component.pk, plan_component_summary))
         sub_dict["usage_amount_due"] = Decimal(0)
         for component_pk, component_dict in sub_dict["components"]:
@@ -2581,7 +2839,7 @@ class SubscriptionRecord(models.Model):
         self.auto_renew = False
         self.save()
 
-    def calculate_earned_revenue_per_day(self):
+    def calculate_earned_revenue_per_day(self, tier_schedules=None):
         return_dict = {}
         for period in periods_bwn_twodates(
             USAGE_CALC_GRANULARITY.DAILY, self.start_date, self.end_date
@@ -2613,7 +2871,9 @@ class SubscriptionRecord(models.Model):
                     * duration_microseconds
                 )
         for component in self.billing_plan.plan_components.all():
-            rev_per_day = component.calculate_revenue_per_day(self)
+            rev_per_day = component.calculate_revenue_per_day(
+                self, tier_schedules=tier_schedules
+            )
             for period, d in rev_per_day.items():
                 period = convert_to_date(period)
                 d["usage_qty"]
@@ -2623,6 +2883,99 @@ class SubscriptionRecord(models.Model):
         return return_dict
 
 
+class BillingRun(models.Model):
+    """
+    One pass of the periodic billing job. The customers with subscription records due
+    before due_before are split into chunks that are invoiced by separate workers, and
+    the counters track how far the run has got.
+    """
+
+    billing_run_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    status = models.CharField(
+        choices=BILLING_RUN_STATUS.choices,
+        default=BILLING_RUN_STATUS.RUNNING,
+        max_length=40,
+    )
+    due_before = models.DateTimeField()
+    started_at = models.DateTimeField(default=now_utc)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    total_customers = models.PositiveIntegerField(default=0)
+    total_chunks = models.PositiveIntegerField(default=0)
+    completed_chunks = models.PositiveIntegerField(default=0)
+    invoiced_customers = models.PositiveIntegerField(default=0)
+    skipped_customers = models.PositiveIntegerField(
+        default=0,
+        help_text="Customers that were already being billed by an overlapping run.",
+    )
+    failed_customers = models.PositiveIntegerField(default=0)
+    retries = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Billing run {self.started_at} - {self.status}"
+
+    def record_progress(
+        self, invoiced=0, skipped=0, failed=0, retried=False, chunk_completed=False
+    ):
+        # counters are updated in the database since every chunk reports concurrently
+        BillingRun.objects.filter(pk=self.pk).update(
+            invoiced_customers=F("invoiced_customers") + invoiced,
+            skipped_customers=F("skipped_customers") + skipped,
+            failed_customers=F("failed_customers") + failed,
+            retries=F("retries") + int(retried),
+            completed_chunks=F("completed_chunks") + int(chunk_completed),
+        )
+        if chunk_completed:
+            self.finish_if_done()
+
+    def finish_if_done(self):
+        BillingRun.objects.filter(
+            pk=self.pk,
+            status=BILLING_RUN_STATUS.RUNNING,
+            completed_chunks__gte=F("total_chunks"),
+        ).update(
+            status=Case(
+                When(failed_customers__gt=0, then=Value(BILLING_RUN_STATUS.FAILED)),
+                default=Value(BILLING_RUN_STATUS.COMPLETED),
+            ),
+            completed_at=now_utc(),
+        )
+
+
+class InvoicingJob(models.Model):
+    """
+    Invoice generation requested by a subscription change through the API. The change
+    is committed first and the invoices are generated in the background by the
+    run_invoicing_job task. Their cost is predicted up front, without taxes or
+    customer balances, from a read-only computation of the fees and usage.
+    """
+
+    organization = models.ForeignKey(
+        Organization, on_delete=models.CASCADE, related_name="invoicing_jobs"
+    )
+    invoicing_job_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    status = models.CharField(
+        choices=INVOICING_JOB_STATUS.choices,
+        default=INVOICING_JOB_STATUS.PENDING,
+        max_length=40,
+    )
+    subscription_records = models.ManyToManyField(SubscriptionRecord, related_name="+")
+    invoices = models.ManyToManyField(Invoice, related_name="+", blank=True)
+    predicted_cost_due = models.DecimalField(
+        decimal_places=10, max_digits=20, null=True, blank=True
+    )
+    errors = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Why the customers that couldn't be invoiced failed, keyed by customer_id. The billing run invoices their subscriptions instead.",
+    )
+    created = models.DateTimeField(default=now_utc)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Invoicing job {self.created} - {self.status}"
+
+
 class Backtest(models.Model):
     """
     This model is used to store the results of a backtest.
@@ -2637,7 +2990,7 @@ class Backtest(models.Model):
     time_created = models.DateTimeField(default=now_utc)
     backtest_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     kpis = models.JSONField(default=list)
-    backtest_results = models.JSONField(default=dict, blank=True)
+    backtest_results = models.JSONField(default=dict, blank=True, encoder=JSONEncoder)
     status = models.CharField(
         choices=BACKTEST_STATUS.choices,
         default=BACKTEST_STATUS.RUNNING,
@@ -2669,6 +3022,8 @@ class BacktestSubstitution(models.Model):
     new_plan = models.ForeignKey(
         PlanVersion, on_delete=models.CASCADE, related_name="+"
     )
+    # filled in by the worker that evaluates the substitution, null while pending
+    results = models.JSONField(null=True, blank=True, encoder=JSONEncoder)
     history = HistoricalRecords()
 
     def __str__(self):
@@ -2846,10 +3201,8 @@ class UsageAlert(models.Model):
         constraints = []
 
     def save(self, *args, **kwargs):
-        if self.metric.metric_type != METRIC_TYPE.COUNTER:
-            raise ValidationError(
-                "Only counter metrics can be used for alerts at this time"
-            )
+        if self.metric.metric_type == METRIC_TYPE.CUSTOM:
+            raise ValidationError("Custom metrics can't be used for alerts")
         super(UsageAlert, self).save(*args, **kwargs)
         active_sr = SubscriptionRecord.objects.active().filter(
             organization=self.organization,
@@ -2861,7 +3214,7 @@ class UsageAlert(models.Model):
                 alert=self,
                 subscription_record=subscription_record,
                 last_run_value=0,
-                last_run_timestamp=now_utc(),
+                last_run_timestamp=subscription_record.usage_start_date,
             )
 
 
@@ -2887,29 +3240,79 @@ class UsageAlertResult(models.Model):
             ),
         ]
 
-    def refresh(self):
-        # calculate the value for the alert
-        # update the last_run_value and last_run_timestamp
-        # save the object
-
-        metric = self.alert.metric
-        subscription_record = self.subscription_record
-        now = now_utc()
-        new_value = metric.get_subscription_record_total_billable_usage(
-            subscription_record
-        )
-        if (
+    def evaluate(self, new_value, as_of):
+        """
+        Update the value of the alert result with the metric's current usage as of the
+        given time and return whether the threshold was crossed on the way up. Gauges
+        and rates re-arm once they drop back under the threshold.
+        """
+        triggered = (
             new_value >= self.alert.threshold
             and self.last_run_value < self.alert.threshold
-        ):
-            # send alert
-            usage_alert_webhook(
-                self.alert, self, subscription_record, self.organization
-            )
+        )
+        if triggered:
             self.triggered_count = self.triggered_count + 1
         self.last_run_value = new_value
-        self.last_run_timestamp = now
-        self.save()
+        self.last_run_timestamp = as_of
+        return triggered
+
+    def refresh(self):
+        UsageAlertResult.refresh_many([self])
+
+    @classmethod
+    def refresh_many(cls, alert_results):
+        """
+        Evaluate the alert results, save them in bulk and send the triggered ones with
+        a single usage_alert_webhook call per organization. The usage is read with one
+        query per metric, which only looks at the buckets newer than last_run_timestamp:
+        counters add them to last_run_value, gauges and rates take the latest ones.
+        """
+        alert_results = list(alert_results)
+        now = now_utc()
+        prefetch_related_objects(alert_results, "subscription_record__filters")
+        organizations = {x.organization_id: x.organization for x in alert_results}
+        group_by = {
+            setting.organization_id: setting.setting_values
+            for setting in OrganizationSetting.objects.filter(
+                organization__in=organizations.keys(),
+                setting_name=ORGANIZATION_SETTING_NAMES.SUBSCRIPTION_FILTER_KEYS,
+            )
+        }
+        for organization_pk, organization in organizations.items():
+            if organization_pk not in group_by:
+                organization.provision_subscription_filter_settings()
+                group_by[organization_pk] = []
+        alert_results_per_metric = {}
+        for alert_result in alert_results:
+            alert_results_per_metric.setdefault(
+                alert_result.alert.metric_id, []
+            ).append(alert_result)
+        evaluated = []
+        triggered = {}
+        for metric_alert_results in alert_results_per_metric.values():
+            metric = metric_alert_results[0].alert.metric
+            usages = metric.get_subscription_records_current_usage(
+                [
+                    (x.subscription_record, x.last_run_value, x.last_run_timestamp)
+                    for x in metric_alert_results
+                ],
+                group_by[metric.organization_id],
+                now,
+            )
+            for alert_result, (usage, as_of) in zip(metric_alert_results, usages):
+                if alert_result.evaluate(usage, as_of):
+                    triggered.setdefault(alert_result.organization_id, []).append(
+                        alert_result
+                    )
+                evaluated.append(alert_result)
+        cls.objects.bulk_update(
+            evaluated,
+            ["last_run_value", "last_run_timestamp", "triggered_count"],
+            batch_size=1000,
+        )
+        for org_alert_results in triggered.values():
+            usage_alert_webhook(org_alert_results[0].organization, org_alert_results)
+        return evaluated
 
 
 class StripeCustomerIntegration(models.Model):
@@ -2918,6 +3321,12 @@ class StripeCustomerIntegration(models.Model):
     )
     stripe_customer_id = models.TextField()
     created = models.DateTimeField(default=now_utc)
+    # what the payment processor last told us about the customer, so serializing a
+    # customer never has to call out to it
+    has_payment_method = models.BooleanField(default=False)
+    billing_address = models.JSONField(null=True, blank=True)
+    shipping_address = models.JSONField(null=True, blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         constraints = [
@@ -2927,6 +3336,12 @@ class StripeCustomerIntegration(models.Model):
             ),
         ]
 
+    def get_address(self, type: Literal["shipping", "billing"]) -> Optional[Address]:
+        address = self.billing_address if type == "billing" else self.shipping_address
+        if not address:
+            return None
+        return Address(organization_id=self.organization_id, **address)
+
 
 class BraintreeCustomerIntegration(models.Model):
     organization = models.ForeignKey(
@@ -2934,6 +3349,12 @@ class BraintreeCustomerIntegration(models.Model):
     )
     braintree_customer_id = models.TextField()
     created = models.DateTimeField(default=now_utc)
+    # what the payment processor last told us about the customer, so serializing a
+    # customer never has to call out to it
+    has_payment_method = models.BooleanField(default=False)
+    billing_address = models.JSONField(null=True, blank=True)
+    shipping_address = models.JSONField(null=True, blank=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         constraints = [
@@ -2943,6 +3364,12 @@ class BraintreeCustomerIntegration(models.Model):
             ),
         ]
 
+    def get_address(self, type: Literal["shipping", "billing"]) -> Optional[Address]:
+        address = self.billing_address if type == "billing" else self.shipping_address
+        if not address:
+            return None
+        return Address(organization_id=self.organization_id, **address)
+
 
 class StripeOrganizationIntegration(models.Model):
     organization = models.ForeignKey(
@@ -1,7 +1,12 @@
 import abc
 import base64
 import datetime
+import itertools
 import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from decimal import Decimal
 from typing import Literal, Optional
 from urllib.parse import urlencode
@@ -13,6 +18,7 @@ import sentry_sdk
 import stripe
 from django.conf import settings
 from django.core.cache import cache
+from django.db import connections, transaction
 from django.db.models import F, Prefetch, Q
 from metering_billing.serializers.payment_processor_serializers import (
     PaymentProcesorPostResponseSerializer,
@@ -30,6 +36,7 @@ from metering_billing.utils.enums import (
 )
 from rest_framework import serializers, status
 from rest_framework.response import Response
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
 
 logger = logging.getLogger("django.server")
 
@@ -50,6 +57,13 @@ BRAINTREE_TEST_PUBLIC_KEY = settings.BRAINTREE_TEST_PUBLIC_KEY
 BRAINTREE_TEST_SECRET_KEY = settings.BRAINTREE_TEST_SECRET_KEY
 
 VITE_API_URL = settings.VITE_API_URL
+PAYMENT_STATUS_POLL_CONCURRENCY = settings.PAYMENT_STATUS_POLL_CONCURRENCY
+PAYMENT_STATUS_LIST_WINDOW_DAYS = settings.PAYMENT_STATUS_LIST_WINDOW_DAYS
+API_CLIENT_REGISTRY_SIZE = settings.API_CLIENT_REGISTRY_SIZE
+API_CLIENT_MAX_AGE = settings.API_CLIENT_MAX_AGE
+# the largest page the Stripe list endpoints return
+STRIPE_IMPORT_PAGE_SIZE = 100
+STRIPE_IMPORT_CHECKPOINT_TTL = 60 * 60 * 24
 
 
 def base64_encode(data: str) -> str:
@@ -59,6 +73,100 @@ def base64_encode(data: str) -> str:
     return base64_string
 
 
+class APIClientRegistry:
+    """
+    Long-lived API clients keyed by processor and organization. The clients keep
+    their HTTP sessions alive between calls, so a billing run reuses connections
+    instead of doing a TLS handshake per request. A client is rebuilt when the
+    credentials it was built from change or when it is older than max_age, and the
+    least recently used ones are dropped once there are more than max_size.
+    """
+
+    def __init__(self, max_size, max_age):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, credentials, build):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._clients.get(key)
+            if (
+                entry is not None
+                and entry[0] == credentials
+                and now - entry[1] < self.max_age
+            ):
+                self._clients.move_to_end(key)
+                return entry[2]
+        # building can mean a network call, so don't hold the lock for it
+        client = build()
+        with self._lock:
+            self._clients[key] = (credentials, now, client)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        return client
+
+    def invalidate(self, key):
+        with self._lock:
+            self._clients.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+api_clients = APIClientRegistry(API_CLIENT_REGISTRY_SIZE, API_CLIENT_MAX_AGE)
+
+
+class PooledBraintreeConfiguration(braintree.Configuration):
+    """
+    Braintree configuration that hands out one Http client for every call. The stock
+    one builds a new client, and with it a new requests session, on each gateway
+    call, so a cached gateway alone wouldn't keep any connection alive.
+    """
+
+    def http(self):
+        # the constructor builds the shared client through this method
+        if getattr(self, "_http_strategy", None) is None:
+            return super().http()
+        return self._http_strategy
+
+
+def poll_payment_object_statuses(get_status, payment_object_ids) -> dict:
+    """
+    Calls get_status for every payment object id in a bounded pool of threads. Ids
+    whose lookup fails are left out of the result, so they're retried on the next poll.
+    """
+
+    def get_status_and_close(payment_object_id):
+        try:
+            return get_status(payment_object_id)
+        finally:
+            # the worker threads can open their own database connections
+            connections.close_all()
+
+    statuses = {}
+    if len(payment_object_ids) == 0:
+        return statuses
+    max_workers = min(PAYMENT_STATUS_POLL_CONCURRENCY, len(payment_object_ids))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(get_status_and_close, payment_object_id): payment_object_id
+            for payment_object_id in payment_object_ids
+        }
+        for future in as_completed(futures):
+            payment_object_id = futures[future]
+            try:
+                statuses[payment_object_id] = future.result()
+            except Exception as e:
+                logger.error(
+                    f"Could not update status of payment object {payment_object_id}: {e}"
+                )
+    return statuses
+
+
 class PaymentProcesor(abc.ABC):
     # MANAGEMENT METHODS
     @abc.abstractmethod
@@ -119,6 +227,17 @@ class PaymentProcesor(abc.ABC):
         """This method will be called periodically when the status of a payment object needs to be updated. It should return the status of the payment object, which should be either paid or unpaid."""
         pass
 
+    def update_payment_object_statuses(
+        self, organization, payment_object_ids: list[str], created_at=None
+    ) -> dict[str, int]:
+        """This method will be called periodically with all the open payment objects of an organization. It should return a dictionary mapping the ids it could check to their status. created_at, if it's given, maps the ids to when their invoices were issued. Processors with list or search APIs should override it, by default every id goes through update_payment_object_status in a bounded pool of threads."""
+        return poll_payment_object_statuses(
+            lambda payment_object_id: self.update_payment_object_status(
+                organization, payment_object_id
+            ),
+            payment_object_ids,
+        )
+
     @abc.abstractmethod
     def retrieve_customer_by_external_id(self, organization, external_id: str):
         """This method will be called when a customer is created in Lotus and the payment provider is connected. It should return the customer object from the payment provider."""
@@ -126,7 +245,12 @@ class PaymentProcesor(abc.ABC):
 
     @abc.abstractmethod
     def has_payment_method(self, customer) -> bool:
-        """This method will be caleld to check if the customer has a payment method attached to their account."""
+        """This method will be caleld to check if the customer has a payment method attached to their account. It's called while serializing customers, so it should answer from what sync_customers stored instead of calling out to the payment processor."""
+        pass
+
+    @abc.abstractmethod
+    def sync_customers(self, organization) -> int:
+        """This method will be called periodically to refresh what Lotus keeps about the organization's customers in the payment processor: whether they have a payment method and their addresses. It should look customers up in batches. Return the number of customers that were refreshed."""
         pass
 
     @abc.abstractmethod
@@ -136,7 +260,7 @@ class PaymentProcesor(abc.ABC):
 
     @abc.abstractmethod
     def get_customer_address(self, customer, type: Literal["shipping", "billing"]):
-        """This method will be called to get the address of a customer."""
+        """This method will be called to get the address of a customer. Like has_payment_method, it should answer from what sync_customers stored."""
         pass
 
     @abc.abstractmethod
@@ -348,27 +472,49 @@ class BraintreeConnector(PaymentProcesor):
                 organization.organization_type
                 == Organization.OrganizationType.PRODUCTION
             ):
-                config = braintree.Configuration(
+                credentials = (
                     braintree.Environment.Production,
-                    merchant_id=self.live_merchant_id,
-                    public_key=self.live_public_key,
-                    private_key=self.live_private_key,
+                    self.live_merchant_id,
+                    self.live_public_key,
+                    self.live_private_key,
                 )
-                gateway = braintree.BraintreeGateway(config)
-
             else:
-                config = braintree.Configuration(
+                credentials = (
                     braintree.Environment.Sandbox,
-                    merchant_id=self.test_merchant_id,
-                    public_key=self.test_public_key,
-                    private_key=self.test_private_key,
+                    self.test_merchant_id,
+                    self.test_public_key,
+                    self.test_private_key,
                 )
-                gateway = braintree.BraintreeGateway(config)
+
+            def build_gateway():
+                environment, merchant_id, public_key, private_key = credentials
+                config = PooledBraintreeConfiguration(
+                    environment,
+                    merchant_id=merchant_id,
+                    public_key=public_key,
+                    private_key=private_key,
+                )
+                return braintree.BraintreeGateway(config)
+
         else:
-            gateway = braintree.BraintreeGateway(
-                access_token=self._get_access_token(organization)
+            integration = organization.braintree_integration
+            credentials = (
+                organization.organization_type,
+                integration.braintree_merchant_id if integration else None,
             )
-        return gateway
+
+            def build_gateway():
+                return braintree.BraintreeGateway(
+                    PooledBraintreeConfiguration(
+                        access_token=self._get_access_token(organization)
+                    )
+                )
+
+        return api_clients.get(
+            (PAYMENT_PROCESSORS.BRAINTREE, organization.pk),
+            credentials,
+            build_gateway,
+        )
 
     # IMPORT METHODS
 
@@ -532,35 +678,92 @@ class BraintreeConnector(PaymentProcesor):
         else:
             return Invoice.PaymentStatus.UNPAID
 
+    def update_payment_object_statuses(
+        self, organization, payment_object_ids, created_at=None
+    ):
+        from metering_billing.models import Invoice
+
+        gateway = self._get_gateway(organization)
+        statuses = {}
+        for i in range(0, len(payment_object_ids), 100):
+            transactions = gateway.transaction.search(
+                braintree.TransactionSearch.ids.in_list(payment_object_ids[i : i + 100])
+            )
+            for braintree_transaction in transactions.items:
+                if braintree_transaction.status == braintree.Transaction.Status.Settled:
+                    statuses[braintree_transaction.id] = Invoice.PaymentStatus.PAID
+                else:
+                    statuses[braintree_transaction.id] = Invoice.PaymentStatus.UNPAID
+        return statuses
+
     def retrieve_customer_by_external_id(self, organization, external_id: str):
         gateway = self._get_gateway(organization)
         customer = gateway.customer.find(external_id)
         return customer
 
     def has_payment_method(self, customer) -> bool:
-        braintree_customer_id = customer.braintree_integration.braintree_customer_id
-        cust_dict = cache.get(f"braintree_customer_{braintree_customer_id}")
-        if cust_dict is None:
-            customer_obj = self.retrieve_customer_by_external_id(
-                customer.organization, braintree_customer_id
-            )
-            cust_dict = parse_nested_response(customer_obj)
-            cache.set(
-                f"braintree_customer_{braintree_customer_id}",
-                cust_dict,
-                60 * 60 * 24,
+        return customer.braintree_integration.has_payment_method
+
+    @staticmethod
+    def customer_state(braintree_customer):
+        address = next(iter(braintree_customer.addresses or []), None)
+        if address is not None:
+            address = {
+                "city": address.locality,
+                "country": address.country_code_alpha2,
+                "line1": address.street_address,
+                "line2": address.extended_address,
+                "postal_code": address.postal_code,
+                "state": address.region,
+            }
+        # braintree doesn't tell billing and shipping addresses apart
+        return {
+            "has_payment_method": len(braintree_customer.payment_methods or []) > 0,
+            "billing_address": address,
+            "shipping_address": address,
+        }
+
+    def sync_customers(self, organization) -> int:
+        from metering_billing.models import BraintreeCustomerIntegration
+
+        gateway = self._get_gateway(organization)
+        integrations = list(
+            BraintreeCustomerIntegration.objects.filter(organization=organization)
+        )
+        synced_integrations = []
+        for i in range(0, len(integrations), 100):
+            chunk = {
+                integration.braintree_customer_id: integration
+                for integration in integrations[i : i + 100]
+            }
+            braintree_customers = gateway.customer.search(
+                braintree.CustomerSearch.ids.in_list(list(chunk.keys()))
             )
-        return len(cust_dict.get("invoice_settings", {}).get("payment_methods", [])) > 0
+            now = now_utc()
+            for braintree_customer in braintree_customers.items:
+                integration = chunk[braintree_customer.id]
+                for field, value in self.customer_state(braintree_customer).items():
+                    setattr(integration, field, value)
+                integration.synced_at = now
+                synced_integrations.append(integration)
+        BraintreeCustomerIntegration.objects.bulk_update(
+            synced_integrations,
+            ["has_payment_method", "billing_address", "shipping_address", "synced_at"],
+            batch_size=1000,
+        )
+        return len(synced_integrations)
 
     def connect_customer(self, customer, external_id) -> bool:
         from metering_billing.models import BraintreeCustomerIntegration
 
         gateway = self._get_gateway(customer.organization)
         try:
-            gateway.customer.find(external_id)
+            braintree_customer = gateway.customer.find(external_id)
             integration = BraintreeCustomerIntegration.objects.create(
                 organization=customer.organization,
                 braintree_customer_id=external_id,
+                synced_at=now_utc(),
+                **self.customer_state(braintree_customer),
             )
             customer.braintree_integration = integration
             customer.save()
@@ -569,32 +772,9 @@ class BraintreeConnector(PaymentProcesor):
             return False
 
     def get_customer_address(self, customer, type: Literal["shipping", "billing"]):
-        from metering_billing.models import Address
-
-        # ignore type for now
-        cust_dict = cache.get(
-            f"braintree_customer_{customer.braintree_integration.braintree_customer_id}"
-        )
-        if cust_dict is None:
-            customer_obj = self.retrieve_customer_by_external_id(
-                customer.organization, customer.stripe_integration.stripe_customer_id
-            )
-            cust_dict = parse_nested_response(customer_obj)
-            cache.set(
-                f"braintree_customer_{customer.braintree_integration.braintree_customer_id}",
-                cust_dict,
-                60 * 60 * 24,
-            )
-        address = next(iter(cust_dict.get("addresses", [])), {})
-        addy = Address(
-            city=address.get("locality"),
-            country=address.get("country_code_alpha2"),
-            line1=address.get("street_address"),
-            line2=address.get("extended_address"),
-            postal_code=address.get("postal_code"),
-            state=address.get("region"),
-        )
-        return addy
+        if customer.braintree_integration is None:
+            return None
+        return customer.braintree_integration.get_address(type)
 
     def get_organization_address(
         self,
@@ -666,6 +846,8 @@ class BraintreeConnector(PaymentProcesor):
         )
         organization.braintree_integration = integration
         organization.save()
+        # the connection may have been reauthorized with new tokens
+        api_clients.invalidate((PAYMENT_PROCESSORS.BRAINTREE, organization.pk))
         self.initialize_settings(organization)
 
         response = {
@@ -803,6 +985,62 @@ class StripeConnector(PaymentProcesor):
         else:
             return Invoice.PaymentStatus.UNPAID
 
+    def update_payment_object_statuses(
+        self, organization, payment_object_ids, created_at=None
+    ):
+        from metering_billing.models import Invoice, Organization
+
+        if created_at is None:
+            return super().update_payment_object_statuses(
+                organization, payment_object_ids
+            )
+        # invoices issued recently are looked for in one listing of the invoices paid
+        # since then, anything not in there is still unpaid. The listing is bounded so
+        # an old invoice that stays open doesn't make every poll page through months
+        # of paid invoices, the older ones are retrieved by id instead.
+        window_start = now_utc() - datetime.timedelta(
+            days=PAYMENT_STATUS_LIST_WINDOW_DAYS
+        )
+        recent_ids, older_ids = [], []
+        for payment_object_id in payment_object_ids:
+            issued = created_at.get(payment_object_id)
+            if issued is not None and issued >= window_start:
+                recent_ids.append(payment_object_id)
+            else:
+                older_ids.append(payment_object_id)
+        statuses = super().update_payment_object_statuses(organization, older_ids)
+        if len(recent_ids) == 0:
+            return statuses
+        invoice_payload = {}
+        if not self.self_hosted:
+            invoice_payload[
+                "stripe_account"
+            ] = organization.stripe_integration.stripe_account_id
+        if organization.organization_type == Organization.OrganizationType.PRODUCTION:
+            invoice_payload["api_key"] = self.live_secret_key
+        else:
+            invoice_payload["api_key"] = self.test_secret_key
+        open_ids = set(recent_ids)
+        for payment_object_id in recent_ids:
+            statuses[payment_object_id] = Invoice.PaymentStatus.UNPAID
+        # a day of slack for the payment object being created after the invoice
+        created_after = min(created_at[x] for x in recent_ids) - datetime.timedelta(
+            days=1
+        )
+        paid_invoices = stripe.Invoice.list(
+            status="paid",
+            created={"gte": int(created_after.timestamp())},
+            limit=100,
+            **invoice_payload,
+        )
+        for stripe_invoice in paid_invoices.auto_paging_iter():
+            if stripe_invoice.id in open_ids:
+                statuses[stripe_invoice.id] = Invoice.PaymentStatus.PAID
+                open_ids.remove(stripe_invoice.id)
+                if len(open_ids) == 0:
+                    break
+        return statuses
+
     def retrieve_customer_by_external_id(self, organization, external_id: str):
         from metering_billing.models import Organization
 
@@ -820,21 +1058,76 @@ class StripeConnector(PaymentProcesor):
         return customer
 
     def has_payment_method(self, customer) -> bool:
-        stripe_id = customer.stripe_integration.stripe_customer_id
-        cust_dict = cache.get(f"stripe_customer_{stripe_id}")
-        if cust_dict is None:
-            customer_obj = self.retrieve_customer_by_external_id(
-                customer.organization, stripe_id
-            )
-            cust_dict = parse_nested_response(customer_obj)
-            cache.set(
-                f"stripe_customer_{stripe_id}",
-                cust_dict,
-                60 * 60 * 24,
-            )
-        return (
-            cust_dict.get("invoice_settings", {}).get("default_payment_method")
-            is not None
+        return customer.stripe_integration.has_payment_method
+
+    @staticmethod
+    def customer_state(stripe_customer):
+        def address_dict(address):
+            if not address:
+                return None
+            return {
+                "city": address.get("city"),
+                "country": address.get("country"),
+                "line1": address.get("line1"),
+                "line2": address.get("line2"),
+                "postal_code": address.get("postal_code"),
+                "state": address.get("state"),
+            }
+
+        invoice_settings = stripe_customer.get("invoice_settings") or {}
+        shipping = stripe_customer.get("shipping") or {}
+        return {
+            "has_payment_method": invoice_settings.get("default_payment_method")
+            is not None,
+            "billing_address": address_dict(stripe_customer.get("address")),
+            "shipping_address": address_dict(shipping.get("address")),
+        }
+
+    def update_customer_states(self, stripe_customers, organization=None) -> int:
+        """
+        Stores the state of the given Stripe customers on their integrations. Without
+        an organization, every integration with a matching id is updated, which is
+        what webhooks need since they aren't tied to an organization.
+        """
+        from metering_billing.models import StripeCustomerIntegration
+
+        stripe_customers = {x.id: x for x in stripe_customers}
+        integrations = StripeCustomerIntegration.objects.filter(
+            stripe_customer_id__in=stripe_customers.keys()
+        )
+        if organization is not None:
+            integrations = integrations.filter(organization=organization)
+        integrations = list(integrations)
+        now = now_utc()
+        for integration in integrations:
+            stripe_customer = stripe_customers[integration.stripe_customer_id]
+            for field, value in self.customer_state(stripe_customer).items():
+                setattr(integration, field, value)
+            integration.synced_at = now
+        StripeCustomerIntegration.objects.bulk_update(
+            integrations,
+            ["has_payment_method", "billing_address", "shipping_address", "synced_at"],
+        )
+        return len(integrations)
+
+    def sync_customers(self, organization) -> int:
+        from metering_billing.models import StripeCustomerIntegration
+
+        # only the customers linked in Lotus, not everyone on the Stripe account
+        stripe_customer_ids = list(
+            StripeCustomerIntegration.objects.filter(
+                organization=organization
+            ).values_list("stripe_customer_id", flat=True)
+        )
+        request_kwargs = self._request_kwargs(organization)
+        stripe_customers = poll_payment_object_statuses(
+            lambda stripe_customer_id: stripe.Customer.retrieve(
+                stripe_customer_id, **request_kwargs
+            ),
+            stripe_customer_ids,
+        )
+        return self.update_customer_states(
+            stripe_customers.values(), organization=organization
         )
 
     def connect_customer(self, customer, external_id) -> bool:
@@ -858,6 +1151,8 @@ class StripeConnector(PaymentProcesor):
             integration = StripeCustomerIntegration.objects.create(
                 organization=customer.organization,
                 stripe_customer_id=external_id,
+                synced_at=now_utc(),
+                **self.customer_state(cust),
             )
             customer.stripe_integration = integration
             customer.save()
@@ -866,31 +1161,9 @@ class StripeConnector(PaymentProcesor):
             return False
 
     def get_customer_address(self, customer, type: Literal["shipping", "billing"]):
-        from metering_billing.models import Address
-
-        stripe_id = customer.stripe_integration.stripe_customer_id
-        key = "address" if type == "billing" else "shipping"
-        cust_dict = cache.get(f"stripe_customer_{stripe_id}")
-        if cust_dict is None:
-            customer_obj = self.retrieve_customer_by_external_id(
-                customer.organization, stripe_id
-            )
-            cust_dict = parse_nested_response(customer_obj)
-            cache.set(
-                f"stripe_customer_{stripe_id}",
-                cust_dict,
-                60 * 60 * 24,
-            )
-        address = cust_dict.get(key, {}) or {}
-        addy = Address(
-            city=address.get("city"),
-            country=address.get("country"),
-            line1=address.get("line1"),
-            line2=address.get("line2"),
-            postal_code=address.get("postal_code"),
-            state=address.get("state"),
-        )
-        return addy
+        if customer.stripe_integration is None:
+            return None
+        return customer.stripe_integration.get_address(type)
 
     def get_organization_address(
         self,
@@ -935,94 +1208,190 @@ class StripeConnector(PaymentProcesor):
 
         return customer
 
+    def _request_kwargs(self, organization):
+        from metering_billing.models import Organization
+
+        request_kwargs = {}
+        if not self.self_hosted:
+            # this is to get "on behalf" of someone
+            request_kwargs[
+                "stripe_account"
+            ] = organization.stripe_integration.stripe_account_id
+        if organization.organization_type == Organization.OrganizationType.PRODUCTION:
+            request_kwargs["api_key"] = self.live_secret_key
+        else:
+            request_kwargs["api_key"] = self.test_secret_key
+        return request_kwargs
+
+    def _list_pages(self, resource, organization, checkpoint_name, **params):
+        """
+        Streams the pages of a Stripe list endpoint. The last object of every page that
+        was processed is checkpointed, so an import that stops halfway resumes after
+        it the next time it runs, and starts over once it has reached the end.
+        """
+        checkpoint_key = (
+            f"stripe_import_{organization.organization_id.hex}_{checkpoint_name}"
+        )
+        starting_after = cache.get(checkpoint_key)
+        while True:
+            if starting_after is not None:
+                params["starting_after"] = starting_after
+            page = resource.list(limit=STRIPE_IMPORT_PAGE_SIZE, **params)
+            if len(page.data) == 0:
+                break
+            yield page.data
+            starting_after = page.data[-1].id
+            cache.set(checkpoint_key, starting_after, STRIPE_IMPORT_CHECKPOINT_TTL)
+            if not page.has_more:
+                break
+        cache.delete(checkpoint_key)
+
     def import_customers(self, organization):
         """
         Imports customers from Stripe. If they already exist (by checking that either they already have their Stripe ID in our system, or seeing that they have the same email address), then we update the Stripe section of payment_providers dict to reflect new information. If they don't exist, we create them (not as a Lotus customer yet, just as a Stripe customer).
         """
+        num_cust_added = 0
+        try:
+            for stripe_customers in self._list_pages(
+                stripe.Customer,
+                organization,
+                "customers",
+                **self._request_kwargs(organization),
+            ):
+                num_cust_added += self._import_customer_page(
+                    organization, stripe_customers
+                )
+                self.update_customer_states(stripe_customers, organization=organization)
+        except Exception as e:
+            logger.error(f"Ran into exception: {e}")
+
+        return num_cust_added
+
+    def _import_customer_page(self, organization, stripe_customers):
         from metering_billing.models import (
             Customer,
-            Organization,
+            PricingUnit,
             StripeCustomerIntegration,
         )
 
-        if organization.organization_type == Organization.OrganizationType.PRODUCTION:
-            stripe.api_key = self.live_secret_key
-        else:
-            stripe.api_key = self.test_secret_key
-
-        num_cust_added = 0
-
-        stripe_cust_kwargs = {}
-        if not self.self_hosted:
-            # this is to get "on behalf" of someone
-            stripe_cust_kwargs[
-                "stripe_account"
-            ] = organization.stripe_integration.stripe_account_id
-        try:
-            stripe_customers_response = stripe.Customer.list(**stripe_cust_kwargs)
-            for stripe_customer in stripe_customers_response.auto_paging_iter():
-                stripe_id = stripe_customer.id
-                stripe_email = stripe_customer.email
-                stripe_name = stripe_customer.name
-                stripe_name = stripe_name if stripe_name else "no_stripe_name"
-                customer = Customer.objects.filter(
-                    Q(stripe_integration__stripe_customer_id=stripe_id)
-                    | (Q(email=stripe_email) & Q(email__isnull=False)),
+        stripe_emails = {x.email for x in stripe_customers if x.email}
+        existing_customers = Customer.objects.filter(
+            Q(
+                stripe_integration__stripe_customer_id__in=[
+                    x.id for x in stripe_customers
+                ]
+            )
+            | Q(email__in=stripe_emails),
+            organization=organization,
+        ).select_related("stripe_integration")
+        customers_by_stripe_id = {}
+        customers_by_email = {}
+        for customer in existing_customers:
+            if customer.stripe_integration:
+                customers_by_stripe_id[
+                    customer.stripe_integration.stripe_customer_id
+                ] = customer
+            if customer.email:
+                customers_by_email[customer.email] = customer
+
+        matched_customers = {}
+        new_stripe_customers = []
+        for stripe_customer in stripe_customers:
+            customer = customers_by_stripe_id.get(stripe_customer.id)
+            if customer is None and stripe_customer.email:
+                customer = customers_by_email.get(stripe_customer.email)
+            if customer is not None:  # customer exists in system already
+                matched_customers[customer.pk] = customer
+            elif stripe_customer.email in customers_by_email:
+                # same email as a customer created from this page
+                continue
+            else:
+                new_stripe_customers.append(stripe_customer)
+                if stripe_customer.email:
+                    customers_by_email[stripe_customer.email] = None
+
+        with transaction.atomic():
+            for customer in matched_customers.values():
+                customer.payment_provider = PAYMENT_PROCESSORS.STRIPE
+            bulk_update_with_history(
+                list(matched_customers.values()), Customer, ["payment_provider"]
+            )
+            if len(new_stripe_customers) == 0:
+                return 0
+            # an earlier run can have stopped between creating the integration and
+            # the customer
+            StripeCustomerIntegration.objects.bulk_create(
+                [
+                    StripeCustomerIntegration(
+                        organization=organization, stripe_customer_id=x.id
+                    )
+                    for x in new_stripe_customers
+                ],
+                ignore_conflicts=True,
+            )
+            integrations = {
+                integration.stripe_customer_id: integration
+                for integration in StripeCustomerIntegration.objects.filter(
                     organization=organization,
+                    stripe_customer_id__in=[x.id for x in new_stripe_customers],
+                )
+            }
+            default_currency = (
+                organization.default_currency
+                or PricingUnit.objects.filter(
+                    code="USD", organization=organization
                 ).first()
-                if customer:  # customer exists in system already
-                    customer.payment_provider = PAYMENT_PROCESSORS.STRIPE
-                    customer.save()
-                else:
-                    stripe_integration = StripeCustomerIntegration.objects.create(
+            )
+            bulk_create_with_history(
+                [
+                    Customer(
                         organization=organization,
-                        stripe_customer_id=stripe_id,
+                        customer_name=x.name if x.name else "no_stripe_name",
+                        email=x.email,
+                        payment_provider=PAYMENT_PROCESSORS.STRIPE,
+                        stripe_integration=integrations[x.id],
+                        default_currency=default_currency,
                     )
-                    customer_kwargs = {
-                        "organization": organization,
-                        "customer_name": stripe_name,
-                        "email": stripe_email,
-                        "payment_provider": PAYMENT_PROCESSORS.STRIPE,
-                        "stripe_integration": stripe_integration,
-                    }
-                    customer = Customer.objects.create(**customer_kwargs)
-                    num_cust_added += 1
-        except Exception as e:
-            logger.error("Ran into exception:", e)
-
-        return num_cust_added
+                    for x in new_stripe_customers
+                ],
+                Customer,
+            )
+        return len(new_stripe_customers)
 
     def import_payment_objects(self, organization):
-        from metering_billing.models import Organization
-
-        if organization.organization_type == Organization.OrganizationType.PRODUCTION:
-            stripe.api_key = self.live_secret_key
-        else:
-            stripe.api_key = self.test_secret_key
-        imported_invoices = {}
-        for customer in organization.customers.all():
-            if customer.stripe_integration:
-                invoices = self._import_payment_objects_for_customer(customer)
-                imported_invoices[customer.customer_id] = invoices
-        return imported_invoices
-
-    def _import_payment_objects_for_customer(self, customer):
-        from metering_billing.models import Invoice
-
-        payload = {}
-        if not self.self_hosted:
-            payload[
-                "stripe_account"
-            ] = customer.organization.stripe_integration.stripe_account_id
-        invoices = stripe.Invoice.list(
-            customer=customer.stripe_integration.stripe_customer_id, **payload
+        imported_invoices = defaultdict(list)
+        for stripe_invoices in self._list_pages(
+            stripe.Invoice,
+            organization,
+            "invoices",
+            **self._request_kwargs(organization),
+        ):
+            for invoice in self._import_invoice_page(organization, stripe_invoices):
+                imported_invoices[invoice.customer.customer_id].append(invoice)
+        return dict(imported_invoices)
+
+    def _import_invoice_page(self, organization, stripe_invoices):
+        from metering_billing.models import Customer, Invoice
+
+        customers = {
+            customer.stripe_integration.stripe_customer_id: customer
+            for customer in Customer.objects.filter(
+                organization=organization,
+                stripe_integration__stripe_customer_id__in={
+                    x.customer for x in stripe_invoices
+                },
+            ).select_related("stripe_integration")
+        }
+        existing_invoice_ids = set(
+            Invoice.objects.filter(
+                organization=organization,
+                external_payment_obj_id__in=[x.id for x in stripe_invoices],
+            ).values_list("external_payment_obj_id", flat=True)
         )
         lotus_invoices = []
-        for stripe_invoice in invoices.auto_paging_iter():
-            if Invoice.objects.filter(
-                organization=customer.organization,
-                external_payment_obj_id=stripe_invoice.id,
-            ).exists():
+        for stripe_invoice in stripe_invoices:
+            customer = customers.get(stripe_invoice.customer)
+            if customer is None or stripe_invoice.id in existing_invoice_ids:
                 continue
             cost_due = Decimal(stripe_invoice.amount_due) / 100
             invoice_kwargs = {
@@ -1035,10 +1404,23 @@ class StripeConnector(PaymentProcesor):
                 "cust_connected_to_payment_provider": True,
                 "external_payment_obj_id": stripe_invoice.id,
                 "external_payment_obj_type": PAYMENT_PROCESSORS.STRIPE,
-                "organization": customer.organization,
+                "organization": organization,
+                "currency": organization.default_currency,
             }
-            lotus_invoice = Invoice.objects.create(**invoice_kwargs)
-            lotus_invoices.append(lotus_invoice)
+            lotus_invoices.append(Invoice(**invoice_kwargs))
+
+        # bulk_create skips Invoice.save, so number the invoices here
+        invoices_by_date = defaultdict(list)
+        for invoice in lotus_invoices:
+            invoices_by_date[invoice.issue_date.date()].append(invoice)
+        with transaction.atomic():
+            for invoices in invoices_by_date.values():
+                invoice_numbers = Invoice.generate_invoice_numbers(
+                    organization, invoices[0].issue_date, n=len(invoices)
+                )
+                for invoice, invoice_number in zip(invoices, invoice_numbers):
+                    invoice.invoice_number = invoice_number
+            bulk_create_with_history(lotus_invoices, Invoice)
         return lotus_invoices
 
     def create_customer_flow(self, customer) -> None:
@@ -1208,24 +1590,14 @@ class StripeConnector(PaymentProcesor):
         from metering_billing.models import (
             Customer,
             ExternalPlanLink,
-            Organization,
             Plan,
             SubscriptionRecord,
         )
 
-        if organization.organization_type == Organization.OrganizationType.PRODUCTION:
-            stripe.api_key = self.live_secret_key
-        else:
-            stripe.api_key = self.test_secret_key
-
-        stripe_cust_kwargs = {}
-        if not self.self_hosted:
-            stripe_cust_kwargs[
-                "stripe_account"
-            ] = organization.stripe_integration.stripe_account_id
+        stripe_cust_kwargs = self._request_kwargs(organization)
 
         stripe_subscriptions = stripe.Subscription.search(
-            query="status:'active'", **stripe_cust_kwargs
+            query="status:'active'", limit=STRIPE_IMPORT_PAGE_SIZE, **stripe_cust_kwargs
         )
         plans_with_links = (
             Plan.objects.filter(organization=organization, status=PLAN_STATUS.ACTIVE)
@@ -1249,66 +1621,84 @@ class StripeConnector(PaymentProcesor):
             (plan_id, external_plan_ids)
             for plan_id, external_plan_ids in plan_dict.items()
         ]
+        billing_plans = Plan.objects.select_related("display_version").in_bulk(
+            plan_dict.keys()
+        )
         ret_subs = []
-        for i, subscription in enumerate(stripe_subscriptions.auto_paging_iter()):
-            if (
-                subscription.cancel_at_period_end
-            ):  # don't transfer subscriptions that are ending
-                continue
-            try:  # if no customer matches, don't transfer
-                customer = Customer.objects.get(
+        subscription_iter = stripe_subscriptions.auto_paging_iter()
+        while True:
+            page = list(itertools.islice(subscription_iter, STRIPE_IMPORT_PAGE_SIZE))
+            if len(page) == 0:
+                break
+            customers = {
+                customer.stripe_integration.stripe_customer_id: customer
+                for customer in Customer.objects.filter(
                     organization=organization,
-                    stripe_integration__stripe_customer_id=subscription.customer,
-                )
-            except Customer.DoesNotExist:
-                continue
-            sub_items = subscription["items"]
-            item_ids = {x["price"]["id"] for x in sub_items["data"]} | {
-                x["price"]["product"] for x in sub_items["data"]
+                    stripe_integration__stripe_customer_id__in={
+                        x.customer for x in page
+                    },
+                ).select_related("stripe_integration")
             }
-            matching_plans = list(filter(lambda x: x[1] & item_ids, lotus_plans))
-            # if no plans match any of the items, don't transfer
-            if len(matching_plans) == 0:
-                continue
-            # great, in this case we transfer the subscription
-            elif len(matching_plans) == 1:
-                billing_plan = Plan.objects.get(id=matching_plans[0][0])
-                # check to see if subscription exists
-                validated_data = {
-                    "organization": organization,
-                    "customer": customer,
-                    "billing_plan": billing_plan.display_version,
-                    "auto_renew": True,
-                    "is_new": False,
+            for subscription in page:
+                if (
+                    subscription.cancel_at_period_end
+                ):  # don't transfer subscriptions that are ending
+                    continue
+                customer = customers.get(subscription.customer)
+                if customer is None:  # if no customer matches, don't transfer
+                    continue
+                sub_items = subscription["items"]
+                item_ids = {x["price"]["id"] for x in sub_items["data"]} | {
+                    x["price"]["product"] for x in sub_items["data"]
                 }
-                if end_now:
-                    validated_data["start_date"] = now_utc()
-                    sub = stripe.Subscription.delete(
-                        subscription.id,
-                        prorate=True,
-                        invoice_now=True,
-                        **stripe_cust_kwargs,
-                    )
-                else:
-                    validated_data["start_date"] = datetime.datetime.utcfromtimestamp(
-                        subscription.current_period_end
-                    ).replace(tzinfo=pytz.utc)
-                    sub = stripe.Subscription.modify(
-                        subscription.id,
-                        cancel_at_period_end=True,
-                        **stripe_cust_kwargs,
-                    )
-                ret_subs.append(sub)
-                SubscriptionRecord.objects.create(**validated_data)
-            else:  # error if multiple plans match
-                err_msg = "Multiple Lotus plans match Stripe subscription {}.".format(
-                    subscription
-                )
-                for plan_id, linked_ids in matching_plans:
-                    err_msg += "Plan {} matches items {}".format(
-                        plan_id, item_ids.intersection(linked_ids)
+                matching_plans = list(filter(lambda x: x[1] & item_ids, lotus_plans))
+                # if no plans match any of the items, don't transfer
+                if len(matching_plans) == 0:
+                    continue
+                # great, in this case we transfer the subscription
+                elif len(matching_plans) == 1:
+                    billing_plan = billing_plans[matching_plans[0][0]]
+                    # check to see if subscription exists
+                    validated_data = {
+                        "organization": organization,
+                        "customer": customer,
+                        "billing_plan": billing_plan.display_version,
+                        "auto_renew": True,
+                        "is_new": False,
+                    }
+                    if end_now:
+                        validated_data["start_date"] = now_utc()
+                        sub = stripe.Subscription.delete(
+                            subscription.id,
+                            prorate=True,
+                            invoice_now=True,
+                            **stripe_cust_kwargs,
+                        )
+                    else:
+                        period_end = datetime.datetime.utcfromtimestamp(
+                            subscription.current_period_end
+                        )
+                        validated_data["start_date"] = period_end.replace(
+                            tzinfo=pytz.utc
+                        )
+                        sub = stripe.Subscription.modify(
+                            subscription.id,
+                            cancel_at_period_end=True,
+                            **stripe_cust_kwargs,
+                        )
+                    ret_subs.append(sub)
+                    SubscriptionRecord.objects.create(**validated_data)
+                else:  # error if multiple plans match
+                    err_msg = (
+                        "Multiple Lotus plans match Stripe subscription {}.".format(
+                            subscription
+                        )
                     )
-                raise ValueError(err_msg)
+                    for plan_id, linked_ids in matching_plans:
+                        err_msg += "Plan {} matches items {}".format(
+                            plan_id, item_ids.intersection(linked_ids)
+                        )
+                    raise ValueError(err_msg)
         return ret_subs
 
     def initialize_settings(self, organization, **kwargs):
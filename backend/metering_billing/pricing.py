@@ -0,0 +1,155 @@
+import bisect
+import math
+from decimal import Decimal
+
+from metering_billing.utils import convert_to_decimal
+
+
+class CompiledTier:
+    """
+    Immutable snapshot of a PriceTier. The arithmetic here is the single source of truth
+    for tier revenue, PriceTier.calculate_revenue delegates to it.
+    """
+
+    __slots__ = (
+        "is_flat",
+        "is_per_unit",
+        "range_start",
+        "range_end",
+        "cost_per_batch",
+        "metric_units_per_batch",
+        "rounding",
+        "discontinuous_range",
+    )
+
+    def __init__(self, tier, prev_tier_end=False):
+        from metering_billing.models import PriceTier
+
+        self.is_flat = tier.type == PriceTier.PriceTierType.FLAT
+        self.is_per_unit = tier.type == PriceTier.PriceTierType.PER_UNIT
+        self.range_start = tier.range_start
+        self.range_end = tier.range_end
+        self.cost_per_batch = tier.cost_per_batch
+        self.metric_units_per_batch = tier.metric_units_per_batch
+        self.rounding = {
+            PriceTier.BatchRoundingType.ROUND_UP: math.ceil,
+            PriceTier.BatchRoundingType.ROUND_DOWN: math.floor,
+            PriceTier.BatchRoundingType.ROUND_NEAREST: round,
+        }.get(tier.batch_rounding_type)
+        self.discontinuous_range = (
+            prev_tier_end != tier.range_start and prev_tier_end is not None
+        )
+
+    def in_range(self, usage: Decimal) -> bool:
+        if self.discontinuous_range:
+            return self.range_start <= usage
+        return self.range_start < usage or self.range_start == 0
+
+    def charge(self, usage: Decimal):
+        if self.is_flat:
+            return self.cost_per_batch
+        elif self.is_per_unit:
+            if self.range_end is not None:
+                billable_units = min(
+                    usage - self.range_start, self.range_end - self.range_start
+                )
+            else:
+                billable_units = usage - self.range_start
+            if self.discontinuous_range:
+                billable_units += 1
+            billable_batches = billable_units / self.metric_units_per_batch
+            if self.rounding is not None:
+                billable_batches = self.rounding(billable_batches)
+            return self.cost_per_batch * billable_batches
+        return 0
+
+    def revenue(self, usage: Decimal):
+        revenue = 0
+        if self.in_range(usage):
+            revenue += self.charge(usage)
+        return revenue
+
+
+class TierSchedule:
+    """
+    Pre-computed pricing schedule for a PlanComponent.
+
+    Tiers are sorted by range_start and the revenue of every bounded tier, when fully
+    consumed, is accumulated up front. Evaluating a usage value then only needs a binary
+    search over the breakpoints plus the arithmetic for the tier the usage falls in, and
+    the additions happen in the same order as summing the tiers one by one, so the
+    Decimal results are identical.
+
+    Two summation modes exist because the callers historically differ: total revenue
+    sums the raw tier revenues and quantizes once, while per-day revenue quantizes every
+    tier before summing (quantize_tiers=True).
+    """
+
+    def __init__(self, tiers):
+        self.tiers = []
+        prev_tier_end = False
+        for tier in sorted(tiers, key=lambda x: x.range_start):
+            self.tiers.append(CompiledTier(tier, prev_tier_end=prev_tier_end))
+            prev_tier_end = tier.range_end
+
+        self.breakpoints = []
+        self._full_revenue = [0]
+        self._full_revenue_quantized = [Decimal(0)]
+        for tier in self.tiers:
+            if tier.range_end is None:
+                break
+            # only used once usage is strictly past range_end, so the tier is in range
+            # and the billable units are capped at the width of the tier
+            tier_revenue = 0
+            tier_revenue += tier.charge(tier.range_end)
+            self.breakpoints.append(tier.range_end)
+            self._full_revenue.append(self._full_revenue[-1] + tier_revenue)
+            self._full_revenue_quantized.append(
+                self._full_revenue_quantized[-1] + convert_to_decimal(tier_revenue)
+            )
+
+    @classmethod
+    def from_plan_component(cls, plan_component):
+        return cls(plan_component.tiers.all())
+
+    def revenue(self, usage, quantize_tiers=False):
+        usage = convert_to_decimal(usage)
+        # number of leading tiers whose range ends strictly below the usage
+        n_full = bisect.bisect_left(self.breakpoints, usage)
+        if quantize_tiers:
+            revenue = self._full_revenue_quantized[n_full]
+        else:
+            revenue = self._full_revenue[n_full]
+        for tier in self.tiers[n_full:]:
+            if tier.range_start > usage:
+                # tiers are sorted, so none of the remaining ones are in range either
+                break
+            tier_revenue = tier.revenue(usage)
+            if quantize_tiers:
+                revenue += convert_to_decimal(tier_revenue)
+            else:
+                revenue += tier_revenue
+        return revenue
+
+    def revenue_many(self, usages, quantize_tiers=False):
+        return [self.revenue(usage, quantize_tiers=quantize_tiers) for usage in usages]
+
+    def total_revenue(self, usage) -> Decimal:
+        return convert_to_decimal(self.revenue(usage))
+
+
+class TierScheduleCache:
+    """
+    Compiles each PlanComponent's schedule once so it can be shared across every
+    subscription record evaluated in the same invoice run or analytics request.
+    """
+
+    def __init__(self):
+        self._schedules = {}
+
+    def get(self, plan_component) -> TierSchedule:
+        schedule = self._schedules.get(plan_component.pk)
+        if schedule is None:
+            schedule = TierSchedule.from_plan_component(plan_component)
+            self._schedules[plan_component.pk] = schedule
+        return schedule
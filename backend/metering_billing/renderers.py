@@ -0,0 +1,112 @@
+import datetime
+import decimal
+import json
+
+import orjson
+from django.db.models.query import QuerySet
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+# DRF escapes these in its JSON so the output can be embedded in a <script> tag
+LINE_SEPARATORS = (
+    ("\u2028".encode(), b"\\u2028"),
+    ("\u2029".encode(), b"\\u2029"),
+)
+
+
+def default(obj):
+    """
+    The types orjson can't encode on its own, handled the same way DRF's JSONEncoder
+    handles them.
+    """
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    elif isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    elif isinstance(obj, Promise):
+        return force_str(obj)
+    elif isinstance(obj, QuerySet):
+        return tuple(obj)
+    elif isinstance(obj, bytes):
+        return obj.decode()
+    elif hasattr(obj, "tolist"):
+        # numpy arrays and scalars
+        return obj.tolist()
+    elif hasattr(obj, "__getitem__"):
+        cls = list if isinstance(obj, (list, tuple)) else dict
+        try:
+            return cls(obj)
+        except Exception:
+            pass
+    elif hasattr(obj, "__iter__"):
+        return tuple(item for item in obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """
+    Encode data to the same bytes JSONRenderer produces without indentation.
+    Datetimes, dates, UUIDs and enums are encoded natively by orjson. Unlike
+    JSONRenderer, NaN and infinity are encoded as null rather than raising, and
+    float exponents are written without a plus sign, e.g. 1e16 for 1e+16.
+    """
+    ret = orjson.dumps(
+        data,
+        default=default,
+        option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS,
+    )
+    for separator, escaped in LINE_SEPARATORS:
+        ret = ret.replace(separator, escaped)
+    return ret
+
+
+def loads(data):
+    """
+    Decode JSON bytes or text with orjson. Invalid input raises a
+    json.JSONDecodeError, like the standard library.
+    """
+    return orjson.loads(data)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson. Indented output, e.g. for the browsable
+    API, falls back to the standard library.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if (
+            self.get_indent(accepted_media_type, renderer_context or {})
+            or self.ensure_ascii
+            or not self.compact
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            return dumps(data)
+        except orjson.JSONEncodeError:
+            # e.g. integers wider than 64 bits, which the standard library handles
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class ORJSONParser(JSONParser):
+    """
+    JSONParser that decodes with orjson. Bodies that aren't UTF-8 fall back to the
+    standard library.
+    """
+
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", "utf-8")
+        if encoding.lower().replace("_", "-") not in ("utf-8", "utf8"):
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return loads(stream.read())
+        except json.JSONDecodeError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
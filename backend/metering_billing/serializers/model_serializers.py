@@ -1966,6 +1966,9 @@ class DraftInvoiceSerializer(InvoiceSerializer):
     line_items = serializers.SerializerMethodField()
 
     def get_line_items(self, obj) -> GroupedLineItemSerializer(many=True):
+        draft_line_items = getattr(obj, "draft_line_items", None)
+        if draft_line_items is not None:
+            return self.get_draft_line_items(draft_line_items)
         associated_subscription_records = (
             obj.line_items.filter(associated_subscription_record__isnull=False)
             .values_list("associated_subscription_record", flat=True)
@@ -1989,6 +1992,28 @@ class DraftInvoiceSerializer(InvoiceSerializer):
         data = GroupedLineItemSerializer(srs, many=True).data
         return data
 
+    def get_draft_line_items(self, draft_line_items):
+        # same grouping as above, for unsaved line items computed in memory
+        grouped = {}
+        for line_item in draft_line_items:
+            sr = line_item.associated_subscription_record
+            if sr is not None:
+                grouped.setdefault(sr.pk, (sr, []))[1].append(line_item)
+        srs = []
+        for sr, line_items in grouped.values():
+            line_items.sort(key=lambda x: (x.name, x.start_date, x.subtotal))
+            grouped_line_item_dict = {
+                "plan_name": sr.billing_plan.plan.plan_name,
+                "subscription_filters": sr.filters.all(),
+                "subtotal": sum(x.subtotal for x in line_items),
+                "start_date": sr.start_date,
+                "end_date": sr.end_date,
+                "sub_items": line_items,
+            }
+            srs.append(grouped_line_item_dict)
+        data = GroupedLineItemSerializer(srs, many=True).data
+        return data
+
 
 class CustomerBalanceAdjustmentSerializer(
     api_serializers.CustomerBalanceAdjustmentSerializer
@@ -1,7 +1,11 @@
+import datetime
+
+from django.conf import settings
 from metering_billing.models import Customer
 from metering_billing.serializers.serializer_utils import (
     SlugRelatedFieldWithOrganization,
 )
+from metering_billing.utils import now_utc
 from metering_billing.utils.enums import (
     ORGANIZATION_SETTING_GROUPS,
     ORGANIZATION_SETTING_NAMES,
@@ -54,3 +58,32 @@ class OrganizationSettingFilterSerializer(serializers.Serializer):
         help_text="Filters organization_settings to a single setting_group. Defaults to returning all settings.",
         choices=ORGANIZATION_SETTING_GROUPS.choices,
     )
+
+
+class EventListFilterSerializer(serializers.Serializer):
+    start_date = serializers.DateTimeField(
+        required=False,
+        help_text=f"Only events created at or after this time. Defaults to {settings.EVENT_BROWSING_WINDOW_DAYS} days before end_date.",
+    )
+    end_date = serializers.DateTimeField(
+        required=False,
+        help_text="Only events created before this time. Defaults to now.",
+    )
+    customer_id = serializers.CharField(
+        required=False, help_text="Only events of the customer with this id."
+    )
+    event_name = serializers.CharField(
+        required=False, help_text="Only events with this event name."
+    )
+
+    def validate(self, data):
+        data = super().validate(data)
+        data.setdefault("end_date", now_utc())
+        data.setdefault(
+            "start_date",
+            data["end_date"]
+            - datetime.timedelta(days=settings.EVENT_BROWSING_WINDOW_DAYS),
+        )
+        if data["start_date"] > data["end_date"]:
+            raise serializers.ValidationError("start_date must be before end_date")
+        return data
@@ -132,6 +132,13 @@ class SlugRelatedFieldWithOrganization(serializers.SlugRelatedField):
             data = OrganizationUUIDField().to_internal_value(data)
         elif self.queryset.model is Invoice:
             data = InvoiceUUIDField().to_internal_value(data)
+        # batch endpoints look up the objects of all their items up front
+        lookup = self.context.get("slug_lookups", {}).get(self.queryset.model)
+        if lookup is not None:
+            key = data if isinstance(data, uuid.UUID) else str(data)
+            if key not in lookup:
+                self.fail("does_not_exist", slug_name=self.slug_field, value=key)
+            return lookup[key]
         return super().to_internal_value(data)
 
     def to_representation(self, obj):
@@ -253,6 +260,12 @@ class InvoiceUUIDField(UUIDPrefixField):
         super().__init__("invoice_", *args, **kwargs)
 
 
+@extend_schema_field(serializers.RegexField(regex=r"invjob_[0-9a-f]{32}"))
+class InvoicingJobUUIDField(UUIDPrefixField):
+    def __init__(self, *args, **kwargs):
+        super().__init__("invjob_", *args, **kwargs)
+
+
 @extend_schema_field(serializers.RegexField(regex=r"plan_version_[0-9a-f]{32}"))
 class PlanVersionUUIDField(UUIDPrefixField):
     def __init__(self, *args, **kwargs):
@@ -1,35 +1,31 @@
 import logging
-from decimal import Decimal, InvalidOperation
+from collections import Counter, defaultdict
+from datetime import timedelta
 
-import pytz
+import sentry_sdk
 from celery import shared_task
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import F, Min, Q
 from metering_billing.payment_processors import PAYMENT_PROCESSOR_MAP
-from metering_billing.serializers.backtest_serializers import (
-    AllSubstitutionResultsSerializer,
-)
-from metering_billing.serializers.serializer_utils import PlanVersionUUIDField
-from metering_billing.utils import (
-    date_as_max_dt,
-    date_as_min_dt,
-    dates_bwn_two_dts,
-    make_all_dates_times_strings,
-    make_all_datetimes_dates,
-    make_all_decimals_floats,
-    now_utc,
-)
+from metering_billing.utils import now_utc
 from metering_billing.utils.enums import (
     BACKTEST_STATUS,
     CUSTOMER_BALANCE_ADJUSTMENT_STATUS,
+    INVOICING_JOB_STATUS,
+    PAYMENT_PROCESSORS,
 )
-from metering_billing.webhooks import invoice_past_due_webhook
+from metering_billing.webhooks import invoice_paid_webhook, invoice_past_due_webhook
+from simple_history.utils import bulk_update_with_history
 
 logger = logging.getLogger("django.server")
 EVENT_CACHE_FLUSH_COUNT = settings.EVENT_CACHE_FLUSH_COUNT
 EVENT_CACHE_FLUSH_SECONDS = settings.EVENT_CACHE_FLUSH_SECONDS
 POSTHOG_PERSON = settings.POSTHOG_PERSON
+BILLING_RUN_CHUNK_SIZE = settings.BILLING_RUN_CHUNK_SIZE
+BILLING_RUN_MAX_RETRIES = settings.BILLING_RUN_MAX_RETRIES
+BALANCE_ADJUSTMENT_EXPIRY_BATCH_SIZE = settings.BALANCE_ADJUSTMENT_EXPIRY_BATCH_SIZE
 
 
 @shared_task
@@ -53,50 +49,235 @@ def generate_invoice_pdf_async(invoice_pk):
     invoice.save()
 
 
-@shared_task
-def calculate_invoice():
+def calculate_invoice_inner(synchronous=False):
     # GENERAL PHILOSOPHY: this task is for periodic maintenance of ending susbcriptions. We only end and re-start subscriptions when they're scheduled to end, if for some other reason they end early then it is up to the other process to handle the invoice creationg and .
-    # get ending subs
-
-    from metering_billing.invoice import generate_invoice
-    from metering_billing.models import Invoice, SubscriptionRecord
+    # the due customers are split into chunks that are billed in parallel by the workers
+    from metering_billing.models import BillingRun, SubscriptionRecord
 
     now_minus_30 = now_utc() + relativedelta(
         minutes=-30
     )  # grace period of 30 minutes for sending events
-    sub_records_to_bill = SubscriptionRecord.objects.filter(
-        (Q(end_date__lt=now_minus_30) | Q(next_billing_date__lt=now_minus_30))
-        & Q(fully_billed=False),
+    customer_pks = list(
+        SubscriptionRecord.objects.due_for_billing(now_minus_30)
+        .order_by("customer_id")
+        .values_list("customer_id", flat=True)
+        .distinct()
+    )
+    chunks = [
+        customer_pks[i : i + BILLING_RUN_CHUNK_SIZE]
+        for i in range(0, len(customer_pks), BILLING_RUN_CHUNK_SIZE)
+    ]
+    billing_run = BillingRun.objects.create(
+        due_before=now_minus_30,
+        total_customers=len(customer_pks),
+        total_chunks=len(chunks),
     )
+    if len(chunks) == 0:
+        billing_run.finish_if_done()
+    for chunk in chunks:
+        if synchronous:
+            run_billing_chunk_inner(billing_run.pk, chunk)
+        else:
+            run_billing_chunk.delay(billing_run.pk, chunk)
+    return billing_run
+
+
+@shared_task
+def calculate_invoice():
+    calculate_invoice_inner()
+    retry_stale_invoicing_jobs()
+
 
-    # now generate invoices and new subs
-    cust_info = sub_records_to_bill.values_list("customer", "organization").distinct()
-    for customer_id, organization_id in cust_info:
-        customer_subscription_records = sub_records_to_bill.filter(
-            customer_id=customer_id
+def run_invoicing_job_inner(invoicing_job_pk):
+    from metering_billing.invoice import generate_invoice
+    from metering_billing.models import Invoice, InvoicingJob, SubscriptionRecord
+    from metering_billing.taxes import TaxRateService
+
+    with transaction.atomic():
+        invoicing_job = (
+            InvoicingJob.objects.select_for_update(skip_locked=True)
+            .filter(pk=invoicing_job_pk, status=INVOICING_JOB_STATUS.PENDING)
+            .first()
         )
-        # Generate the invoice
-        try:
-            generate_invoice(
-                customer_subscription_records,
-                charge_next_plan=True,
-                generate_next_subscription_record=True,
+        if invoicing_job is None:
+            # already invoiced, or being invoiced by another worker
+            return None
+        # records invoiced by someone else since the job was created, e.g. a billing
+        # run, are left out, and so are the ones a billing run is invoicing right now
+        invoiced_since = (
+            Invoice.objects.filter(
+                issue_date__gte=invoicing_job.created,
+                subscription_records__isnull=False,
+            )
+            .exclude(payment_status=Invoice.PaymentStatus.DRAFT)
+            .values("subscription_records")
+        )
+        subscription_records = list(
+            SubscriptionRecord.objects.filter(
+                pk__in=invoicing_job.subscription_records.values("pk"),
+                fully_billed=False,
             )
-            now = now_utc()
+            .exclude(pk__in=invoiced_since)
+            .select_for_update(skip_locked=True)
+        )
+        customer_subscription_records = defaultdict(list)
+        for subscription_record in subscription_records:
+            customer_subscription_records[subscription_record.customer_id].append(
+                subscription_record
+            )
+        invoices = []
+        errors = {}
+        tax_rates = TaxRateService()
+        for srs in customer_subscription_records.values():
+            # one customer's failure leaves the others invoiced, its records are
+            # picked up by the billing run once the job isn't pending anymore
+            try:
+                with transaction.atomic():
+                    invoices.extend(generate_invoice(srs, tax_rates=tax_rates) or [])
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+                errors[srs[0].customer.customer_id] = str(e)
+        invoicing_job.invoices.add(*invoices)
+        invoicing_job.errors = errors
+        invoicing_job.status = (
+            INVOICING_JOB_STATUS.FAILED
+            if len(errors) > 0 and len(errors) == len(customer_subscription_records)
+            else INVOICING_JOB_STATUS.COMPLETED
+        )
+        invoicing_job.completed_at = now_utc()
+        invoicing_job.save()
+    return invoicing_job
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def run_invoicing_job(self, invoicing_job_pk):
+    from metering_billing.models import InvoicingJob
+
+    try:
+        run_invoicing_job_inner(invoicing_job_pk)
+    except Exception as e:
+        invoicing_jobs = InvoicingJob.objects.filter(pk=invoicing_job_pk)
+        invoicing_jobs.update(attempts=F("attempts") + 1)
+        if self.request.retries >= self.max_retries:
+            invoicing_jobs.update(status=INVOICING_JOB_STATUS.FAILED)
+            raise e
+        raise self.retry(exc=e)
+
+
+def retry_stale_invoicing_jobs():
+    from metering_billing.invoice import enqueue_invoicing_job
+    from metering_billing.models import InvoicingJob
+
+    # jobs whose enqueue was lost, e.g. because the broker was unreachable
+    stale = now_utc() - relativedelta(minutes=30)
+    for invoicing_job_pk in InvoicingJob.objects.filter(
+        status=INVOICING_JOB_STATUS.PENDING, created__lt=stale
+    ).values_list("pk", flat=True):
+        enqueue_invoicing_job(invoicing_job_pk)
+
+
+def bill_customer(customer_pk, due_before, invoice_number_pool=None, tax_rates=None):
+    """
+    Invoice the due subscription records of a customer. The records are claimed with
+    FOR UPDATE SKIP LOCKED, so if an overlapping run is already billing any of them the
+    customer is left to that run and False is returned.
+    """
+    from metering_billing.invoice import generate_invoice
+    from metering_billing.models import Invoice, InvoicingJob, SubscriptionRecord
+
+    # records waiting on an invoicing job are invoiced by that job
+    scheduled = InvoicingJob.subscription_records.through.objects.filter(
+        invoicingjob__status=INVOICING_JOB_STATUS.PENDING
+    ).values("subscriptionrecord_id")
+    due_subscription_records = (
+        SubscriptionRecord.objects.due_for_billing(due_before)
+        .filter(customer_id=customer_pk)
+        .exclude(pk__in=scheduled)
+    )
+    with transaction.atomic():
+        customer_subscription_records = list(
+            due_subscription_records.select_for_update(skip_locked=True)
+        )
+        if len(customer_subscription_records) == 0:
+            return False
+        if len(customer_subscription_records) != due_subscription_records.count():
+            # only got part of the customer, the rest is locked by another run
+            return False
+        generate_invoice(
+            customer_subscription_records,
+            charge_next_plan=True,
+            generate_next_subscription_record=True,
+            invoice_number_pool=invoice_number_pool,
+            tax_rates=tax_rates,
+        )
+    now = now_utc()
+    # delete draft invoices
+    Invoice.objects.filter(
+        issue_date__lt=now,
+        payment_status=Invoice.PaymentStatus.DRAFT,
+        customer_id=customer_pk,
+    ).delete()
+    return True
+
+
+def run_billing_chunk_inner(billing_run_pk, customer_pks, final_attempt=True):
+    from metering_billing.invoice import InvoiceNumberPool
+    from metering_billing.models import BillingRun, Customer
+    from metering_billing.taxes import TaxRateService
+
+    billing_run = BillingRun.objects.get(pk=billing_run_pk)
+    # reserve the chunk's invoice numbers up front, outside the invoicing transactions
+    invoice_number_pool = InvoiceNumberPool()
+    organization_counts = Counter(
+        Customer.objects.filter(pk__in=customer_pks).values_list(
+            "organization_id", flat=True
+        )
+    )
+    issue_date = now_utc()
+    for organization_pk, n in organization_counts.items():
+        invoice_number_pool.reserve(organization_pk, issue_date, n)
+    # customers sharing an address and tax code share a single rate lookup
+    tax_rates = TaxRateService()
+    invoiced, skipped, failed = 0, 0, []
+    for customer_pk in customer_pks:
+        try:
+            if bill_customer(
+                customer_pk,
+                billing_run.due_before,
+                invoice_number_pool=invoice_number_pool,
+                tax_rates=tax_rates,
+            ):
+                invoiced += 1
+            else:
+                skipped += 1
         except Exception as e:
             logger.error(
-                "Error generating invoice for subscription records {}. Error was {}".format(
-                    [str(x) for x in customer_subscription_records], e
+                "Error generating invoice for customer {} in billing run {}. Error was {}".format(
+                    customer_pk, billing_run.billing_run_id, e
                 )
             )
-            continue
-        # delete draft invoices
-        Invoice.objects.filter(
-            issue_date__lt=now,
-            payment_status=Invoice.PaymentStatus.DRAFT,
-            customer_id=customer_id,
-            organization_id=organization_id,
-        ).delete()
+            failed.append(customer_pk)
+    if len(failed) > 0 and not final_attempt:
+        billing_run.record_progress(invoiced=invoiced, skipped=skipped, retried=True)
+    else:
+        billing_run.record_progress(
+            invoiced=invoiced,
+            skipped=skipped,
+            failed=len(failed),
+            chunk_completed=True,
+        )
+    return failed
+
+
+@shared_task(bind=True, max_retries=BILLING_RUN_MAX_RETRIES, default_retry_delay=60)
+def run_billing_chunk(self, billing_run_pk, customer_pks):
+    final_attempt = self.request.retries >= self.max_retries
+    failed = run_billing_chunk_inner(
+        billing_run_pk, customer_pks, final_attempt=final_attempt
+    )
+    if len(failed) > 0 and not final_attempt:
+        # only the customers that failed are retried
+        raise self.retry(args=(billing_run_pk, failed))
 
 
 def refresh_alerts_inner():
@@ -107,16 +288,62 @@ def refresh_alerts_inner():
     UsageAlertResult.objects.filter(subscription_record__end_date__lt=now).delete()
     alert_results = UsageAlertResult.objects.filter(
         subscription_record__end_date__gte=now
-    ).prefetch_related("alert", "subscription_record", "alert__metric")
-    for alert_result in alert_results:
-        alert_result.refresh()
+    ).select_related(
+        "organization",
+        "alert__metric__organization",
+        "subscription_record__customer",
+        "subscription_record__billing_plan__plan",
+    )
+    UsageAlertResult.refresh_many(alert_results)
 
 
 @shared_task
 def refresh_alerts():
+    # safety net for the event-driven evaluation in refresh_alerts_for_usage_changes
     refresh_alerts_inner()
 
 
+def refresh_alerts_for_usage_changes_inner(usage_changes):
+    """
+    Re-evaluate only the alert results that the ingested events can have moved: the
+    ones of the given customers on metrics tracking the given event names.
+    """
+    from metering_billing.models import UsageAlertResult
+
+    changes_by_org = {}
+    for organization_pk, customer_id, event_name in usage_changes:
+        changes_by_org.setdefault(organization_pk, set()).add((customer_id, event_name))
+    now = now_utc()
+    for organization_pk, changes in changes_by_org.items():
+        alert_results = UsageAlertResult.objects.filter(
+            organization_id=organization_pk,
+            subscription_record__end_date__gte=now,
+            subscription_record__customer__customer_id__in={x[0] for x in changes},
+            alert__metric__event_name__in={x[1] for x in changes},
+        ).select_related(
+            "organization",
+            "alert__metric__organization",
+            "subscription_record__customer",
+            "subscription_record__billing_plan__plan",
+        )
+        UsageAlertResult.refresh_many(
+            [
+                alert_result
+                for alert_result in alert_results
+                if (
+                    alert_result.subscription_record.customer.customer_id,
+                    alert_result.alert.metric.event_name,
+                )
+                in changes
+            ]
+        )
+
+
+@shared_task
+def refresh_alerts_for_usage_changes(usage_changes):
+    refresh_alerts_for_usage_changes_inner(usage_changes)
+
+
 def prune_guard_table_inner():
     from metering_billing.models import IdempotenceCheck
 
@@ -130,331 +357,232 @@ def prune_guard_table():
     prune_guard_table_inner()
 
 
-@shared_task
-def zero_out_expired_balance_adjustments():
-    from metering_billing.models import CustomerBalanceAdjustment
+def zero_out_expired_balance_adjustments_inner(now=None, batch_size=None):
+    """
+    Offsets the remaining credit of every expired grant, batch_size grants at a time.
+    Each batch locks the affected credit balances and grants, bulk inserts the
+    offsetting debits, closes the grants and moves the running balances, in a handful
+    of statements regardless of how many grants expired.
+    """
+    from metering_billing.models import (
+        CustomerBalanceAdjustment,
+        CustomerCreditBalance,
+    )
 
-    now = now_utc()
-    expired_balance_adjustments = CustomerBalanceAdjustment.objects.filter(
+    now = now or now_utc()
+    batch_size = batch_size or BALANCE_ADJUSTMENT_EXPIRY_BATCH_SIZE
+    expired_filter = Q(
         expires_at__lt=now,
         amount__gt=0,
         status=CUSTOMER_BALANCE_ADJUSTMENT_STATUS.ACTIVE,
     )
-    for ba in expired_balance_adjustments:
-        ba.zero_out(reason="expired")
+    # (customer, created) is unique, so every offset written by this run gets its own
+    # microsecond
+    n_created = 0
+    last_pk = 0
+    while True:
+        candidates = list(
+            CustomerBalanceAdjustment.objects.filter(expired_filter, pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", "organization_id", "customer_id", "pricing_unit_id")[
+                :batch_size
+            ]
+        )
+        if len(candidates) == 0:
+            break
+        last_pk = candidates[-1][0]
+        balance_keys = {
+            (customer_id, pricing_unit_id): organization_id
+            for _, organization_id, customer_id, pricing_unit_id in candidates
+        }
+        with transaction.atomic():
+            # balances before grants, the same order as every other ledger writer
+            credit_balances = {
+                (balance.customer_id, balance.pricing_unit_id): balance
+                for balance in CustomerCreditBalance.objects.select_for_update()
+                .filter(customer_id__in={key[0] for key in balance_keys})
+                .order_by("pk")
+            }
+            for key, organization_id in balance_keys.items():
+                if key not in credit_balances:
+                    credit_balances[key] = CustomerCreditBalance.lock(
+                        organization_id, *key
+                    )
+            expired_adjustments = list(
+                CustomerBalanceAdjustment.objects.select_for_update()
+                .filter(expired_filter, pk__in=[x[0] for x in candidates])
+                .order_by("pk")
+            )
+            offsets = []
+            for adjustment in expired_adjustments:
+                remaining_balance = adjustment.get_remaining_balance()
+                if remaining_balance <= 0:
+                    continue
+                created = now + timedelta(microseconds=n_created)
+                n_created += 1
+                fmt = adjustment.expires_at.strftime("%Y-%m-%d %H:%M")
+                offsets.append(
+                    CustomerBalanceAdjustment(
+                        organization_id=adjustment.organization_id,
+                        customer_id=adjustment.customer_id,
+                        amount=-remaining_balance,
+                        pricing_unit_id=adjustment.pricing_unit_id,
+                        parent_adjustment=adjustment,
+                        description=f"Expiring remaining credit at {fmt} UTC",
+                        created=created,
+                        effective_at=created,
+                    )
+                )
+                credit_balances[
+                    (adjustment.customer_id, adjustment.pricing_unit_id)
+                ].balance -= remaining_balance
+            CustomerBalanceAdjustment.objects.bulk_create(offsets)
+            CustomerBalanceAdjustment.objects.filter(
+                pk__in=[adjustment.pk for adjustment in expired_adjustments]
+            ).update(
+                status=CUSTOMER_BALANCE_ADJUSTMENT_STATUS.INACTIVE,
+                remaining_balance=0,
+            )
+            next_expiries = {
+                (x["customer_id"], x["pricing_unit_id"]): x["next_expiry"]
+                for x in CustomerBalanceAdjustment.objects.filter(
+                    customer_id__in={key[0] for key in balance_keys},
+                    status=CUSTOMER_BALANCE_ADJUSTMENT_STATUS.ACTIVE,
+                    remaining_balance__gt=0,
+                )
+                .order_by()
+                .values("customer_id", "pricing_unit_id")
+                .annotate(next_expiry=Min("expires_at"))
+            }
+            for key, credit_balance in credit_balances.items():
+                credit_balance.next_expiry = next_expiries.get(key)
+            CustomerCreditBalance.objects.bulk_update(
+                credit_balances.values(), ["balance", "next_expiry"]
+            )
+        if len(candidates) < batch_size:
+            break
 
 
 @shared_task
-def update_invoice_status():
+def zero_out_expired_balance_adjustments():
+    zero_out_expired_balance_adjustments_inner()
+
+
+def update_invoice_status_inner():
+    """
+    Polls the payment processors for the status of every open invoice. Invoices are
+    grouped by processor and organization so each group is one bulk lookup, and the
+    ones that were paid are written back together.
+    """
     from metering_billing.models import Invoice
 
+    working_processors = [
+        pp for pp, connector in PAYMENT_PROCESSOR_MAP.items() if connector.working()
+    ]
     incomplete_invoices = Invoice.objects.filter(
-        Q(payment_status=Invoice.PaymentStatus.UNPAID),
+        payment_status=Invoice.PaymentStatus.UNPAID,
         external_payment_obj_id__isnull=False,
-    )
-    for incomplete_invoice in incomplete_invoices:
-        pp = incomplete_invoice.external_payment_obj_type
-        if pp in PAYMENT_PROCESSOR_MAP and PAYMENT_PROCESSOR_MAP[pp].working():
-            organization = incomplete_invoice.organization
-            status = PAYMENT_PROCESSOR_MAP[pp].update_payment_object_status(
-                organization, incomplete_invoice.external_payment_obj_id
+        external_payment_obj_type__in=working_processors,
+    ).select_related("organization")
+    invoice_groups = defaultdict(list)
+    for invoice in incomplete_invoices.iterator():
+        invoice_groups[
+            (invoice.external_payment_obj_type, invoice.organization_id)
+        ].append(invoice)
+
+    paid_invoices = []
+    for (pp, _), invoices in invoice_groups.items():
+        organization = invoices[0].organization
+        try:
+            statuses = PAYMENT_PROCESSOR_MAP[pp].update_payment_object_statuses(
+                organization,
+                [invoice.external_payment_obj_id for invoice in invoices],
+                created_at={
+                    invoice.external_payment_obj_id: invoice.issue_date
+                    for invoice in invoices
+                },
             )
-            if status == Invoice.PaymentStatus.PAID:
-                incomplete_invoice.payment_status = Invoice.PaymentStatus.PAID
-                incomplete_invoice.save()
+        except Exception as e:
+            logger.error(
+                f"Could not update {pp} invoice statuses for {organization}: {e}"
+            )
+            continue
+        for invoice in invoices:
+            if (
+                statuses.get(invoice.external_payment_obj_id)
+                == Invoice.PaymentStatus.PAID
+            ):
+                invoice.payment_status = Invoice.PaymentStatus.PAID
+                paid_invoices.append(invoice)
+
+    with transaction.atomic():
+        bulk_update_with_history(
+            paid_invoices, Invoice, ["payment_status"], batch_size=1000
+        )
+        for invoice in paid_invoices:
+            if invoice.cost_due > 0:
+                invoice_paid_webhook(invoice, invoice.organization)
+    return paid_invoices
+
+
+@shared_task
+def update_invoice_status():
+    update_invoice_status_inner()
+
+
+def run_backtest_inner(backtest_id, synchronous=False):
+    # every substitution is evaluated by its own task, the last one to finish
+    # combines the results
+    from metering_billing.backtests import finish_backtest_if_done
+    from metering_billing.models import Backtest
+
+    backtest = Backtest.objects.get(backtest_id=backtest_id)
+    substitution_pks = list(
+        backtest.backtest_substitutions.values_list("pk", flat=True)
+    )
+    logger.info(f"Running backtest for {len(substitution_pks)} substitutions")
+    if len(substitution_pks) == 0:
+        return finish_backtest_if_done(backtest.pk)
+    for substitution_pk in substitution_pks:
+        if synchronous:
+            run_backtest_substitution_inner(substitution_pk)
+        else:
+            run_backtest_substitution.delay(substitution_pk)
+    return backtest
 
 
 @shared_task
 def run_backtest(backtest_id):
-    from metering_billing.models import Backtest, PlanComponent, SubscriptionRecord
+    run_backtest_inner(backtest_id)
+
 
+def run_backtest_substitution_inner(substitution_pk):
+    from metering_billing.backtests import (
+        compute_substitution_results,
+        finish_backtest_if_done,
+    )
+    from metering_billing.models import Backtest, BacktestSubstitution
+
+    substitution = BacktestSubstitution.objects.select_related(
+        "backtest__organization"
+    ).get(pk=substitution_pk)
     try:
-        backtest = Backtest.objects.get(backtest_id=backtest_id)
-        backtest_substitutions = backtest.backtest_substitutions.all()
-        queries = [Q(billing_plan=x.original_plan) for x in backtest_substitutions]
-        query = queries.pop()
-        start_date = date_as_min_dt(backtest.start_date, timezone=pytz.UTC)
-        end_date = date_as_max_dt(backtest.end_date, timezone=pytz.UTC)
-        for item in queries:
-            query |= item
-        all_subs_time_period = (
-            SubscriptionRecord.objects.filter(
-                query,
-                start_date__lte=end_date,
-                end_date__gte=start_date,
-                end_date__lte=end_date,
-                organization=backtest.organization,
-            )
-            .prefetch_related("billing_plan")
-            .prefetch_related("billing_plan__plan_components")
-        )
-        all_results = {
-            "substitution_results": [],
-        }
-        logger.info(f"Running backtest for {len(backtest_substitutions)} substitutions")
-        for subst in backtest_substitutions:
-            outer_results = {
-                "substitution_name": f"{str(subst.original_plan)} --> {str(subst.new_plan)}",
-                "original_plan": {
-                    "plan_name": str(subst.original_plan),
-                    "plan_id": PlanVersionUUIDField().to_representation(
-                        subst.original_plan.version_id
-                    ),
-                    "plan_revenue": Decimal(0),
-                },
-                "new_plan": {
-                    "plan_name": str(subst.new_plan),
-                    "plan_id": PlanVersionUUIDField().to_representation(
-                        subst.new_plan.version_id
-                    ),
-                    "plan_revenue": Decimal(0),
-                },
-            }
-            # since we can have at most one new plan per old plan, the old plan uniquely
-            # identifies the substitutiont
-            subst_subscriptions = all_subs_time_period.filter(
-                billing_plan=subst.original_plan
-            )
-            inner_results = {
-                "cumulative_revenue": {},
-                "revenue_by_metric": {},
-                "top_customers": {},
-            }
-            for sub in subst_subscriptions:
-                # create if not seen
-                customer = sub.customer
-                if customer not in inner_results["top_customers"]:
-                    inner_results["top_customers"][customer] = {
-                        "original_plan_revenue": Decimal(0),
-                        "new_plan_revenue": Decimal(0),
-                    }
-                end_date = sub.end_date
-                if end_date not in inner_results["cumulative_revenue"]:
-                    inner_results["cumulative_revenue"][end_date] = {
-                        "original_plan_revenue": Decimal(0),
-                        "new_plan_revenue": Decimal(0),
-                    }
-                ## PROCESS OLD SUB
-                old_usage_revenue = sub.get_usage_and_revenue()
-                # cumulative revenue
-                inner_results["cumulative_revenue"][end_date][
-                    "original_plan_revenue"
-                ] += old_usage_revenue["total_amount_due"]
-                # customer revenue
-                inner_results["top_customers"][customer][
-                    "original_plan_revenue"
-                ] += old_usage_revenue["total_amount_due"]
-                # per metric
-                for component_pk, component_dict in old_usage_revenue["components"]:
-                    metric = PlanComponent.objects.get(pk=component_pk).billable_metric
-                    metric_name = metric.billable_metric_name
-                    if metric_name not in inner_results["revenue_by_metric"]:
-                        inner_results["revenue_by_metric"][metric_name] = {
-                            "original_plan_revenue": Decimal(0),
-                            "new_plan_revenue": Decimal(0),
-                        }
-                    inner_results["revenue_by_metric"][metric_name][
-                        "original_plan_revenue"
-                    ] += component_dict["revenue"]
-                if "flat_fees" not in inner_results["revenue_by_metric"]:
-                    inner_results["revenue_by_metric"]["flat_fees"] = {
-                        "original_plan_revenue": Decimal(0),
-                        "new_plan_revenue": Decimal(0),
-                    }
-                inner_results["revenue_by_metric"]["flat_fees"][
-                    "original_plan_revenue"
-                ] += old_usage_revenue["flat_amount_due"]
-                ## PROCESS NEW SUB
-                sub.billing_plan = subst.new_plan
-                sub.save()
-                new_usage_revenue = sub.get_usage_and_revenue()
-                # revert it so we don't accidentally change the past lol
-                sub.billing_plan = subst.original_plan
-                sub.save()
-                # cumulative revenue
-                inner_results["cumulative_revenue"][end_date][
-                    "new_plan_revenue"
-                ] += new_usage_revenue["total_amount_due"]
-                # customer revenue
-                inner_results["top_customers"][customer][
-                    "new_plan_revenue"
-                ] += new_usage_revenue["total_amount_due"]
-                # per metric
-                for component_pk, component_dict in new_usage_revenue["components"]:
-                    metric = PlanComponent.objects.get(pk=component_pk).billable_metric
-                    metric_name = metric.billable_metric_name
-                    if metric_name not in inner_results["revenue_by_metric"]:
-                        inner_results["revenue_by_metric"][metric_name] = {
-                            "new_plan_revenue": Decimal(0),
-                            "original_plan_revenue": Decimal(0),
-                        }
-                    inner_results["revenue_by_metric"][metric_name][
-                        "new_plan_revenue"
-                    ] += component_dict["revenue"]
-                inner_results["revenue_by_metric"]["flat_fees"][
-                    "new_plan_revenue"
-                ] += new_usage_revenue["flat_amount_due"]
-            # change cumulative revenue to be cumulative and in fronted format
-            cum_rev_dict_list = []
-            cum_rev = inner_results.pop("cumulative_revenue")
-            cum_rev_lst = sorted(cum_rev.items(), key=lambda x: x[0], reverse=True)
-            date_cumrev_list = []
-            for date, cum_rev_dict in cum_rev_lst:
-                date_cumrev_list.append((date.date(), cum_rev_dict))
-            cum_rev_lst = date_cumrev_list
-            try:
-                every_date = list(
-                    dates_bwn_two_dts(cum_rev_lst[-1][0], cum_rev_lst[0][0])
-                )
-            except IndexError:
-                every_date = []
-            if cum_rev_lst:
-                date, rev_dict = cum_rev_lst.pop(-1)
-                last_dict = {**rev_dict, "date": date}
-            else:
-                rev_dict = {}
-            for date in every_date:
-                if (
-                    date < cum_rev_lst[-1][0]
-                ):  # have not reached the next data point yet, dont add
-                    new_dict = last_dict.copy()
-                    new_dict["date"] = date
-                elif (
-                    date == cum_rev_lst[-1][0]
-                ):  # have reached the next data point, add it
-                    date, rev_dict = cum_rev_lst.pop()
-                    new_dict = {**rev_dict, "date": date}
-                    new_dict["original_plan_revenue"] += last_dict[
-                        "original_plan_revenue"
-                    ]
-                    new_dict["new_plan_revenue"] += last_dict["new_plan_revenue"]
-                    last_dict = new_dict
-                else:
-                    raise Exception("should not be greater than the most recent date")
-                cum_rev_dict_list.append(new_dict)
-            inner_results["cumulative_revenue"] = cum_rev_dict_list
-            # change metric revenue to be in frontend format
-            metric_rev = inner_results.pop("revenue_by_metric")
-            metric_rev = [
-                {**rev_dict, "metric_name": metric_name}
-                for metric_name, rev_dict in metric_rev.items()
-            ]
-            inner_results["revenue_by_metric"] = metric_rev
-            # change top customers to be in frontend format
-            top_cust_dict = {}
-            top_cust = inner_results.pop("top_customers")
-            top_original = sorted(
-                top_cust.items(),
-                key=lambda x: x[1]["original_plan_revenue"],
-                reverse=True,
-            )[:5]
-            top_cust_dict["original_plan_revenue"] = [
-                {
-                    "customer_id": customer.customer_id,
-                    "customer_name": customer.customer_name,
-                    "value": rev_dict.get("original_plan_revenue", 0),
-                }
-                for customer, rev_dict in top_original
-            ]
-            top_new = sorted(
-                top_cust.items(), key=lambda x: x[1]["new_plan_revenue"], reverse=True
-            )[:5]
-            top_cust_dict["new_plan_revenue"] = [
-                {
-                    "customer_id": customer.customer_id,
-                    "customer_name": customer.customer_name,
-                    "value": rev_dict.get("new_plan_revenue", 0),
-                }
-                for customer, rev_dict in top_new
-            ]
-            all_pct_change = []
-            for customer, rev_dict in top_cust.items():
-                try:
-                    pct_change = (
-                        rev_dict.get("new_plan_revenue", 0)
-                        / rev_dict.get("original_plan_revenue", 0)
-                        - 1
-                    )
-                except ZeroDivisionError:
-                    pct_change = None
-                all_pct_change.append((customer, pct_change))
-            all_pct_change = sorted(
-                [tup for tup in all_pct_change if tup[1] is not None],
-                key=lambda x: x[1],
-            )
-            top_cust_dict["biggest_pct_increase"] = [
-                {
-                    "customer_id": customer.customer_id,
-                    "customer_name": customer.customer_name,
-                    "value": pct_change,
-                }
-                for customer, pct_change in all_pct_change[-5:]
-            ][::-1]
-            top_cust_dict["biggest_pct_decrease"] = [
-                {
-                    "customer_id": customer.customer_id,
-                    "customer_name": customer.customer_name,
-                    "value": pct_change,
-                }
-                for customer, pct_change in all_pct_change[:5]
-            ]
-            inner_results["top_customers"] = top_cust_dict
-            # now add the inner results to the outer results
-            outer_results["results"] = inner_results
-            try:
-                outer_results["original_plan"]["plan_revenue"] = inner_results[
-                    "cumulative_revenue"
-                ][-1]["original_plan_revenue"]
-            except IndexError:
-                outer_results["original_plan"]["plan_revenue"] = Decimal(0)
-            try:
-                outer_results["new_plan"]["plan_revenue"] = inner_results[
-                    "cumulative_revenue"
-                ][-1]["new_plan_revenue"]
-            except IndexError:
-                outer_results["new_plan"]["plan_revenue"] = Decimal(0)
-            try:
-                outer_results["pct_revenue_change"] = (
-                    outer_results["new_plan"]["plan_revenue"]
-                    / outer_results["original_plan"]["plan_revenue"]
-                    - 1
-                )
-            except (ZeroDivisionError, InvalidOperation):
-                outer_results["pct_revenue_change"] = None
-            all_results["substitution_results"].append(outer_results)
-        all_results["original_plans_revenue"] = sum(
-            x["original_plan"]["plan_revenue"]
-            for x in all_results["substitution_results"]
-        )
-        all_results["new_plans_revenue"] = sum(
-            x["new_plan"]["plan_revenue"] for x in all_results["substitution_results"]
-        )
-        try:
-            all_results["pct_revenue_change"] = (
-                all_results["new_plans_revenue"] / all_results["original_plans_revenue"]
-                - 1
-            )
-        except (ZeroDivisionError, InvalidOperation):
-            all_results["pct_revenue_change"] = None
-        all_results = make_all_decimals_floats(all_results)
-        all_results = make_all_datetimes_dates(all_results)
-        all_results = make_all_dates_times_strings(all_results)
-        serializer = AllSubstitutionResultsSerializer(data=all_results)
-        try:
-            serializer.is_valid(raise_exception=True)
-        except Exception:
-            logger.error("errors", serializer.errors, "all results", all_results)
-            raise Exception
-        results = make_all_dates_times_strings(serializer.validated_data)
-        backtest.backtest_results = results
-        backtest.status = BACKTEST_STATUS.COMPLETED
-        backtest.save()
+        results = compute_substitution_results(substitution)
+        # update() so the results don't add a history row per substitution
+        BacktestSubstitution.objects.filter(pk=substitution_pk).update(results=results)
+        finish_backtest_if_done(substitution.backtest_id)
     except Exception as e:
-        backtest.status = BACKTEST_STATUS.FAILED
-        backtest.save()
+        Backtest.objects.filter(pk=substitution.backtest_id).update(
+            status=BACKTEST_STATUS.FAILED
+        )
         raise e
 
 
+@shared_task
+def run_backtest_substitution(substitution_pk):
+    run_backtest_substitution_inner(substitution_pk)
+
+
 @shared_task
 def run_generate_invoice(subscription_record_pk_set, **kwargs):
     from metering_billing.invoice import generate_invoice
@@ -481,6 +609,88 @@ def import_customers_from_payment_processor(payment_processor, organization_pk):
     import_customers_from_payment_processor_inner(payment_processor, organization_pk)
 
 
+def connect_customers_to_payment_processors_inner(
+    organization_pk, customer_payment_providers
+):
+    """
+    Links customers created in a batch to the payment processors of their
+    organization. A customer that names a connected processor is connected to its
+    existing account there, any other one is created in every connected processor.
+    """
+    from metering_billing.models import Customer, Organization
+
+    organization = Organization.objects.get(pk=organization_pk)
+    connected = [
+        pp
+        for pp in PAYMENT_PROCESSORS
+        if PAYMENT_PROCESSOR_MAP[pp].organization_connected(organization)
+    ]
+    if len(connected) == 0:
+        return
+    customers = Customer.objects.filter(organization=organization).in_bulk(
+        [customer_pk for customer_pk, _, _ in customer_payment_providers]
+    )
+    for (
+        customer_pk,
+        payment_provider,
+        payment_provider_id,
+    ) in customer_payment_providers:
+        customer = customers.get(customer_pk)
+        if customer is None:
+            continue
+        try:
+            if payment_provider in connected:
+                PAYMENT_PROCESSOR_MAP[payment_provider].connect_customer(
+                    customer, payment_provider_id
+                )
+            else:
+                for pp in connected:
+                    PAYMENT_PROCESSOR_MAP[pp].create_customer_flow(customer)
+        except Exception as e:
+            logger.error(f"Could not connect {customer} to a payment processor: {e}")
+
+
+@shared_task
+def connect_customers_to_payment_processors(
+    organization_pk, customer_payment_providers
+):
+    connect_customers_to_payment_processors_inner(
+        organization_pk, customer_payment_providers
+    )
+
+
+def sync_payment_processor_customers_inner():
+    """
+    Refreshes the payment methods and addresses Lotus keeps for customers connected
+    to a payment processor. Webhooks keep them current between runs where the
+    processor sends them.
+    """
+    from metering_billing.models import Organization
+
+    customer_links = {
+        PAYMENT_PROCESSORS.STRIPE: "stripe_customer_links",
+        PAYMENT_PROCESSORS.BRAINTREE: "braintree_customer_links",
+    }
+    num_synced = 0
+    for pp, connector in PAYMENT_PROCESSOR_MAP.items():
+        if not connector.working() or pp not in customer_links:
+            continue
+        organizations = Organization.objects.filter(
+            **{f"{customer_links[pp]}__isnull": False}
+        ).distinct()
+        for organization in organizations:
+            try:
+                num_synced += connector.sync_customers(organization)
+            except Exception as e:
+                logger.error(f"Could not sync {pp} customers for {organization}: {e}")
+    return num_synced
+
+
+@shared_task
+def sync_payment_processor_customers():
+    sync_payment_processor_customers_inner()
+
+
 def check_past_due_invoices_inner():
     from metering_billing.models import Invoice
 
@@ -491,11 +701,19 @@ def check_past_due_invoices_inner():
         invoice_past_due_webhook_sent=False,
     )
     for invoice in incomplete_invoices:
-        invoice_past_due_webhook(invoice, invoice.organization)
-        invoice.invoice_past_due_webhook_sent = True
-        invoice.save()
+        with transaction.atomic():
+            invoice_past_due_webhook(invoice, invoice.organization)
+            invoice.invoice_past_due_webhook_sent = True
+            invoice.save()
 
 
 @shared_task
 def check_past_due_invoices():
     check_past_due_invoices_inner()
+
+
+@shared_task
+def dispatch_webhooks():
+    from metering_billing.webhooks import dispatch_webhook_messages
+
+    dispatch_webhook_messages()
@@ -1,15 +1,23 @@
 import logging
+import threading
+import time
 from decimal import Decimal
-from typing import Dict, Tuple
+from typing import Tuple
 
 import taxjar
 from django.conf import settings
 from django.core.cache import cache
-from metering_billing.models import SubscriptionRecord
 
 TAXJAR_API_KEY = settings.TAXJAR_API_KEY
+TAX_RATE_CACHE_TTL = settings.TAX_RATE_CACHE_TTL
+TAX_RATE_LOCAL_CACHE_TTL = settings.TAX_RATE_LOCAL_CACHE_TTL
+TAX_RATE_ERROR_CACHE_TTL = 24 * 60 * 60
+DEFAULT_TAXJAR_CODE = "30070"
 logger = logging.getLogger("django.server")
 
+_taxjar_client = None
+_taxjar_client_lock = threading.Lock()
+
 
 def get_lotus_tax_rates(customer, organization) -> Tuple[Decimal, bool]:
     # Check customer tax rate first
@@ -26,75 +34,183 @@ def get_lotus_tax_rates(customer, organization) -> Tuple[Decimal, bool]:
     return 0, False
 
 
-def get_taxjar_tax_rates(
-    customer, organization, plan, draft=True, amount=100
-) -> Tuple[Dict[SubscriptionRecord, Decimal], bool]:
-    try:
-        client = taxjar.Client(api_key=settings.TAXJAR_API_KEY)
-    except Exception:
-        return 0, False
-    from_address = organization.get_address()
-    if not from_address:
-        return 0, False
-    to_address = customer.get_shipping_address()
-    if not to_address:
-        return 0, False
-
-    # Build cache key from addresses
-    from_cache_key = (
-        f"{from_address.line1 or 'None'}:"
-        f"{from_address.line2 or 'None'}:{from_address.city or 'None'}:"
-        f"{from_address.state or 'None'}:{from_address.postal_code or 'None'}:"
-        f"{from_address.country or 'None'}"
-    )
-    to_cache_key = (
-        f"{to_address.line1 or 'None'}:"
-        f"{to_address.line2 or 'None'}:{to_address.city or 'None'}:"
-        f"{to_address.state or 'None'}:{to_address.postal_code or 'None'}:"
-        f"{to_address.country or 'None'}"
+def get_taxjar_client():
+    """
+    Process-wide TaxJar client, so every lookup reuses the same HTTP session.
+    """
+    global _taxjar_client
+    if _taxjar_client is None:
+        with _taxjar_client_lock:
+            if _taxjar_client is None:
+                try:
+                    _taxjar_client = taxjar.Client(api_key=TAXJAR_API_KEY)
+                except Exception as e:
+                    logger.error(f"Could not create TaxJar client: {e}")
+                    return None
+    return _taxjar_client
+
+
+class LocalTTLCache:
+    """
+    Small thread-safe in-process cache in front of the shared cache, so repeated
+    lookups within a worker don't need a round trip to Redis.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._values[key] = (time.monotonic() + ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+local_tax_rate_cache = LocalTTLCache(TAX_RATE_LOCAL_CACHE_TTL)
+
+
+def address_cache_key(address):
+    return (
+        f"{address.line1 or 'None'}:"
+        f"{address.line2 or 'None'}:{address.city or 'None'}:"
+        f"{address.state or 'None'}:{address.postal_code or 'None'}:"
+        f"{address.country or 'None'}"
     )
-    cache_key = f"{from_cache_key}:{to_cache_key}"
-    taxjar_code = plan.taxjar_code or "30070"
-
-    # Check if tax rate is already in cache
-    plan_cache_key = f"{cache_key}:{taxjar_code}"
-    tax_rate = cache.get(plan_cache_key)
-    if tax_rate == "ERROR" and draft:
-        return 0, False
-    if tax_rate is not None and draft:
-        return tax_rate, True
-    # Query taxjar for tax rate
-    try:
-        response = client.tax_for_order(
-            {
-                "amount": amount,
-                "from_country": from_address.country,
-                "from_zip": from_address.postal_code,
-                "from_state": from_address.state,
-                "from_city": from_address.city,
-                "from_street": from_address.line1,
-                "to_street": to_address.line1,
-                "to_city": to_address.city,
-                "to_state": to_address.state,
-                "to_country": to_address.country,
-                "to_zip": to_address.postal_code,
-                "shipping": 0,
-            }
+
+
+class TaxRateService:
+    """
+    Resolves TaxJar rates for invoices. Rates only depend on the origin address, the
+    destination address and the product tax code, so every taxable line item sharing
+    those resolves to a single lookup. A service can be shared by all the invoices of
+    a billing run, rates are kept per run and then in the in-process and shared caches.
+
+    Cached rates are used for final invoices too. Cached errors are only trusted for
+    drafts, a final invoice retries the lookup once per service.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+        self._rates = {}
+        self._addresses = {}
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_taxjar_client()
+        return self._client
+
+    def _get_address(self, key, getter):
+        if key not in self._addresses:
+            self._addresses[key] = getter()
+        return self._addresses[key]
+
+    def rate_key(self, customer, organization, plan):
+        from_address = self._get_address(
+            ("organization", organization.pk), organization.get_address
+        )
+        if not from_address:
+            return None
+        to_address = self._get_address(
+            ("customer", customer.pk), customer.get_shipping_address
         )
-    except taxjar.exceptions.TaxJarConnectionError as e:
-        logger.error(f"TaxJarConnectionError: {e.__dict__}")
-        cache.set(plan_cache_key, "ERROR", 24 * 60 * 60)
-        return 0, False
-    except taxjar.exceptions.TaxJarResponseError as e:
-        logger.error(f"TaxJarResponseError: {e.__dict__}")
-        cache.set(plan_cache_key, "ERROR", 24 * 60 * 60)
-        return 0, False
-    except Exception as e:
-        logger.error(f"Unknown TaxJarException: {e.__dict__}")
-        cache.set(plan_cache_key, "ERROR", 24 * 60 * 60)
-        return 0, False
-
-    tax_rate = Decimal(response.rate * 100)  # to keep in line with lotus tax rates
-    cache.set(plan_cache_key, tax_rate, 30 * 24 * 60 * 60)
-
-    return tax_rate, True
+        if not to_address:
+            return None
+        taxjar_code = (plan.taxjar_code if plan else None) or DEFAULT_TAXJAR_CODE
+        return (from_address, to_address, taxjar_code)
+
+    def get_taxjar_tax_rate(
+        self, customer, organization, plan, draft=True
+    ) -> Tuple[Decimal, bool]:
+        rate_key = self.rate_key(customer, organization, plan)
+        if rate_key is None:
+            return 0, False
+        from_address, to_address, taxjar_code = rate_key
+        cache_key = (
+            f"{address_cache_key(from_address)}:{address_cache_key(to_address)}:"
+            f"{taxjar_code}"
+        )
+        if cache_key in self._rates:
+            return self._rates[cache_key]
+
+        tax_rate = local_tax_rate_cache.get(cache_key)
+        if tax_rate is None:
+            tax_rate = cache.get(cache_key)
+            if tax_rate is not None:
+                local_tax_rate_cache.set(cache_key, tax_rate)
+        if tax_rate == "ERROR" and draft:
+            result = (0, False)
+        elif tax_rate is not None and tax_rate != "ERROR":
+            result = (tax_rate, True)
+        else:
+            result = self._fetch_taxjar_tax_rate(
+                cache_key, from_address, to_address, taxjar_code
+            )
+        self._rates[cache_key] = result
+        return result
+
+    def _fetch_taxjar_tax_rate(self, cache_key, from_address, to_address, taxjar_code):
+        client = self.client
+        if client is None:
+            return 0, False
+        try:
+            response = client.tax_for_order(
+                {
+                    "amount": 100,
+                    "from_country": from_address.country,
+                    "from_zip": from_address.postal_code,
+                    "from_state": from_address.state,
+                    "from_city": from_address.city,
+                    "from_street": from_address.line1,
+                    "to_street": to_address.line1,
+                    "to_city": to_address.city,
+                    "to_state": to_address.state,
+                    "to_country": to_address.country,
+                    "to_zip": to_address.postal_code,
+                    "shipping": 0,
+                    "line_items": [
+                        {
+                            "quantity": 1,
+                            "unit_price": 100,
+                            "product_tax_code": taxjar_code,
+                        }
+                    ],
+                }
+            )
+        except taxjar.exceptions.TaxJarConnectionError as e:
+            logger.error(f"TaxJarConnectionError: {e.__dict__}")
+            self._cache_rate(cache_key, "ERROR", TAX_RATE_ERROR_CACHE_TTL)
+            return 0, False
+        except taxjar.exceptions.TaxJarResponseError as e:
+            logger.error(f"TaxJarResponseError: {e.__dict__}")
+            self._cache_rate(cache_key, "ERROR", TAX_RATE_ERROR_CACHE_TTL)
+            return 0, False
+        except Exception as e:
+            logger.error(f"Unknown TaxJarException: {e.__dict__}")
+            self._cache_rate(cache_key, "ERROR", TAX_RATE_ERROR_CACHE_TTL)
+            return 0, False
+
+        # to keep in line with lotus tax rates
+        tax_rate = Decimal(str(response.rate)) * 100
+        self._cache_rate(cache_key, tax_rate, TAX_RATE_CACHE_TTL)
+        return tax_rate, True
+
+    def _cache_rate(self, cache_key, value, ttl):
+        cache.set(cache_key, value, ttl)
+        local_tax_rate_cache.set(cache_key, value, min(ttl, TAX_RATE_LOCAL_CACHE_TTL))
@@ -33,6 +33,230 @@ def use_dummy_cache_backend(settings):
     settings.CELERY_RESULT_BACKEND = "db+sqlite:///results.sqlite"
 
 
+@pytest.fixture(autouse=True)
+def run_invoicing_jobs_inline(monkeypatch):
+    # there is no celery worker in the test environment
+    from metering_billing import invoice
+    from metering_billing.tasks import run_invoicing_job_inner
+
+    monkeypatch.setattr(invoice, "enqueue_invoicing_job", run_invoicing_job_inner)
+
+
+class FakeTaxJarClient:
+    """
+    Stands in for taxjar.Client. Rates are looked up by destination zip and product
+    tax code, and every order sent is recorded so tests can count the outbound calls.
+    """
+
+    def __init__(self, rates=None, default_rate=0.1):
+        self.rates = rates or {}
+        self.default_rate = default_rate
+        self.orders = []
+
+    def tax_for_order(self, order_deets):
+        from types import SimpleNamespace
+
+        self.orders.append(order_deets)
+        product_tax_code = order_deets["line_items"][0]["product_tax_code"]
+        rate = self.rates.get(
+            (order_deets["to_zip"], product_tax_code), self.default_rate
+        )
+        return SimpleNamespace(rate=rate)
+
+
+@pytest.fixture
+def fake_taxjar(monkeypatch):
+    from metering_billing import taxes
+
+    client = FakeTaxJarClient()
+    monkeypatch.setattr(taxes, "_taxjar_client", client)
+    taxes.local_tax_rate_cache.clear()
+
+    yield client
+
+    taxes.local_tax_rate_cache.clear()
+
+
+class FakePaymentProcessor:
+    """
+    Stands in for a payment processor without a bulk status API. Every lookup takes
+    latency seconds, and the peak number of lookups in flight is recorded so the
+    polling pool can be checked and benchmarked offline.
+    """
+
+    def __init__(self, latency=0.0):
+        import threading
+
+        self.latency = latency
+        self.paid_ids = set()
+        self.lookups = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def working(self):
+        return True
+
+    def update_payment_object_status(self, organization, payment_object_id):
+        import time
+
+        from metering_billing.models import Invoice
+
+        with self._lock:
+            self.lookups.append(payment_object_id)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self.in_flight -= 1
+        if payment_object_id in self.paid_ids:
+            return Invoice.PaymentStatus.PAID
+        return Invoice.PaymentStatus.UNPAID
+
+    def update_payment_object_statuses(
+        self, organization, payment_object_ids, created_at=None
+    ):
+        from metering_billing.payment_processors import poll_payment_object_statuses
+
+        return poll_payment_object_statuses(
+            lambda payment_object_id: self.update_payment_object_status(
+                organization, payment_object_id
+            ),
+            payment_object_ids,
+        )
+
+
+@pytest.fixture
+def fake_payment_processor(monkeypatch):
+    from metering_billing.payment_processors import PAYMENT_PROCESSOR_MAP
+    from metering_billing.utils.enums import PAYMENT_PROCESSORS
+
+    processor = FakePaymentProcessor(latency=0.05)
+    monkeypatch.setitem(PAYMENT_PROCESSOR_MAP, PAYMENT_PROCESSORS.STRIPE, processor)
+    return processor
+
+
+class FakeSvix:
+    """
+    Stands in for the Svix client. Every message sent is recorded, and the next
+    fail_next calls raise so retries can be exercised.
+    """
+
+    def __init__(self):
+        from types import SimpleNamespace
+
+        self.sent = []
+        self.fail_next = 0
+        self.message = SimpleNamespace(create=self.create_message)
+
+    def create_message(self, app_id, message_in):
+        if self.fail_next > 0:
+            self.fail_next -= 1
+            raise ConnectionError("svix is down")
+        self.sent.append((app_id, message_in))
+
+
+@pytest.fixture
+def fake_svix(monkeypatch):
+    from metering_billing import webhooks
+
+    svix = FakeSvix()
+    monkeypatch.setattr(webhooks, "SVIX_CONNECTOR", svix)
+    # the tests drain the outbox themselves
+    monkeypatch.setattr(webhooks, "schedule_webhook_dispatch", lambda: None)
+    return svix
+
+
+class FakeStripe:
+    """
+    Stands in for the Stripe customer and invoice list endpoints. Objects are served
+    in pages the way Stripe does, every request is recorded, and the request with
+    index fail_on_request raises so an import can be interrupted halfway. Customers
+    retrieved one by one are recorded in retrieved.
+    """
+
+    def __init__(self):
+        self.customers = []
+        self.invoices = []
+        self.requests = []
+        self.retrieved = []
+        self.fail_on_request = None
+
+    def add_customer(
+        self, email=None, name=None, address=None, default_payment_method=None
+    ):
+        import stripe
+
+        customer = stripe.Customer.construct_from(
+            {
+                "id": f"cus_{len(self.customers)}",
+                "email": email,
+                "name": name,
+                "address": address,
+                "shipping": None,
+                "invoice_settings": {"default_payment_method": default_payment_method},
+            },
+            "sk_test",
+        )
+        self.customers.append(customer)
+        return customer
+
+    def retrieve_customer(self, id, **kwargs):
+        self.retrieved.append(id)
+        (customer,) = [x for x in self.customers if x.id == id]
+        return customer
+
+    def add_invoice(self, customer_id, amount_due, created):
+        from types import SimpleNamespace
+
+        invoice = SimpleNamespace(
+            id=f"in_{len(self.invoices)}",
+            customer=customer_id,
+            amount_due=amount_due,
+            created=int(created.timestamp()),
+        )
+        self.invoices.append(invoice)
+        return invoice
+
+    def _list(self, objects, limit=10, starting_after=None, **kwargs):
+        from types import SimpleNamespace
+
+        self.requests.append(starting_after)
+        if self.fail_on_request == len(self.requests) - 1:
+            raise ConnectionError("stripe is down")
+        start = 0
+        if starting_after is not None:
+            start = [x.id for x in objects].index(starting_after) + 1
+        data = objects[start : start + limit]
+        return SimpleNamespace(data=data, has_more=start + limit < len(objects))
+
+    def list_customers(self, **kwargs):
+        return self._list(self.customers, **kwargs)
+
+    def list_invoices(self, **kwargs):
+        return self._list(self.invoices, **kwargs)
+
+
+@pytest.fixture
+def fake_stripe(monkeypatch, settings):
+    import stripe
+    from metering_billing.payment_processors import PAYMENT_PROCESSOR_MAP
+
+    # import checkpoints live in the cache
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": uuid.uuid4().hex,
+        }
+    }
+    fake = FakeStripe()
+    monkeypatch.setattr(stripe.Customer, "list", fake.list_customers)
+    monkeypatch.setattr(stripe.Customer, "retrieve", fake.retrieve_customer)
+    monkeypatch.setattr(stripe.Invoice, "list", fake.list_invoices)
+    monkeypatch.setattr(PAYMENT_PROCESSOR_MAP["stripe"], "self_hosted", True)
+    return fake
+
+
 @pytest.fixture
 def turn_off_stripe_connection():
     from metering_billing.payment_processors import PAYMENT_PROCESSOR_MAP
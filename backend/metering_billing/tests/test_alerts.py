@@ -1,10 +1,13 @@
 import itertools
 import json
+import unittest.mock as mock
+import uuid
 from datetime import timedelta
 
 import pytest
 from django.urls import reverse
 from metering_billing.aggregation.billable_metrics import METRIC_HANDLER_MAP
+from metering_billing.kafka.consumer import write_batch_events_to_db
 from metering_billing.models import (
     Event,
     Metric,
@@ -15,8 +18,12 @@ from metering_billing.models import (
     UsageAlertResult,
 )
 from metering_billing.serializers.serializer_utils import DjangoJSONEncoder
-from metering_billing.tasks import refresh_alerts_inner
+from metering_billing.tasks import (
+    refresh_alerts_for_usage_changes_inner,
+    refresh_alerts_inner,
+)
 from metering_billing.utils import now_utc
+from metering_billing.utils.enums import EVENT_TYPE, METRIC_AGGREGATION, METRIC_TYPE
 from model_bakery import baker
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -246,7 +253,226 @@ class TestUsageAlerts:
             properties={"num_characters": 70},
         )
 
-        refresh_alerts_inner()
+        # counters read whole seconds, so the event's second has to be over
+        with mock.patch(
+            "metering_billing.models.now_utc",
+            return_value=now_utc() + timedelta(seconds=2),
+        ):
+            refresh_alerts_inner()
 
         alert_result = UsageAlertResult.objects.all().first()
         assert alert_result.triggered_count == 1
+
+    def test_usage_changes_refresh_only_matching_alert_results(
+        self, alerts_test_common_setup
+    ):
+        setup_dict = alerts_test_common_setup(
+            num_subscriptions=1, auth_method="session_auth"
+        )
+        response = setup_dict["client"].post(
+            reverse("usage_alert-list"),
+            data=json.dumps(setup_dict["payload"], cls=DjangoJSONEncoder),
+            content_type="application/json",
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        alert_result = UsageAlertResult.objects.get()
+        last_run_timestamp = alert_result.last_run_timestamp
+
+        def make_event(event_name):
+            return {
+                "idempotency_id": str(uuid.uuid4()),
+                "event_name": event_name,
+                "properties": {"num_characters": 70},
+                "time_created": now_utc(),
+                "organization": setup_dict["org"],
+                "cust_id": setup_dict["customer"].customer_id,
+            }
+
+        usage_changes = write_batch_events_to_db(
+            {setup_dict["org"].pk: [make_event("unrelated_event")]}
+        )
+        assert usage_changes == {
+            (
+                setup_dict["org"].pk,
+                setup_dict["customer"].customer_id,
+                "unrelated_event",
+            )
+        }
+        refresh_alerts_for_usage_changes_inner(usage_changes)
+        alert_result.refresh_from_db()
+        assert alert_result.last_run_timestamp == last_run_timestamp
+        assert alert_result.triggered_count == 0
+
+        usage_changes = write_batch_events_to_db(
+            {setup_dict["org"].pk: [make_event("email_sent")]}
+        )
+        with mock.patch(
+            "metering_billing.models.now_utc",
+            return_value=now_utc() + timedelta(seconds=2),
+        ):
+            refresh_alerts_for_usage_changes_inner(usage_changes)
+        alert_result.refresh_from_db()
+        assert alert_result.last_run_timestamp > last_run_timestamp
+        assert alert_result.triggered_count == 1
+
+    def test_gauge_alert_triggers_and_rearms(self, alerts_test_common_setup):
+        setup_dict = alerts_test_common_setup(
+            num_subscriptions=1, auth_method="session_auth"
+        )
+        metric = Metric.objects.create(
+            organization=setup_dict["org"],
+            event_name="number_of_users",
+            property_name="number",
+            usage_aggregation_type=METRIC_AGGREGATION.MAX,
+            metric_type=METRIC_TYPE.GAUGE,
+            event_type=EVENT_TYPE.TOTAL,
+        )
+        METRIC_HANDLER_MAP[metric.metric_type].create_continuous_aggregate(metric)
+        UsageAlert.objects.create(
+            organization=setup_dict["org"],
+            metric=metric,
+            plan_version=setup_dict["billing_plan"],
+            threshold=5,
+        )
+        alert_result = UsageAlertResult.objects.get(alert__metric=metric)
+        now = now_utc()
+
+        def set_number_of_users(number, minutes_ago):
+            Event.objects.create(
+                organization=setup_dict["org"],
+                event_name="number_of_users",
+                cust_id=setup_dict["customer"].customer_id,
+                time_created=now - timedelta(minutes=minutes_ago),
+                properties={"number": number},
+            )
+            with mock.patch(
+                "metering_billing.models.now_utc",
+                return_value=now - timedelta(minutes=minutes_ago - 1),
+            ):
+                refresh_alerts_inner()
+            alert_result.refresh_from_db()
+
+        set_number_of_users(3, minutes_ago=40)
+        assert alert_result.triggered_count == 0
+        set_number_of_users(6, minutes_ago=30)
+        assert alert_result.triggered_count == 1
+        set_number_of_users(7, minutes_ago=20)
+        assert alert_result.triggered_count == 1
+        set_number_of_users(2, minutes_ago=10)
+        assert alert_result.triggered_count == 1
+        set_number_of_users(8, minutes_ago=5)
+        assert alert_result.triggered_count == 2
+
+    def test_custom_metric_alert_is_rejected(self, alerts_test_common_setup):
+        setup_dict = alerts_test_common_setup(
+            num_subscriptions=1, auth_method="session_auth"
+        )
+        metric = baker.make(
+            Metric,
+            organization=setup_dict["org"],
+            metric_type=METRIC_TYPE.CUSTOM,
+            billable_metric_name="custom_metric",
+        )
+        with pytest.raises(Exception):
+            UsageAlert.objects.create(
+                organization=setup_dict["org"],
+                metric=metric,
+                plan_version=setup_dict["billing_plan"],
+                threshold=5,
+            )
+        assert not UsageAlert.objects.filter(metric=metric).exists()
+
+    def test_triggered_alerts_are_dispatched_once_per_org(
+        self,
+        alerts_test_common_setup,
+        add_customers_to_org,
+        add_subscription_record_to_org,
+        monkeypatch,
+    ):
+        from metering_billing import models
+
+        setup_dict = alerts_test_common_setup(
+            num_subscriptions=1, auth_method="session_auth"
+        )
+        (other_customer,) = add_customers_to_org(setup_dict["org"], n=1)
+        add_subscription_record_to_org(
+            setup_dict["org"], setup_dict["billing_plan"], other_customer
+        )
+        response = setup_dict["client"].post(
+            reverse("usage_alert-list"),
+            data=json.dumps(setup_dict["payload"], cls=DjangoJSONEncoder),
+            content_type="application/json",
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        assert UsageAlertResult.objects.count() == 2
+        dispatches = []
+        monkeypatch.setattr(
+            models,
+            "usage_alert_webhook",
+            lambda organization, alert_results: dispatches.append(
+                (organization, alert_results)
+            ),
+        )
+
+        for customer in [setup_dict["customer"], other_customer]:
+            Event.objects.create(
+                organization=setup_dict["org"],
+                event_name="email_sent",
+                cust_id=customer.customer_id,
+                time_created=now_utc(),
+                properties={"num_characters": 70},
+            )
+        with mock.patch(
+            "metering_billing.models.now_utc",
+            return_value=now_utc() + timedelta(seconds=2),
+        ):
+            refresh_alerts_inner()
+
+        assert len(dispatches) == 1
+        organization, alert_results = dispatches[0]
+        assert organization == setup_dict["org"]
+        assert len(alert_results) == 2
+
+    def test_counter_alert_only_reads_usage_since_last_run(
+        self, alerts_test_common_setup, add_subscription_record_to_org
+    ):
+        setup_dict = alerts_test_common_setup(
+            num_subscriptions=0, auth_method="session_auth"
+        )
+        subscription_record = add_subscription_record_to_org(
+            setup_dict["org"],
+            setup_dict["billing_plan"],
+            setup_dict["customer"],
+            start_date=now_utc() - timedelta(days=1),
+        )
+        response = setup_dict["client"].post(
+            reverse("usage_alert-list"),
+            data=json.dumps(setup_dict["payload"], cls=DjangoJSONEncoder),
+            content_type="application/json",
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        alert_result = UsageAlertResult.objects.get()
+        assert alert_result.last_run_timestamp == subscription_record.usage_start_date
+        now = now_utc()
+        alert_result.last_run_value = 40
+        alert_result.last_run_timestamp = now.replace(microsecond=0) - timedelta(
+            seconds=10
+        )
+        alert_result.save()
+        for seconds_ago, num_characters in [(20, 1000), (5, 30)]:
+            Event.objects.create(
+                organization=setup_dict["org"],
+                event_name="email_sent",
+                cust_id=setup_dict["customer"].customer_id,
+                time_created=now - timedelta(seconds=seconds_ago),
+                properties={"num_characters": num_characters},
+            )
+
+        with mock.patch("metering_billing.models.now_utc", return_value=now):
+            refresh_alerts_inner()
+
+        alert_result.refresh_from_db()
+        # the event from before the last run is already part of last_run_value
+        assert alert_result.last_run_value == 70
+        assert alert_result.last_run_timestamp == now.replace(microsecond=0)
+        assert alert_result.triggered_count == 1
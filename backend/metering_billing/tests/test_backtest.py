@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+import pytest
+from metering_billing.models import Backtest, BacktestSubstitution, SubscriptionRecord
+from metering_billing.tasks import run_backtest_inner
+from metering_billing.utils import now_utc
+from metering_billing.utils.enums import BACKTEST_STATUS
+
+
+@pytest.fixture
+def backtest_test_common_setup(
+    generate_org_and_api_key,
+    add_customers_to_org,
+    add_product_to_org,
+    add_plan_to_product,
+    add_plan_version_to_plan,
+    add_subscription_record_to_org,
+):
+    def do_backtest_test_common_setup():
+        setup_dict = {}
+        org, _ = generate_org_and_api_key()
+        setup_dict["org"] = org
+        customers = add_customers_to_org(org, n=2)
+        product = add_product_to_org(org)
+        original_plan = add_plan_version_to_plan(add_plan_to_product(product))
+        new_plan = add_plan_version_to_plan(add_plan_to_product(product))
+        new_plan.recurring_charges.update(amount=45)
+        setup_dict["original_plan"] = original_plan
+        setup_dict["new_plan"] = new_plan
+        setup_dict["subscription_records"] = [
+            add_subscription_record_to_org(
+                org, original_plan, customer, now_utc() - timedelta(days=45)
+            )
+            for customer in customers
+        ]
+        backtest = Backtest.objects.create(
+            backtest_name="test-backtest",
+            start_date=(now_utc() - timedelta(days=60)).date(),
+            end_date=now_utc().date(),
+            organization=org,
+            kpis=["total_revenue"],
+        )
+        BacktestSubstitution.objects.create(
+            organization=org,
+            backtest=backtest,
+            original_plan=original_plan,
+            new_plan=new_plan,
+        )
+        setup_dict["backtest"] = backtest
+        return setup_dict
+
+    return do_backtest_test_common_setup
+
+
+@pytest.mark.django_db(transaction=True)
+class TestBacktest:
+    def test_backtest_compares_plans(self, backtest_test_common_setup):
+        setup_dict = backtest_test_common_setup()
+        backtest = setup_dict["backtest"]
+
+        run_backtest_inner(backtest.backtest_id, synchronous=True)
+
+        backtest.refresh_from_db()
+        assert backtest.status == BACKTEST_STATUS.COMPLETED
+        results = backtest.backtest_results
+        assert results["original_plans_revenue"] == 60
+        assert results["new_plans_revenue"] == 90
+        assert results["pct_revenue_change"] == pytest.approx(0.5)
+        (substitution_results,) = results["substitution_results"]
+        flat_fees = [
+            x
+            for x in substitution_results["results"]["revenue_by_metric"]
+            if x["metric_name"] == "flat_fees"
+        ]
+        assert flat_fees[0]["original_plan_revenue"] == 60
+        assert flat_fees[0]["new_plan_revenue"] == 90
+
+    def test_backtest_does_not_write_subscription_records(
+        self, backtest_test_common_setup
+    ):
+        setup_dict = backtest_test_common_setup()
+        history_len = SubscriptionRecord.history.count()
+
+        run_backtest_inner(setup_dict["backtest"].backtest_id, synchronous=True)
+
+        assert SubscriptionRecord.history.count() == history_len
+        for subscription_record in setup_dict["subscription_records"]:
+            subscription_record.refresh_from_db()
+            assert subscription_record.billing_plan == setup_dict["original_plan"]
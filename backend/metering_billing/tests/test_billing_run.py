@@ -0,0 +1,191 @@
+import threading
+from datetime import timedelta
+
+import pytest
+from django.db import connection, transaction
+from metering_billing.models import (
+    BillingRun,
+    Invoice,
+    InvoicingJob,
+    SubscriptionRecord,
+)
+from metering_billing.tasks import (
+    bill_customer,
+    calculate_invoice_inner,
+    run_invoicing_job_inner,
+)
+from metering_billing.utils import now_utc
+from metering_billing.utils.enums import BILLING_RUN_STATUS, INVOICING_JOB_STATUS
+
+
+@pytest.fixture
+def billing_run_test_common_setup(
+    generate_org_and_api_key,
+    add_customers_to_org,
+    add_product_to_org,
+    add_plan_to_product,
+    add_plan_version_to_plan,
+    add_subscription_record_to_org,
+):
+    def do_billing_run_test_common_setup():
+        setup_dict = {}
+        org, _ = generate_org_and_api_key()
+        setup_dict["org"] = org
+        customers = add_customers_to_org(org, n=3)
+        setup_dict["customers"] = customers
+        product = add_product_to_org(org)
+        plan = add_plan_to_product(product)
+        plan_version = add_plan_version_to_plan(plan)
+        plan.display_version = plan_version
+        plan.save()
+        setup_dict["billing_plan"] = plan_version
+        for customer in customers:
+            # started long enough ago that the period has ended and is due
+            add_subscription_record_to_org(
+                org, plan_version, customer, now_utc() - timedelta(days=45)
+            )
+        return setup_dict
+
+    return do_billing_run_test_common_setup
+
+
+@pytest.mark.django_db(transaction=True)
+class TestBillingRun:
+    def test_billing_run_invoices_due_customers(self, billing_run_test_common_setup):
+        setup_dict = billing_run_test_common_setup()
+        due_before = now_utc() - timedelta(minutes=30)
+        assert SubscriptionRecord.objects.due_for_billing(due_before).count() == 3
+
+        billing_run = calculate_invoice_inner(synchronous=True)
+
+        billing_run.refresh_from_db()
+        assert billing_run.status == BILLING_RUN_STATUS.COMPLETED
+        assert billing_run.total_customers == 3
+        assert billing_run.invoiced_customers == 3
+        assert billing_run.failed_customers == 0
+        assert billing_run.completed_chunks == billing_run.total_chunks
+        assert billing_run.completed_at is not None
+        for customer in setup_dict["customers"]:
+            assert (
+                Invoice.objects.filter(customer=customer)
+                .exclude(payment_status=Invoice.PaymentStatus.DRAFT)
+                .count()
+                == 1
+            )
+        assert SubscriptionRecord.objects.due_for_billing(due_before).count() == 0
+
+    def test_second_billing_run_finds_nothing_due(self, billing_run_test_common_setup):
+        billing_run_test_common_setup()
+        first_run = calculate_invoice_inner(synchronous=True)
+        invoices_len = Invoice.objects.count()
+
+        second_run = calculate_invoice_inner(synchronous=True)
+
+        second_run.refresh_from_db()
+        assert second_run.pk != first_run.pk
+        assert second_run.total_customers == 0
+        assert second_run.status == BILLING_RUN_STATUS.COMPLETED
+        assert Invoice.objects.count() == invoices_len
+
+    def test_bill_customer_skips_when_nothing_due(self, billing_run_test_common_setup):
+        setup_dict = billing_run_test_common_setup()
+        customer = setup_dict["customers"][0]
+        due_before = now_utc() - timedelta(minutes=30)
+
+        assert bill_customer(customer.pk, due_before) is True
+        assert bill_customer(customer.pk, due_before) is False
+        assert BillingRun.objects.count() == 0
+
+    def test_bill_customer_skips_records_locked_by_another_run(
+        self, billing_run_test_common_setup
+    ):
+        setup_dict = billing_run_test_common_setup()
+        customer = setup_dict["customers"][0]
+        due_before = now_utc() - timedelta(minutes=30)
+        locked = threading.Event()
+        release = threading.Event()
+
+        def other_run():
+            # holds the row locks on its own connection, like a concurrent worker
+            try:
+                with transaction.atomic():
+                    list(
+                        SubscriptionRecord.objects.filter(
+                            customer=customer
+                        ).select_for_update()
+                    )
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=other_run)
+        thread.start()
+        try:
+            assert locked.wait(10)
+            assert bill_customer(customer.pk, due_before) is False
+            assert Invoice.objects.filter(customer=customer).count() == 0
+        finally:
+            release.set()
+            thread.join()
+
+        assert bill_customer(customer.pk, due_before) is True
+        assert Invoice.objects.filter(customer=customer).count() > 0
+
+    def test_records_of_pending_invoicing_job_are_billed_once(
+        self, billing_run_test_common_setup
+    ):
+        setup_dict = billing_run_test_common_setup()
+        customer = setup_dict["customers"][0]
+        due_before = now_utc() - timedelta(minutes=30)
+        invoicing_job = InvoicingJob.objects.create(organization=setup_dict["org"])
+        invoicing_job.subscription_records.add(
+            *SubscriptionRecord.objects.filter(customer=customer)
+        )
+
+        assert bill_customer(customer.pk, due_before) is False
+        assert Invoice.objects.filter(customer=customer).count() == 0
+
+        run_invoicing_job_inner(invoicing_job.pk)
+        invoicing_job.refresh_from_db()
+        assert invoicing_job.status == INVOICING_JOB_STATUS.COMPLETED
+        invoices_len = Invoice.objects.filter(customer=customer).count()
+        assert invoices_len > 0
+        assert invoicing_job.errors == {}
+
+    def test_invoicing_job_failure_leaves_only_that_customer_to_billing_run(
+        self, billing_run_test_common_setup, monkeypatch
+    ):
+        from metering_billing import invoice
+
+        setup_dict = billing_run_test_common_setup()
+        failing_customer, other_customer, _ = setup_dict["customers"]
+        due_before = now_utc() - timedelta(minutes=30)
+        invoicing_job = InvoicingJob.objects.create(organization=setup_dict["org"])
+        invoicing_job.subscription_records.add(
+            *SubscriptionRecord.objects.filter(
+                customer__in=[failing_customer, other_customer]
+            )
+        )
+        generate_invoice = invoice.generate_invoice
+
+        def fail_for_one_customer(subscription_records, **kwargs):
+            if subscription_records[0].customer == failing_customer:
+                raise ConnectionError("the tax provider is down")
+            return generate_invoice(subscription_records, **kwargs)
+
+        monkeypatch.setattr(invoice, "generate_invoice", fail_for_one_customer)
+        run_invoicing_job_inner(invoicing_job.pk)
+        monkeypatch.setattr(invoice, "generate_invoice", generate_invoice)
+
+        invoicing_job.refresh_from_db()
+        assert invoicing_job.status == INVOICING_JOB_STATUS.COMPLETED
+        assert invoicing_job.errors == {
+            failing_customer.customer_id: "the tax provider is down"
+        }
+        assert [x.customer for x in invoicing_job.invoices.all()] == [other_customer]
+        assert not Invoice.objects.filter(customer=failing_customer).exists()
+
+        assert bill_customer(other_customer.pk, due_before) is False
+        assert bill_customer(failing_customer.pk, due_before) is True
+        assert Invoice.objects.filter(customer=failing_customer).count() == 1
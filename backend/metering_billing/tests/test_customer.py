@@ -1,12 +1,23 @@
 import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
 
 import pytest
+from django.db import IntegrityError, connection, transaction
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from metering_billing.models import Customer
+from metering_billing.models import (
+    Customer,
+    CustomerBalanceAdjustment,
+    CustomerCreditBalance,
+)
 from metering_billing.serializers.serializer_utils import DjangoJSONEncoder
+from metering_billing.tasks import zero_out_expired_balance_adjustments_inner
+from metering_billing.utils import now_utc
+from metering_billing.utils.enums import CUSTOMER_BALANCE_ADJUSTMENT_STATUS
 
 
 @pytest.fixture
@@ -98,6 +109,72 @@ class TestGetCustomers:
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data) == num_customers
 
+    def test_paginated_list_walks_every_customer_once(self, customer_test_common_setup):
+        setup_dict = customer_test_common_setup(
+            num_customers=5,
+            auth_method="api_key",
+            user_org_and_api_key_org_different=False,
+        )
+        # ties on created are broken by id
+        same_time = now_utc()
+        Customer.objects.filter(
+            pk__in=[c.pk for c in setup_dict["org_customers"][:3]]
+        ).update(created=same_time)
+
+        seen = []
+        payload = {"page_size": 2}
+        while True:
+            response = setup_dict["client"].get(reverse("customer-list"), payload)
+            assert response.status_code == status.HTTP_200_OK
+            assert len(response.data["results"]) <= 2
+            seen.extend(c["customer_id"] for c in response.data["results"])
+            if response.data["next"] is None:
+                break
+            payload = {"page_size": 2, "cursor": response.data["next"]}
+
+        assert len(seen) == 5
+        assert set(seen) == {c.customer_id for c in setup_dict["org_customers"]}
+
+    def test_paginated_list_only_loads_expanded_fields(
+        self, customer_test_common_setup
+    ):
+        setup_dict = customer_test_common_setup(
+            num_customers=2,
+            auth_method="api_key",
+            user_org_and_api_key_org_different=False,
+        )
+
+        response = setup_dict["client"].get(reverse("customer-list"), {"page_size": 10})
+        assert response.status_code == status.HTTP_200_OK
+        customer = response.data["results"][0]
+        assert "created" in customer
+        assert "subscriptions" not in customer
+        assert "invoices" not in customer
+        assert "total_amount_due" not in customer
+
+        response = setup_dict["client"].get(
+            reverse("customer-list"),
+            {"page_size": 10, "expand": ["subscriptions", "total_amount_due"]},
+        )
+        assert response.status_code == status.HTTP_200_OK
+        customer = response.data["results"][0]
+        assert customer["subscriptions"] == []
+        assert customer["total_amount_due"] == 0
+        assert "invoices" not in customer
+
+    def test_paginated_list_rejects_invalid_cursor(self, customer_test_common_setup):
+        setup_dict = customer_test_common_setup(
+            num_customers=2,
+            auth_method="api_key",
+            user_org_and_api_key_org_different=False,
+        )
+
+        response = setup_dict["client"].get(
+            reverse("customer-list"), {"cursor": "not-a-cursor"}
+        )
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
 
 @pytest.fixture
 def insert_customer_payload():
@@ -213,3 +290,268 @@ class TestInsertCustomer:
         assert response.status_code == status.HTTP_201_CREATED
         assert len(response.data) > 0  # check that the response is not empty
         assert len(get_customers_in_org(setup_dict["org"])) == num_customers + 1
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("turn_off_stripe_connection")
+class TestBatchCreateCustomers:
+    def test_valid_customers_created_and_duplicates_reported(
+        self, customer_test_common_setup, get_customers_in_org
+    ):
+        num_customers = 3
+        setup_dict = customer_test_common_setup(
+            num_customers=num_customers,
+            auth_method="api_key",
+            user_org_and_api_key_org_different=False,
+        )
+
+        payload = {
+            "customers": [
+                {"customer_id": "batch_1", "email": "batch_1@test.com"},
+                {"customer_id": "batch_2", "email": "batch_2@test.com"},
+                {
+                    "customer_id": setup_dict["org_customers"][0].customer_id,
+                    "email": "batch_3@test.com",
+                },
+                {"customer_id": "batch_4", "email": "batch_1@test.com"},
+            ]
+        }
+        response = setup_dict["client"].post(
+            reverse("customer-batch"),
+            data=json.dumps(payload, cls=DjangoJSONEncoder),
+            content_type="application/json",
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert [x["customer_id"] for x in response.data["customers"]] == [
+            "batch_1",
+            "batch_2",
+        ]
+        assert set(response.data["errors"]) == {2, 3}
+        assert len(get_customers_in_org(setup_dict["org"])) == num_customers + 2
+
+    def test_customers_created_concurrently_are_reported(
+        self, customer_test_common_setup, get_customers_in_org, monkeypatch
+    ):
+        from metering_billing import batch
+
+        num_customers = 3
+        setup_dict = customer_test_common_setup(
+            num_customers=num_customers,
+            auth_method="api_key",
+            user_org_and_api_key_org_different=False,
+        )
+        bulk_create_with_history = batch.bulk_create_with_history
+
+        def create_concurrently(*args, **kwargs):
+            # another request creates one of the customers after they were checked
+            def other_request():
+                try:
+                    Customer.objects.create(
+                        organization=setup_dict["org"],
+                        customer_id="batch_2",
+                        email="other@test.com",
+                    )
+                finally:
+                    connection.close()
+
+            thread = threading.Thread(target=other_request)
+            thread.start()
+            thread.join()
+            return bulk_create_with_history(*args, **kwargs)
+
+        monkeypatch.setattr(batch, "bulk_create_with_history", create_concurrently)
+
+        payload = {
+            "customers": [
+                {"customer_id": "batch_1", "email": "batch_1@test.com"},
+                {"customer_id": "batch_2", "email": "batch_2@test.com"},
+            ]
+        }
+        response = setup_dict["client"].post(
+            reverse("customer-batch"),
+            data=json.dumps(payload, cls=DjangoJSONEncoder),
+            content_type="application/json",
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert [x["customer_id"] for x in response.data["customers"]] == ["batch_1"]
+        assert response.data["errors"] == {
+            1: {"customer_id": ["Customer ID already exists"]}
+        }
+        assert len(get_customers_in_org(setup_dict["org"])) == num_customers + 2
+
+    def test_no_valid_customers_reject_batch(
+        self, customer_test_common_setup, get_customers_in_org
+    ):
+        num_customers = 3
+        setup_dict = customer_test_common_setup(
+            num_customers=num_customers,
+            auth_method="api_key",
+            user_org_and_api_key_org_different=False,
+        )
+
+        payload = {
+            "customers": [
+                {
+                    "customer_id": setup_dict["org_customers"][0].customer_id,
+                    "email": "batch_1@test.com",
+                },
+                {"customer_id": "batch_2"},
+            ]
+        }
+        response = setup_dict["client"].post(
+            reverse("customer-batch"),
+            data=json.dumps(payload, cls=DjangoJSONEncoder),
+            content_type="application/json",
+        )
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data["customers"] == []
+        assert len(response.data["errors"]) == 2
+        assert len(get_customers_in_org(setup_dict["org"])) == num_customers
+
+
+@pytest.mark.django_db(transaction=True)
+class TestExpireBalanceAdjustments:
+    def test_expired_credits_are_offset_in_batches(
+        self, generate_org_and_api_key, add_customers_to_org
+    ):
+        org, _ = generate_org_and_api_key()
+        (customer,) = add_customers_to_org(org, n=1)
+        now = now_utc()
+        expired = [
+            CustomerBalanceAdjustment.objects.create(
+                customer=customer,
+                amount=10,
+                created=now - timedelta(days=10, seconds=i),
+                effective_at=now - timedelta(days=10),
+                expires_at=now - timedelta(days=1),
+            )
+            for i in range(3)
+        ]
+        CustomerBalanceAdjustment.objects.create(
+            customer=customer,
+            amount=-4,
+            parent_adjustment=expired[0],
+            created=now - timedelta(days=5),
+        )
+        CustomerBalanceAdjustment.objects.create(
+            customer=customer,
+            amount=-10,
+            parent_adjustment=expired[1],
+            created=now - timedelta(days=4),
+        )
+        unexpired = CustomerBalanceAdjustment.objects.create(
+            customer=customer,
+            amount=10,
+            created=now - timedelta(days=3),
+            expires_at=now + timedelta(days=1),
+        )
+
+        zero_out_expired_balance_adjustments_inner(now=now, batch_size=2)
+
+        for adjustment in expired:
+            adjustment.refresh_from_db()
+            assert adjustment.status == CUSTOMER_BALANCE_ADJUSTMENT_STATUS.INACTIVE
+            assert adjustment.get_remaining_balance() == 0
+        assert expired[1].drawdowns.count() == 1
+        offset = expired[2].drawdowns.get()
+        assert offset.amount == Decimal(-10)
+        assert offset.pricing_unit == expired[2].pricing_unit
+        assert offset.description.startswith("Expiring remaining credit")
+        unexpired.refresh_from_db()
+        assert unexpired.status == CUSTOMER_BALANCE_ADJUSTMENT_STATUS.ACTIVE
+        credit_balance = CustomerCreditBalance.objects.get(customer=customer)
+        assert credit_balance.balance == Decimal(10)
+        assert credit_balance.next_expiry == unexpired.expires_at
+
+    def test_credit_ledger_keeps_running_balance(
+        self, generate_org_and_api_key, add_customers_to_org
+    ):
+        org, _ = generate_org_and_api_key()
+        (customer,) = add_customers_to_org(org, n=1)
+        now = now_utc()
+        expiring_grant = CustomerBalanceAdjustment.objects.create(
+            customer=customer,
+            amount=10,
+            created=now - timedelta(days=2),
+            expires_at=now + timedelta(days=1),
+        )
+        grant = CustomerBalanceAdjustment.objects.create(
+            customer=customer,
+            amount=20,
+            created=now - timedelta(days=1),
+        )
+        pricing_unit = grant.pricing_unit
+        assert (
+            CustomerBalanceAdjustment.get_pricing_unit_balance(customer, pricing_unit)
+            == 30
+        )
+
+        leftover = CustomerBalanceAdjustment.draw_down_amount(
+            customer, Decimal(15), pricing_unit, description="invoice"
+        )
+
+        assert leftover == 0
+        expiring_grant.refresh_from_db()
+        grant.refresh_from_db()
+        # the grant expiring first is drawn down first
+        assert expiring_grant.remaining_balance == 0
+        assert expiring_grant.status == CUSTOMER_BALANCE_ADJUSTMENT_STATUS.INACTIVE
+        assert grant.remaining_balance == Decimal(15)
+        assert grant.drawdowns.get().amount == -5
+        assert (
+            CustomerBalanceAdjustment.get_pricing_unit_balance(customer, pricing_unit)
+            == 15
+        )
+        assert CustomerCreditBalance.objects.get(customer=customer).next_expiry is None
+
+        grant.zero_out(reason="voided")
+        assert grant.remaining_balance == 0
+        assert (
+            CustomerBalanceAdjustment.get_pricing_unit_balance(customer, pricing_unit)
+            == 0
+        )
+
+    def test_expired_credit_is_not_available_before_the_job_runs(
+        self, generate_org_and_api_key, add_customers_to_org
+    ):
+        org, _ = generate_org_and_api_key()
+        (customer,) = add_customers_to_org(org, n=1)
+        now = now_utc()
+        grant = CustomerBalanceAdjustment.objects.create(
+            customer=customer,
+            amount=10,
+            created=now - timedelta(days=2),
+            expires_at=now - timedelta(days=1),
+        )
+
+        assert (
+            CustomerBalanceAdjustment.get_pricing_unit_balance(
+                customer, grant.pricing_unit
+            )
+            == 0
+        )
+        assert (
+            CustomerBalanceAdjustment.draw_down_amount(
+                customer, Decimal(5), grant.pricing_unit
+            )
+            == 5
+        )
+
+    def test_credit_balance_without_pricing_unit_is_unique(
+        self, generate_org_and_api_key, add_customers_to_org
+    ):
+        org, _ = generate_org_and_api_key()
+        (customer,) = add_customers_to_org(org, n=1)
+        with transaction.atomic():
+            first = CustomerCreditBalance.lock(org.pk, customer.pk, None)
+        with transaction.atomic():
+            second = CustomerCreditBalance.lock(org.pk, customer.pk, None)
+
+        assert first.pk == second.pk
+        with pytest.raises(IntegrityError), transaction.atomic():
+            CustomerCreditBalance.objects.create(
+                organization=org, customer=customer, pricing_unit=None
+            )
@@ -4,20 +4,24 @@ from datetime import timedelta
 from decimal import Decimal
 
 import pytest
+from django.db.models import Count, Max, Min, Sum
 from django.urls import reverse
-from metering_billing.invoice import generate_invoice
+from metering_billing.invoice import InvoiceNumberPool, generate_invoice
 from metering_billing.models import (
     Event,
     Invoice,
+    InvoiceLineItem,
+    InvoiceNumberCounter,
     Metric,
     PlanComponent,
     PriceAdjustment,
     PriceTier,
     SubscriptionRecord,
 )
+from metering_billing.serializers.model_serializers import DraftInvoiceSerializer
 from metering_billing.serializers.serializer_utils import DjangoJSONEncoder
 from metering_billing.utils import now_utc
-from metering_billing.utils.enums import PRICE_ADJUSTMENT_TYPE
+from metering_billing.utils.enums import CHARGEABLE_ITEM_TYPE, PRICE_ADJUSTMENT_TYPE
 from model_bakery import baker
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -277,3 +281,187 @@ class TestGenerateInvoice:
         assert len(result_invoices) == 1
 
         assert result_invoices[0].invoice_pdf != ""
+
+    def test_generate_invoice_persists_line_items_in_bulk(
+        self, draft_invoice_test_common_setup
+    ):
+        setup_dict = draft_invoice_test_common_setup(auth_method="api_key")
+        setup_dict["org"].tax_rate = Decimal("10")
+        setup_dict["org"].save()
+
+        (invoice,) = generate_invoice(
+            SubscriptionRecord.objects.filter(pk=setup_dict["subscription_record"].pk),
+            draft=False,
+        )
+
+        invoice.refresh_from_db()
+        assert invoice.invoice_number != ""
+        line_items = invoice.line_items.all()
+        assert line_items.count() > 0
+        assert all(
+            x.pricing_unit == setup_dict["org"].default_currency for x in line_items
+        )
+        total = line_items.aggregate(tot=Sum("subtotal"))["tot"]
+        assert invoice.cost_due == total
+        assert list(invoice.subscription_records.all()) == [
+            setup_dict["subscription_record"]
+        ]
+        assert line_items.filter(chargeable_item_type=CHARGEABLE_ITEM_TYPE.TAX).exists()
+
+    def test_generate_invoice_stores_line_item_summary(
+        self, draft_invoice_test_common_setup
+    ):
+        setup_dict = draft_invoice_test_common_setup(auth_method="api_key")
+
+        (invoice,) = generate_invoice(
+            SubscriptionRecord.objects.filter(pk=setup_dict["subscription_record"].pk),
+            draft=False,
+        )
+
+        invoice.refresh_from_db()
+        summary = invoice.line_items.aggregate(
+            start_date=Min("start_date"), end_date=Max("end_date"), count=Count("id")
+        )
+        assert invoice.line_item_count == summary["count"] > 0
+        assert invoice.start_date == summary["start_date"]
+        assert invoice.end_date == summary["end_date"]
+
+    def test_draft_invoice_does_not_write(self, draft_invoice_test_common_setup):
+        setup_dict = draft_invoice_test_common_setup(auth_method="api_key")
+        setup_dict["org"].tax_rate = Decimal("10")
+        setup_dict["org"].save()
+        sub_records = SubscriptionRecord.objects.filter(
+            pk=setup_dict["subscription_record"].pk
+        )
+        prev_invoices_len = Invoice.objects.count()
+        prev_line_items_len = InvoiceLineItem.objects.count()
+
+        (draft_invoice,) = generate_invoice(sub_records, draft=True)
+
+        assert draft_invoice.pk is None
+        assert Invoice.objects.count() == prev_invoices_len
+        assert InvoiceLineItem.objects.count() == prev_line_items_len
+        data = DraftInvoiceSerializer(draft_invoice).data
+        assert data["cost_due"] == draft_invoice.cost_due
+        grouped_total = sum(x["subtotal"] for x in data["line_items"])
+        assert abs(grouped_total - draft_invoice.cost_due) < Decimal("0.01")
+
+        (invoice,) = generate_invoice(sub_records, draft=False)
+        assert invoice.cost_due == draft_invoice.cost_due
+
+
+@pytest.mark.django_db(transaction=True)
+class TestInvoiceNumberCounter:
+    def test_reserve_blocks_of_invoice_numbers(self, draft_invoice_test_common_setup):
+        setup_dict = draft_invoice_test_common_setup(auth_method="api_key")
+        org = setup_dict["org"]
+        issue_date = now_utc()
+        prefix = issue_date.strftime("%y%m%d")
+
+        first = Invoice.generate_invoice_numbers(org, issue_date)
+        block = InvoiceNumberCounter.reserve(org.pk, issue_date, n=3)
+        last = Invoice.generate_invoice_numbers(org, issue_date)
+
+        numbers = first + block + last
+        assert numbers == [f"{prefix}-{i:06d}" for i in range(1, 6)]
+        assert InvoiceNumberCounter.objects.get(organization=org).last_number == 5
+
+    def test_counter_continues_after_existing_invoices(
+        self, draft_invoice_test_common_setup
+    ):
+        setup_dict = draft_invoice_test_common_setup(auth_method="api_key")
+        org = setup_dict["org"]
+        issue_date = now_utc()
+        prefix = issue_date.strftime("%y%m%d")
+        Invoice.objects.create(
+            organization=org,
+            customer=setup_dict["customer"],
+            issue_date=issue_date,
+            invoice_number=f"{prefix}-000007",
+        )
+
+        (invoice_number,) = Invoice.generate_invoice_numbers(org, issue_date)
+
+        assert invoice_number == f"{prefix}-000008"
+
+    def test_invoice_number_pool_uses_reserved_block(
+        self, draft_invoice_test_common_setup
+    ):
+        setup_dict = draft_invoice_test_common_setup(auth_method="api_key")
+        org = setup_dict["org"]
+        issue_date = now_utc()
+        pool = InvoiceNumberPool()
+        pool.reserve(org.pk, issue_date, 2)
+
+        (invoice,) = generate_invoice(
+            SubscriptionRecord.objects.filter(pk=setup_dict["subscription_record"].pk),
+            issue_date=issue_date,
+            invoice_number_pool=pool,
+        )
+        (other_number,) = Invoice.generate_invoice_numbers(org, issue_date)
+
+        prefix = issue_date.strftime("%y%m%d")
+        assert invoice.invoice_number == f"{prefix}-000001"
+        assert other_number == f"{prefix}-000003"
+
+
+@pytest.mark.django_db(transaction=True)
+class TestListInvoices:
+    def test_paginated_list_walks_every_invoice_once(
+        self, draft_invoice_test_common_setup
+    ):
+        setup_dict = draft_invoice_test_common_setup(auth_method="api_key")
+        generate_invoice(
+            SubscriptionRecord.objects.filter(pk=setup_dict["subscription_record"].pk),
+            draft=False,
+        )
+        # ties on issue_date are broken by id
+        baker.make(
+            Invoice,
+            organization=setup_dict["org"],
+            customer=setup_dict["customer"],
+            issue_date=now_utc() - timedelta(days=1),
+            payment_status=Invoice.PaymentStatus.PAID,
+            invoice_number="",
+            _quantity=4,
+        )
+        invoice_ids = set(
+            Invoice.objects.filter(organization=setup_dict["org"]).values_list(
+                "invoice_id", flat=True
+            )
+        )
+
+        seen = []
+        payload = {"page_size": 2, "payment_status": ["paid", "unpaid"]}
+        while True:
+            response = setup_dict["client"].get(reverse("invoice-list"), payload)
+            assert response.status_code == status.HTTP_200_OK
+            for invoice in response.data["results"]:
+                assert "line_items" not in invoice
+                assert "line_item_count" in invoice
+                seen.append(invoice["invoice_id"])
+            if response.data["next"] is None:
+                break
+            payload["cursor"] = response.data["next"]
+
+        assert len(seen) == len(invoice_ids) == 5
+        assert {x.replace("invoice_", "") for x in seen} == {x.hex for x in invoice_ids}
+
+    def test_paginated_list_expands_line_items(self, draft_invoice_test_common_setup):
+        setup_dict = draft_invoice_test_common_setup(auth_method="api_key")
+        (invoice,) = generate_invoice(
+            SubscriptionRecord.objects.filter(pk=setup_dict["subscription_record"].pk),
+            draft=False,
+        )
+        payload = {
+            "page_size": 10,
+            "payment_status": ["paid", "unpaid"],
+            "expand": ["line_items"],
+        }
+
+        response = setup_dict["client"].get(reverse("invoice-list"), payload)
+
+        assert response.status_code == status.HTTP_200_OK
+        (result,) = response.data["results"]
+        assert len(result["line_items"]) == result["line_item_count"]
+        assert result["line_item_count"] == invoice.line_items.count()
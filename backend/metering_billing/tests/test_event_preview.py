@@ -1,5 +1,10 @@
+from datetime import timedelta
+
 import pytest
 from django.urls import reverse
+from metering_billing.models import Event
+from metering_billing.utils import now_utc
+from model_bakery import baker
 from rest_framework import status
 from rest_framework.test import APIClient
 
@@ -77,3 +82,112 @@ class TestEventPreview:
         data = response.json()
         events = data["results"]
         assert len(events) == 10
+
+    def test_pages_forward_and_back_without_repeats(
+        self, event_preview_test_common_setup
+    ):
+        setup_dict = event_preview_test_common_setup(
+            num_subscriptions=0,
+            auth_method="session_auth",
+            user_org_and_api_key_org_different=False,
+        )
+        # events ingested in a batch share a timestamp
+        baker.make(
+            Event,
+            organization=setup_dict["org"],
+            cust_id=setup_dict["customer"].customer_id,
+            time_created=now_utc() - timedelta(hours=1),
+            _quantity=25,
+        )
+
+        pages = []
+        payload = {}
+        while True:
+            response = setup_dict["client"].get(reverse("event-list"), payload)
+            assert response.status_code == status.HTTP_200_OK
+            data = response.json()
+            pages.append([x["idempotency_id"] for x in data["results"]])
+            if data["next"] is None:
+                break
+            payload = {"c": data["next"]}
+
+        assert [len(x) for x in pages] == [10, 10, 5]
+        assert len({x for page in pages for x in page}) == 25
+
+        response = setup_dict["client"].get(
+            reverse("event-list"), {"c": data["previous"]}
+        )
+        data = response.json()
+        assert [x["idempotency_id"] for x in data["results"]] == pages[1]
+        response = setup_dict["client"].get(
+            reverse("event-list"), {"c": data["previous"]}
+        )
+        data = response.json()
+        assert [x["idempotency_id"] for x in data["results"]] == pages[0]
+        assert data["previous"] is None
+
+    def test_filters_on_time_window_customer_and_event_name(
+        self, event_preview_test_common_setup
+    ):
+        setup_dict = event_preview_test_common_setup(
+            num_subscriptions=0,
+            auth_method="session_auth",
+            user_org_and_api_key_org_different=False,
+        )
+        org = setup_dict["org"]
+        customer_id = setup_dict["customer"].customer_id
+        baker.make(
+            Event,
+            organization=org,
+            cust_id=customer_id,
+            event_name="email_sent",
+            time_created=now_utc() - timedelta(hours=1),
+            _quantity=3,
+        )
+        baker.make(
+            Event,
+            organization=org,
+            cust_id="someone_else",
+            event_name="email_sent",
+            time_created=now_utc() - timedelta(hours=1),
+            _quantity=2,
+        )
+        baker.make(
+            Event,
+            organization=org,
+            cust_id=customer_id,
+            event_name="api_call",
+            time_created=now_utc() - timedelta(hours=1),
+            _quantity=4,
+        )
+        # outside of the default window
+        baker.make(
+            Event,
+            organization=org,
+            cust_id=customer_id,
+            event_name="email_sent",
+            time_created=now_utc() - timedelta(days=30),
+            _quantity=5,
+        )
+
+        def count_events(payload):
+            payload = {"page_size": 100, **payload}
+            response = setup_dict["client"].get(reverse("event-list"), payload)
+            assert response.status_code == status.HTTP_200_OK
+            return len(response.json()["results"])
+
+        assert count_events({}) == 9
+        assert count_events({"customer_id": customer_id}) == 7
+        assert count_events({"event_name": "email_sent"}) == 5
+        assert (
+            count_events({"customer_id": customer_id, "event_name": "email_sent"}) == 3
+        )
+        assert (
+            count_events(
+                {
+                    "start_date": (now_utc() - timedelta(days=60)).isoformat(),
+                    "event_name": "email_sent",
+                }
+            )
+            == 10
+        )
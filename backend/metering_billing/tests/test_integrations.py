@@ -7,6 +7,7 @@ import pytest
 import stripe
 from django.conf import settings
 from django.db.models import Q
+from django.urls import reverse
 from metering_billing.invoice import generate_invoice
 from metering_billing.models import (
     Customer,
@@ -14,9 +15,16 @@ from metering_billing.models import (
     Invoice,
     SubscriptionRecord,
 )
-from metering_billing.payment_processors import PAYMENT_PROCESSOR_MAP
+from metering_billing.payment_processors import (
+    PAYMENT_PROCESSOR_MAP,
+    APIClientRegistry,
+    api_clients,
+)
+from metering_billing.tasks import update_invoice_status_inner
+from metering_billing.views.webhook_views import _customer_updated_handler
 from metering_billing.utils import now_utc
 from metering_billing.utils.enums import PAYMENT_PROCESSORS
+from model_bakery import baker
 from rest_framework.test import APIClient
 
 STRIPE_TEST_SECRET_KEY = settings.STRIPE_TEST_SECRET_KEY
@@ -512,3 +520,317 @@ class TestBraintreeIntegration:
             .status
         )
         assert new_status == braintree.Transaction.Status.Voided
+
+
+@pytest.mark.django_db(transaction=True)
+class TestUpdateInvoiceStatus:
+    def test_open_invoices_are_polled_concurrently(
+        self, generate_org_and_api_key, add_customers_to_org, fake_payment_processor
+    ):
+        org, _ = generate_org_and_api_key()
+        (customer,) = add_customers_to_org(org, n=1)
+        invoices = baker.make(
+            Invoice,
+            organization=org,
+            customer=customer,
+            cost_due=10,
+            payment_status=Invoice.PaymentStatus.UNPAID,
+            external_payment_obj_type=PAYMENT_PROCESSORS.STRIPE,
+            external_payment_obj_id=iter([f"in_{i}" for i in range(10)]),
+            _quantity=10,
+        )
+        fake_payment_processor.paid_ids = {"in_0", "in_3"}
+
+        paid_invoices = update_invoice_status_inner()
+
+        assert sorted(fake_payment_processor.lookups) == sorted(
+            invoice.external_payment_obj_id for invoice in invoices
+        )
+        assert fake_payment_processor.max_in_flight > 1
+        assert {invoice.external_payment_obj_id for invoice in paid_invoices} == {
+            "in_0",
+            "in_3",
+        }
+        assert (
+            Invoice.objects.filter(payment_status=Invoice.PaymentStatus.PAID).count()
+            == 2
+        )
+        paid_invoice = Invoice.objects.get(external_payment_obj_id="in_0")
+        assert paid_invoice.history.first().payment_status == (
+            Invoice.PaymentStatus.PAID
+        )
+
+    def test_old_open_stripe_invoices_are_retrieved_by_id(
+        self, generate_org_and_api_key, monkeypatch
+    ):
+        from types import SimpleNamespace
+
+        org, _ = generate_org_and_api_key()
+        now = now_utc()
+        list_calls = []
+        retrieved = []
+
+        def list_invoices(**kwargs):
+            list_calls.append(kwargs["created"]["gte"])
+            paid = [SimpleNamespace(id="in_recent_paid")]
+            return SimpleNamespace(auto_paging_iter=lambda: iter(paid))
+
+        def retrieve_invoice(payment_object_id, **kwargs):
+            retrieved.append(payment_object_id)
+            return SimpleNamespace(status="open")
+
+        monkeypatch.setattr(stripe.Invoice, "list", list_invoices)
+        monkeypatch.setattr(stripe.Invoice, "retrieve", retrieve_invoice)
+        stripe_connector = PAYMENT_PROCESSOR_MAP[PAYMENT_PROCESSORS.STRIPE]
+        monkeypatch.setattr(stripe_connector, "self_hosted", True)
+        created_at = {
+            "in_recent_paid": now - timedelta(days=1),
+            "in_recent_open": now - timedelta(days=2),
+            "in_old_open": now - timedelta(days=365),
+        }
+
+        statuses = stripe_connector.update_payment_object_statuses(
+            org, list(created_at), created_at=created_at
+        )
+
+        assert statuses == {
+            "in_recent_paid": Invoice.PaymentStatus.PAID,
+            "in_recent_open": Invoice.PaymentStatus.UNPAID,
+            "in_old_open": Invoice.PaymentStatus.UNPAID,
+        }
+        assert retrieved == ["in_old_open"]
+        # the listing starts from the recent invoices, not from the year old one
+        assert list_calls == [int((now - timedelta(days=3)).timestamp())]
+
+
+@pytest.mark.django_db(transaction=True)
+class TestStripeImport:
+    def test_import_customers_in_pages(
+        self, generate_org_and_api_key, add_customers_to_org, fake_stripe
+    ):
+        org, _ = generate_org_and_api_key()
+        (existing_customer,) = add_customers_to_org(org, n=1)
+        existing_customer.email = "existing@example.com"
+        existing_customer.save()
+        fake_stripe.add_customer(email="existing@example.com")
+        for i in range(249):
+            fake_stripe.add_customer(email=f"{i}@example.com", name=f"customer {i}")
+        # the same email twice is imported once
+        fake_stripe.add_customer(email="0@example.com")
+        stripe_connector = PAYMENT_PROCESSOR_MAP[PAYMENT_PROCESSORS.STRIPE]
+
+        assert stripe_connector.import_customers(org) == 249
+
+        assert len(fake_stripe.requests) == 3
+        assert Customer.objects.filter(organization=org).count() == 250
+        existing_customer.refresh_from_db()
+        assert existing_customer.payment_provider == PAYMENT_PROCESSORS.STRIPE
+        new_customer = Customer.objects.get(organization=org, email="10@example.com")
+        assert new_customer.customer_name == "customer 10"
+        assert new_customer.stripe_integration.stripe_customer_id == "cus_11"
+        assert new_customer.default_currency == org.default_currency
+        assert new_customer.history.count() == 1
+
+        # importing again doesn't duplicate anything
+        assert stripe_connector.import_customers(org) == 0
+        assert Customer.objects.filter(organization=org).count() == 250
+
+    def test_interrupted_import_resumes_after_last_page(
+        self, generate_org_and_api_key, fake_stripe
+    ):
+        org, _ = generate_org_and_api_key()
+        for i in range(250):
+            fake_stripe.add_customer(email=f"{i}@example.com")
+        fake_stripe.fail_on_request = 1
+        stripe_connector = PAYMENT_PROCESSOR_MAP[PAYMENT_PROCESSORS.STRIPE]
+
+        assert stripe_connector.import_customers(org) == 100
+
+        fake_stripe.fail_on_request = None
+        fake_stripe.requests = []
+        assert stripe_connector.import_customers(org) == 150
+        assert fake_stripe.requests == ["cus_99", "cus_199"]
+        assert Customer.objects.filter(organization=org).count() == 250
+
+        # a finished import starts from the beginning the next time
+        fake_stripe.requests = []
+        assert stripe_connector.import_customers(org) == 0
+        assert fake_stripe.requests == [None, "cus_99", "cus_199"]
+
+    def test_import_payment_objects_in_pages(
+        self, generate_org_and_api_key, fake_stripe
+    ):
+        org, _ = generate_org_and_api_key()
+        stripe_customers = [
+            fake_stripe.add_customer(email=f"{i}@example.com") for i in range(3)
+        ]
+        stripe_connector = PAYMENT_PROCESSOR_MAP[PAYMENT_PROCESSORS.STRIPE]
+        stripe_connector.import_customers(org)
+        issue_date = now_utc() - timedelta(days=3)
+        for i in range(150):
+            fake_stripe.add_invoice(stripe_customers[i % 3].id, 1000, issue_date)
+        # invoices of customers that aren't in Lotus are skipped
+        fake_stripe.add_invoice("cus_unknown", 1000, issue_date)
+        fake_stripe.requests = []
+
+        imported_invoices = stripe_connector.import_payment_objects(org)
+
+        assert len(fake_stripe.requests) == 2
+        assert sum(len(v) for v in imported_invoices.values()) == 150
+        invoices = Invoice.objects.filter(organization=org)
+        assert invoices.count() == 150
+        assert len({invoice.invoice_number for invoice in invoices}) == 150
+        invoice = invoices.get(external_payment_obj_id="in_0")
+        assert invoice.cost_due == 10
+        assert invoice.currency == org.default_currency
+        assert invoice.customer.stripe_integration.stripe_customer_id == "cus_0"
+
+        assert stripe_connector.import_payment_objects(org) == {}
+        assert Invoice.objects.filter(organization=org).count() == 150
+
+
+@pytest.mark.django_db(transaction=True)
+class TestStripeCustomerState:
+    def test_customer_state_is_kept_locally(
+        self, generate_org_and_api_key, api_client_with_api_key_auth, fake_stripe
+    ):
+        org, key = generate_org_and_api_key()
+        stripe_customer = fake_stripe.add_customer(
+            email="paying@example.com",
+            address={
+                "city": "San Francisco",
+                "country": "US",
+                "line1": "1 Market St",
+                "line2": None,
+                "postal_code": "94105",
+                "state": "CA",
+            },
+            default_payment_method="pm_card_visa",
+        )
+        fake_stripe.add_customer(email="free@example.com")
+        stripe_connector = PAYMENT_PROCESSOR_MAP[PAYMENT_PROCESSORS.STRIPE]
+
+        # importing stores the state of the imported customers
+        stripe_connector.import_customers(org)
+        customer = Customer.objects.get(organization=org, email="paying@example.com")
+        assert customer.stripe_integration.has_payment_method
+        assert customer.get_billing_address().city == "San Francisco"
+        assert customer.get_shipping_address() is None
+
+        # listing customers doesn't call out to stripe
+        client = api_client_with_api_key_auth(key)
+        response = client.get(reverse("customer-list"))
+        assert response.status_code == 200
+        (customer_data,) = [
+            x for x in response.data if x["email"] == "paying@example.com"
+        ]
+        assert customer_data["has_payment_method"]
+        assert customer_data["payment_provider_id"] == stripe_customer.id
+        assert customer_data["billing_address"]["postal_code"] == "94105"
+        assert fake_stripe.retrieved == []
+
+        # the periodic sync picks up changes of the linked customers only
+        stripe_customer["invoice_settings"]["default_payment_method"] = None
+        fake_stripe.add_customer(email="not-imported@example.com")
+        assert stripe_connector.sync_customers(org) == 2
+        assert sorted(fake_stripe.retrieved) == ["cus_0", "cus_1"]
+        customer.stripe_integration.refresh_from_db()
+        assert not customer.stripe_integration.has_payment_method
+        assert customer.stripe_integration.synced_at is not None
+
+    def test_customer_webhook_updates_state(
+        self, generate_org_and_api_key, fake_stripe
+    ):
+        org, _ = generate_org_and_api_key()
+        stripe_customer = fake_stripe.add_customer(email="paying@example.com")
+        stripe_connector = PAYMENT_PROCESSOR_MAP[PAYMENT_PROCESSORS.STRIPE]
+        stripe_connector.import_customers(org)
+        customer = Customer.objects.get(organization=org, email="paying@example.com")
+        assert not customer.stripe_integration.has_payment_method
+
+        stripe_customer["invoice_settings"]["default_payment_method"] = "pm_card_visa"
+        _customer_updated_handler(
+            {"type": "customer.updated", "data": {"object": stripe_customer}}
+        )
+
+        customer.stripe_integration.refresh_from_db()
+        assert customer.stripe_integration.has_payment_method
+
+
+class TestAPIClientRegistry:
+    def test_least_recently_used_client_is_dropped(self):
+        registry = APIClientRegistry(max_size=2, max_age=60)
+        builds = []
+
+        def build(key):
+            builds.append(key)
+            return object()
+
+        client_a = registry.get("a", "credentials", lambda: build("a"))
+        registry.get("b", "credentials", lambda: build("b"))
+        assert registry.get("a", "credentials", lambda: build("a")) is client_a
+        registry.get("c", "credentials", lambda: build("c"))
+        registry.get("b", "credentials", lambda: build("b"))
+        assert builds == ["a", "b", "c", "b"]
+
+    def test_client_is_rebuilt_when_too_old(self):
+        registry = APIClientRegistry(max_size=2, max_age=0)
+        client = registry.get("a", "credentials", object)
+        assert registry.get("a", "credentials", object) is not client
+
+    @pytest.mark.django_db(transaction=True)
+    def test_braintree_gateway_is_reused_until_credentials_change(
+        self, generate_org_and_api_key, monkeypatch
+    ):
+        org, _ = generate_org_and_api_key()
+        braintree_connector = PAYMENT_PROCESSOR_MAP[PAYMENT_PROCESSORS.BRAINTREE]
+        monkeypatch.setattr(braintree_connector, "self_hosted", True)
+        for environment in ["live", "test"]:
+            monkeypatch.setattr(
+                braintree_connector, f"{environment}_merchant_id", "merchant_id"
+            )
+            monkeypatch.setattr(
+                braintree_connector, f"{environment}_public_key", "public_key"
+            )
+            monkeypatch.setattr(
+                braintree_connector, f"{environment}_private_key", "private_key"
+            )
+        api_clients.clear()
+
+        gateway = braintree_connector._get_gateway(org)
+        assert braintree_connector._get_gateway(org) is gateway
+
+        monkeypatch.setattr(braintree_connector, "live_private_key", "rotated_key")
+        monkeypatch.setattr(braintree_connector, "test_private_key", "rotated_key")
+        new_gateway = braintree_connector._get_gateway(org)
+        assert new_gateway is not gateway
+        assert new_gateway.config.private_key == "rotated_key"
+
+    def test_cached_braintree_gateway_reuses_its_session(self, monkeypatch):
+        import requests
+        from types import SimpleNamespace
+
+        from metering_billing.payment_processors import PooledBraintreeConfiguration
+
+        gateway = braintree.BraintreeGateway(
+            PooledBraintreeConfiguration(
+                braintree.Environment.Sandbox,
+                merchant_id="merchant_id",
+                public_key="public_key",
+                private_key="private_key",
+            )
+        )
+        sessions = []
+
+        def send(session, request, **kwargs):
+            sessions.append(session)
+            return SimpleNamespace(status_code=404, text="")
+
+        monkeypatch.setattr(requests.Session, "send", send)
+        for customer_id in ["cus_1", "cus_2"]:
+            with pytest.raises(braintree.exceptions.NotFoundError):
+                gateway.customer.find(customer_id)
+
+        assert len(sessions) == 2
+        assert sessions[0] is sessions[1]
+        assert gateway.config.http() is gateway.config.http()
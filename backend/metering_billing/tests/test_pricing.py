@@ -0,0 +1,126 @@
+import itertools
+import math
+import random
+from decimal import Decimal
+
+from metering_billing.models import PriceTier
+from metering_billing.pricing import TierSchedule
+from metering_billing.utils import convert_to_decimal
+
+
+def reference_tier_revenue(tier, usage, prev_tier_end=False):
+    # the tier arithmetic as it was before tier schedules were compiled
+    revenue = 0
+    discontinuous_range = (
+        prev_tier_end != tier.range_start and prev_tier_end is not None
+    )
+    usage = convert_to_decimal(usage)
+    usage_in_range = (
+        tier.range_start <= usage
+        if discontinuous_range
+        else tier.range_start < usage or tier.range_start == 0
+    )
+    if usage_in_range:
+        if tier.type == PriceTier.PriceTierType.FLAT:
+            revenue += tier.cost_per_batch
+        elif tier.type == PriceTier.PriceTierType.PER_UNIT:
+            if tier.range_end is not None:
+                billable_units = min(
+                    usage - tier.range_start, tier.range_end - tier.range_start
+                )
+            else:
+                billable_units = usage - tier.range_start
+            if discontinuous_range:
+                billable_units += 1
+            billable_batches = billable_units / tier.metric_units_per_batch
+            if tier.batch_rounding_type == PriceTier.BatchRoundingType.ROUND_UP:
+                billable_batches = math.ceil(billable_batches)
+            elif tier.batch_rounding_type == PriceTier.BatchRoundingType.ROUND_DOWN:
+                billable_batches = math.floor(billable_batches)
+            elif tier.batch_rounding_type == PriceTier.BatchRoundingType.ROUND_NEAREST:
+                billable_batches = round(billable_batches)
+            revenue += tier.cost_per_batch * billable_batches
+    return revenue
+
+
+def reference_revenue(tiers, usage, quantize_tiers=False):
+    revenue = Decimal(0) if quantize_tiers else 0
+    for i, tier in enumerate(tiers):
+        if i > 0:
+            tier_revenue = reference_tier_revenue(
+                tier, usage, prev_tier_end=tiers[i - 1].range_end
+            )
+        else:
+            tier_revenue = reference_tier_revenue(tier, usage)
+        revenue += convert_to_decimal(tier_revenue) if quantize_tiers else tier_revenue
+    return revenue
+
+
+def make_tiers(breakpoints, types, rounding, gap):
+    tiers = []
+    starts = [Decimal(0)] + [Decimal(b) + gap for b in breakpoints]
+    ends = [Decimal(b) for b in breakpoints] + [None]
+    for start, end, tier_type in zip(starts, ends, itertools.cycle(types)):
+        tiers.append(
+            PriceTier(
+                type=tier_type,
+                range_start=start,
+                range_end=end,
+                cost_per_batch=Decimal("0.3333333333"),
+                metric_units_per_batch=Decimal(3),
+                batch_rounding_type=rounding,
+            )
+        )
+    return tiers
+
+
+class TestTierSchedule:
+    def test_matches_reference_arithmetic(self):
+        rng = random.Random(0)
+        usages = [Decimal(0), Decimal(5), Decimal(10), Decimal(11)] + [
+            Decimal(rng.randint(0, 20000)) / 7 for _ in range(200)
+        ]
+        for breakpoints, types, rounding, gap in itertools.product(
+            [[], [10], [10, 100, 1000]],
+            [
+                [PriceTier.PriceTierType.FREE, PriceTier.PriceTierType.PER_UNIT],
+                [PriceTier.PriceTierType.PER_UNIT, PriceTier.PriceTierType.FLAT],
+            ],
+            [None, *PriceTier.BatchRoundingType.values],
+            [Decimal(0), Decimal(1)],
+        ):
+            tiers = make_tiers(breakpoints, types, rounding, gap)
+            schedule = TierSchedule(tiers)
+            for usage in usages:
+                for quantize_tiers in [False, True]:
+                    expected = reference_revenue(tiers, usage, quantize_tiers)
+                    actual = schedule.revenue(usage, quantize_tiers=quantize_tiers)
+                    assert actual == expected
+                    assert str(convert_to_decimal(actual)) == str(
+                        convert_to_decimal(expected)
+                    )
+
+    def test_revenue_many_matches_single(self):
+        tiers = make_tiers(
+            [10, 100],
+            [PriceTier.PriceTierType.FREE, PriceTier.PriceTierType.PER_UNIT],
+            None,
+            Decimal(0),
+        )
+        schedule = TierSchedule(tiers)
+        usages = [Decimal(x) for x in range(0, 200, 3)]
+        assert schedule.revenue_many(usages, quantize_tiers=True) == [
+            schedule.revenue(x, quantize_tiers=True) for x in usages
+        ]
+
+    def test_tier_order_does_not_matter(self):
+        tiers = make_tiers(
+            [10, 100],
+            [PriceTier.PriceTierType.PER_UNIT, PriceTier.PriceTierType.FLAT],
+            PriceTier.BatchRoundingType.ROUND_UP,
+            Decimal(1),
+        )
+        in_order = TierSchedule(tiers)
+        reversed_order = TierSchedule(list(reversed(tiers)))
+        for usage in [Decimal(x) for x in range(0, 300, 7)]:
+            assert in_order.revenue(usage) == reversed_order.revenue(usage)
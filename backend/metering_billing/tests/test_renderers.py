@@ -0,0 +1,90 @@
+import datetime
+import io
+import json
+import uuid
+from decimal import Decimal
+
+import pytest
+import pytz
+from django.utils.translation import gettext_lazy as _
+from metering_billing.serializers.response_serializers import CostAnalysisSerializer
+from metering_billing.models import Invoice
+from metering_billing.renderers import ORJSONParser, ORJSONRenderer
+from metering_billing.utils.enums import PAYMENT_PROCESSORS
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+
+@pytest.fixture
+def payload():
+    return {
+        "numbers": [1, 2.5, 0.1 + 0.2, Decimal("10.50"), None, True],
+        "created": datetime.datetime(2023, 1, 2, 3, 4, 5, 123456, tzinfo=pytz.utc),
+        "local": pytz.timezone("US/Eastern").localize(
+            datetime.datetime(2023, 1, 2, 3, 4, 5)
+        ),
+        "date": datetime.date(2023, 1, 1),
+        "id": uuid.UUID("5a787575-87fd-4ded-8b3f-84e6b9db332c"),
+        "processor": PAYMENT_PROCESSORS.STRIPE,
+        "status": Invoice.PaymentStatus.PAID,
+        "label": _("paid"),
+        "text": "héllo   wörld",
+        1: "int key",
+        "duration": datetime.timedelta(seconds=90),
+        "nested": {"tuple": (1, 2)},
+    }
+
+
+class TestORJSONRenderer:
+    def test_output_matches_json_renderer(self, payload):
+        assert ORJSONRenderer().render(payload) == JSONRenderer().render(payload)
+
+    def test_wide_integers_fall_back_to_json_renderer(self, payload):
+        payload["nested"]["huge"] = 2**70
+        assert ORJSONRenderer().render(payload) == JSONRenderer().render(payload)
+
+    def test_indented_output_matches_json_renderer(self, payload):
+        media_type = "application/json; indent=4"
+        assert ORJSONRenderer().render(payload, media_type) == JSONRenderer().render(
+            payload, media_type
+        )
+
+    def test_non_finite_floats_are_null(self):
+        data = {"nan": float("nan"), "inf": float("inf"), "big": 1e16}
+        assert ORJSONRenderer().render(data) == b'{"nan":null,"inf":null,"big":1e16}'
+
+    def test_validated_data_is_normalized_at_render_time(self):
+        serializer = CostAnalysisSerializer(
+            data={
+                "per_day": [
+                    {
+                        "date": datetime.date(2023, 1, 1),
+                        "cost_data": [],
+                        "revenue": Decimal("12.5"),
+                    }
+                ],
+                "total_cost": Decimal("0"),
+                "total_revenue": Decimal("12.5"),
+                "margin": Decimal("1"),
+            }
+        )
+        serializer.is_valid(raise_exception=True)
+        assert json.loads(ORJSONRenderer().render(serializer.validated_data)) == {
+            "per_day": [{"date": "2023-01-01", "cost_data": [], "revenue": 12.5}],
+            "total_cost": 0.0,
+            "total_revenue": 12.5,
+            "margin": 1.0,
+        }
+
+
+class TestORJSONParser:
+    def test_parses_like_json_parser(self, payload):
+        body = JSONRenderer().render(payload)
+        assert ORJSONParser().parse(io.BytesIO(body)) == JSONParser().parse(
+            io.BytesIO(body)
+        )
+
+    def test_invalid_json_is_a_parse_error(self):
+        with pytest.raises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'{"event_name": '))
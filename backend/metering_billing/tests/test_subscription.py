@@ -9,11 +9,13 @@ from metering_billing.aggregation.billable_metrics import METRIC_HANDLER_MAP
 from metering_billing.models import (
     Event,
     Invoice,
+    InvoicingJob,
     Metric,
     Plan,
     PlanComponent,
     PlanVersion,
     PriceTier,
+    RecurringCharge,
     SubscriptionRecord,
 )
 from metering_billing.serializers.serializer_utils import DjangoJSONEncoder
@@ -22,6 +24,7 @@ from metering_billing.utils.enums import (
     CHARGEABLE_ITEM_TYPE,
     FLAT_FEE_BEHAVIOR,
     INVOICING_BEHAVIOR,
+    INVOICING_JOB_STATUS,
     PLAN_DURATION,
     PLAN_STATUS,
     USAGE_BEHAVIOR,
@@ -234,6 +237,108 @@ class TestCreateSubscription:
         assert len(response.data) > 0  # check that the response is not empty
         assert len(get_subscription_records_in_org(setup_dict["org"])) == 1
 
+    def test_batch_create_subscriptions_reports_overlaps(
+        self,
+        subscription_test_common_setup,
+        get_subscription_records_in_org,
+        add_customers_to_org,
+    ):
+        num_subscriptions = 0
+        setup_dict = subscription_test_common_setup(
+            num_subscriptions=num_subscriptions,
+            auth_method="api_key",
+            user_org_and_api_key_org_different=False,
+        )
+        customers = add_customers_to_org(setup_dict["org"], n=2)
+
+        payload = {
+            "subscriptions": [
+                setup_dict["payload"],
+                {**setup_dict["payload"], "customer_id": customers[0].customer_id},
+                {**setup_dict["payload"], "customer_id": customers[1].customer_id},
+                setup_dict["payload"],
+            ]
+        }
+        response = setup_dict["client"].post(
+            reverse("subscription-add-batch"),
+            data=json.dumps(payload, cls=DjangoJSONEncoder),
+            content_type="application/json",
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        assert [
+            x["customer"]["customer_id"] for x in response.data["subscriptions"]
+        ] == [
+            setup_dict["customer"].customer_id,
+            customers[0].customer_id,
+            customers[1].customer_id,
+        ]
+        assert set(response.data["errors"]) == {3}
+        assert len(get_subscription_records_in_org(setup_dict["org"])) == 3
+
+        response = setup_dict["client"].post(
+            reverse("subscription-add-batch"),
+            data=json.dumps(payload, cls=DjangoJSONEncoder),
+            content_type="application/json",
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert len(response.data["errors"]) == 4
+        assert len(get_subscription_records_in_org(setup_dict["org"])) == 3
+
+    def test_batch_invoicing_failure_is_reported_per_customer(
+        self,
+        subscription_test_common_setup,
+        get_subscription_records_in_org,
+        add_customers_to_org,
+        monkeypatch,
+    ):
+        from metering_billing import invoice
+
+        setup_dict = subscription_test_common_setup(
+            num_subscriptions=0,
+            auth_method="api_key",
+            user_org_and_api_key_org_different=False,
+        )
+        billing_plan = setup_dict["billing_plan"]
+        RecurringCharge.objects.create(
+            organization=setup_dict["org"],
+            plan_version=billing_plan,
+            charge_timing=RecurringCharge.ChargeTimingType.IN_ADVANCE,
+            amount=30,
+            pricing_unit=billing_plan.pricing_unit,
+        )
+        (failing_customer,) = add_customers_to_org(setup_dict["org"], n=1)
+        generate_invoice = invoice.generate_invoice
+
+        def fail_for_one_customer(subscription_records, **kwargs):
+            if subscription_records[0].customer == failing_customer:
+                raise ConnectionError("the payment processor is down")
+            return generate_invoice(subscription_records, **kwargs)
+
+        monkeypatch.setattr(invoice, "generate_invoice", fail_for_one_customer)
+
+        payload = {
+            "subscriptions": [
+                setup_dict["payload"],
+                {**setup_dict["payload"], "customer_id": failing_customer.customer_id},
+            ]
+        }
+        response = setup_dict["client"].post(
+            reverse("subscription-add-batch"),
+            data=json.dumps(payload, cls=DjangoJSONEncoder),
+            content_type="application/json",
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert len(response.data["subscriptions"]) == 2
+        assert set(response.data["errors"]) == {1}
+        assert len(get_subscription_records_in_org(setup_dict["org"])) == 2
+        assert Invoice.objects.filter(customer=setup_dict["customer"]).exists()
+        assert not Invoice.objects.filter(customer=failing_customer).exists()
+        assert all(
+            x.invoice_usage_charges
+            for x in get_subscription_records_in_org(setup_dict["org"])
+        )
+
 
 @pytest.mark.django_db(transaction=True)
 class TestUpdateSub:
@@ -261,6 +366,50 @@ class TestUpdateSub:
         assert response.status_code == status.HTTP_200_OK
         assert new_invoices_len == prev_invoices_len + 1
 
+    def test_end_subscription_returns_invoicing_job(
+        self, subscription_test_common_setup
+    ):
+        setup_dict = subscription_test_common_setup(
+            num_subscriptions=1, auth_method="session_auth"
+        )
+
+        params = {
+            "customer_id": setup_dict["customer"].customer_id,
+        }
+        payload = {
+            "flat_fee_behavior": FLAT_FEE_BEHAVIOR.CHARGE_FULL,
+            "invoicing_behavior": INVOICING_BEHAVIOR.INVOICE_NOW,
+        }
+        response = setup_dict["client"].post(
+            reverse("subscription-cancel") + "?" + urllib.parse.urlencode(params),
+            data=json.dumps(payload, cls=DjangoJSONEncoder),
+            content_type="application/json",
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        invoicing_job = InvoicingJob.objects.get(
+            invoicing_job_id=response["X-Invoicing-Job-Id"].replace("invjob_", "")
+        )
+        assert invoicing_job.status == INVOICING_JOB_STATUS.COMPLETED
+        (invoice,) = invoicing_job.invoices.all()
+        # no taxes or customer balances in play, so the prediction is exact
+        assert invoicing_job.predicted_cost_due == invoice.cost_due
+        assert (
+            response["X-Predicted-Invoice-Amount"]
+            == f"{invoicing_job.predicted_cost_due:.2f}"
+        )
+        assert SubscriptionRecord.objects.get(
+            pk=setup_dict["org_subscription"].pk
+        ).fully_billed
+
+        response = setup_dict["client"].get(
+            reverse("invoicing_job"),
+            {"invoicing_job_id": response["X-Invoicing-Job-Id"]},
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["status"] == INVOICING_JOB_STATUS.COMPLETED
+        assert len(response.data["invoices"]) == 1
+
     def test_end_subscription_dont_generate_invoice(
         self, subscription_test_common_setup
     ):
@@ -749,3 +898,52 @@ class TestRegressions:
             setup_dict["org"].update_subscription_filter_settings(["email"])
         except Exception as e:
             assert False, e
+
+
+@pytest.mark.django_db(transaction=True)
+class TestListSubscriptions:
+    def test_list_pages_follow_cursor(
+        self, subscription_test_common_setup, add_subscription_record_to_org
+    ):
+        setup_dict = subscription_test_common_setup(
+            num_subscriptions=0, auth_method="api_key"
+        )
+        now = now_utc()
+        # not started, active and ended, newest first
+        for start, end in [(20, 30), (-1, 10), (-20, -10)]:
+            add_subscription_record_to_org(
+                setup_dict["org"],
+                setup_dict["billing_plan"],
+                setup_dict["customer"],
+                start_date=now + timedelta(days=start),
+                end_date=now + timedelta(days=end),
+            )
+        params = {
+            "customer_id": setup_dict["customer"].customer_id,
+            "status": ["active", "ended", "not_started"],
+            "page_size": 2,
+        }
+
+        response = setup_dict["client"].get(reverse("subscription-list"), params)
+        assert response.status_code == status.HTTP_200_OK
+        first_page = response.json()
+        assert len(first_page["results"]) == 2
+        assert first_page["previous"] is None
+
+        response = setup_dict["client"].get(
+            reverse("subscription-list"), {**params, "cursor": first_page["next"]}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        second_page = response.json()
+        assert len(second_page["results"]) == 1
+        assert second_page["next"] is None
+        assert second_page["previous"] is not None
+        start_dates = [
+            x["start_date"] for x in first_page["results"] + second_page["results"]
+        ]
+        assert start_dates == sorted(start_dates, reverse=True)
+
+        response = setup_dict["client"].get(
+            reverse("subscription-list"), {**params, "status": ["ended"]}
+        )
+        assert len(response.json()["results"]) == 1
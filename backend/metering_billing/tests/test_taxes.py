@@ -0,0 +1,135 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from metering_billing.models import Address, Invoice, InvoiceLineItem, Organization
+from metering_billing.taxes import TaxRateService
+from metering_billing.tasks import calculate_invoice_inner
+from metering_billing.utils import now_utc
+from metering_billing.utils.enums import CHARGEABLE_ITEM_TYPE, TAX_PROVIDER
+from model_bakery import baker
+
+
+@pytest.fixture
+def tax_test_common_setup(
+    generate_org_and_api_key,
+    add_customers_to_org,
+    add_product_to_org,
+    add_plan_to_product,
+    add_plan_version_to_plan,
+    add_subscription_record_to_org,
+):
+    def do_tax_test_common_setup():
+        setup_dict = {}
+        org, _ = generate_org_and_api_key()
+        org.organization_type = Organization.OrganizationType.PRODUCTION
+        org.tax_providers = [TAX_PROVIDER.TAXJAR]
+        org.default_payment_provider = None
+        org.address = baker.make(
+            Address,
+            organization=org,
+            line1="1 Market St",
+            line2=None,
+            city="San Francisco",
+            state="CA",
+            postal_code="94105",
+            country="US",
+        )
+        org.save()
+        setup_dict["org"] = org
+        shipping_address = baker.make(
+            Address,
+            organization=org,
+            line1="350 5th Ave",
+            line2=None,
+            city="New York",
+            state="NY",
+            postal_code="10118",
+            country="US",
+        )
+        customers = add_customers_to_org(org, n=3)
+        for customer in customers:
+            customer.payment_provider = None
+            customer.shipping_address = shipping_address
+            customer.save()
+        setup_dict["customers"] = customers
+        product = add_product_to_org(org)
+        plan = add_plan_to_product(product)
+        plan_version = add_plan_version_to_plan(plan)
+        plan.display_version = plan_version
+        plan.save()
+        setup_dict["plan"] = plan
+        for customer in customers:
+            add_subscription_record_to_org(
+                org, plan_version, customer, now_utc() - timedelta(days=45)
+            )
+        return setup_dict
+
+    return do_tax_test_common_setup
+
+
+@pytest.mark.django_db(transaction=True)
+class TestTaxRateService:
+    def test_shared_address_and_code_is_one_lookup(
+        self, tax_test_common_setup, fake_taxjar
+    ):
+        setup_dict = tax_test_common_setup()
+        tax_rates = TaxRateService()
+        for customer in setup_dict["customers"]:
+            tax_rate, success = tax_rates.get_taxjar_tax_rate(
+                customer, setup_dict["org"], setup_dict["plan"], draft=False
+            )
+            assert success
+            assert tax_rate == Decimal("10.0")
+        assert len(fake_taxjar.orders) == 1
+
+        # a new service, e.g. the next chunk, is served by the process cache
+        TaxRateService().get_taxjar_tax_rate(
+            setup_dict["customers"][0], setup_dict["org"], setup_dict["plan"]
+        )
+        assert len(fake_taxjar.orders) == 1
+
+    def test_tax_code_is_part_of_the_lookup(self, tax_test_common_setup, fake_taxjar):
+        setup_dict = tax_test_common_setup()
+        customer = setup_dict["customers"][0]
+        plan = setup_dict["plan"]
+        fake_taxjar.rates[("10118", "31000")] = 0.05
+        tax_rates = TaxRateService()
+
+        tax_rate, _ = tax_rates.get_taxjar_tax_rate(customer, setup_dict["org"], plan)
+        assert tax_rate == Decimal("10.0")
+        plan.taxjar_code = "31000"
+        plan.save()
+        tax_rate, _ = tax_rates.get_taxjar_tax_rate(customer, setup_dict["org"], plan)
+        assert tax_rate == Decimal("5.00")
+        assert len(fake_taxjar.orders) == 2
+        assert fake_taxjar.orders[1]["line_items"][0]["product_tax_code"] == "31000"
+
+    def test_missing_address_skips_lookup(self, tax_test_common_setup, fake_taxjar):
+        setup_dict = tax_test_common_setup()
+        customer = setup_dict["customers"][0]
+        customer.shipping_address = None
+        customer.save()
+
+        tax_rate, success = TaxRateService().get_taxjar_tax_rate(
+            customer, setup_dict["org"], setup_dict["plan"]
+        )
+        assert not success
+        assert tax_rate == 0
+        assert len(fake_taxjar.orders) == 0
+
+    def test_billing_run_looks_up_each_rate_once(
+        self, tax_test_common_setup, fake_taxjar
+    ):
+        tax_test_common_setup()
+
+        calculate_invoice_inner(synchronous=True)
+
+        invoices = Invoice.objects.exclude(payment_status=Invoice.PaymentStatus.DRAFT)
+        assert invoices.count() == 3
+        assert len(fake_taxjar.orders) == 1
+        tax_line_items = InvoiceLineItem.objects.filter(
+            invoice__in=invoices, chargeable_item_type=CHARGEABLE_ITEM_TYPE.TAX
+        )
+        for line_item in tax_line_items:
+            assert line_item.name == "Tax - 10.00%"
@@ -1,11 +1,14 @@
 import json
 import uuid
+from datetime import timedelta
 
 import pytest
 from django.urls import reverse
+from model_bakery import baker
 from rest_framework import status
 
 from metering_billing.kafka.consumer import write_batch_events_to_db
+from metering_billing.models import Event
 from metering_billing.serializers.serializer_utils import DjangoJSONEncoder
 from metering_billing.utils import now_utc
 
@@ -178,3 +181,91 @@ class TestTrackEvent:
         assert [
             getattr(event, "idempotency_id") for event in customer_org_events
         ].count(idem2) == 1
+
+
+@pytest.mark.django_db
+class TestConfirmIdemsReceived:
+    def test_reports_only_missing_ids(self, track_event_test_common_setup):
+        setup_dict = track_event_test_common_setup(
+            idempotency_already_created=True, customer_id_exists=True
+        )
+        received = list(
+            Event.objects.filter(organization=setup_dict["org"]).values_list(
+                "idempotency_id", flat=True
+            )
+        )
+        missing = [str(uuid.uuid4()) for _ in range(3)]
+
+        response = setup_dict["client"].post(
+            reverse("verify_idems_received"),
+            data=json.dumps({"idempotency_ids": received + missing + missing[:1]}),
+            content_type="application/json",
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert sorted(response.json()["ids_not_found"]) == sorted(missing)
+
+    def test_respects_customer_and_lookback(self, track_event_test_common_setup):
+        setup_dict = track_event_test_common_setup(
+            idempotency_already_created=True, customer_id_exists=True
+        )
+        events = list(Event.objects.filter(organization=setup_dict["org"]))
+        old_event = baker.make(
+            Event,
+            organization=setup_dict["org"],
+            cust_id=setup_dict["customer_id"],
+            time_created=now_utc() - timedelta(days=60),
+        )
+        idempotency_ids = [x.idempotency_id for x in events] + [
+            old_event.idempotency_id
+        ]
+
+        response = setup_dict["client"].post(
+            reverse("verify_idems_received"),
+            data=json.dumps(
+                {"idempotency_ids": idempotency_ids, "customer_id": "someone_else"}
+            ),
+            content_type="application/json",
+        )
+        assert sorted(response.json()["ids_not_found"]) == sorted(idempotency_ids)
+
+        response = setup_dict["client"].post(
+            reverse("verify_idems_received"),
+            data=json.dumps(
+                {
+                    "idempotency_ids": idempotency_ids,
+                    "customer_id": setup_dict["customer_id"],
+                }
+            ),
+            content_type="application/json",
+        )
+        assert response.json()["ids_not_found"] == [old_event.idempotency_id]
+
+        response = setup_dict["client"].post(
+            reverse("verify_idems_received"),
+            data=json.dumps(
+                {"idempotency_ids": idempotency_ids, "number_days_lookback": 90}
+            ),
+            content_type="application/json",
+        )
+        assert response.json()["ids_not_found"] == []
+
+    def test_invalid_lookback_is_rejected(self, track_event_test_common_setup):
+        setup_dict = track_event_test_common_setup(
+            idempotency_already_created=True, customer_id_exists=True
+        )
+
+        for number_days_lookback in ["a month", 0]:
+            response = setup_dict["client"].post(
+                reverse("verify_idems_received"),
+                data=json.dumps(
+                    {
+                        "idempotency_ids": [str(uuid.uuid4())],
+                        "number_days_lookback": number_days_lookback,
+                    }
+                ),
+                content_type="application/json",
+            )
+
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+            assert response.json()["status"] == "failure"
@@ -0,0 +1,132 @@
+from datetime import timedelta
+
+import pytest
+from metering_billing.models import (
+    Invoice,
+    WebhookEndpoint,
+    WebhookOutboxMessage,
+    WebhookTrigger,
+)
+from metering_billing.utils import now_utc
+from metering_billing.utils.enums import WEBHOOK_MESSAGE_STATUS, WEBHOOK_TRIGGER_EVENTS
+from metering_billing.webhooks import claim_webhook_messages, dispatch_webhook_messages
+from model_bakery import baker
+
+
+@pytest.fixture
+def webhook_test_common_setup(generate_org_and_api_key, add_customers_to_org):
+    def do_webhook_test_common_setup():
+        setup_dict = {}
+        org, _ = generate_org_and_api_key()
+        setup_dict["org"] = org
+        (customer,) = add_customers_to_org(org, n=1)
+        setup_dict["customer"] = customer
+        endpoint = WebhookEndpoint.objects.create(
+            organization=org, webhook_url="https://example.com/webhook"
+        )
+        WebhookTrigger.objects.create(
+            organization=org,
+            webhook_endpoint=endpoint,
+            trigger_name=WEBHOOK_TRIGGER_EVENTS.INVOICE_PAID,
+        )
+        setup_dict["invoices"] = baker.make(
+            Invoice,
+            organization=org,
+            customer=customer,
+            cost_due=10,
+            payment_status=Invoice.PaymentStatus.UNPAID,
+            _quantity=2,
+        )
+        return setup_dict
+
+    return do_webhook_test_common_setup
+
+
+def pay(invoice):
+    invoice.payment_status = Invoice.PaymentStatus.PAID
+    invoice.save()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestWebhookOutbox:
+    def test_webhooks_are_sent_by_the_dispatcher(
+        self, webhook_test_common_setup, fake_svix
+    ):
+        setup_dict = webhook_test_common_setup()
+
+        pay(setup_dict["invoices"][0])
+
+        assert len(fake_svix.sent) == 0
+        message = WebhookOutboxMessage.objects.get()
+        assert message.event_type == WEBHOOK_TRIGGER_EVENTS.INVOICE_PAID
+        assert message.customer == setup_dict["customer"]
+
+        assert dispatch_webhook_messages() == 1
+        (app_id, message_in) = fake_svix.sent[0]
+        assert app_id == setup_dict["org"].organization_id.hex
+        assert message_in.event_id == message.event_id
+        assert (
+            message_in.payload["properties"]["event_type"]
+            == WEBHOOK_TRIGGER_EVENTS.INVOICE_PAID
+        )
+        message.refresh_from_db()
+        assert message.status == WEBHOOK_MESSAGE_STATUS.SENT
+        assert dispatch_webhook_messages() == 0
+
+    def test_failed_webhook_is_retried_in_order(
+        self, webhook_test_common_setup, fake_svix
+    ):
+        setup_dict = webhook_test_common_setup()
+        first_invoice, second_invoice = setup_dict["invoices"]
+        pay(first_invoice)
+        pay(second_invoice)
+        first, second = WebhookOutboxMessage.objects.order_by("created", "pk")
+        fake_svix.fail_next = 1
+
+        assert dispatch_webhook_messages() == 0
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        assert first.status == WEBHOOK_MESSAGE_STATUS.PENDING
+        assert first.attempts == 1
+        assert first.next_attempt_at > now_utc()
+        # the second message of the customer waits for the first one
+        assert second.attempts == 0
+        assert dispatch_webhook_messages() == 0
+
+        first.next_attempt_at = now_utc() - timedelta(seconds=1)
+        first.save()
+        assert dispatch_webhook_messages() == 2
+        assert [message_in.event_id for _, message_in in fake_svix.sent] == [
+            first.event_id,
+            second.event_id,
+        ]
+        assert not WebhookOutboxMessage.objects.filter(
+            status=WEBHOOK_MESSAGE_STATUS.PENDING
+        ).exists()
+
+    def test_customer_messages_are_claimed_together(
+        self, webhook_test_common_setup, fake_svix
+    ):
+        setup_dict = webhook_test_common_setup()
+        first_invoice, second_invoice = setup_dict["invoices"]
+        pay(first_invoice)
+        pay(second_invoice)
+
+        messages = claim_webhook_messages(batch_size=10)
+
+        assert [message.pk for message in messages] == list(
+            WebhookOutboxMessage.objects.order_by("created", "pk").values_list(
+                "pk", flat=True
+            )
+        )
+        # leased, so they aren't claimed again while being sent
+        assert claim_webhook_messages(batch_size=10) == []
+
+    def test_no_endpoints_no_outbox(self, webhook_test_common_setup, fake_svix):
+        setup_dict = webhook_test_common_setup()
+        WebhookEndpoint.objects.all().delete()
+
+        pay(setup_dict["invoices"][0])
+
+        assert not WebhookOutboxMessage.objects.exists()
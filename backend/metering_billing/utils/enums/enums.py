@@ -143,6 +143,18 @@ class BACKTEST_STATUS(models.TextChoices):
     FAILED = ("failed", _("Failed"))
 
 
+class BILLING_RUN_STATUS(models.TextChoices):
+    RUNNING = ("running", _("Running"))
+    COMPLETED = ("completed", _("Completed"))
+    FAILED = ("failed", _("Failed"))
+
+
+class INVOICING_JOB_STATUS(models.TextChoices):
+    PENDING = ("pending", _("Pending"))
+    COMPLETED = ("completed", _("Completed"))
+    FAILED = ("failed", _("Failed"))
+
+
 class PRODUCT_STATUS(models.TextChoices):
     ACTIVE = ("active", _("Active"))
     ARCHIVED = ("archived", _("Archived"))
@@ -190,6 +202,12 @@ class WEBHOOK_TRIGGER_EVENTS(models.TextChoices):
     CUSTOMER_CREATED = ("customer.created", _("customer.created"))
 
 
+class WEBHOOK_MESSAGE_STATUS(models.TextChoices):
+    PENDING = ("pending", _("Pending"))
+    SENT = ("sent", _("Sent"))
+    FAILED = ("failed", _("Failed"))
+
+
 class FLAT_FEE_BEHAVIOR(models.TextChoices):
     REFUND = ("refund", _("Refund"))
     CHARGE_PRORATED = ("charge_prorated", _("Prorate"))
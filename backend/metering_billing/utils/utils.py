@@ -1,4 +1,3 @@
-import collections
 import datetime
 import json
 import uuid
@@ -83,48 +82,6 @@ def convert_to_datetime(value, date_behavior="min", tz=pytz.UTC):
         raise ServerError(f"can't convert type {type(value)} into date")
 
 
-def make_all_decimals_floats(data):
-    if isinstance(data, list):
-        return [make_all_decimals_floats(x) for x in data]
-    elif isinstance(data, (dict, collections.OrderedDict)):
-        return {
-            make_all_decimals_floats(key): make_all_decimals_floats(val)
-            for key, val in data.items()
-        }
-    elif isinstance(data, Decimal):
-        return float(data)
-    else:
-        return data
-
-
-def make_all_dates_times_strings(data):
-    if isinstance(data, list):
-        return [make_all_dates_times_strings(x) for x in data]
-    elif isinstance(data, (dict, collections.OrderedDict)):
-        return {
-            make_all_dates_times_strings(key): make_all_dates_times_strings(val)
-            for key, val in data.items()
-        }
-    elif isinstance(data, (datetime.date, datetime.datetime)):
-        return str(data)
-    else:
-        return data
-
-
-def make_all_datetimes_dates(data):
-    if isinstance(data, list):
-        return [make_all_datetimes_dates(x) for x in data]
-    elif isinstance(data, (dict, collections.OrderedDict)):
-        return {
-            make_all_datetimes_dates(key): make_all_datetimes_dates(val)
-            for key, val in data.items()
-        }
-    elif isinstance(data, datetime.datetime):
-        return data.date()
-    else:
-        return data
-
-
 def years_bwn_twodates(start_date, end_date):
     years_btwn = relativedelta(end_date, start_date).years
     for n in range(years_btwn + 1):
@@ -1,5 +1,6 @@
 # import lotus_python
 import logging
+import uuid
 
 import api.views as api_views
 import posthog
@@ -82,6 +83,7 @@ from metering_billing.serializers.model_serializers import (
     WebhookEndpointSerializer,
 )
 from metering_billing.serializers.request_serializers import (
+    EventListFilterSerializer,
     OrganizationSettingFilterSerializer,
 )
 from metering_billing.serializers.serializer_utils import (
@@ -95,7 +97,7 @@ from metering_billing.serializers.serializer_utils import (
     WebhookEndpointUUIDField,
 )
 from metering_billing.tasks import run_backtest
-from metering_billing.utils import make_all_decimals_floats, now_utc
+from metering_billing.utils import now_utc
 from metering_billing.utils.enums import (
     METRIC_STATUS,
     PAYMENT_PROCESSORS,
@@ -109,6 +111,8 @@ from rest_framework.response import Response
 
 POSTHOG_PERSON = settings.POSTHOG_PERSON
 SVIX_CONNECTOR = settings.SVIX_CONNECTOR
+CUSTOMER_ID_NAMESPACE = settings.CUSTOMER_ID_NAMESPACE
+EVENT_NAME_NAMESPACE = settings.EVENT_NAME_NAMESPACE
 logger = logging.getLogger("django.server")
 
 
@@ -407,6 +411,21 @@ class CursorSetPagination(CustomPagination):
     cursor_query_param = "c"
 
 
+class EventCursorPagination(api_views.KeysetPagination):
+    """
+    Events newest first. The cursor starts with the time_created of the row to
+    continue from, so a page only reads the chunks between it and the edge of the
+    time window, however deep it is.
+    """
+
+    ordering = ("-time_created", "-idempotency_id")
+    page_size = 10
+    cursor_query_param = "c"
+
+    def is_requested(self, request):
+        return True
+
+
 class EventViewSet(
     PermissionPolicyMixin, mixins.ListModelMixin, viewsets.GenericViewSet
 ):
@@ -416,7 +435,7 @@ class EventViewSet(
 
     queryset = Event.objects.all()
     serializer_class = EventSerializer
-    pagination_class = CursorSetPagination
+    pagination_class = EventCursorPagination
     permission_classes = [IsAuthenticated & ValidOrganization]
     http_method_names = [
         "get",
@@ -424,13 +443,33 @@ class EventViewSet(
     ]
 
     def get_queryset(self):
-        now = now_utc()
         organization = self.request.organization
-        return (
-            super()
-            .get_queryset()
-            .filter(organization=organization, time_created__lt=now)
-        )
+        serializer = EventListFilterSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        # the time window limits the query to the chunks that can hold the events,
+        # the hashed columns are the ones the events index is on
+        filter_kwargs = {
+            "organization": organization,
+            "time_created__gte": serializer.validated_data["start_date"],
+            "time_created__lt": serializer.validated_data["end_date"],
+        }
+        customer_id = serializer.validated_data.get("customer_id")
+        if customer_id is not None:
+            filter_kwargs["uuidv5_customer_id"] = uuid.uuid5(
+                CUSTOMER_ID_NAMESPACE, customer_id
+            )
+        event_name = serializer.validated_data.get("event_name")
+        if event_name is not None:
+            filter_kwargs["uuidv5_event_name"] = uuid.uuid5(
+                EVENT_NAME_NAMESPACE, event_name
+            )
+        return super().get_queryset().filter(**filter_kwargs)
+
+    @extend_schema(
+        parameters=[EventListFilterSerializer],
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -507,7 +546,6 @@ class CustomerViewSet(api_views.CustomerViewSet):
         """
         customers = self.get_queryset()
         cust = CustomerWithRevenueSerializer(customers, many=True).data
-        cust = make_all_decimals_floats(cust)
         return Response(cust, status=status.HTTP_200_OK)
 
 
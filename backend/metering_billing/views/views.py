@@ -22,6 +22,7 @@ from metering_billing.models import (
 from metering_billing.netsuite_csv import get_csv_presigned_url
 from metering_billing.payment_processors import PAYMENT_PROCESSOR_MAP
 from metering_billing.permissions import HasUserAPIKey, ValidOrganization
+from metering_billing.pricing import TierScheduleCache
 from metering_billing.serializers.model_serializers import (
     DraftInvoiceSerializer,
     MetricDetailSerializer,
@@ -47,8 +48,6 @@ from metering_billing.utils import (
     convert_to_decimal,
     date_as_max_dt,
     date_as_min_dt,
-    make_all_dates_times_strings,
-    make_all_decimals_floats,
     periods_bwn_twodates,
 )
 from metering_billing.utils.enums import (
@@ -115,6 +114,7 @@ class PeriodMetricRevenueView(APIView):
         return_dict["total_revenue_period_1"] = p1_collected or Decimal(0)
         return_dict["total_revenue_period_2"] = p2_collected or Decimal(0)
         # earned
+        tier_schedules = TierScheduleCache()
         for start, end, num in [(p1_start, p1_end, 1), (p2_start, p2_end, 2)]:
             subs = (
                 SubscriptionRecord.objects.filter(
@@ -140,7 +140,9 @@ class PeriodMetricRevenueView(APIView):
                     "revenue": Decimal(0),
                 }
             for subscription in subs:
-                earned_revenue = subscription.calculate_earned_revenue_per_day()
+                earned_revenue = subscription.calculate_earned_revenue_per_day(
+                    tier_schedules=tier_schedules
+                )
                 for date, earned_revenue in earned_revenue.items():
                     date = convert_to_date(date)
                     if date in per_day_dict:
@@ -150,10 +152,7 @@ class PeriodMetricRevenueView(APIView):
             )
         serializer = PeriodMetricRevenueResponseSerializer(data=return_dict)
         serializer.is_valid(raise_exception=True)
-        ret = serializer.validated_data
-        ret = make_all_decimals_floats(ret)
-        ret = make_all_dates_times_strings(ret)
-        return Response(ret, status=status.HTTP_200_OK)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
 
 class PeriodEventsView(APIView):
@@ -281,8 +280,11 @@ class CostAnalysisView(APIView):
             .prefetch_related("billing_plan__plan_components__billable_metric")
             .prefetch_related("billing_plan__plan_components__tiers")
         )
+        tier_schedules = TierScheduleCache()
         for subscription in subscriptions:
-            earned_revenue = subscription.calculate_earned_revenue_per_day()
+            earned_revenue = subscription.calculate_earned_revenue_per_day(
+                tier_schedules=tier_schedules
+            )
             for date, earned_revenue in earned_revenue.items():
                 date = convert_to_date(date)
                 if date in per_day_dict:
@@ -307,10 +309,7 @@ class CostAnalysisView(APIView):
             )
         serializer = CostAnalysisSerializer(data=return_dict)
         serializer.is_valid(raise_exception=True)
-        ret = serializer.validated_data
-        ret = make_all_decimals_floats(ret)
-        ret = make_all_dates_times_strings(ret)
-        return Response(ret, status=status.HTTP_200_OK)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
 
 class PeriodSubscriptionsView(APIView):
@@ -366,9 +365,7 @@ class PeriodSubscriptionsView(APIView):
             )
         serializer = PeriodSubscriptionsResponseSerializer(data=return_dict)
         serializer.is_valid(raise_exception=True)
-        ret = serializer.validated_data
-        ret = make_all_decimals_floats(ret)
-        return Response(ret, status=status.HTTP_200_OK)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
 
 class PeriodMetricUsageView(APIView):
@@ -417,10 +414,7 @@ class PeriodMetricUsageView(APIView):
             data={"metrics": final_results}
         )
         serializer.is_valid(raise_exception=True)
-        ret = serializer.validated_data
-        ret = make_all_decimals_floats(ret)
-        ret = make_all_dates_times_strings(ret)
-        return Response(ret, status=status.HTTP_200_OK)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
 
 class SettingsView(APIView):
@@ -539,8 +533,6 @@ class DraftInvoiceView(APIView):
                 ),
             )
             serializer = DraftInvoiceSerializer(invoices, many=True).data
-            for invoice in invoices:
-                invoice.delete()
             response = {"invoices": serializer or []}
         return Response(response, status=status.HTTP_200_OK)
 
@@ -10,6 +10,7 @@ from rest_framework.decorators import (
 from rest_framework.response import Response
 
 from metering_billing.models import Invoice
+from metering_billing.payment_processors import PAYMENT_PROCESSOR_MAP
 from metering_billing.utils.enums import PAYMENT_PROCESSORS
 
 STRIPE_WEBHOOK_SECRET = settings.STRIPE_WEBHOOK_SECRET
@@ -28,6 +29,13 @@ def _invoice_paid_handler(event):
         matching_invoice.save()
 
 
+def _customer_updated_handler(event):
+    stripe_customer = event["data"]["object"]
+    PAYMENT_PROCESSOR_MAP[PAYMENT_PROCESSORS.STRIPE].update_customer_states(
+        [stripe_customer]
+    )
+
+
 @api_view(http_method_names=["POST"])
 @csrf_exempt
 @permission_classes([])
@@ -50,6 +58,12 @@ def stripe_webhook_endpoint(request):
     # Handle the checkout.session.completed event
     if event["type"] == "invoice.paid":
         _invoice_paid_handler(event)
+    elif event["type"] in [
+        "customer.created",
+        "customer.updated",
+        "customer.deleted",
+    ]:
+        _customer_updated_handler(event)
 
     # Passed signature verification
     return Response(status=status.HTTP_200_OK)
@@ -1,157 +1,191 @@
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
 from django.utils.text import slugify
-from metering_billing.utils import (
-    make_all_dates_times_strings,
-    make_all_decimals_floats,
-    now_utc,
-)
-from metering_billing.utils.enums import WEBHOOK_TRIGGER_EVENTS
+from metering_billing.utils import now_utc
+from metering_billing.utils.enums import WEBHOOK_MESSAGE_STATUS, WEBHOOK_TRIGGER_EVENTS
 from svix.api import MessageIn
+from svix.internal.openapi_client.models.http_error import HttpError
+
+logger = logging.getLogger("django.server")
 
 SVIX_CONNECTOR = settings.SVIX_CONNECTOR
+WEBHOOK_DISPATCH_BATCH_SIZE = settings.WEBHOOK_DISPATCH_BATCH_SIZE
+WEBHOOK_DISPATCH_CONCURRENCY = settings.WEBHOOK_DISPATCH_CONCURRENCY
+WEBHOOK_DISPATCH_CONCURRENCY_PER_ORGANIZATION = (
+    settings.WEBHOOK_DISPATCH_CONCURRENCY_PER_ORGANIZATION
+)
+WEBHOOK_MAX_ATTEMPTS = settings.WEBHOOK_MAX_ATTEMPTS
+# a claimed message is retried after this long if its dispatcher died
+WEBHOOK_DISPATCH_LEASE = timedelta(minutes=5)
+WEBHOOK_RETRY_BASE_DELAY = timedelta(seconds=30)
+WEBHOOK_RETRY_MAX_DELAY = timedelta(hours=6)
+WEBHOOK_DISPATCH_SCHEDULED_KEY = "webhook_dispatch_scheduled"
+# arbitrary key of the postgres advisory lock taken while claiming messages
+WEBHOOK_CLAIM_ADVISORY_LOCK = 0x77686B
+
+
+def has_webhook_endpoints(organization, trigger_name):
+    from metering_billing.models import WebhookEndpoint
+
+    return WebhookEndpoint.objects.filter(
+        organization=organization, triggers__trigger_name=trigger_name
+    ).exists()
+
+
+def outbox_message(organization, event_type, event_id, properties, customer=None):
+    from metering_billing.models import WebhookOutboxMessage
+
+    return WebhookOutboxMessage(
+        organization=organization,
+        customer=customer,
+        event_type=event_type,
+        event_id=event_id,
+        properties=properties,
+    )
+
+
+def enqueue_webhook_messages(messages):
+    """
+    Writes the messages to the outbox in the caller's transaction, the dispatcher is
+    woken up once it commits.
+    """
+    from metering_billing.models import WebhookOutboxMessage
+
+    if len(messages) == 0:
+        return
+    WebhookOutboxMessage.objects.bulk_create(messages)
+    transaction.on_commit(schedule_webhook_dispatch)
+
+
+def schedule_webhook_dispatch():
+    from metering_billing.tasks import dispatch_webhooks
+
+    # one dispatch run picks up everything enqueued in the meantime
+    if cache.add(WEBHOOK_DISPATCH_SCHEDULED_KEY, True, 60):
+        dispatch_webhooks.apply_async(countdown=1)
 
 
 def invoice_created_webhook(invoice, organization):
     from api.serializers.model_serializers import InvoiceSerializer
-    from metering_billing.models import WebhookEndpoint
 
-    if SVIX_CONNECTOR is not None:
-        endpoints = (
-            WebhookEndpoint.objects.filter(organization=organization)
-            .prefetch_related("triggers")
-            .filter(triggers__trigger_name=WEBHOOK_TRIGGER_EVENTS.INVOICE_CREATED)
-            .distinct()
-        )
-        if endpoints.count() > 0:
-            svix = SVIX_CONNECTOR
-            now = str(now_utc())
-            invoice_data = InvoiceSerializer(invoice).data
-            invoice_data = make_all_decimals_floats(invoice_data)
-            invoice_data = make_all_dates_times_strings(invoice_data)
-            response = {
-                "event_type": WEBHOOK_TRIGGER_EVENTS.INVOICE_CREATED,
-                "payload": invoice_data,
-            }
-            svix.message.create(
-                organization.organization_id.hex,
-                MessageIn(
-                    event_type=WEBHOOK_TRIGGER_EVENTS.INVOICE_CREATED,
-                    event_id=str(organization.organization_id.hex)
+    if SVIX_CONNECTOR is not None and has_webhook_endpoints(
+        organization, WEBHOOK_TRIGGER_EVENTS.INVOICE_CREATED
+    ):
+        invoice_data = InvoiceSerializer(invoice).data
+        response = {
+            "event_type": WEBHOOK_TRIGGER_EVENTS.INVOICE_CREATED,
+            "payload": invoice_data,
+        }
+        enqueue_webhook_messages(
+            [
+                outbox_message(
+                    organization,
+                    WEBHOOK_TRIGGER_EVENTS.INVOICE_CREATED,
+                    str(organization.organization_id.hex)
                     + "_"
                     + str(invoice_data["invoice_number"])
                     + "_"
                     + "created",
-                    payload={
-                        "attempt": 5,
-                        "created_at": now,
-                        "properties": response,
-                    },
-                ),
-            )
+                    response,
+                    customer=invoice.customer,
+                )
+            ]
+        )
 
 
 def invoice_paid_webhook(invoice, organization):
     from api.serializers.model_serializers import InvoiceSerializer
-    from metering_billing.models import WebhookEndpoint
 
-    if SVIX_CONNECTOR is not None:
-        endpoints = (
-            WebhookEndpoint.objects.filter(organization=organization)
-            .prefetch_related("triggers")
-            .filter(triggers__trigger_name=WEBHOOK_TRIGGER_EVENTS.INVOICE_PAID)
-            .distinct()
-        )
-        if endpoints.count() > 0:
-            svix = SVIX_CONNECTOR
-            now = str(now_utc())
-            invoice_data = InvoiceSerializer(invoice).data
-            invoice_data = make_all_decimals_floats(invoice_data)
-            invoice_data = make_all_dates_times_strings(invoice_data)
-            response = {
-                "event_type": WEBHOOK_TRIGGER_EVENTS.INVOICE_PAID,
-                "payload": invoice_data,
-            }
-            svix.message.create(
-                organization.organization_id.hex,
-                MessageIn(
-                    event_type=WEBHOOK_TRIGGER_EVENTS.INVOICE_PAID,
-                    event_id=str(organization.organization_id.hex)
+    if SVIX_CONNECTOR is not None and has_webhook_endpoints(
+        organization, WEBHOOK_TRIGGER_EVENTS.INVOICE_PAID
+    ):
+        invoice_data = InvoiceSerializer(invoice).data
+        response = {
+            "event_type": WEBHOOK_TRIGGER_EVENTS.INVOICE_PAID,
+            "payload": invoice_data,
+        }
+        enqueue_webhook_messages(
+            [
+                outbox_message(
+                    organization,
+                    WEBHOOK_TRIGGER_EVENTS.INVOICE_PAID,
+                    str(organization.organization_id.hex)
                     + "_"
                     + str(invoice_data["invoice_number"])
                     + "_"
                     + "paid",
-                    payload={
-                        "attempt": 5,
-                        "created_at": now,
-                        "properties": response,
-                    },
-                ),
-            )
+                    response,
+                    customer=invoice.customer,
+                )
+            ]
+        )
 
 
 def invoice_past_due_webhook(invoice, organization):
     from api.serializers.model_serializers import InvoiceSerializer
-    from metering_billing.models import WebhookEndpoint
 
-    if SVIX_CONNECTOR is not None:
-        endpoints = (
-            WebhookEndpoint.objects.filter(organization=organization)
-            .prefetch_related("triggers")
-            .filter(triggers__trigger_name=WEBHOOK_TRIGGER_EVENTS.INVOICE_PAST_DUE)
-            .distinct()
-        )
-        if endpoints.count() > 0:
-            svix = SVIX_CONNECTOR
-            now = str(now_utc())
-            invoice_data = InvoiceSerializer(invoice).data
-            invoice_data = make_all_decimals_floats(invoice_data)
-            invoice_data = make_all_dates_times_strings(invoice_data)
-            response = {
-                "event_type": WEBHOOK_TRIGGER_EVENTS.INVOICE_PAST_DUE,
-                "payload": invoice_data,
-            }
-            svix.message.create(
-                organization.organization_id.hex,
-                MessageIn(
-                    event_type=WEBHOOK_TRIGGER_EVENTS.INVOICE_PAST_DUE,
-                    event_id=str(organization.organization_id.hex)
+    if SVIX_CONNECTOR is not None and has_webhook_endpoints(
+        organization, WEBHOOK_TRIGGER_EVENTS.INVOICE_PAST_DUE
+    ):
+        invoice_data = InvoiceSerializer(invoice).data
+        response = {
+            "event_type": WEBHOOK_TRIGGER_EVENTS.INVOICE_PAST_DUE,
+            "payload": invoice_data,
+        }
+        enqueue_webhook_messages(
+            [
+                outbox_message(
+                    organization,
+                    WEBHOOK_TRIGGER_EVENTS.INVOICE_PAST_DUE,
+                    str(organization.organization_id.hex)
                     + "_"
                     + str(invoice_data["invoice_number"])
                     + "_"
-                    + "paid",
-                    payload={
-                        "attempt": 5,
-                        "created_at": now,
-                        "properties": response,
-                    },
-                ),
-            )
+                    + "past_due",
+                    response,
+                    customer=invoice.customer,
+                )
+            ]
+        )
 
 
-def usage_alert_webhook(usage_alert, alert_result, subscription_record, organization):
+def usage_alert_webhook(organization, alert_results):
+    """
+    Enqueue the alert results of an organization that were triggered in one
+    evaluation cycle. The endpoints are looked up once, and each alert result is
+    still delivered as its own message so the payload stays the same.
+    """
     from api.serializers.model_serializers import (
         LightweightSubscriptionRecordSerializer,
         UsageAlertSerializer,
     )
     from api.serializers.webhook_serializers import UsageAlertPayload
-    from metering_billing.models import WebhookEndpoint
 
-    if SVIX_CONNECTOR is not None:
-        endpoints = (
-            WebhookEndpoint.objects.filter(organization=organization)
-            .prefetch_related("triggers")
-            .filter(triggers__trigger_name=WEBHOOK_TRIGGER_EVENTS.USAGE_ALERT_TRIGGERED)
-            .distinct()
+    if (
+        SVIX_CONNECTOR is not None
+        and len(alert_results) > 0
+        and has_webhook_endpoints(
+            organization, WEBHOOK_TRIGGER_EVENTS.USAGE_ALERT_TRIGGERED
         )
-        if endpoints.count() > 0:
-            svix = SVIX_CONNECTOR
-            now = str(now_utc())
+    ):
+        messages = []
+        for alert_result in alert_results:
+            usage_alert = alert_result.alert
+            subscription_record = alert_result.subscription_record
             alert_data = {
                 "subscription": LightweightSubscriptionRecordSerializer(
                     subscription_record
                 ).data,
                 "usage_alert": UsageAlertSerializer(usage_alert).data,
-                "usage": alert_result.usage,
+                "usage": alert_result.last_run_value,
                 "time_triggered": alert_result.last_run_timestamp,
             }
             response = {
@@ -169,38 +203,43 @@ def usage_alert_webhook(usage_alert, alert_result, subscription_record, organiza
                 + "_"
                 + "triggered"
             )
-            svix.message.create(
-                organization.organization_id.hex,
-                MessageIn(
-                    event_type=WEBHOOK_TRIGGER_EVENTS.USAGE_ALERT_TRIGGERED,
-                    event_id=event_id,
-                    payload={
-                        "attempt": 5,
-                        "created_at": now,
-                        "properties": response,
-                    },
-                ),
+            messages.append(
+                outbox_message(
+                    organization,
+                    WEBHOOK_TRIGGER_EVENTS.USAGE_ALERT_TRIGGERED,
+                    event_id,
+                    response,
+                    customer=subscription_record.customer,
+                )
             )
+        enqueue_webhook_messages(messages)
 
 
 def customer_created_webhook(customer, customer_data=None):
+    customers_created_webhook(
+        customer.organization,
+        [customer],
+        customers_data=[customer_data] if customer_data else None,
+    )
+
+
+def customers_created_webhook(organization, customers, customers_data=None):
+    """
+    Enqueue a customer.created message for each of the organization's new customers,
+    checking for endpoints once. customers_data is the serialized customers, in the
+    same order, if the caller already has it.
+    """
     from api.serializers.model_serializers import CustomerSerializer
-    from metering_billing.models import WebhookEndpoint
 
-    if SVIX_CONNECTOR is not None:
-        endpoints = (
-            WebhookEndpoint.objects.prefetch_related("triggers")
-            .filter(triggers__trigger_name=WEBHOOK_TRIGGER_EVENTS.CUSTOMER_CREATED)
-            .distinct()
-        )
-        if endpoints.count() > 0:
-            svix = SVIX_CONNECTOR
-            now = str(now_utc())
-            payload = (
-                customer_data if customer_data else CustomerSerializer(customer).data
-            )
-            payload = make_all_decimals_floats(payload)
-            payload = make_all_dates_times_strings(payload)
+    if (
+        SVIX_CONNECTOR is not None
+        and len(customers) > 0
+        and has_webhook_endpoints(organization, WEBHOOK_TRIGGER_EVENTS.CUSTOMER_CREATED)
+    ):
+        if customers_data is None:
+            customers_data = CustomerSerializer(customers, many=True).data
+        messages = []
+        for customer, payload in zip(customers, customers_data):
             response = {
                 "event_type": WEBHOOK_TRIGGER_EVENTS.CUSTOMER_CREATED,
                 "payload": payload,
@@ -212,15 +251,166 @@ def customer_created_webhook(customer, customer_data=None):
                 + "_"
                 + "created"
             )
-            response = svix.message.create(
-                customer.organization.organization_id.hex,
-                MessageIn(
-                    event_type=WEBHOOK_TRIGGER_EVENTS.CUSTOMER_CREATED,
-                    event_id=event_id,
-                    payload={
-                        "attempt": 5,
-                        "created_at": now,
-                        "properties": response,
-                    },
-                ),
+            messages.append(
+                outbox_message(
+                    organization,
+                    WEBHOOK_TRIGGER_EVENTS.CUSTOMER_CREATED,
+                    event_id,
+                    response,
+                    customer=customer,
+                )
+            )
+        enqueue_webhook_messages(messages)
+
+
+def claim_webhook_messages(batch_size):
+    """
+    Claims the next messages that are due by leasing them for a while, oldest first.
+    A customer's due messages are claimed together, in the order they were written,
+    and send_webhook_messages sends them one after the other. A message is only held
+    back while an earlier message of the same customer is pending but not due, i.e.
+    backing off after a failure or leased by a dispatch that's still sending it.
+    """
+    from metering_billing.models import WebhookOutboxMessage
+
+    now = now_utc()
+    earlier_waiting = WebhookOutboxMessage.objects.filter(
+        Q(created__lt=OuterRef("created"))
+        | Q(created=OuterRef("created"), pk__lt=OuterRef("pk")),
+        customer=OuterRef("customer"),
+        status=WEBHOOK_MESSAGE_STATUS.PENDING,
+        next_attempt_at__gt=now,
+    )
+    with transaction.atomic():
+        # claims are serialized, so a dispatch always sees the leases taken by the
+        # one before it and never starts a customer's run halfway through
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(%s)", [WEBHOOK_CLAIM_ADVISORY_LOCK]
+            )
+        messages = list(
+            WebhookOutboxMessage.objects.select_for_update(
+                skip_locked=True, of=("self",)
+            )
+            .select_related("organization")
+            .filter(status=WEBHOOK_MESSAGE_STATUS.PENDING, next_attempt_at__lte=now)
+            .exclude(Exists(earlier_waiting))
+            .order_by("created", "pk")[:batch_size]
+        )
+        WebhookOutboxMessage.objects.filter(
+            pk__in=[message.pk for message in messages]
+        ).update(next_attempt_at=now + WEBHOOK_DISPATCH_LEASE)
+    return messages
+
+
+def send_webhook_message(message):
+    """
+    Sends one message to Svix, returns the error if it couldn't be sent.
+    """
+    try:
+        SVIX_CONNECTOR.message.create(
+            message.organization.organization_id.hex,
+            MessageIn(
+                event_type=message.event_type,
+                event_id=message.event_id,
+                payload={
+                    "attempt": 5,
+                    "created_at": str(message.created),
+                    "properties": message.properties,
+                },
+            ),
+        )
+    except HttpError as e:
+        if e.status_code == 409:
+            # already accepted under this event id by an earlier attempt
+            return None
+        return str(e)
+    except Exception as e:
+        return str(e)
+    return None
+
+
+def send_webhook_messages(messages):
+    """
+    Sends a batch of claimed messages. Messages of one customer are sent one after the
+    other and the rest of the customer's messages wait if one fails, independent
+    messages go out concurrently with at most
+    WEBHOOK_DISPATCH_CONCURRENCY_PER_ORGANIZATION in flight per organization.
+    """
+    from metering_billing.models import WebhookOutboxMessage
+
+    lanes = defaultdict(list)
+    for message in messages:
+        if message.customer_id is not None:
+            lanes[("customer", message.customer_id)].append(message)
+        else:
+            lanes[("message", message.pk)].append(message)
+    organization_slots = {
+        message.organization_id: threading.BoundedSemaphore(
+            WEBHOOK_DISPATCH_CONCURRENCY_PER_ORGANIZATION
+        )
+        for message in messages
+    }
+
+    def send_lane(lane):
+        outcomes = []
+        for message in lane:
+            with organization_slots[message.organization_id]:
+                error = send_webhook_message(message)
+            outcomes.append((message, error))
+            if error is not None:
+                break
+        return outcomes
+
+    max_workers = min(WEBHOOK_DISPATCH_CONCURRENCY, len(lanes))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        outcomes = [
+            outcome
+            for lane_outcomes in executor.map(send_lane, lanes.values())
+            for outcome in lane_outcomes
+        ]
+
+    now = now_utc()
+    n_sent = 0
+    attempted = set()
+    for message, error in outcomes:
+        attempted.add(message.pk)
+        message.attempts += 1
+        message.last_error = error
+        if error is None:
+            message.status = WEBHOOK_MESSAGE_STATUS.SENT
+            message.sent_at = now
+            n_sent += 1
+        elif message.attempts >= WEBHOOK_MAX_ATTEMPTS:
+            logger.error(f"Giving up on webhook {message.event_id}: {error}")
+            message.status = WEBHOOK_MESSAGE_STATUS.FAILED
+        else:
+            message.next_attempt_at = now + min(
+                WEBHOOK_RETRY_BASE_DELAY * 2 ** (message.attempts - 1),
+                WEBHOOK_RETRY_MAX_DELAY,
             )
+    for message in messages:
+        if message.pk not in attempted:
+            # held back behind a failed message of the same customer
+            message.next_attempt_at = now
+    WebhookOutboxMessage.objects.bulk_update(
+        messages, ["status", "attempts", "next_attempt_at", "last_error", "sent_at"]
+    )
+    return n_sent
+
+
+def dispatch_webhook_messages(batch_size=None):
+    """
+    Drains the webhook outbox in batches, returns the number of messages sent.
+    """
+    if SVIX_CONNECTOR is None:
+        return 0
+    batch_size = batch_size or WEBHOOK_DISPATCH_BATCH_SIZE
+    cache.delete(WEBHOOK_DISPATCH_SCHEDULED_KEY)
+    n_sent = 0
+    while True:
+        messages = claim_webhook_messages(batch_size)
+        if len(messages) == 0:
+            break
+        n_sent += send_webhook_messages(messages)
+    return n_sent